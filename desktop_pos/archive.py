@@ -0,0 +1,222 @@
+"""
+Архив продаж по годам: закрытые годы переносятся из основной базы в отдельные файлы SQLite
+(archive/vetpos_<год>.db рядом с базой). Отчёты подключают (ATTACH) только годы, которые
+попадают в период, - только для чтения и с отображением в память (mmap)
+"""
+
+import os
+import re
+from pathlib import Path
+
+from timestamps import business_date
+
+
+# Каталог архива рядом с файлом базы и имя файла года
+ARCHIVE_DIR = 'archive'
+ARCHIVE_FILE = 'vetpos_{year}.db'
+ARCHIVE_FILE_PATTERN = re.compile(r'^vetpos_(\d{4})\.db$')
+
+# Отображение файла архива в память (байт)
+ARCHIVE_MMAP_SIZE = 256 * 1024 * 1024
+
+# Одновременно подключённых лет: SQLite допускает 10 баз на соединение, одна остаётся для переноса
+MAX_ATTACHED_YEARS = 8
+
+# Схема подключения файла при переносе года
+WRITE_SCHEMA = 'archive_write'
+
+# Таблицы архива и отбор строк года (:first, :last - бизнес-даты года, :start, :end - границы в UTC)
+ARCHIVE_TABLES = (
+    ('sales', 'business_date BETWEEN :first AND :last'),
+    ('sale_items', 'sale_id IN (SELECT id FROM main.sales WHERE business_date BETWEEN :first AND :last)'),
+    ('returns', 'sale_id IN (SELECT id FROM main.sales WHERE business_date BETWEEN :first AND :last)'),
+    ('return_items', '''return_id IN (
+        SELECT r.id FROM main.returns r JOIN main.sales s ON r.sale_id = s.id
+        WHERE s.business_date BETWEEN :first AND :last)'''),
+    ('inventory_movements', 'created_at >= :start AND created_at < :end'),
+)
+
+# Индексы файла архива (поиск по периоду и по чеку)
+ARCHIVE_INDEXES = (
+    ('sales', 'business_date'),
+    ('sale_items', 'sale_id'),
+    ('returns', 'sale_id'),
+    ('return_items', 'return_id'),
+    ('inventory_movements', 'product_id, seq'),
+)
+
+
+def year_bounds(year):
+    """Параметры отбора строк года"""
+    return {'first': f'{year}-01-01', 'last': f'{year}-12-31',
+            'start': f'{year}-01-01', 'end': f'{year + 1}-01-01'}
+
+
+class SalesArchive:
+    """Перенос закрытых лет в файлы архива и единые представления all_<таблица> для отчётов"""
+    
+    def __init__(self, db):
+        self.db = db
+        self.directory = os.path.join(os.path.dirname(os.path.abspath(db.db_path)), ARCHIVE_DIR)
+        # Подключённые годы: год -> имя схемы
+        self.attached = {}
+        
+    def path(self, year):
+        """Файл архива года"""
+        return os.path.join(self.directory, ARCHIVE_FILE.format(year=year))
+        
+    def years(self):
+        """Годы, для которых есть файлы архива"""
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(int(match.group(1)) for match in map(ARCHIVE_FILE_PATTERN.match, os.listdir(self.directory))
+                      if match)
+                      
+    def archived_through(self):
+        """Последняя бизнес-дата, перенесённая в архив ('' - архива нет)"""
+        return self.db.get_setting('sales_archived_through') or ''
+        
+    def candidate_years(self):
+        """Закрытые годы с продажами в основной базе (до текущего года)"""
+        current = business_date()[:4]
+        return [int(row['year']) for row in self.db.fetch_all('''
+            SELECT DISTINCT substr(business_date, 1, 4) as year FROM sales
+            WHERE business_date < ?
+            ORDER BY year
+        ''', (f'{current}-01-01',))]
+        
+    def years_for(self, date_from, date_to):
+        """Годы архива, которые пересекаются с периодом (пустой список - хватает основной базы)"""
+        if date_from > self.archived_through():
+            return []
+        return [year for year in self.years() if date_from[:4] <= str(year) <= date_to[:4]]
+        
+    # Перенос года
+    def archive_year(self, year):
+        """Перенос продаж, возвратов и движений товара года в файл архива; возвращает число строк"""
+        if year >= int(business_date()[:4]):
+            raise ValueError("В архив переносятся только закрытые годы")
+        bounds = year_bounds(year)
+        if self.db.fetch_one('''
+            SELECT 1 FROM shifts WHERE status = 'open' AND business_date <= ?
+        ''', (bounds['last'],)):
+            raise ValueError(f"Есть открытые смены {year} года")
+            
+        os.makedirs(self.directory, exist_ok=True)
+        connection = self.db.get_connection()
+        # ATTACH и DETACH не выполняются внутри транзакции
+        self.db.commit()
+        self.detach_all()
+        connection.execute(f'ATTACH DATABASE ? AS {WRITE_SCHEMA}', (self.path(year),))
+        try:
+            # Копирование идемпотентно (INSERT OR IGNORE по id): сбой между шагами исправляется повтором
+            counts = {}
+            try:
+                for table, condition in ARCHIVE_TABLES:
+                    columns = self.prepare_table(table)
+                    names = ', '.join(columns)
+                    cursor = connection.execute(f'''
+                        INSERT OR IGNORE INTO {WRITE_SCHEMA}.{table} ({names})
+                        SELECT {names} FROM main.{table} WHERE {condition}
+                    ''', bounds)
+                    counts[table] = cursor.rowcount
+                for table, columns in ARCHIVE_INDEXES:
+                    connection.execute(f'''
+                        CREATE INDEX IF NOT EXISTS {WRITE_SCHEMA}.idx_{table}_archive ON {table}({columns})
+                    ''')
+                connection.commit()
+            except Exception:
+                connection.rollback()
+                raise
+                
+            # Удаление из основной базы только строк, уже записанных в архив. Отметка архива ставится
+            # первой: триггер журнала движения разрешает удалять только движения перенесённых лет
+            try:
+                if bounds['last'] > self.archived_through():
+                    connection.execute('''
+                        INSERT OR REPLACE INTO settings (key, value, description)
+                        VALUES ('sales_archived_through', ?, 'Последняя дата продаж в архиве')
+                    ''', (bounds['last'],))
+                # Снимки остатка на конец года: текущий остаток считается без файлов архива
+                self.db.checkpoint_stock(bounds['end'])
+                for table, _ in ARCHIVE_TABLES:
+                    connection.execute(f'''
+                        DELETE FROM main.{table} WHERE id IN (SELECT id FROM {WRITE_SCHEMA}.{table})
+                    ''')
+                connection.commit()
+            except Exception:
+                connection.rollback()
+                raise
+        finally:
+            connection.execute(f'DETACH DATABASE {WRITE_SCHEMA}')
+        return counts
+        
+    def prepare_table(self, table):
+        """Таблица в файле архива с колонками основной базы; возвращает список колонок"""
+        connection = self.db.get_connection()
+        columns = [(row[1], row[2]) for row in connection.execute(f'PRAGMA main.table_info({table})')]
+        existing = {row[1] for row in connection.execute(f'PRAGMA {WRITE_SCHEMA}.table_info({table})')}
+        if not existing:
+            definitions = ', '.join(f'{name} INTEGER PRIMARY KEY' if name == 'id' else f'{name} {kind}'
+                                    for name, kind in columns)
+            connection.execute(f'CREATE TABLE {WRITE_SCHEMA}.{table} ({definitions})')
+        else:
+            # Колонки, добавленные миграциями после прошлого переноса
+            for name, kind in columns:
+                if name not in existing:
+                    connection.execute(f'ALTER TABLE {WRITE_SCHEMA}.{table} ADD COLUMN {name} {kind}')
+        return [name for name, _ in columns]
+        
+    # Подключение архива для отчётов
+    def attach(self, years):
+        """Подключение лет архива только для чтения и пересоздание представлений all_<таблица>"""
+        years = sorted(years)
+        if years == sorted(self.attached):
+            return
+        if len(years) > MAX_ATTACHED_YEARS:
+            raise ValueError(f"Период захватывает больше {MAX_ATTACHED_YEARS} лет архива")
+            
+        connection = self.db.get_connection()
+        self.db.commit()
+        for year in [year for year in self.attached if year not in years]:
+            connection.execute(f'DETACH DATABASE {self.attached.pop(year)}')
+        for year in years:
+            if year not in self.attached:
+                schema = f'archive_{year}'
+                uri = Path(self.path(year)).as_uri() + '?mode=ro'
+                connection.execute(f'ATTACH DATABASE ? AS {schema}', (uri,))
+                connection.execute(f'PRAGMA {schema}.mmap_size = {ARCHIVE_MMAP_SIZE}')
+                self.attached[year] = schema
+        self.create_views()
+        
+    def create_views(self):
+        """Представления all_<таблица>: основная база и подключённые годы (UNION ALL)"""
+        connection = self.db.get_connection()
+        for table, _ in ARCHIVE_TABLES:
+            columns = [row[1] for row in connection.execute(f'PRAGMA main.table_info({table})')]
+            parts = [f"SELECT {', '.join(columns)} FROM main.{table}"]
+            for schema in self.attached.values():
+                # Колонки, которых нет в старом файле архива, читаются как NULL
+                existing = {row[1] for row in connection.execute(f'PRAGMA {schema}.table_info({table})')}
+                selected = ', '.join(name if name in existing else f'NULL AS {name}' for name in columns)
+                parts.append(f'SELECT {selected} FROM {schema}.{table}')
+            connection.execute(f'DROP VIEW IF EXISTS temp.all_{table}')
+            connection.execute(f"CREATE TEMP VIEW all_{table} AS {' UNION ALL '.join(parts)}")
+            
+    def detach_all(self):
+        """Отключение всех лет архива (представления all_<таблица> видят только основную базу)"""
+        connection = self.db.get_connection()
+        for schema in self.attached.values():
+            connection.execute(f'DETACH DATABASE {schema}')
+        self.attached = {}
+        for table, _ in ARCHIVE_TABLES:
+            connection.execute(f'DROP VIEW IF EXISTS temp.all_{table}')
+            
+    def fetch_period(self, statement, archive_statement, date_from, date_to, params=None):
+        """Запрос за период: archive_statement (через all_<таблица>) - только если период заходит в архив"""
+        params = (date_from, date_to) if params is None else params
+        years = self.years_for(date_from, date_to)
+        if not years:
+            return self.db.queries.all(statement, params)
+        self.attach(years)
+        return self.db.queries.all(archive_statement, params)
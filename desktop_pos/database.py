@@ -5,25 +5,268 @@
 
 import sqlite3
 import os
-from datetime import datetime
+import re
+import time
+from collections import deque
+from datetime import datetime, date, timedelta
 import json
+import socket
 import bcrypt
-import uuid
+from money import line_total, to_kopecks, percent_of, prorate, allocate
+import timestamps
+from archive import SalesArchive
+from maintenance import DatabaseMaintenance
+from replication import ChangeCapture
+from queries import (CACHED_STATEMENTS, QueryRepository, PRODUCTS_ACTIVE, PRODUCTS_SEARCH,
+                     PRODUCT_BY_BARCODE, CUSTOMERS_ACTIVE, CUSTOMERS_SEARCH, CUSTOMERS_BY_PHONE,
+                     CUSTOMERS_BY_PHONE_PREFIX, CUSTOMERS_FTS_SEARCH, SALE_FOR_RETURN, SALE_ITEM_RETURN,
+                     SALE_REFUNDED, SALE_BONUS, SALE_MARK_RETURNED, RETURN_INSERT, RETURN_ITEM_INSERT,
+                     RETURN_MOVEMENT_INSERT, RECEIPT_FOR_RETURN, RECEIPT_NUMBER_NEXT, SALE_RECEIPT,
+                     STOCK_AT, STOCK_AT_ARCHIVE, STOCK_MOVEMENTS, STOCK_MOVEMENTS_ARCHIVE)
+
+
+# Способы оплаты и соответствующие им счётчики смены (sales_*, count_*)
+PAYMENT_COLUMNS = {
+    'Наличные': 'cash',
+    'Банковская карта': 'card',
+    'Безналичный расчёт': 'transfer',
+}
+
+# Счётчики смены, которые можно пересчитать по продажам и возвратам
+SHIFT_COUNTERS = (
+    'total_sales', 'transactions_count', 'total_returns', 'returns_count', 'returns_cash',
+    'sales_cash', 'sales_card', 'sales_transfer', 'count_cash', 'count_card', 'count_transfer',
+    'cash_in', 'cash_out',
+)
+
+
+# Период снимков остатка кассового журнала (в событиях)
+CASH_SNAPSHOT_INTERVAL = 50
+
+# Колонки времени в секундах эпохи (в старых базах - текст CURRENT_TIMESTAMP в UTC)
+EPOCH_COLUMNS = {
+    'sales': ('created_at',),
+    'returns': ('return_date',),
+    'shifts': ('start_time', 'end_time'),
+    'customers': ('created_at',),
+}
+
+# Допуск сравнения дробных количеств (количества хранятся с тремя знаками)
+QUANTITY_EPSILON = 0.0005
+
+# Период снимков остатка бонусного журнала клиента (в событиях)
+BONUS_SNAPSHOT_INTERVAL = 20
+
+# Период снимков остатка товара в журнале движения (в движениях товара)
+STOCK_SNAPSHOT_INTERVAL = 50
+
+# Время жизни резерва товара без подтверждения от кассы (минуты)
+RESERVATION_TTL_MINUTES = 30
+
+# Условие действующего резерва (r - stock_reservations)
+ACTIVE_RESERVATION = "r.expires_at > datetime('now')"
+
+
+# Порог медленного запроса по умолчанию (мс) и размер журнала медленных запросов
+SLOW_QUERY_MS = 100
+SLOW_QUERY_LOG_SIZE = 200
+
+# Число строк, возвращаемых поиском клиентов
+CUSTOMER_SEARCH_LIMIT = 100
+
+# Минимальная длина фрагмента для триграммного индекса FTS5
+TRIGRAM_MIN_LENGTH = 3
+
+# Символы оформления номера телефона, не влияющие на поиск
+PHONE_PUNCTUATION = '+- ().'
+PHONE_QUERY = re.compile(r'[\d+\- ().]+')
+
+
+def phone_digits_sql(column):
+    """Выражение SQL: только цифры номера, 11-значные номера с 7/8 - без кода страны"""
+    digits = column
+    for char in PHONE_PUNCTUATION:
+        digits = f"replace({digits}, '{char}', '')"
+    return (f"CASE WHEN length({digits}) = 11 AND substr({digits}, 1, 1) IN ('7', '8') "
+            f"THEN substr({digits}, 2) ELSE {digits} END")
+
+
+def fold_name_sql(column):
+    """Выражение SQL: имя для поискового индекса (регистр свёртывает токенизатор, ё -> е)"""
+    return f"replace(replace({column}, 'ё', 'е'), 'Ё', 'Е')"
+
+
+def normalize_phone(text):
+    """Цифры номера из строки поиска в том же виде, что и customers.phone_digits"""
+    digits = re.sub(r'\D', '', text)
+    if (len(digits) == 11 and digits[0] in '78') or text.lstrip().startswith('+7'):
+        return digits[1:]
+    return digits
+
+
+def fts_phrase(text):
+    """Фраза запроса FTS5 в кавычках"""
+    return '"' + text.replace('"', '""') + '"'
+
+# Литералы в тексте запроса: строки и числа вне имён
+SQL_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+
+# Денежные колонки в копейках (INTEGER); в базах старого формата - рубли в REAL
+MONEY_COLUMNS = {
+    'sales': ('total_amount', 'discount_amount', 'tax_amount', 'final_amount'),
+    'sale_items': ('price', 'total_amount'),
+    'returns': ('total_amount',),
+    'return_items': ('price', 'total_amount'),
+    'shifts': ('start_amount', 'end_amount', 'total_sales', 'total_returns', 'sales_cash',
+               'sales_card', 'sales_transfer', 'returns_cash', 'cash_in', 'cash_out'),
+    'cash_ledger': ('amount',),
+    'cash_ledger_snapshots': ('balance',),
+    'customers': ('total_purchases',),
+}
+
+
+def payment_column(payment_method):
+    """Суффикс счётчика смены для способа оплаты"""
+    return PAYMENT_COLUMNS.get(payment_method, 'transfer')
+
+
+def line_refund(line, quantity):
+    """Сумма возврата количества позиции чека: её доля суммы позиции за вычетом скидки (копейки)"""
+    return prorate(line.total_amount - (line.discount_amount or 0), line_total(line.price, quantity),
+                   line.total_amount)
+
+
+class QueryStats:
+    """Счётчики времени запросов по нормализованному тексту SQL и журнал медленных запросов"""
+    
+    def __init__(self, connection, slow_ms=SLOW_QUERY_MS):
+        self.connection = connection
+        self.slow_ms = slow_ms
+        self.normalized = {}
+        self.reset()
+        
+    def reset(self):
+        """Сброс накопленной статистики"""
+        # {sql: [число, суммарно с, максимум с, строк]}
+        self.stats = {}
+        self.slow = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+        self.started = datetime.now()
+        
+    def normalize(self, query):
+        """Текст запроса без литералов и лишних пробелов (кэшируется)"""
+        sql = self.normalized.get(query)
+        if sql is None:
+            sql = ' '.join(SQL_LITERAL.sub('?', query).split())
+            self.normalized[query] = sql
+        return sql
+        
+    def record(self, query, params, seconds, rows):
+        """Учёт выполненного запроса"""
+        sql = self.normalize(query)
+        entry = self.stats.get(sql)
+        if entry is None:
+            entry = self.stats[sql] = [0, 0.0, 0.0, 0]
+        entry[0] += 1
+        entry[1] += seconds
+        entry[3] += rows
+        if seconds > entry[2]:
+            entry[2] = seconds
+            
+        if seconds * 1000 >= self.slow_ms:
+            self.log_slow(sql, query, params, seconds)
+            
+    def explain(self, query, params):
+        """План выполнения запроса"""
+        try:
+            # План запрашивается напрямую у соединения, мимо счётчиков
+            return '\n'.join(row[-1] for row in self.connection.execute(
+                'EXPLAIN QUERY PLAN ' + query, params or ()))
+        except sqlite3.Error as e:
+            return f"План недоступен: {e}"
+            
+    def log_slow(self, sql, query, params, seconds):
+        """Запись медленного запроса вместе с планом выполнения"""
+        plan = self.explain(query, params)
+        self.slow.append({
+            'sql': sql,
+            'params': [str(value) for value in (params or ())],
+            'ms': round(seconds * 1000, 2),
+            'at': datetime.now().isoformat(timespec='seconds'),
+            'plan': plan,
+        })
+        print(f"[SQL] медленный запрос {seconds * 1000:.1f} мс: {sql}\n{plan}")
+        
+    def snapshot(self):
+        """Статистика по запросам, отсортированная по суммарному времени"""
+        result = []
+        for sql, (count, total, maximum, rows) in self.stats.items():
+            result.append({
+                'sql': sql,
+                'count': count,
+                'total_ms': round(total * 1000, 2),
+                'avg_ms': round(total * 1000 / count, 3),
+                'max_ms': round(maximum * 1000, 2),
+                'rows': rows,
+            })
+        result.sort(key=lambda item: item['total_ms'], reverse=True)
+        return result
+        
+    def export_json(self, path):
+        """Выгрузка статистики и журнала медленных запросов в JSON"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'started': self.started.isoformat(timespec='seconds'),
+                'exported': datetime.now().isoformat(timespec='seconds'),
+                'slow_ms': self.slow_ms,
+                'queries': self.snapshot(),
+                'slow': list(self.slow),
+            }, f, ensure_ascii=False, indent=2)
 
 
 class DatabaseManager:
-    def __init__(self, db_path="vetpos.db"):
+    def __init__(self, db_path="vetpos.db", register_id=None, initialize=True):
         self.db_path = db_path
+        # Идентификатор кассы (несколько касс могут работать с одной базой)
+        self.register_id = register_id or os.environ.get('VETPOS_REGISTER') or socket.gethostname()
         self.connection = None
-        self.create_database()
+        # Статистика запросов (None - выключена, без накладных расходов)
+        self.query_stats = None
+        # Именованные запросы модулей
+        self.queries = QueryRepository(self)
+        # Архив закрытых лет (отдельные файлы рядом с базой); нужен уже миграциям - пересчёту счётчиков смен
+        self.archive = SalesArchive(self)
+        # initialize=False - база уже создана и переведена её владельцем (читатели сервера, утилиты):
+        # без схемы, миграций и тестовых данных
+        if initialize:
+            self.create_database()
+        else:
+            self.open_connection()
+        # Обслуживание по расписанию (статистика, возврат страниц, проверка целостности)
+        self.maintenance = DatabaseMaintenance(self)
+        # Журнал изменений для центральной базы (ведётся после replication.py enable)
+        self.replication = ChangeCapture(self)
         
-    def create_database(self):
-        """Создание базы данных и таблиц"""
-        self.connection = sqlite3.connect(self.db_path, check_same_thread=False)
+        if os.environ.get('VETPOS_SQL_STATS') == '1' or self.get_setting('sql_stats') == '1':
+            self.enable_query_stats(float(self.get_setting('sql_slow_ms') or SLOW_QUERY_MS))
+        
+    def open_connection(self):
+        """Подключение к файлу базы"""
+        # Ожидание блокировки записи, когда с базой работают несколько касс
+        # uri=True - файлы архива подключаются по URI только для чтения (mode=ro)
+        self.connection = sqlite3.connect(self.db_path, timeout=15, check_same_thread=False,
+                                          cached_statements=CACHED_STATEMENTS, uri=True)
         self.connection.row_factory = sqlite3.Row  # Для доступа к колонкам по имени
         
+    def create_database(self):
+        """Создание базы данных и таблиц"""
+        self.open_connection()
         cursor = self.connection.cursor()
         
+        # Новая база создаётся с возвратом свободных страниц по шагам; старые переводятся
+        # обслуживанием (maintenance.py) полным VACUUM после закрытия смены
+        cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        
         # Таблица пользователей
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS users (
@@ -48,8 +291,9 @@ class DatabaseManager:
                 cost_price DECIMAL(10,2),
                 category TEXT,
                 unit TEXT DEFAULT 'шт',
-                quantity DECIMAL(10,3) DEFAULT 0,
+                quantity DECIMAL(10,3) DEFAULT 0, -- кэш журнала движения, ведётся его триггером
                 min_quantity DECIMAL(10,3) DEFAULT 0,
+                stock_seq INTEGER DEFAULT 0, -- номер последнего движения товара
                 is_active BOOLEAN DEFAULT 1,
                 created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
                 updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
@@ -66,9 +310,10 @@ class DatabaseManager:
                 address TEXT,
                 discount_percent DECIMAL(5,2) DEFAULT 0,
                 bonus_points INTEGER DEFAULT 0,
-                total_purchases DECIMAL(12,2) DEFAULT 0,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                is_active BOOLEAN DEFAULT 1
+                total_purchases INTEGER DEFAULT 0, -- копейки
+                created_at INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)), -- секунды эпохи
+                is_active BOOLEAN DEFAULT 1,
+                phone_digits TEXT -- номер без оформления и кода страны (ведётся триггером)
             )
         ''')
         
@@ -77,14 +322,25 @@ class DatabaseManager:
             CREATE TABLE IF NOT EXISTS shifts (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 cashier_id INTEGER NOT NULL,
-                start_time DATETIME NOT NULL,
-                end_time DATETIME,
-                start_amount DECIMAL(10,2) NOT NULL,
-                end_amount DECIMAL(10,2),
-                total_sales DECIMAL(10,2) DEFAULT 0,
-                total_returns DECIMAL(10,2) DEFAULT 0,
+                start_time INTEGER NOT NULL, -- секунды эпохи
+                end_time INTEGER,
+                business_date TEXT, -- местная дата открытия смены (ГГГГ-ММ-ДД)
+                start_amount INTEGER NOT NULL, -- суммы смены в копейках
+                end_amount INTEGER,
+                total_sales INTEGER DEFAULT 0,
+                total_returns INTEGER DEFAULT 0,
                 transactions_count INTEGER DEFAULT 0,
                 status TEXT DEFAULT 'open',
+                sales_cash INTEGER DEFAULT 0,
+                sales_card INTEGER DEFAULT 0,
+                sales_transfer INTEGER DEFAULT 0,
+                count_cash INTEGER DEFAULT 0,
+                count_card INTEGER DEFAULT 0,
+                count_transfer INTEGER DEFAULT 0,
+                returns_count INTEGER DEFAULT 0,
+                returns_cash INTEGER DEFAULT 0,
+                cash_in INTEGER DEFAULT 0,
+                cash_out INTEGER DEFAULT 0,
                 FOREIGN KEY (cashier_id) REFERENCES users (id)
             )
         ''')
@@ -95,14 +351,16 @@ class DatabaseManager:
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 shift_id INTEGER NOT NULL,
                 customer_id INTEGER,
-                total_amount DECIMAL(10,2) NOT NULL,
-                discount_amount DECIMAL(10,2) DEFAULT 0,
-                tax_amount DECIMAL(10,2) DEFAULT 0,
-                final_amount DECIMAL(10,2) NOT NULL,
+                total_amount INTEGER NOT NULL, -- суммы чека в копейках
+                discount_amount INTEGER DEFAULT 0,
+                tax_amount INTEGER DEFAULT 0,
+                final_amount INTEGER NOT NULL,
                 payment_method TEXT NOT NULL,
                 status TEXT DEFAULT 'completed',
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                receipt_number TEXT,
+                created_at INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)), -- секунды эпохи
+                receipt_number INTEGER, -- сквозной номер чека кассы в смене
+                register_id TEXT,
+                business_date TEXT, -- бизнес-дата смены продажи
                 FOREIGN KEY (shift_id) REFERENCES shifts (id),
                 FOREIGN KEY (customer_id) REFERENCES customers (id)
             )
@@ -115,21 +373,24 @@ class DatabaseManager:
                 sale_id INTEGER NOT NULL,
                 product_id INTEGER NOT NULL,
                 quantity DECIMAL(10,3) NOT NULL,
-                price DECIMAL(10,2) NOT NULL,
+                price INTEGER NOT NULL, -- копейки
                 discount_percent DECIMAL(5,2) DEFAULT 0,
-                total_amount DECIMAL(10,2) NOT NULL,
+                total_amount INTEGER NOT NULL,
+                discount_amount INTEGER DEFAULT 0, -- копейки: скидка правил и доля скидки чека
+                returned_quantity DECIMAL(10,3) DEFAULT 0, -- ведётся возвратами в их транзакции
                 FOREIGN KEY (sale_id) REFERENCES sales (id),
                 FOREIGN KEY (product_id) REFERENCES products (id)
             )
         ''')
         
-        # Таблица движения товаров
+        # Журнал движения товаров: каждое изменение остатка (только добавление)
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS inventory_movements (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 product_id INTEGER NOT NULL,
-                movement_type TEXT NOT NULL, -- 'in', 'out', 'adjustment'
-                quantity DECIMAL(10,3) NOT NULL,
+                seq INTEGER, -- номер движения товара, подряд с 1
+                movement_type TEXT NOT NULL, -- 'opening', 'in', 'sale', 'return', 'adjustment'
+                quantity DECIMAL(10,3) NOT NULL, -- количество со знаком: расход < 0
                 price DECIMAL(10,2),
                 reason TEXT,
                 document_number TEXT,
@@ -140,6 +401,18 @@ class DatabaseManager:
             )
         ''')
         
+        # Снимки остатка товара каждые STOCK_SNAPSHOT_INTERVAL движений и на границах архива
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS stock_snapshots (
+                product_id INTEGER NOT NULL,
+                seq INTEGER NOT NULL,
+                quantity DECIMAL(10,3) NOT NULL, -- остаток после движения seq
+                created_at DATETIME NOT NULL, -- время движения seq
+                PRIMARY KEY (product_id, seq),
+                FOREIGN KEY (product_id) REFERENCES products (id)
+            )
+        ''')
+        
         # Таблица настроек
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS settings (
@@ -155,10 +428,13 @@ class DatabaseManager:
             CREATE TABLE IF NOT EXISTS returns (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 sale_id INTEGER NOT NULL,
-                total_amount REAL NOT NULL,
-                return_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                total_amount INTEGER NOT NULL, -- копейки
+                return_date INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)), -- секунды эпохи
                 reason TEXT,
-                FOREIGN KEY (sale_id) REFERENCES sales(id)
+                shift_id INTEGER,
+                business_date TEXT, -- бизнес-дата смены возврата
+                FOREIGN KEY (sale_id) REFERENCES sales(id),
+                FOREIGN KEY (shift_id) REFERENCES shifts(id)
             )
         ''')
         
@@ -170,30 +446,266 @@ class DatabaseManager:
                 sale_item_id INTEGER NOT NULL,
                 product_id INTEGER NOT NULL,
                 quantity DECIMAL(10,3) NOT NULL,
-                price DECIMAL(10,2) NOT NULL,
-                total_amount DECIMAL(10,2) NOT NULL,
+                price INTEGER NOT NULL, -- копейки
+                total_amount INTEGER NOT NULL,
                 FOREIGN KEY (return_id) REFERENCES returns(id),
                 FOREIGN KEY (sale_item_id) REFERENCES sale_items(id),
                 FOREIGN KEY (product_id) REFERENCES products(id)
             )
         ''')
         
+        # Кассовый журнал: события движения наличных (только добавление)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS cash_ledger (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                shift_id INTEGER NOT NULL,
+                seq INTEGER NOT NULL,
+                event_type TEXT NOT NULL, -- 'open', 'sale', 'return', 'cash_in', 'cash_out'
+                amount INTEGER NOT NULL, -- копейки со знаком: поступление в кассу > 0
+                reason TEXT,
+                document_number TEXT,
+                user_id INTEGER,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE (shift_id, seq),
+                FOREIGN KEY (shift_id) REFERENCES shifts (id),
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+        ''')
+        
+        # Снимки остатка кассы каждые CASH_SNAPSHOT_INTERVAL событий
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS cash_ledger_snapshots (
+                shift_id INTEGER NOT NULL,
+                seq INTEGER NOT NULL,
+                balance INTEGER NOT NULL, -- копейки
+                PRIMARY KEY (shift_id, seq),
+                FOREIGN KEY (shift_id) REFERENCES shifts (id)
+            )
+        ''')
+        
+        self.create_cash_ledger_triggers(cursor)
+        
+        # Отложенные чеки и журнал текущего чека кассы
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS parked_receipts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                register_id TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'active', -- 'active' (текущий чек), 'parked'
+                customer_id INTEGER,
+                discount_percent DECIMAL(5,2) DEFAULT 0,
+                payload TEXT NOT NULL DEFAULT '[]', -- [[product_id, quantity, price в копейках], ...]
+                user_id INTEGER,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (customer_id) REFERENCES customers (id),
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+        ''')
+        
+        # Счётчики номеров чеков кассы в смене
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS receipt_sequences (
+                register_id TEXT NOT NULL,
+                shift_id INTEGER NOT NULL,
+                last_number INTEGER NOT NULL,
+                PRIMARY KEY (register_id, shift_id)
+            ) WITHOUT ROWID
+        ''')
+        self.add_column_if_missing(cursor, 'sales', 'register_id', 'TEXT')
+        
+        # Резерв товара под открытые и отложенные чеки
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS stock_reservations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                receipt_id INTEGER NOT NULL,
+                product_id INTEGER NOT NULL,
+                quantity DECIMAL(10,3) NOT NULL,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                expires_at DATETIME NOT NULL, -- резерв без продления снимается сборщиком
+                UNIQUE (receipt_id, product_id),
+                FOREIGN KEY (receipt_id) REFERENCES parked_receipts (id),
+                FOREIGN KEY (product_id) REFERENCES products (id)
+            )
+        ''')
+        
+        # Складские документы: приход и инвентаризация
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS stock_documents (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                doc_type TEXT NOT NULL, -- 'receiving', 'stocktake'
+                number TEXT UNIQUE,
+                status TEXT DEFAULT 'draft', -- 'draft', 'posted'
+                supplier TEXT,
+                comment TEXT,
+                user_id INTEGER,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                posted_at DATETIME,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+        ''')
+        
+        # Строки складских документов (для инвентаризации quantity - фактический остаток)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS stock_document_lines (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                document_id INTEGER NOT NULL,
+                product_id INTEGER NOT NULL,
+                quantity DECIMAL(10,3) NOT NULL,
+                price DECIMAL(10,2),
+                expected_quantity DECIMAL(10,3), -- учётный остаток на момент проведения
+                UNIQUE (document_id, product_id),
+                FOREIGN KEY (document_id) REFERENCES stock_documents (id),
+                FOREIGN KEY (product_id) REFERENCES products (id)
+            )
+        ''')
+        
+        # Правила скидок и акций (цель: товар, категория или весь ассортимент)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS discount_rules (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                rule_type TEXT NOT NULL, -- 'percent', 'n_for_m'
+                product_id INTEGER,
+                category TEXT,
+                percent DECIMAL(5,2) DEFAULT 0,
+                buy_quantity INTEGER, -- N штук по цене M
+                pay_quantity INTEGER,
+                date_from DATE,
+                date_to DATE,
+                time_from TEXT, -- 'ЧЧ:ММ'; окно может переходить через полночь
+                time_to TEXT,
+                weekdays TEXT, -- '12345' (1 - понедельник), NULL - все дни
+                is_active BOOLEAN DEFAULT 1,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (product_id) REFERENCES products (id)
+            )
+        ''')
+        
+        # Бонусный журнал: начисления, списания, корректировки и сгорания баллов (только добавление)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS bonus_ledger (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                customer_id INTEGER NOT NULL,
+                seq INTEGER NOT NULL,
+                event_type TEXT NOT NULL, -- 'opening', 'accrual', 'redeem', 'manual', 'expire', 'reversal', 'restore'
+                points INTEGER NOT NULL, -- баллы со знаком: начисление > 0
+                sale_id INTEGER,
+                expires_at DATE, -- дата сгорания начисления, NULL - бессрочно
+                reason TEXT,
+                user_id INTEGER,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE (customer_id, seq),
+                FOREIGN KEY (customer_id) REFERENCES customers (id),
+                FOREIGN KEY (sale_id) REFERENCES sales (id),
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+        ''')
+        
+        # Снимки остатка баллов клиента каждые BONUS_SNAPSHOT_INTERVAL событий
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS bonus_ledger_snapshots (
+                customer_id INTEGER NOT NULL,
+                seq INTEGER NOT NULL,
+                balance INTEGER NOT NULL,
+                PRIMARY KEY (customer_id, seq),
+                FOREIGN KEY (customer_id) REFERENCES customers (id)
+            )
+        ''')
+        
+        self.create_bonus_ledger_triggers(cursor)
+        
+        # Журнал обслуживания базы: размер в страницах до и после каждой задачи
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS maintenance_log (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                started_at INTEGER NOT NULL,
+                task TEXT NOT NULL, -- 'analyze', 'optimize', 'integrity', 'vacuum', 'convert', 'reconcile'
+                trigger TEXT NOT NULL, -- 'idle', 'shift_close', 'manual'
+                duration_ms REAL,
+                pages_before INTEGER,
+                pages_after INTEGER,
+                free_before INTEGER,
+                free_after INTEGER,
+                result TEXT
+            )
+        ''')
+        
+        # Поисковый индекс клиентов: триграммы имени и цифр телефона (rowid = customers.id)
+        cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS customers_fts 
+            USING fts5(name, phone, tokenize='trigram')
+        ''')
+        self.add_column_if_missing(cursor, 'customers', 'phone_digits', 'TEXT')
+        self.create_customer_search_triggers(cursor)
+        
+        # Миграция баз, созданных до появления счётчиков смены. Суммы переводятся в копейки раньше
+        # пересчёта счётчиков и переноса остатка в кассовый журнал: они считаются уже в копейках
+        shift_counters_added = self.migrate_shift_totals(cursor)
+        self.migrate_money_kopecks(cursor)
+        self.migrate_returns_amount_type(cursor)
+        if shift_counters_added:
+            self.rebuild_shift_totals()
+        self.migrate_cash_ledger()
+        self.migrate_bonus_ledger(cursor)
+        self.migrate_customer_search(cursor)
+        self.migrate_returned_quantity(cursor)
+        self.migrate_line_discounts(cursor)
+        self.migrate_epoch_timestamps(cursor)
+        self.migrate_stock_ledger(cursor)
+        self.create_stock_ledger_triggers(cursor)
+        
         # Создание индексов
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_products_barcode ON products(barcode)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_products_name ON products(name)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_customers_phone ON customers(phone)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_customers_phone_digits ON customers(phone_digits)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_customers_name ON customers(name)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_sales_created_at ON sales(created_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_sales_business_date ON sales(business_date)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_returns_business_date ON returns(business_date)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_sales_shift_id ON sales(shift_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_sales_customer_id ON sales(customer_id, created_at)')
+        cursor.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_sales_receipt_number 
+            ON sales(register_id, shift_id, receipt_number)
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_sale_items_sale_id ON sale_items(sale_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_sale_items_product_id ON sale_items(product_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_shifts_cashier_status ON shifts(cashier_id, status)')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_inventory_movements_product 
+            ON inventory_movements(product_id, created_at)
+        ''')
+        cursor.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_inventory_movements_seq 
+            ON inventory_movements(product_id, seq)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_stock_snapshots_created 
+            ON stock_snapshots(product_id, created_at, seq)
+        ''')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_returns_sale_id ON returns(sale_id)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_return_items_return_id ON return_items(return_id)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_return_items_sale_item_id ON return_items(sale_item_id)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_return_items_product_id ON return_items(product_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_parked_receipts_register ON parked_receipts(register_id, status)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_stock_reservations_product ON stock_reservations(product_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_stock_reservations_expires ON stock_reservations(expires_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_stock_documents_type ON stock_documents(doc_type, created_at)')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_bonus_ledger_expires ON bonus_ledger(expires_at)
+            WHERE event_type = 'accrual'
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_bonus_ledger_sale_id ON bonus_ledger(sale_id)')
         
         # Создание пользователя по умолчанию с хешированным паролем
-        admin_password_hash = bcrypt.hashpw('admin'.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-        cursor.execute('''
-            INSERT OR IGNORE INTO users (username, password, name, role) 
-            VALUES ('admin', ?, 'Администратор', 'admin')
-        ''', (admin_password_hash,))
+        # Хеш bcrypt считается только для новой базы: на каждом запуске это сотни миллисекунд
+        if not cursor.execute("SELECT 1 FROM users WHERE username = 'admin'").fetchone():
+            admin_password_hash = bcrypt.hashpw('admin'.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+            cursor.execute('''
+                INSERT OR IGNORE INTO users (username, password, name, role) 
+                VALUES ('admin', ?, 'Администратор', 'admin')
+            ''', (admin_password_hash,))
         
         # Настройки по умолчанию
         default_settings = [
@@ -205,7 +717,11 @@ class DatabaseManager:
             ('tax_rate', '20', 'Ставка НДС в процентах'),
             ('currency', 'RUB', 'Валюта'),
             ('moysklad_token', '', 'Токен API МойСклад'),
-            ('moysklad_sync', '0', 'Синхронизация с МойСклад')
+            ('moysklad_sync', '0', 'Синхронизация с МойСклад'),
+            ('bonus_point_value', '100', 'Стоимость бонусного балла в копейках'),
+            ('bonus_max_percent', '50', 'Максимальная доля чека, оплачиваемая баллами (%)'),
+            ('bonus_accrual_percent', '5', 'Начисление баллов с оплаченной суммы чека (%)'),
+            ('bonus_expiry_days', '365', 'Срок действия начисленных баллов в днях (0 - бессрочно)')
         ]
         
         for key, value, description in default_settings:
@@ -230,8 +746,9 @@ class DatabaseManager:
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?)
             ''', (barcode, name, description, price, cost_price, category, unit, quantity))
         
-        # Добавление тестовых клиентов
-        test_customers = [
+        # Добавление тестовых клиентов - только в пустой справочник: уникального ключа у клиентов нет,
+        # и INSERT OR IGNORE добавлял бы их на каждом запуске
+        test_customers = [] if cursor.execute('SELECT 1 FROM customers LIMIT 1').fetchone() else [
             ('Иванов Иван Иванович', '+7-915-123-45-67', 'ivanov@email.com', 'г. Москва, ул. Центральная, д. 1', 5),
             ('Петрова Анна Сергеевна', '+7-916-234-56-78', 'petrova@email.com', 'г. Москва, ул. Садовая, д. 15', 10),
             ('Сидоров Петр Николаевич', '+7-917-345-67-89', '', 'г. Москва, ул. Лесная, д. 8', 0)
@@ -246,58 +763,482 @@ class DatabaseManager:
         
         self.connection.commit()
         
+    def add_column_if_missing(self, cursor, table, column, definition):
+        """Добавление колонки в таблицу существующей базы"""
+        columns = [row[1] for row in cursor.execute(f'PRAGMA table_info({table})')]
+        if column in columns:
+            return False
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+        return True
+        
+    def migrate_shift_totals(self, cursor):
+        """Добавление счётчиков смены в базы старого формата; возвращает True, если их нужно пересчитать"""
+        added = False
+        for bucket in ('cash', 'card', 'transfer'):
+            added |= self.add_column_if_missing(cursor, 'shifts', f'sales_{bucket}', 'DECIMAL(10,2) DEFAULT 0')
+            added |= self.add_column_if_missing(cursor, 'shifts', f'count_{bucket}', 'INTEGER DEFAULT 0')
+        added |= self.add_column_if_missing(cursor, 'shifts', 'returns_count', 'INTEGER DEFAULT 0')
+        added |= self.add_column_if_missing(cursor, 'shifts', 'returns_cash', 'DECIMAL(10,2) DEFAULT 0')
+        added |= self.add_column_if_missing(cursor, 'shifts', 'cash_in', 'DECIMAL(10,2) DEFAULT 0')
+        added |= self.add_column_if_missing(cursor, 'shifts', 'cash_out', 'DECIMAL(10,2) DEFAULT 0')
+        
+        if self.add_column_if_missing(cursor, 'returns', 'shift_id', 'INTEGER'):
+            # Старые возвраты относим к смене исходной продажи
+            cursor.execute('''
+                UPDATE returns 
+                SET shift_id = (SELECT shift_id FROM sales WHERE sales.id = returns.sale_id)
+            ''')
+            
+        return added
+        
+    def migrate_epoch_timestamps(self, cursor):
+        """Перевод времени продаж, возвратов, смен и клиентов из текста UTC в секунды эпохи и бизнес-даты"""
+        self.add_column_if_missing(cursor, 'shifts', 'business_date', 'TEXT')
+        self.add_column_if_missing(cursor, 'sales', 'business_date', 'TEXT')
+        self.add_column_if_missing(cursor, 'returns', 'business_date', 'TEXT')
+        
+        done = cursor.execute("SELECT value FROM settings WHERE key = 'time_units'").fetchone()
+        if done and done[0] == 'epoch':
+            return
+            
+        for table, columns in EPOCH_COLUMNS.items():
+            assignments = ', '.join(f"{column} = CAST(strftime('%s', {column}) AS INTEGER)" for column in columns)
+            cursor.execute(f"UPDATE {table} SET {assignments} WHERE typeof({columns[0]}) = 'text'")
+            
+        # Бизнес-дата - местная дата открытия смены; продажи и возвраты относятся к дню своей смены,
+        # в том числе после полуночи
+        cursor.execute('''
+            UPDATE shifts SET business_date = date(start_time, 'unixepoch', 'localtime')
+            WHERE business_date IS NULL
+        ''')
+        for table, column in (('sales', 'created_at'), ('returns', 'return_date')):
+            cursor.execute(f'''
+                UPDATE {table}
+                SET business_date = COALESCE(
+                    (SELECT sh.business_date FROM shifts sh WHERE sh.id = {table}.shift_id),
+                    date({column}, 'unixepoch', 'localtime'))
+                WHERE business_date IS NULL
+            ''')
+            
+        cursor.execute('''
+            INSERT OR REPLACE INTO settings (key, value, description)
+            VALUES ('time_units', 'epoch', 'Время продаж, возвратов, смен и клиентов - секунды эпохи')
+        ''')
+        
+    def migrate_returned_quantity(self, cursor):
+        """Возвращённое количество позиций чеков по возвратам, оформленным до его появления"""
+        if self.add_column_if_missing(cursor, 'sale_items', 'returned_quantity', 'DECIMAL(10,3) DEFAULT 0'):
+            cursor.execute('''
+                UPDATE sale_items
+                SET returned_quantity = (
+                    SELECT SUM(ri.quantity) FROM return_items ri WHERE ri.sale_item_id = sale_items.id
+                )
+                WHERE id IN (SELECT sale_item_id FROM return_items)
+            ''')
+            
+    def migrate_line_discounts(self, cursor):
+        """Скидка позиций чеков, проведённых до её учёта: скидка чека делится пропорционально суммам"""
+        if not self.add_column_if_missing(cursor, 'sale_items', 'discount_amount', 'INTEGER DEFAULT 0'):
+            return
+            
+        sales = {}
+        for sale_id, item_id, total, discount in cursor.execute('''
+            SELECT si.sale_id, si.id, si.total_amount, s.discount_amount
+            FROM sale_items si JOIN sales s ON s.id = si.sale_id
+            WHERE s.discount_amount > 0
+            ORDER BY si.sale_id, si.id
+        ''').fetchall():
+            sales.setdefault((sale_id, discount), []).append((item_id, total))
+        for (_, discount), items in sales.items():
+            shares = allocate(discount, [total for _, total in items])
+            cursor.executemany('UPDATE sale_items SET discount_amount = ? WHERE id = ?',
+                               [(share, item_id) for share, (item_id, _) in zip(shares, items)])
+                               
+    def migrate_stock_ledger(self, cursor):
+        """Нумерация движений старой базы и вступительные записи: журнал сходится с остатками"""
+        self.add_column_if_missing(cursor, 'products', 'stock_seq', 'INTEGER DEFAULT 0')
+        if not self.add_column_if_missing(cursor, 'inventory_movements', 'seq', 'INTEGER'):
+            return
+            
+        cursor.execute('''
+            UPDATE inventory_movements SET seq = numbered.seq
+            FROM (
+                SELECT id, ROW_NUMBER() OVER (PARTITION BY product_id ORDER BY id) as seq
+                FROM inventory_movements
+            ) numbered
+            WHERE inventory_movements.id = numbered.id
+        ''')
+        # Продажи до журнала не писали движений: расхождение с остатком фиксируется вступительной записью
+        cursor.execute('''
+            INSERT INTO inventory_movements (product_id, seq, movement_type, quantity, reason)
+            SELECT p.id, COALESCE(m.seq, 0) + 1, 'opening', p.quantity - COALESCE(m.total, 0),
+                   'Перенос остатка: движения до журнала'
+            FROM products p
+            LEFT JOIN (
+                SELECT product_id, MAX(seq) as seq, SUM(quantity) as total
+                FROM inventory_movements GROUP BY product_id
+            ) m ON m.product_id = p.id
+            WHERE ABS(p.quantity - COALESCE(m.total, 0)) > ?
+        ''', (QUANTITY_EPSILON,))
+        cursor.execute('''
+            UPDATE products SET stock_seq = COALESCE(
+                (SELECT MAX(seq) FROM inventory_movements WHERE product_id = products.id), 0)
+        ''')
+        cursor.execute('''
+            INSERT OR IGNORE INTO stock_snapshots (product_id, seq, quantity, created_at)
+            SELECT id, stock_seq, quantity, CURRENT_TIMESTAMP FROM products WHERE stock_seq > 0
+        ''')
+        
+    def create_stock_ledger_triggers(self, cursor):
+        """Неизменяемость журнала движения, ведение остатка products.quantity и снимков"""
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS inventory_movements_no_update
+            BEFORE UPDATE ON inventory_movements
+            BEGIN
+                SELECT RAISE(ABORT, 'Журнал движения товаров не допускает изменений');
+            END
+        ''')
+        # Удаляются только движения, перенесённые в архив закрытых лет
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS inventory_movements_no_delete
+            BEFORE DELETE ON inventory_movements
+            WHEN OLD.created_at >= COALESCE(
+                date((SELECT value FROM settings WHERE key = 'sales_archived_through'), '+1 day'), '')
+            BEGIN
+                SELECT RAISE(ABORT, 'Журнал движения товаров не допускает удалений');
+            END
+        ''')
+        # Остаток в карточке товара - кэш журнала; вступительная запись фиксирует уже учтённый остаток.
+        # Снимок считается по журналу (прошлый снимок и хвост), а не по кэшу
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS inventory_movements_stock
+            AFTER INSERT ON inventory_movements
+            BEGIN
+                UPDATE products 
+                SET quantity = quantity + CASE WHEN NEW.movement_type = 'opening' THEN 0 ELSE NEW.quantity END,
+                    stock_seq = NEW.seq
+                WHERE id = NEW.product_id;
+                INSERT INTO stock_snapshots (product_id, seq, quantity, created_at)
+                SELECT NEW.product_id, NEW.seq,
+                       COALESCE(s.quantity, 0) + (
+                           SELECT SUM(m.quantity) FROM inventory_movements m
+                           WHERE m.product_id = NEW.product_id AND m.seq > COALESCE(s.seq, 0)),
+                       NEW.created_at
+                FROM (SELECT 1) LEFT JOIN (
+                    SELECT seq, quantity FROM stock_snapshots
+                    WHERE product_id = NEW.product_id ORDER BY seq DESC LIMIT 1
+                ) s
+                WHERE NEW.seq % {STOCK_SNAPSHOT_INTERVAL} = 0;
+            END
+        ''')
+        # Начальный остаток нового товара (карточка, импорт, генератор) - первая запись журнала
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS products_opening_stock
+            AFTER INSERT ON products
+            WHEN NEW.quantity != 0
+            BEGIN
+                INSERT INTO inventory_movements (product_id, seq, movement_type, quantity, reason)
+                VALUES (NEW.id, 1, 'opening', NEW.quantity, 'Начальный остаток');
+            END
+        ''')
+        
+    def create_cash_ledger_triggers(self, cursor):
+        """Запрет изменения и удаления записей кассового журнала"""
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS cash_ledger_no_update
+            BEFORE UPDATE ON cash_ledger
+            BEGIN
+                SELECT RAISE(ABORT, 'Кассовый журнал не допускает изменений');
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS cash_ledger_no_delete
+            BEFORE DELETE ON cash_ledger
+            BEGIN
+                SELECT RAISE(ABORT, 'Кассовый журнал не допускает удалений');
+            END
+        ''')
+        
+    def create_bonus_ledger_triggers(self, cursor):
+        """Неизменяемость бонусного журнала и ведение остатка customers.bonus_points"""
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS bonus_ledger_no_update
+            BEFORE UPDATE ON bonus_ledger
+            BEGIN
+                SELECT RAISE(ABORT, 'Бонусный журнал не допускает изменений');
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS bonus_ledger_no_delete
+            BEFORE DELETE ON bonus_ledger
+            BEGIN
+                SELECT RAISE(ABORT, 'Бонусный журнал не допускает удалений');
+            END
+        ''')
+        # Остаток в карточке клиента - кэш журнала; вступительная запись фиксирует уже учтённый остаток
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS bonus_ledger_balance
+            AFTER INSERT ON bonus_ledger
+            WHEN NEW.event_type != 'opening'
+            BEGIN
+                UPDATE customers SET bonus_points = bonus_points + NEW.points WHERE id = NEW.customer_id;
+            END
+        ''')
+        
+    def create_customer_search_triggers(self, cursor):
+        """Ведение нормализованного телефона и поискового индекса при изменении клиентов"""
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS customers_search_insert
+            AFTER INSERT ON customers
+            BEGIN
+                UPDATE customers SET phone_digits = {phone_digits_sql('NEW.phone')} WHERE id = NEW.id;
+                INSERT INTO customers_fts (rowid, name, phone)
+                VALUES (NEW.id, {fold_name_sql('NEW.name')}, {phone_digits_sql('NEW.phone')});
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS customers_search_update
+            AFTER UPDATE OF name, phone ON customers
+            BEGIN
+                UPDATE customers SET phone_digits = {phone_digits_sql('NEW.phone')} WHERE id = NEW.id;
+                DELETE FROM customers_fts WHERE rowid = OLD.id;
+                INSERT INTO customers_fts (rowid, name, phone)
+                VALUES (NEW.id, {fold_name_sql('NEW.name')}, {phone_digits_sql('NEW.phone')});
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS customers_search_delete
+            AFTER DELETE ON customers
+            BEGIN
+                DELETE FROM customers_fts WHERE rowid = OLD.id;
+            END
+        ''')
+        
+    def migrate_customer_search(self, cursor):
+        """Заполнение телефона и поискового индекса для клиентов, добавленных до их появления"""
+        cursor.execute(f'''
+            UPDATE customers SET phone_digits = {phone_digits_sql('phone')}
+            WHERE phone_digits IS NULL AND phone IS NOT NULL
+        ''')
+        cursor.execute(f'''
+            INSERT INTO customers_fts (rowid, name, phone)
+            SELECT id, {fold_name_sql('name')}, phone_digits FROM customers
+            WHERE id > (SELECT COALESCE(MAX(rowid), 0) FROM customers_fts)
+        ''')
+        
+    def migrate_bonus_ledger(self, cursor):
+        """Перенос остатков баллов старого формата во вступительные записи журнала"""
+        cursor.execute('''
+            INSERT INTO bonus_ledger (customer_id, seq, event_type, points, reason)
+            SELECT c.id, 1, 'opening', c.bonus_points, 'Перенос остатка'
+            FROM customers c
+            WHERE c.bonus_points != 0
+            AND NOT EXISTS (SELECT 1 FROM bonus_ledger l WHERE l.customer_id = c.id)
+        ''')
+        
+    def migrate_money_kopecks(self, cursor):
+        """Перевод денежных колонок из рублей (REAL) в целые копейки одной транзакцией"""
+        done = cursor.execute("SELECT value FROM settings WHERE key = 'money_units'").fetchone()
+        if done and done[0] == 'kopecks':
+            return
+            
+        try:
+            for table, columns in MONEY_COLUMNS.items():
+                if table == 'cash_ledger':
+                    # Перевод единиц - единственное допустимое изменение журнала;
+                    # транзакция уже открыта предыдущими UPDATE, триггер вернётся при откате
+                    cursor.execute('DROP TRIGGER IF EXISTS cash_ledger_no_update')
+                assignments = ', '.join(f'{column} = CAST(ROUND({column} * 100) AS INTEGER)'
+                                        for column in columns)
+                cursor.execute(f'UPDATE {table} SET {assignments}')
+            self.create_cash_ledger_triggers(cursor)
+            
+            # Цены позиций отложенных чеков
+            for receipt_id, payload in cursor.execute('SELECT id, payload FROM parked_receipts').fetchall():
+                rows = [[product_id, quantity, to_kopecks(price)]
+                        for product_id, quantity, price in json.loads(payload or '[]')]
+                cursor.execute('UPDATE parked_receipts SET payload = ? WHERE id = ?',
+                               (json.dumps(rows, separators=(',', ':')), receipt_id))
+                               
+            cursor.execute('''
+                INSERT OR REPLACE INTO settings (key, value, description)
+                VALUES ('money_units', 'kopecks', 'Денежные суммы хранятся в копейках')
+            ''')
+            self.connection.commit()
+        except Exception:
+            self.connection.rollback()
+            raise
+        
+    def migrate_returns_amount_type(self, cursor):
+        """Пересоздание таблицы возвратов старого формата: сумма в колонке REAL читалась дробной"""
+        columns = {row[1]: row[2] for row in cursor.execute('PRAGMA table_info(returns)')}
+        if columns.get('total_amount', '').upper() != 'REAL':
+            return
+            
+        # Тип колонки в SQLite не меняется: строки копируются в таблицу с тем же описанием и целой суммой
+        table_sql = cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'returns'").fetchone()[0]
+        table_sql = re.sub(r'^CREATE TABLE\s+(IF NOT EXISTS\s+)?"?returns"?', 'CREATE TABLE returns_rebuild', table_sql)
+        table_sql = re.sub(r'\btotal_amount\s+REAL\b', 'total_amount INTEGER', table_sql)
+        # Индексы и триггеры (в том числе журнала репликации) удаляются вместе с таблицей
+        dependents = [row[0] for row in cursor.execute('''
+            SELECT sql FROM sqlite_master
+            WHERE tbl_name = 'returns' AND type IN ('index', 'trigger') AND sql IS NOT NULL
+        ''')]
+        sequence = cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'returns'").fetchone()
+        
+        try:
+            cursor.execute('DROP TABLE IF EXISTS returns_rebuild')
+            cursor.execute(table_sql)
+            cursor.execute('INSERT INTO returns_rebuild SELECT * FROM returns')
+            cursor.execute('DROP TABLE returns')
+            cursor.execute('ALTER TABLE returns_rebuild RENAME TO returns')
+            for sql in dependents:
+                cursor.execute(sql)
+            # Номера возвратов, перенесённых в архив, не выдаются повторно
+            if sequence:
+                cursor.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'returns'",
+                               (sequence[0],))
+            self.connection.commit()
+        except Exception:
+            self.connection.rollback()
+            raise
+            
+    def migrate_cash_ledger(self):
+        """Перенос остатка открытых смен старого формата в кассовый журнал"""
+        shifts = self.fetch_all('''
+            SELECT s.id, s.cashier_id,
+                   s.start_amount + s.sales_cash - s.returns_cash + s.cash_in - s.cash_out as cash_balance
+            FROM shifts s
+            WHERE s.status = 'open'
+            AND NOT EXISTS (SELECT 1 FROM cash_ledger l WHERE l.shift_id = s.id)
+        ''')
+        
+        for shift in shifts:
+            self.add_cash_event(shift['id'], 'open', shift['cash_balance'],
+                                reason='Перенос остатка', user_id=shift['cashier_id'])
+        
     def get_connection(self):
         """Получение соединения с БД"""
         return self.connection
         
-    def execute_query(self, query, params=None):
-        """Выполнение запроса"""
+    def enable_query_stats(self, slow_ms=SLOW_QUERY_MS):
+        """Включение статистики запросов"""
+        if self.query_stats is None:
+            self.query_stats = QueryStats(self.connection, slow_ms)
+        else:
+            self.query_stats.slow_ms = slow_ms
+        return self.query_stats
+        
+    def disable_query_stats(self):
+        """Выключение статистики запросов"""
+        self.query_stats = None
+        
+    def run_query(self, query, params=None, row_type=None):
+        """Выполнение запроса без учёта в статистике"""
         cursor = self.connection.cursor()
+        if row_type is not None:
+            cursor.row_factory = row_type.from_row
         if params:
             cursor.execute(query, params)
         else:
             cursor.execute(query)
         return cursor
         
-    def fetch_all(self, query, params=None):
-        """Получение всех записей"""
-        cursor = self.execute_query(query, params)
-        return cursor.fetchall()
+    def execute_query(self, query, params=None):
+        """Выполнение запроса"""
+        if self.query_stats is None:
+            return self.run_query(query, params)
+        started = time.perf_counter()
+        cursor = self.run_query(query, params)
+        self.query_stats.record(query, params, time.perf_counter() - started, max(cursor.rowcount, 0))
+        return cursor
+        
+    def execute_many(self, query, rows):
+        """Выполнение запроса для пакета строк"""
+        if self.query_stats is None:
+            return self.connection.executemany(query, rows)
+        started = time.perf_counter()
+        cursor = self.connection.executemany(query, rows)
+        self.query_stats.record(query, None, time.perf_counter() - started, max(cursor.rowcount, 0))
+        return cursor
+        
+    def fetch_all(self, query, params=None, row_type=None):
+        """Получение всех записей (row_type - тип строк из queries, иначе sqlite3.Row)"""
+        if self.query_stats is None:
+            return self.run_query(query, params, row_type).fetchall()
+        # Время учитывается вместе с выборкой строк: SQLite выполняет запрос по мере чтения
+        started = time.perf_counter()
+        rows = self.run_query(query, params, row_type).fetchall()
+        self.query_stats.record(query, params, time.perf_counter() - started, len(rows))
+        return rows
         
-    def fetch_one(self, query, params=None):
+    def fetch_one(self, query, params=None, row_type=None):
         """Получение одной записи"""
-        cursor = self.execute_query(query, params)
-        return cursor.fetchone()
+        if self.query_stats is None:
+            return self.run_query(query, params, row_type).fetchone()
+        started = time.perf_counter()
+        row = self.run_query(query, params, row_type).fetchone()
+        self.query_stats.record(query, params, time.perf_counter() - started, 1 if row else 0)
+        return row
         
     def commit(self):
         """Сохранение изменений"""
         self.connection.commit()
         
+    def rollback(self):
+        """Откат незафиксированных изменений"""
+        self.connection.rollback()
+        
     # Методы для работы с товарами
     def get_all_products(self):
         """Получение всех товаров"""
-        return self.fetch_all('''
-            SELECT * FROM products 
-            WHERE is_active = 1 
-            ORDER BY name
-        ''')
+        return self.queries.all(PRODUCTS_ACTIVE)
         
     def search_products(self, search_term):
         """Поиск товаров"""
-        return self.fetch_all('''
-            SELECT * FROM products 
-            WHERE is_active = 1 
-            AND (name LIKE ? OR barcode LIKE ? OR description LIKE ?)
-            ORDER BY name
-        ''', (f'%{search_term}%', f'%{search_term}%', f'%{search_term}%'))
+        return self.queries.all(PRODUCTS_SEARCH, (f'%{search_term}%', f'%{search_term}%', f'%{search_term}%'))
         
     def get_product_by_barcode(self, barcode):
         """Получение товара по штрихкоду"""
-        return self.fetch_one('''
-            SELECT * FROM products 
-            WHERE barcode = ? AND is_active = 1
-        ''', (barcode,))
+        return self.queries.one(PRODUCT_BY_BARCODE, (barcode,))
+        
+    def get_available_quantity(self, product_id, exclude_receipt_id=None):
+        """Свободный остаток товара за вычетом действующих резервов других чеков"""
+        row = self.fetch_one(f'''
+            SELECT p.quantity - COALESCE((
+                SELECT SUM(r.quantity) FROM stock_reservations r
+                WHERE r.product_id = p.id AND r.receipt_id IS NOT ? AND {ACTIVE_RESERVATION}
+            ), 0) as available
+            FROM products p
+            WHERE p.id = ?
+        ''', (exclude_receipt_id, product_id))
+        return row['available'] if row else 0
+        
+    # Методы для резервов товара
+    def reserve_stock(self, receipt_id, quantities):
+        """Замена резервов чека: {product_id: quantity} (часть транзакции)"""
+        self.execute_query('DELETE FROM stock_reservations WHERE receipt_id = ?', (receipt_id,))
+        self.connection.executemany(f'''
+            INSERT INTO stock_reservations (receipt_id, product_id, quantity, expires_at)
+            VALUES (?, ?, ?, datetime('now', '+{RESERVATION_TTL_MINUTES} minutes'))
+        ''', [(receipt_id, product_id, quantity) for product_id, quantity in quantities.items()])
+        
+    def touch_reservations(self, receipt_id):
+        """Продление резервов чека, пока касса с ним работает"""
+        self.execute_query(f'''
+            UPDATE stock_reservations
+            SET expires_at = datetime('now', '+{RESERVATION_TTL_MINUTES} minutes')
+            WHERE receipt_id = ?
+        ''', (receipt_id,))
+        self.commit()
+        
+    def sweep_expired_reservations(self):
+        """Удаление просроченных резервов; возвращает число снятых записей"""
+        cursor = self.execute_query("DELETE FROM stock_reservations WHERE expires_at <= datetime('now')")
+        self.commit()
+        return cursor.rowcount
         
+
     def add_product(self, product_data):
         """Добавление товара"""
         cursor = self.execute_query('''
@@ -308,57 +1249,89 @@ class DatabaseManager:
         self.commit()
         return cursor.lastrowid
         
-    def update_product(self, product_id, product_data):
-        """Обновление товара"""
-        self.execute_query('''
-            UPDATE products 
-            SET name=?, description=?, price=?, cost_price=?, category=?, 
-                unit=?, quantity=?, min_quantity=?, updated_at=CURRENT_TIMESTAMP
-            WHERE id=?
-        ''', (*product_data, product_id))
-        self.commit()
+    def update_product(self, product_id, product_data, user_id=None):
+        """Обновление товара; новый остаток из карточки проводится корректировкой журнала"""
+        name, description, price, cost_price, category, unit, quantity, min_quantity = product_data
+        try:
+            self.execute_query('''
+                UPDATE products 
+                SET name=?, description=?, price=?, cost_price=?, category=?, 
+                    unit=?, min_quantity=?, updated_at=CURRENT_TIMESTAMP
+                WHERE id=?
+            ''', (name, description, price, cost_price, category, unit, min_quantity, product_id))
+            # Разница считается в транзакции: продажи другой кассы после открытия карточки не теряются в журнале
+            self.execute_query('''
+                INSERT INTO inventory_movements 
+                (product_id, seq, movement_type, quantity, reason, user_id)
+                SELECT id, stock_seq + 1, 'adjustment', ? - quantity, 'Изменение остатка в карточке товара', ?
+                FROM products
+                WHERE id = ? AND ABS(? - quantity) > ?
+            ''', (quantity, user_id, product_id, quantity, QUANTITY_EPSILON))
+            self.commit()
+        except Exception:
+            self.rollback()
+            raise
         
     # Методы для работы с клиентами
     def get_all_customers(self):
         """Получение всех клиентов"""
-        return self.fetch_all('''
-            SELECT * FROM customers 
-            WHERE is_active = 1 
-            ORDER BY name
-        ''')
+        return self.queries.all(CUSTOMERS_ACTIVE)
         
-    def search_customers(self, search_term):
-        """Поиск клиентов"""
-        return self.fetch_all('''
-            SELECT * FROM customers 
-            WHERE is_active = 1 
-            AND (name LIKE ? OR phone LIKE ?)
-            ORDER BY name
-        ''', (f'%{search_term}%', f'%{search_term}%'))
+    def search_customers(self, search_term, limit=CUSTOMER_SEARCH_LIMIT):
+        """Поиск клиентов по фрагменту имени или телефона в любом формате (первые limit совпадений)"""
+        search_term = search_term.strip()
+        if not search_term:
+            return []
+            
+        if PHONE_QUERY.fullmatch(search_term):
+            digits = normalize_phone(search_term)
+            if len(digits) == 10:
+                return self.queries.all(CUSTOMERS_BY_PHONE, (digits, limit))
+            # Набор с «+» или короче триграммы - начало номера, иначе - фрагмент (например, последние цифры)
+            if search_term.startswith('+') or len(digits) < TRIGRAM_MIN_LENGTH:
+                return self.queries.all(CUSTOMERS_BY_PHONE_PREFIX, (digits, digits + ':', limit))
+            return self.queries.all(CUSTOMERS_FTS_SEARCH, (f'phone : {fts_phrase(digits)}', limit))
+            
+        # Слова имени и цифры телефона в одной строке: «Иванов 4567»
+        words = [word for word in search_term.replace('ё', 'е').replace('Ё', 'Е').split()
+                 if len(word) >= TRIGRAM_MIN_LENGTH]
+        if words:
+            match = ' AND '.join(f"{'phone' if word.isdigit() else 'name'} : {fts_phrase(word)}"
+                                 for word in words)
+            return self.queries.all(CUSTOMERS_FTS_SEARCH, (match, limit))
+            
+        # Фрагменты короче триграммы ищутся по началу имени (с заглавной буквы)
+        name = search_term[:1].upper() + search_term[1:]
+        return self.queries.all(CUSTOMERS_SEARCH, (name, name + '\uffff', limit))
         
     def add_customer(self, customer_data):
         """Добавление клиента"""
         cursor = self.execute_query('''
-            INSERT INTO customers (name, phone, email, address, discount_percent)
-            VALUES (?, ?, ?, ?, ?)
-        ''', customer_data)
+            INSERT INTO customers (name, phone, email, address, discount_percent, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', tuple(customer_data) + (timestamps.now(),))
         self.commit()
         return cursor.lastrowid
         
     # Методы для работы со сменами
     def open_shift(self, cashier_username, start_amount):
-        """Открытие смены"""
+        """Открытие смены (start_amount - копейки)"""
         # Получение ID кассира
         user = self.fetch_one('SELECT id FROM users WHERE username = ?', (cashier_username,))
         if not user:
             raise ValueError("Пользователь не найден")
             
+        started = timestamps.now()
         cursor = self.execute_query('''
-            INSERT INTO shifts (cashier_id, start_time, start_amount)
-            VALUES (?, CURRENT_TIMESTAMP, ?)
-        ''', (user['id'], start_amount))
+            INSERT INTO shifts (cashier_id, start_time, start_amount, business_date)
+            VALUES (?, ?, ?, ?)
+        ''', (user['id'], started, start_amount, timestamps.business_date(started)))
+        shift_id = cursor.lastrowid
+        
+        self.add_cash_event(shift_id, 'open', start_amount, reason='Размен на начало смены',
+                            user_id=user['id'])
         self.commit()
-        return cursor.lastrowid
+        return shift_id
         
     def get_current_shift(self, cashier_username):
         """Получение текущей смены"""
@@ -372,39 +1345,709 @@ class DatabaseManager:
         ''', (cashier_username,))
         
     # Методы для продаж
-    def create_sale(self, shift_id, customer_id, items, payment_method, discount_amount=0):
-        """Создание продажи"""
-        # Расчёт сумм
-        subtotal = sum(item['quantity'] * item['price'] for item in items)
+    def create_sale(self, shift_id, customer_id, items, payment_method, discount_amount=0, receipt_id=None,
+                    bonus_points=0):
+        """Создание продажи в копейках (receipt_id - журнал чека, bonus_points - списание баллов;
+        item['discount'] - скидка правил на позицию)"""
+        # Расчёт сумм в копейках
+        line_totals = [line_total(item['price'], item['quantity']) for item in items]
+        subtotal = sum(line_totals)
         total_amount = subtotal - discount_amount
         
-        # Создание записи продажи
-        cursor = self.execute_query('''
-            INSERT INTO sales 
-            (shift_id, customer_id, total_amount, discount_amount, final_amount, payment_method)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (shift_id, customer_id, subtotal, discount_amount, total_amount, payment_method))
+        # Скидка позиции - её скидка по правилам и доля остальной скидки чека (процент клиента,
+        # ручной процент, баллы) пропорционально сумме после правил; возврат берёт её без пересчёта
+        rule_discounts = [item.get('discount', 0) for item in items]
+        shares = allocate(discount_amount - sum(rule_discounts),
+                          [total - rule for total, rule in zip(line_totals, rule_discounts)])
+        line_discounts = [rule + share for rule, share in zip(rule_discounts, shares)]
+        
+        try:
+            # Номер чека берётся первым запросом транзакции: запись счётчика захватывает базу,
+            # а откат продажи по любой ошибке возвращает номер - нумерация без пропусков
+            receipt_number = self.next_receipt_number(shift_id)
+            
+            # Создание записи продажи; бизнес-дата - дата смены, даже если продажа после полуночи
+            cursor = self.execute_query('''
+                INSERT INTO sales 
+                (shift_id, customer_id, total_amount, discount_amount, final_amount, payment_method,
+                 register_id, receipt_number, created_at, business_date)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, (SELECT business_date FROM shifts WHERE id = ?))
+            ''', (shift_id, customer_id, subtotal, discount_amount, total_amount, payment_method,
+                  self.register_id, receipt_number, timestamps.now(), shift_id))
+            
+            sale_id = cursor.lastrowid
+            
+            # Списание баллов, учтённых в скидке; остаток читается после захвата записи вставкой продажи
+            if bonus_points:
+                if self.get_bonus_balance(customer_id) < bonus_points:
+                    raise ValueError("Недостаточно бонусных баллов клиента")
+                self.add_bonus_event(customer_id, 'redeem', -bonus_points, sale_id=sale_id)
+            
+            # Добавление позиций
+            for item, item_total, item_discount in zip(items, line_totals, line_discounts):
+                self.execute_query('''
+                    INSERT INTO sale_items 
+                    (sale_id, product_id, quantity, price, total_amount, discount_amount)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (sale_id, item['product_id'], item['quantity'], item['price'], item_total, item_discount))
+                
+                # Движение продажи пишется со сравнением: не больше свободного с учётом чужих резервов;
+                # остаток списывает триггер журнала
+                cursor = self.execute_query(f'''
+                    INSERT INTO inventory_movements 
+                    (product_id, seq, movement_type, quantity, reason, document_number)
+                    SELECT id, stock_seq + 1, 'sale', -?, 'Продажа', ?
+                    FROM products
+                    WHERE id = ? AND quantity - COALESCE((
+                        SELECT SUM(r.quantity) FROM stock_reservations r
+                        WHERE r.product_id = products.id AND r.receipt_id IS NOT ? AND {ACTIVE_RESERVATION}
+                    ), 0) >= ?
+                ''', (item['quantity'], f"sale_{sale_id}", item['product_id'], receipt_id, item['quantity']))
+                
+                if cursor.rowcount == 0:
+                    raise ValueError(f"Недостаточно товара «{item.get('name', item['product_id'])}» на складе")
+                
+            # Счётчики смены, кассовый и бонусный журналы обновляются в той же транзакции
+            self.add_shift_sale(shift_id, payment_method, total_amount, sale_id)
+            if customer_id:
+                self.accrue_bonus_points(customer_id, total_amount, sale_id)
+            
+            # Проданный чек больше не держит резерв
+            if receipt_id is not None:
+                self.execute_query('DELETE FROM stock_reservations WHERE receipt_id = ?', (receipt_id,))
+                self.execute_query('DELETE FROM parked_receipts WHERE id = ?', (receipt_id,))
+            
+            self.commit()
+        except Exception:
+            self.rollback()
+            raise
+        return sale_id
+        
+    def next_receipt_number(self, shift_id):
+        """Следующий номер чека кассы в смене (без фиксации транзакции)"""
+        return self.queries.one(RECEIPT_NUMBER_NEXT, (self.register_id, shift_id)).last_number
         
-        sale_id = cursor.lastrowid
+    def get_sale_receipt(self, sale_id):
+        """Касса, смена и номер чека продажи"""
+        return self.queries.one(SALE_RECEIPT, (sale_id,))
         
-        # Добавление позиций
-        for item in items:
+    # Методы для возвратов
+    def get_sale_for_return(self, sale_id):
+        """Позиции чека с шапкой и возвращённым количеством одним запросом (пустой список - чека нет)"""
+        return self.queries.all(SALE_FOR_RETURN, (sale_id,))
+        
+    def get_receipt_for_return(self, receipt_number, shift_id, register_id=None):
+        """Позиции чека по номеру в смене кассы (по умолчанию - этой кассы)"""
+        return self.queries.all(RECEIPT_FOR_RETURN, (register_id or self.register_id, shift_id, receipt_number))
+        
+    def create_return(self, shift_id, sale_id, quantities=None, reason=None):
+        """Возврат по чеку одной транзакцией: quantities {sale_item_id: количество}, None - весь остаток"""
+        lines = self.get_sale_for_return(sale_id)
+        if not lines:
+            raise ValueError("Чек не найден")
+        sale = lines[0]
+        by_id = {line.id: line for line in lines}
+        
+        if quantities is None:
+            quantities = {line.id: line.quantity - line.returned_quantity for line in lines}
+        returned = []
+        for item_id, quantity in quantities.items():
+            if item_id not in by_id:
+                raise ValueError("Позиция не относится к этому чеку")
+            if quantity > QUANTITY_EPSILON:
+                returned.append((by_id[item_id], quantity))
+        if not returned:
+            raise ValueError("Все позиции чека уже возвращены")
+            
+        try:
+            # Остаток к возврату списывается со сравнением: параллельный возврат не превысит продажу
+            cursor = self.queries.many(SALE_ITEM_RETURN, [
+                (quantity, line.id, sale_id, quantity) for line, quantity in returned])
+            if cursor.rowcount != len(returned):
+                raise ValueError("Количество к возврату больше невозвращённого остатка")
+                
+            # Последний возврат закрывает остаток оплаты, остальные - по суммам позиций за вычетом их скидки
+            if self.queries.execute(SALE_MARK_RETURNED, (sale_id,)).rowcount:
+                amount = int(sale.final_amount - self.queries.one(SALE_REFUNDED, (sale_id,)).refunded)
+            else:
+                amount = sum(line_refund(line, quantity) for line, quantity in returned)
+                
+            return_id = self.queries.execute(RETURN_INSERT, (
+                sale_id, amount, reason, shift_id, timestamps.now(), shift_id)).lastrowid
+            self.queries.many(RETURN_ITEM_INSERT, [
+                (return_id, line.id, line.product_id, quantity, line.price, line_total(line.price, quantity))
+                for line, quantity in returned])
+            # Остаток возвращает триггер журнала движения
+            self.queries.many(RETURN_MOVEMENT_INSERT, [
+                (quantity, f"Возврат по чеку №{sale_id}", f"return_{sale_id}", line.product_id)
+                for line, quantity in returned])
+                
+            # Счётчики смены, кассовый и бонусный журналы
+            self.add_shift_return(shift_id, sale.payment_method, amount, sale_id)
+            if sale.customer_id:
+                self.return_bonus_points(sale.customer_id, sale_id, sale.final_amount)
+            self.commit()
+        except Exception:
+            self.rollback()
+            raise
+        return return_id, amount
+        
+    # Методы для счётчиков смены
+    def add_shift_sale(self, shift_id, payment_method, amount, sale_id=None):
+        """Учёт продажи в счётчиках смены и кассовом журнале (без фиксации транзакции)"""
+        bucket = payment_column(payment_method)
+        self.execute_query(f'''
+            UPDATE shifts 
+            SET total_sales = total_sales + ?,
+                transactions_count = transactions_count + 1,
+                sales_{bucket} = sales_{bucket} + ?,
+                count_{bucket} = count_{bucket} + 1
+            WHERE id = ?
+        ''', (amount, amount, shift_id))
+        
+        if bucket == 'cash':
+            self.add_cash_event(shift_id, 'sale', amount, document_number=f"sale_{sale_id}")
+        
+    def add_shift_return(self, shift_id, payment_method, amount, sale_id=None):
+        """Учёт возврата в счётчиках смены и кассовом журнале (без фиксации транзакции)"""
+        cash_amount = amount if payment_column(payment_method) == 'cash' else 0
+        self.execute_query('''
+            UPDATE shifts 
+            SET total_returns = total_returns + ?,
+                returns_count = returns_count + 1,
+                returns_cash = returns_cash + ?
+            WHERE id = ?
+        ''', (amount, cash_amount, shift_id))
+        
+        if cash_amount:
+            self.add_cash_event(shift_id, 'return', -cash_amount, document_number=f"return_{sale_id}")
+        
+    def add_shift_cash_movement(self, shift_id, amount, reason=None, user_id=None):
+        """Учёт внесения (amount > 0) или изъятия (amount < 0) наличных"""
+        column = 'cash_in' if amount >= 0 else 'cash_out'
+        self.execute_query(f'''
+            UPDATE shifts SET {column} = {column} + ? WHERE id = ?
+        ''', (abs(amount), shift_id))
+        
+        self.add_cash_event(shift_id, column, amount, reason=reason, user_id=user_id)
+        
+    # Методы для кассового журнала
+    def add_cash_event(self, shift_id, event_type, amount, reason=None, document_number=None, user_id=None):
+        """Добавление события в кассовый журнал (без фиксации транзакции)"""
+        last = self.fetch_one('SELECT MAX(seq) as seq FROM cash_ledger WHERE shift_id = ?', (shift_id,))
+        seq = (last['seq'] or 0) + 1
+        
+        self.execute_query('''
+            INSERT INTO cash_ledger 
+            (shift_id, seq, event_type, amount, reason, document_number, user_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (shift_id, seq, event_type, amount, reason, document_number, user_id))
+        
+        # Периодический снимок ограничивает хвост суммирования при чтении остатка
+        if seq % CASH_SNAPSHOT_INTERVAL == 0:
             self.execute_query('''
-                INSERT INTO sale_items 
-                (sale_id, product_id, quantity, price, total_amount)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (sale_id, item['product_id'], item['quantity'], 
-                  item['price'], item['quantity'] * item['price']))
+                INSERT INTO cash_ledger_snapshots (shift_id, seq, balance)
+                VALUES (?, ?, ?)
+            ''', (shift_id, seq, self.get_cash_balance(shift_id)))
+        return seq
+        
+    def get_cash_balance(self, shift_id):
+        """Остаток наличных в копейках: последний снимок плюс не более CASH_SNAPSHOT_INTERVAL событий"""
+        snapshot = self.fetch_one('''
+            SELECT seq, balance FROM cash_ledger_snapshots 
+            WHERE shift_id = ? 
+            ORDER BY seq DESC 
+            LIMIT 1
+        ''', (shift_id,))
+        
+        seq, balance = (snapshot['seq'], snapshot['balance']) if snapshot else (0, 0)
+        tail = self.fetch_one('''
+            SELECT COALESCE(SUM(amount), 0) as total 
+            FROM cash_ledger 
+            WHERE shift_id = ? AND seq > ?
+        ''', (shift_id, seq))
+        return int(balance + tail['total'])
+        
+    def cash_in(self, shift_id, amount, reason=None, user_id=None):
+        """Внесение наличных в кассу (копейки)"""
+        if amount <= 0:
+            raise ValueError("Сумма внесения должна быть больше нуля")
+        self.add_shift_cash_movement(shift_id, amount, reason, user_id)
+        self.commit()
+        return self.get_cash_balance(shift_id)
+        
+    def cash_out(self, shift_id, amount, reason=None, user_id=None):
+        """Изъятие наличных из кассы (копейки)"""
+        if amount <= 0:
+            raise ValueError("Сумма изъятия должна быть больше нуля")
+        if amount > self.get_cash_balance(shift_id):
+            raise ValueError("Сумма изъятия превышает остаток наличных в кассе")
+        self.add_shift_cash_movement(shift_id, -amount, reason, user_id)
+        self.commit()
+        return self.get_cash_balance(shift_id)
+        
+    # Методы для бонусного журнала
+    def add_bonus_event(self, customer_id, event_type, points, sale_id=None, expires_at=None, reason=None,
+                        user_id=None):
+        """Добавление события в бонусный журнал клиента (без фиксации транзакции)"""
+        last = self.fetch_one('SELECT MAX(seq) as seq FROM bonus_ledger WHERE customer_id = ?', (customer_id,))
+        seq = (last['seq'] or 0) + 1
+        
+        self.execute_query('''
+            INSERT INTO bonus_ledger 
+            (customer_id, seq, event_type, points, sale_id, expires_at, reason, user_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (customer_id, seq, event_type, points, sale_id, expires_at, reason, user_id))
+        
+        if seq % BONUS_SNAPSHOT_INTERVAL == 0:
+            self.execute_query('''
+                INSERT INTO bonus_ledger_snapshots (customer_id, seq, balance)
+                VALUES (?, ?, ?)
+            ''', (customer_id, seq, self.get_bonus_balance(customer_id)))
+        return seq
+        
+    def get_bonus_balance(self, customer_id):
+        """Остаток баллов клиента: последний снимок плюс не более BONUS_SNAPSHOT_INTERVAL событий"""
+        snapshot = self.fetch_one('''
+            SELECT seq, balance FROM bonus_ledger_snapshots 
+            WHERE customer_id = ? 
+            ORDER BY seq DESC 
+            LIMIT 1
+        ''', (customer_id,))
+        
+        seq, balance = (snapshot['seq'], snapshot['balance']) if snapshot else (0, 0)
+        tail = self.fetch_one('''
+            SELECT COALESCE(SUM(points), 0) as total 
+            FROM bonus_ledger 
+            WHERE customer_id = ? AND seq > ?
+        ''', (customer_id, seq))
+        return int(balance + tail['total'])
+        
+    def accrue_bonus_points(self, customer_id, amount, sale_id=None):
+        """Начисление баллов с оплаченной суммы в копейках (без фиксации транзакции)"""
+        percent = float(self.get_setting('bonus_accrual_percent') or 0)
+        point_value = int(self.get_setting('bonus_point_value') or 100)
+        points = percent_of(amount, percent) // point_value
+        if points <= 0:
+            return 0
+            
+        days = int(self.get_setting('bonus_expiry_days') or 0)
+        expires_at = (date.today() + timedelta(days=days)).isoformat() if days > 0 else None
+        self.add_bonus_event(customer_id, 'accrual', points, sale_id=sale_id, expires_at=expires_at)
+        return points
+        
+    def return_bonus_points(self, customer_id, sale_id, final_amount):
+        """Отмена начисления и восстановление списанных баллов чека по доле возвращённой суммы (без фиксации)"""
+        refunded = self.queries.one(SALE_REFUNDED, (sale_id,)).refunded
+        bonus = self.queries.one(SALE_BONUS, (sale_id,))
+        # Доли считаются от суммы всех возвратов чека: последний возврат закрывает остаток
+        restore = prorate(bonus.redeemed, refunded, final_amount) - bonus.restored
+        if restore > 0:
+            self.add_bonus_event(customer_id, 'restore', restore, sale_id=sale_id,
+                                 reason=f"Возврат по чеку №{sale_id}: списанные баллы")
+        # Начисленные баллы могли быть потрачены: отменяется не больше остатка
+        reversal = min(prorate(bonus.accrued, refunded, final_amount) - bonus.reversed,
+                       self.get_bonus_balance(customer_id))
+        if reversal > 0:
+            self.add_bonus_event(customer_id, 'reversal', -reversal, sale_id=sale_id,
+                                 reason=f"Возврат по чеку №{sale_id}: отмена начисления")
+                                 
+    def adjust_bonus_points(self, customer_id, points, reason=None, user_id=None):
+        """Ручная корректировка баллов (points со знаком); возвращает новый остаток"""
+        if points < 0 and self.get_bonus_balance(customer_id) < -points:
+            raise ValueError("Остаток баллов не может быть отрицательным")
+        if points:
+            self.add_bonus_event(customer_id, 'manual', points, reason=reason, user_id=user_id)
+        self.commit()
+        return self.get_bonus_balance(customer_id)
+        
+    def expire_bonus_points(self, today=None):
+        """Сгорание просроченных начислений пакетными запросами; возвращает число клиентов"""
+        today = today or date.today().isoformat()
+        since = self.get_setting('bonus_expired_through') or ''
+        if since >= today:
+            return 0
+            
+        try:
+            last = self.fetch_one('SELECT COALESCE(MAX(id), 0) as id FROM bonus_ledger')
+            # Списания гасят в первую очередь сгорающие начисления; бессрочные баллы не сгорают
+            cursor = self.execute_query('''
+                INSERT INTO bonus_ledger (customer_id, seq, event_type, points, reason)
+                SELECT customer_id, seq + 1, 'expire', -amount, 'Истёк срок действия баллов'
+                FROM (
+                    SELECT l.customer_id, MAX(l.seq) as seq,
+                           MIN(c.bonus_points,
+                               SUM(CASE WHEN l.event_type = 'accrual' AND l.expires_at <= :today
+                                        THEN l.points ELSE 0 END)
+                               + SUM(CASE WHEN l.points < 0 THEN l.points ELSE 0 END)) as amount
+                    FROM bonus_ledger l
+                    JOIN customers c ON c.id = l.customer_id
+                    WHERE l.customer_id IN (
+                        SELECT customer_id FROM bonus_ledger
+                        WHERE event_type = 'accrual' AND expires_at > :since AND expires_at <= :today
+                    )
+                    GROUP BY l.customer_id
+                )
+                WHERE amount > 0
+            ''', {'today': today, 'since': since})
+            expired = cursor.rowcount
             
-            # Обновление остатков
             self.execute_query('''
-                UPDATE products 
-                SET quantity = quantity - ?
-                WHERE id = ?
-            ''', (item['quantity'], item['product_id']))
+                INSERT INTO bonus_ledger_snapshots (customer_id, seq, balance)
+                SELECT l.customer_id, l.seq, c.bonus_points
+                FROM bonus_ledger l
+                JOIN customers c ON c.id = l.customer_id
+                WHERE l.id > ? AND l.seq % ? = 0
+            ''', (last['id'], BONUS_SNAPSHOT_INTERVAL))
+            
+            self.execute_query('''
+                INSERT OR REPLACE INTO settings (key, value, description, updated_at)
+                VALUES ('bonus_expired_through', ?, 'Дата последнего сгорания баллов', CURRENT_TIMESTAMP)
+            ''', (today,))
+            self.commit()
+        except Exception:
+            self.rollback()
+            raise
+        return expired
+        
+    def get_shift_totals(self, shift_id):
+        """Итоги смены одной строкой (для X/Z-отчётов)"""
+        return self.fetch_one('''
+            SELECT s.*, u.name as cashier_name,
+                   s.start_amount + s.sales_cash - s.returns_cash 
+                       + s.cash_in - s.cash_out as cash_balance
+            FROM shifts s
+            JOIN users u ON s.cashier_id = u.id
+            WHERE s.id = ?
+        ''', (shift_id,))
+        
+    def shift_source_tables(self, shift_id):
+        """Таблицы продаж и возвратов смены: основная база или all_* с архивом закрытых лет.
+        В архив уходят продажи смен перенесённых лет и возвраты по ним, оформленные и в более поздних сменах"""
+        if self.archive.archived_through():
+            shift = self.fetch_one('SELECT business_date FROM shifts WHERE id = ?', (shift_id,))
+            years = self.archive.years_for('0000-01-01', shift['business_date']) if shift else []
+            if years:
+                self.archive.attach(years)
+                return 'all_sales', 'all_returns'
+        return 'sales', 'returns'
         
+    def compute_shift_totals(self, shift_id):
+        """Пересчёт счётчиков смены по исходным продажам и возвратам (с архивом закрытых лет)"""
+        totals = dict.fromkeys(SHIFT_COUNTERS, 0)
+        sales_table, returns_table = self.shift_source_tables(shift_id)
+        
+        sales = self.fetch_all(f'''
+            SELECT payment_method, COUNT(*) as count, COALESCE(SUM(final_amount), 0) as total
+            FROM {sales_table} 
+            WHERE shift_id = ?
+            GROUP BY payment_method
+        ''', (shift_id,))
+        
+        for row in sales:
+            bucket = payment_column(row['payment_method'])
+            totals['total_sales'] += row['total']
+            totals['transactions_count'] += row['count']
+            totals[f'sales_{bucket}'] += row['total']
+            totals[f'count_{bucket}'] += row['count']
+            
+        returns = self.fetch_all(f'''
+            SELECT s.payment_method, COUNT(*) as count, COALESCE(SUM(r.total_amount), 0) as total
+            FROM {returns_table} r
+            JOIN {sales_table} s ON r.sale_id = s.id
+            WHERE r.shift_id = ?
+            GROUP BY s.payment_method
+        ''', (shift_id,))
+        
+        for row in returns:
+            totals['total_returns'] += row['total']
+            totals['returns_count'] += row['count']
+            if payment_column(row['payment_method']) == 'cash':
+                totals['returns_cash'] += row['total']
+                
+        movements = self.fetch_one('''
+            SELECT COALESCE(SUM(CASE WHEN event_type = 'cash_in' THEN amount END), 0) as cash_in,
+                   COALESCE(SUM(CASE WHEN event_type = 'cash_out' THEN -amount END), 0) as cash_out
+            FROM cash_ledger 
+            WHERE shift_id = ?
+        ''', (shift_id,))
+        totals['cash_in'] = movements['cash_in']
+        totals['cash_out'] = movements['cash_out']
+                
+        return totals
+        
+    def verify_shift_totals(self, shift_id):
+        """Сверка счётчиков смены: {колонка: (в счётчике, по данным)} для расхождений"""
+        stored = self.fetch_one('SELECT * FROM shifts WHERE id = ?', (shift_id,))
+        if not stored:
+            return {}
+            
+        expected = self.compute_shift_totals(shift_id)
+        # Суммы в целых копейках сравниваются точно
+        mismatches = {
+            column: (stored[column] or 0, value)
+            for column, value in expected.items()
+            if (stored[column] or 0) != value
+        }
+        
+        # Остаток по счётчикам должен совпадать с кассовым журналом
+        has_ledger = self.fetch_one('SELECT 1 FROM cash_ledger WHERE shift_id = ? LIMIT 1', (shift_id,))
+        totals = self.get_shift_totals(shift_id)
+        ledger_balance = self.get_cash_balance(shift_id)
+        if has_ledger and totals['cash_balance'] != ledger_balance:
+            mismatches['cash_balance'] = (totals['cash_balance'], ledger_balance)
+        return mismatches
+        
+    def rebuild_shift_totals(self, shift_id=None):
+        """Перезапись счётчиков смены (или всех смен) по исходным данным"""
+        if shift_id is None:
+            shift_ids = [row['id'] for row in self.fetch_all('SELECT id FROM shifts')]
+        else:
+            shift_ids = [shift_id]
+            
+        assignments = ', '.join(f'{column} = ?' for column in SHIFT_COUNTERS)
+        for current_id in shift_ids:
+            totals = self.compute_shift_totals(current_id)
+            self.execute_query(f'UPDATE shifts SET {assignments} WHERE id = ?',
+                               (*[totals[column] for column in SHIFT_COUNTERS], current_id))
         self.commit()
-        return sale_id
+        
+    # Методы для складских документов
+    def create_stock_document(self, doc_type, user_id=None, supplier=None, comment=None):
+        """Создание черновика прихода или инвентаризации"""
+        cursor = self.execute_query('''
+            INSERT INTO stock_documents (doc_type, supplier, comment, user_id)
+            VALUES (?, ?, ?, ?)
+        ''', (doc_type, supplier, comment, user_id))
+        document_id = cursor.lastrowid
+        
+        prefix = 'ПР' if doc_type == 'receiving' else 'ИНВ'
+        self.execute_query('UPDATE stock_documents SET number = ? WHERE id = ?',
+                           (f'{prefix}-{document_id:06d}', document_id))
+        self.commit()
+        return document_id
+        
+    def get_stock_documents(self, doc_type):
+        """Список складских документов с итогами по строкам"""
+        return self.fetch_all('''
+            SELECT d.*, COUNT(l.id) as lines_count,
+                   COALESCE(SUM(l.quantity), 0) as total_quantity,
+                   COALESCE(SUM(l.quantity * l.price), 0) as total_amount
+            FROM stock_documents d
+            LEFT JOIN stock_document_lines l ON l.document_id = d.id
+            WHERE d.doc_type = ?
+            GROUP BY d.id
+            ORDER BY d.created_at DESC
+        ''', (doc_type,))
+        
+    def get_document_lines(self, document_id):
+        """Строки документа с данными товаров"""
+        return self.fetch_all('''
+            SELECT l.product_id, l.quantity, l.price, l.expected_quantity,
+                   p.name, p.barcode, p.unit, p.quantity as book_quantity
+            FROM stock_document_lines l
+            JOIN products p ON l.product_id = p.id
+            WHERE l.document_id = ?
+            ORDER BY p.name
+        ''', (document_id,))
+        
+    def set_document_lines(self, document_id, lines):
+        """Замена строк черновика: {product_id: (quantity, price)} (часть транзакции)"""
+        self.execute_query('DELETE FROM stock_document_lines WHERE document_id = ?', (document_id,))
+        self.connection.executemany('''
+            INSERT INTO stock_document_lines (document_id, product_id, quantity, price)
+            VALUES (?, ?, ?, ?)
+        ''', [(document_id, product_id, quantity, price)
+              for product_id, (quantity, price) in lines.items()])
+        
+    def save_stock_document(self, document_id, lines):
+        """Сохранение черновика документа"""
+        self.set_document_lines(document_id, lines)
+        self.commit()
+        
+    def post_stock_document(self, document_id, lines, user_id=None):
+        """Проведение документа одной транзакцией: остатки и движения товаров"""
+        try:
+            cursor = self.execute_query('''
+                UPDATE stock_documents
+                SET status = 'posted', posted_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND status = 'draft'
+            ''', (document_id,))
+            if cursor.rowcount == 0:
+                raise ValueError("Документ уже проведён")
+                
+            self.set_document_lines(document_id, lines)
+            document = self.fetch_one('SELECT doc_type, number FROM stock_documents WHERE id = ?',
+                                      (document_id,))
+            
+            if document['doc_type'] == 'receiving':
+                self.post_receiving_lines(document_id, document['number'], user_id)
+            else:
+                self.post_stocktake_lines(document_id, document['number'], user_id)
+                
+            self.commit()
+        except Exception:
+            self.rollback()
+            raise
+            
+    def post_receiving_lines(self, document_id, number, user_id):
+        """Оприходование строк прихода (часть транзакции)"""
+        # Остатки увеличивает триггер журнала (товар в документе одной строкой - номера не совпадут)
+        self.execute_query('''
+            INSERT INTO inventory_movements
+            (product_id, seq, movement_type, quantity, price, reason, document_number, user_id)
+            SELECT l.product_id, p.stock_seq + 1, 'in', l.quantity, l.price, 'Приход товаров', ?, ?
+            FROM stock_document_lines l
+            JOIN products p ON p.id = l.product_id
+            WHERE l.document_id = ?
+        ''', (number, user_id, document_id))
+        
+        self.execute_query('''
+            UPDATE products
+            SET cost_price = COALESCE((
+                    SELECT l.price FROM stock_document_lines l
+                    WHERE l.document_id = ? AND l.product_id = products.id), cost_price),
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id IN (SELECT product_id FROM stock_document_lines WHERE document_id = ?)
+        ''', (document_id, document_id))
+        
+    def post_stocktake_lines(self, document_id, number, user_id):
+        """Приведение остатков к фактическим по строкам инвентаризации (часть транзакции)"""
+        # Фиксация учётного остатка на момент проведения
+        self.execute_query('''
+            UPDATE stock_document_lines
+            SET expected_quantity = (SELECT p.quantity FROM products p WHERE p.id = product_id)
+            WHERE document_id = ?
+        ''', (document_id,))
+        
+        # Остатки приводит к фактическим триггер журнала
+        self.execute_query('''
+            INSERT INTO inventory_movements
+            (product_id, seq, movement_type, quantity, price, reason, document_number, user_id)
+            SELECT l.product_id, p.stock_seq + 1, 'adjustment', l.quantity - l.expected_quantity, l.price,
+                   'Инвентаризация', ?, ?
+            FROM stock_document_lines l
+            JOIN products p ON p.id = l.product_id
+            WHERE l.document_id = ? AND l.quantity != l.expected_quantity
+        ''', (number, user_id, document_id))
+        
+        self.execute_query('''
+            UPDATE products SET updated_at = CURRENT_TIMESTAMP
+            WHERE id IN (
+                SELECT product_id FROM stock_document_lines
+                WHERE document_id = ? AND quantity != expected_quantity)
+        ''', (document_id,))
+        
+    def get_stocktake_variance(self, document_id):
+        """Расхождения инвентаризации: учёт, факт, разница в количестве и сумме"""
+        return self.fetch_all('''
+            SELECT p.id, p.name, p.barcode, p.unit,
+                   COALESCE(l.expected_quantity, p.quantity) as expected,
+                   l.quantity as counted,
+                   l.quantity - COALESCE(l.expected_quantity, p.quantity) as variance,
+                   (l.quantity - COALESCE(l.expected_quantity, p.quantity))
+                       * COALESCE(p.cost_price, p.price) as variance_amount
+            FROM stock_document_lines l
+            JOIN products p ON l.product_id = p.id
+            WHERE l.document_id = ? AND l.quantity != COALESCE(l.expected_quantity, p.quantity)
+            ORDER BY ABS(variance_amount) DESC
+        ''', (document_id,))
+        
+    def get_stocktake_variance_totals(self, document_id):
+        """Итоги расхождений: излишки и недостачи в количестве и сумме"""
+        return self.fetch_one('''
+            SELECT COUNT(*) as lines_count,
+                   COALESCE(SUM(CASE WHEN variance > 0 THEN variance END), 0) as surplus,
+                   COALESCE(SUM(CASE WHEN variance < 0 THEN -variance END), 0) as shortage,
+                   COALESCE(SUM(CASE WHEN variance > 0 THEN variance * cost END), 0) as surplus_amount,
+                   COALESCE(SUM(CASE WHEN variance < 0 THEN -variance * cost END), 0) as shortage_amount
+            FROM (
+                SELECT l.quantity - COALESCE(l.expected_quantity, p.quantity) as variance,
+                       COALESCE(p.cost_price, p.price) as cost
+                FROM stock_document_lines l
+                JOIN products p ON l.product_id = p.id
+                WHERE l.document_id = ?
+            )
+        ''', (document_id,))
+        
+    # Методы для журнала движения товаров
+    def get_stock_at(self, product_id, at=None):
+        """Остаток товара по журналу на момент at (секунды эпохи, по умолчанию - сейчас)"""
+        at = timestamps.now() if at is None else at
+        params = {'product_id': product_id, 'at': timestamps.sqlite_text(at)}
+        # Хвост после снимка лежит в году момента: на границах перенесённых лет есть снимки
+        day = timestamps.business_date(at)
+        years = self.archive.years_for(day, day)
+        if not years:
+            return self.queries.one(STOCK_AT, params).quantity
+        self.archive.attach(years)
+        return self.queries.one(STOCK_AT_ARCHIVE, params).quantity
+        
+    def get_stock_movements(self, product_id, date_from, date_to):
+        """Движения товара за период (даты ГГГГ-ММ-ДД) с остатком после каждого движения"""
+        start = timestamps.sqlite_text(time.mktime(time.strptime(date_from, '%Y-%m-%d')))
+        end = timestamps.sqlite_text(time.mktime(time.strptime(date_to, '%Y-%m-%d')) + 86399)
+        balance = self.get_stock_at(product_id, timestamps.to_epoch(start) - 1)
+        movements = self.archive.fetch_period(STOCK_MOVEMENTS, STOCK_MOVEMENTS_ARCHIVE, date_from, date_to,
+                                              (product_id, start, end))
+        result = []
+        for movement in movements:
+            balance += movement.quantity
+            result.append((movement, balance))
+        return result
+        
+    def checkpoint_stock(self, before):
+        """Снимки остатка на последнем движении каждого товара до before (UTC) - без фиксации транзакции;
+        после переноса этих движений в архив остаток считается по основной базе"""
+        self.execute_query('''
+            INSERT OR IGNORE INTO stock_snapshots (product_id, seq, quantity, created_at)
+            SELECT c.product_id, c.seq,
+                   COALESCE(s.quantity, 0) + COALESCE((
+                       SELECT SUM(m.quantity) FROM inventory_movements m
+                       WHERE m.product_id = c.product_id AND m.seq > COALESCE(s.seq, 0) AND m.seq <= c.seq
+                   ), 0),
+                   c.created_at
+            FROM (
+                SELECT product_id, MAX(seq) as seq, created_at
+                FROM inventory_movements WHERE created_at < ?
+                GROUP BY product_id
+            ) c
+            LEFT JOIN stock_snapshots s ON s.product_id = c.product_id AND s.seq = (
+                SELECT MAX(seq) FROM stock_snapshots WHERE product_id = c.product_id AND seq <= c.seq)
+        ''', (before,))
+        
+    def reconcile_stock(self):
+        """Сверка остатков с журналом: товары, у которых кэш в карточке разошёлся с журналом"""
+        return self.fetch_all('''
+            SELECT * FROM (
+                SELECT p.id, p.name, p.quantity, p.stock_seq,
+                       COALESCE(s.quantity, 0) + COALESCE((
+                           SELECT SUM(m.quantity) FROM inventory_movements m
+                           WHERE m.product_id = p.id AND m.seq > COALESCE(s.seq, 0)
+                       ), 0) as ledger_quantity,
+                       COALESCE((SELECT MAX(m.seq) FROM inventory_movements m WHERE m.product_id = p.id),
+                                s.seq, 0) as ledger_seq
+                FROM products p
+                LEFT JOIN stock_snapshots s ON s.product_id = p.id AND s.seq = (
+                    SELECT MAX(seq) FROM stock_snapshots WHERE product_id = p.id)
+            )
+            WHERE ABS(quantity - ledger_quantity) > ? OR stock_seq != ledger_seq
+            ORDER BY ABS(quantity - ledger_quantity) DESC
+        ''', (QUANTITY_EPSILON,))
+        
+    def repair_stock(self, product_ids):
+        """Восстановление остатков в карточках товаров по журналу (журнал - источник истины)"""
+        drift = [row for row in self.reconcile_stock() if row['id'] in set(product_ids)]
+        try:
+            for row in drift:
+                self.execute_query('''
+                    UPDATE products SET quantity = ?, stock_seq = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?
+                ''', (row['ledger_quantity'], row['ledger_seq'], row['id']))
+            self.commit()
+        except Exception:
+            self.rollback()
+            raise
+        return len(drift)
         
     def get_sales_report(self, date_from=None, date_to=None):
         """Отчёт по продажам"""
@@ -418,7 +2061,7 @@ class DatabaseManager:
         params = []
         
         if date_from and date_to:
-            query += ' WHERE DATE(s.created_at) BETWEEN ? AND ?'
+            query += ' WHERE s.business_date BETWEEN ? AND ?'
             params = [date_from, date_to]
             
         query += ' ORDER BY s.created_at DESC'
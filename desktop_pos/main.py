@@ -3,39 +3,78 @@
 Аналог программы "Мой Склад" для Windows
 """
 
+import time
+STARTED = time.perf_counter()
+
 import tkinter as tk
-from tkinter import ttk, messagebox
+from tkinter import ttk, messagebox, simpledialog
 import sqlite3
 import os
+import sys
+import importlib
 from datetime import datetime
 import json
 
 from database import DatabaseManager
-from modules.products import ProductsModule
+from maintenance import MAINTENANCE_IDLE_SECONDS
+from money import to_kopecks, rub
+from timestamps import to_datetime
 from modules.sales import SalesModule
-from modules.customers import CustomersModule
-from modules.reports import ReportsModule
-from modules.shifts import ShiftsModule
-from modules.settings import SettingsModule
+from modules.auth import AuthService, LockDialog
+from modules.profiler import StartupProfiler
+
+IMPORT_SECONDS = time.perf_counter() - STARTED
+
+# Проверка простоя для обслуживания базы и пауза между шагами возврата страниц (мс)
+MAINTENANCE_CHECK_INTERVAL = 30000
+MAINTENANCE_STEP_INTERVAL = 50
+
+# Вкладки, создаваемые при первом открытии: ключ, заголовок, модуль, класс
+LAZY_TABS = [
+    ('products', 'Товары', 'modules.products', 'ProductsModule'),
+    ('customers', 'Клиенты', 'modules.customers', 'CustomersModule'),
+    ('reports', 'Отчёты', 'modules.reports', 'ReportsModule'),
+]
 
 
 class VetPOSApp:
-    def __init__(self):
-        self.root = tk.Tk()
-        self.root.title("VetPOS - Кассовая система")
-        self.root.geometry("1400x800")
-        self.root.state('zoomed')  # Максимизировать окно
+    def __init__(self, profiler=None, db_path="vetpos.db", server=None):
+        self.profiler = profiler or StartupProfiler()
+        
+        with self.profiler.phase('Окно Tk'):
+            self.root = tk.Tk()
+            self.root.title("VetPOS - Кассовая система")
+            self.root.geometry("1400x800")
+            try:
+                self.root.state('zoomed')  # Максимизировать окно
+            except tk.TclError:
+                self.root.attributes('-zoomed', True)  # X11
         
         # Инициализация базы данных
-        self.db = DatabaseManager()
+        with self.profiler.phase('DatabaseManager'):
+            if server:
+                # Общая база нескольких касс на сервере (server.py)
+                from remote import RemoteDatabaseManager
+                self.db = RemoteDatabaseManager(server)
+            else:
+                self.db = DatabaseManager(db_path)
+        self.auth = AuthService(self.db)
         
         # Текущий пользователь и смена
         self.current_user = None
         self.current_shift = None
         
         # Настройка интерфейса
-        self.setup_styles()
-        self.create_main_interface()
+        with self.profiler.phase('Стили'):
+            self.setup_styles()
+        with self.profiler.phase('Интерфейс'):
+            self.create_main_interface()
+        
+        # Обслуживание базы в простое: любой ввод откладывает его
+        self.last_activity = time.monotonic()
+        self.root.bind_all('<Any-KeyPress>', self.note_activity, add='+')
+        self.root.bind_all('<Any-ButtonPress>', self.note_activity, add='+')
+        self.root.after(MAINTENANCE_CHECK_INTERVAL, self.run_maintenance)
         
         # Проверка авторизации при запуске
         self.login_window()
@@ -137,6 +176,8 @@ class VetPOSApp:
         menubar.add_cascade(label="Файл", menu=file_menu)
         file_menu.add_command(label="Новая смена", command=self.open_new_shift)
         file_menu.add_command(label="Закрыть смену", command=self.close_shift)
+        file_menu.add_command(label="Заблокировать кассу", command=self.lock_session,
+                              accelerator="Ctrl+L")
         file_menu.add_separator()
         file_menu.add_command(label="Настройки", command=self.open_settings)
         file_menu.add_separator()
@@ -154,7 +195,7 @@ class VetPOSApp:
         products_menu = tk.Menu(menubar, tearoff=0)
         menubar.add_cascade(label="Товары", menu=products_menu)
         products_menu.add_command(label="Каталог товаров", command=self.open_products)
-        products_menu.add_command(label="Остатки", command=self.open_inventory)
+        products_menu.add_command(label="Инвентаризация", command=self.open_inventory)
         products_menu.add_command(label="Приход товаров", command=self.open_receiving)
         
         # Меню "Клиенты"
@@ -175,6 +216,8 @@ class VetPOSApp:
         menubar.add_cascade(label="Помощь", menu=help_menu)
         help_menu.add_command(label="О программе", command=self.about)
         
+        self.root.bind('<Control-l>', lambda e: self.lock_session())
+        
     def create_header_panel(self):
         """Создание верхней панели с информацией"""
         header_frame = ttk.Frame(self.root)
@@ -263,21 +306,44 @@ class VetPOSApp:
         
     def create_modules(self):
         """Создание модулей приложения"""
-        # Модуль продаж
-        self.modules['sales'] = SalesModule(self.notebook, self.db, self)
+        # Модуль продаж (рабочий экран кассы создаётся сразу)
+        with self.profiler.phase('Модуль Продажи'):
+            self.modules['sales'] = SalesModule(self.notebook, self.db, self)
         self.notebook.add(self.modules['sales'].frame, text="Продажи")
         
-        # Модуль товаров
-        self.modules['products'] = ProductsModule(self.notebook, self.db, self)
-        self.notebook.add(self.modules['products'].frame, text="Товары")
-        
-        # Модуль клиентов
-        self.modules['customers'] = CustomersModule(self.notebook, self.db, self)
-        self.notebook.add(self.modules['customers'].frame, text="Клиенты")
+        # Остальные модули создаются при первом выборе вкладки
+        self.lazy_tabs = {}
+        for key, title, module_name, class_name in LAZY_TABS:
+            placeholder = ttk.Frame(self.notebook)
+            self.notebook.add(placeholder, text=title)
+            self.lazy_tabs[str(placeholder)] = (key, title, module_name, class_name, placeholder)
+            
+        self.notebook.bind('<<NotebookTabChanged>>', self.on_tab_changed)
         
-        # Модуль отчётов
-        self.modules['reports'] = ReportsModule(self.notebook, self.db, self)
-        self.notebook.add(self.modules['reports'].frame, text="Отчёты")
+    def on_tab_changed(self, event=None):
+        """Создание модуля при первом выборе его вкладки"""
+        tab = self.notebook.select()
+        if tab in self.lazy_tabs:
+            self.build_lazy_tab(tab)
+            
+    def build_lazy_tab(self, tab):
+        """Импорт и создание модуля вкладки"""
+        key, title, module_name, class_name, placeholder = self.lazy_tabs.pop(tab)
+        
+        self.root.config(cursor='watch')
+        self.root.update_idletasks()
+        try:
+            with self.profiler.phase(f'Импорт {module_name}'):
+                module_class = getattr(importlib.import_module(module_name), class_name)
+            with self.profiler.phase(f'Модуль {title}'):
+                self.modules[key] = module_class(placeholder, self.db, self)
+            self.modules[key].frame.pack(fill=tk.BOTH, expand=True)
+        except Exception as e:
+            # Вкладка останется пустой до следующей попытки
+            self.lazy_tabs[tab] = (key, title, module_name, class_name, placeholder)
+            messagebox.showerror("Ошибка", f"Не удалось открыть раздел «{title}»: {str(e)}")
+        finally:
+            self.root.config(cursor='')
         
     def login_window(self):
         """Окно авторизации"""
@@ -311,6 +377,8 @@ class VetPOSApp:
         password_entry.grid(row=1, column=1, padx=5, pady=5)
         password_entry.insert(0, "admin")  # По умолчанию
         
+        status_label = ttk.Label(login_win, text="")
+        
         def login():
             username = username_entry.get()
             password = password_entry.get()
@@ -318,27 +386,34 @@ class VetPOSApp:
             if not username or not password:
                 messagebox.showerror("Ошибка", "Введите логин и пароль")
                 return
+            if str(login_button['state']) == tk.DISABLED:
+                return  # Проверка уже идёт
                 
-            # Проверка пароля с хешированием
-            user = self.db.get_user_by_username(username)
-            if user and self.db.verify_password(username, password):
-                self.current_user = {
-                    'username': user['username'],
-                    'name': user['name'],
-                    'role': user['role']
-                }
-                self.update_user_info()
+            # Проверка пароля (bcrypt) в фоновом потоке, окно остаётся отзывчивым
+            login_button.config(state=tk.DISABLED)
+            status_label.config(text="Проверка...")
+            self.auth.login(login_win, username, password, on_result)
+            
+        def on_result(user):
+            if not login_win.winfo_exists():
+                return
+            login_button.config(state=tk.NORMAL)
+            status_label.config(text="")
+            
+            if user:
                 login_win.destroy()
-                self.status_label.config(text=f"Вход выполнен: {username}")
+                self.start_session(user)
             else:
-                messagebox.showerror("Ошибка", "Неверный логин или пароль")
+                messagebox.showerror("Ошибка", "Неверный логин или пароль", parent=login_win)
         
         # Кнопки
         btn_frame = ttk.Frame(login_win)
-        btn_frame.pack(pady=20)
+        btn_frame.pack(pady=(20, 5))
+        status_label.pack()
         
-        ttk.Button(btn_frame, text="Войти", command=login,
-                  style='Action.TButton').pack(side=tk.LEFT, padx=10)
+        login_button = ttk.Button(btn_frame, text="Войти", command=login,
+                                  style='Action.TButton')
+        login_button.pack(side=tk.LEFT, padx=10)
         ttk.Button(btn_frame, text="Отмена", command=self.exit_app,
                   style='Action.TButton').pack(side=tk.LEFT, padx=10)
         
@@ -346,6 +421,34 @@ class VetPOSApp:
         password_entry.focus()
         login_win.bind('<Return>', lambda e: login())
         
+    def start_session(self, user):
+        """Начало работы пользователя после входа или разблокировки"""
+        self.current_user = user
+        self.restore_open_shift()
+        self.update_user_info()
+        self.status_label.config(text=f"Вход выполнен: {user['username']}")
+        
+    def lock_session(self):
+        """Блокировка кассы с разблокировкой по PIN"""
+        if not self.current_user:
+            return
+            
+        pin = simpledialog.askstring("Блокировка кассы",
+                                     "PIN для разблокировки (4–8 цифр):",
+                                     show='*', parent=self.root)
+        if pin is None:
+            return
+            
+        try:
+            self.auth.lock(self.current_user, pin)
+        except ValueError as e:
+            messagebox.showerror("Ошибка", str(e))
+            return
+            
+        self.status_label.config(text="Касса заблокирована")
+        LockDialog(self.root, self.auth, self.current_user['username'],
+                   self.start_session, self.login_window)
+        
     def update_user_info(self):
         """Обновление информации о пользователе"""
         if self.current_user:
@@ -356,12 +459,64 @@ class VetPOSApp:
         else:
             self.shift_label.config(text="Смена не открыта")
             
+    def restore_open_shift(self):
+        """Восстановление открытой смены кассира после перезапуска"""
+        shift = self.db.get_current_shift(self.current_user['username'])
+        if not shift:
+            self.current_shift = None
+        else:
+            self.current_shift = {
+                'id': shift['id'],
+                'start_time': to_datetime(shift['start_time']) or datetime.now(),
+                'start_amount': shift['start_amount']
+            }
+        self.update_cash_info()
+        
+    def update_cash_info(self):
+        """Обновление суммы наличных в кассе по кассовому журналу"""
+        if not self.current_shift:
+            self.cash_amount_label.config(text=rub(0))
+            return
+            
+        balance = self.db.get_cash_balance(self.current_shift['id'])
+        self.cash_amount_label.config(text=rub(balance))
+            
     def update_time(self):
         """Обновление времени"""
         current_time = datetime.now().strftime("%H:%M:%S")
         self.time_label.config(text=current_time)
         self.root.after(1000, self.update_time)
         
+    def note_activity(self, event=None):
+        """Отметка ввода пользователя"""
+        self.last_activity = time.monotonic()
+        
+    def run_maintenance(self):
+        """Шаг обслуживания базы, если касса простаивает"""
+        delay = MAINTENANCE_CHECK_INTERVAL
+        try:
+            if time.monotonic() - self.last_activity >= MAINTENANCE_IDLE_SECONDS:
+                if self.db.maintenance.run_idle():
+                    delay = MAINTENANCE_STEP_INTERVAL
+            else:
+                # Касса снова работает: прерванный проход записывается в журнал
+                self.db.maintenance.finish_vacuum('idle')
+        except Exception as e:
+            self.db.rollback()
+            print(f"Ошибка обслуживания базы: {e}")
+        self.root.after(delay, self.run_maintenance)
+        
+    def run_shift_close_maintenance(self):
+        """Обслуживание базы после закрытия смены"""
+        self.status_label.config(text="Обслуживание базы данных...")
+        self.root.update_idletasks()
+        try:
+            self.db.maintenance.run_after_shift_close()
+            self.status_label.config(text="Смена закрыта, обслуживание базы выполнено")
+        except Exception as e:
+            self.db.rollback()
+            self.status_label.config(text=f"Ошибка обслуживания базы: {e}")
+            
     # Обработчики меню и кнопок
     def open_sales(self):
         """Открыть модуль продаж"""
@@ -382,6 +537,7 @@ class VetPOSApp:
     def open_settings(self):
         """Открыть настройки"""
         if 'settings' not in self.modules:
+            from modules.settings import SettingsModule
             self.modules['settings'] = SettingsModule(self.notebook, self.db, self)
             self.notebook.add(self.modules['settings'].frame, text="Настройки")
         
@@ -411,20 +567,18 @@ class VetPOSApp:
         
         def confirm_open():
             try:
-                amount = float(amount_var.get())
-                shift_id = datetime.now().strftime("%Y%m%d_%H%M%S")
+                amount = to_kopecks(amount_var.get())
+                
+                # Сохранение в БД (счётчики смены ведутся по её ID)
+                shift_id = self.db.open_shift(self.current_user['username'], amount)
                 self.current_shift = {
                     'id': shift_id,
                     'start_time': datetime.now(),
-                    'start_amount': amount,
-                    'current_amount': amount
+                    'start_amount': amount
                 }
                 
-                # Сохранение в БД
-                self.db.open_shift(self.current_user['username'], amount)
-                
                 self.update_user_info()
-                self.cash_amount_label.config(text=f"{amount:.2f} ₽")
+                self.update_cash_info()
                 shift_win.destroy()
                 self.status_label.config(text="Смена открыта")
                 
@@ -448,23 +602,77 @@ class VetPOSApp:
         
     def cash_in(self):
         """Внесение наличных в кассу"""
-        messagebox.showinfo("Внесение", "Функция в разработке")
+        self.cash_operation_dialog("Внесение в кассу", self.db.cash_in)
         
     def cash_out(self):
         """Изъятие наличных из кассы"""
-        messagebox.showinfo("Изъятие", "Функция в разработке")
+        self.cash_operation_dialog("Изъятие из кассы", self.db.cash_out)
+        
+    def cash_operation_dialog(self, title, operation):
+        """Диалог внесения/изъятия наличных"""
+        if not self.current_shift:
+            messagebox.showwarning("Внимание", "Смена не открыта")
+            return
+            
+        cash_win = tk.Toplevel(self.root)
+        cash_win.title(title)
+        cash_win.geometry("400x220")
+        cash_win.transient(self.root)
+        cash_win.grab_set()
+        
+        balance = self.db.get_cash_balance(self.current_shift['id'])
+        ttk.Label(cash_win, text=f"В кассе: {rub(balance)}").pack(pady=10)
+        
+        ttk.Label(cash_win, text="Сумма:").pack()
+        amount_var = tk.StringVar(value="0.00")
+        amount_entry = ttk.Entry(cash_win, textvariable=amount_var, width=15)
+        amount_entry.pack(pady=5)
+        amount_entry.focus()
+        amount_entry.select_range(0, tk.END)
+        
+        ttk.Label(cash_win, text="Основание:").pack()
+        reason_var = tk.StringVar()
+        ttk.Entry(cash_win, textvariable=reason_var, width=40).pack(pady=5)
+        
+        def confirm():
+            try:
+                amount = to_kopecks(amount_var.get())
+            except ValueError:
+                messagebox.showerror("Ошибка", "Введите корректную сумму")
+                return
+                
+            try:
+                new_balance = operation(self.current_shift['id'], amount,
+                                        reason_var.get().strip() or None,
+                                        self.current_user['id'])
+            except ValueError as e:
+                messagebox.showerror("Ошибка", str(e))
+                return
+                
+            self.cash_amount_label.config(text=rub(new_balance))
+            cash_win.destroy()
+            self.status_label.config(text=f"{title}: {rub(amount)}")
+            
+        ttk.Button(cash_win, text="Провести", command=confirm).pack(pady=10)
+        cash_win.bind('<Return>', lambda e: confirm())
         
     def open_inventory(self):
-        """Остатки товаров"""
-        messagebox.showinfo("Остатки", "Функция в разработке")
+        """Инвентаризация остатков"""
+        from modules.inventory import StockDocumentsWindow
+        StockDocumentsWindow(self.root, self.db, 'stocktake',
+                             self.current_user['id'] if self.current_user else None)
         
     def open_receiving(self):
         """Приход товаров"""
-        messagebox.showinfo("Приход", "Функция в разработке")
+        from modules.inventory import StockDocumentsWindow
+        StockDocumentsWindow(self.root, self.db, 'receiving',
+                             self.current_user['id'] if self.current_user else None)
         
     def open_discounts(self):
         """Скидки и бонусы"""
-        messagebox.showinfo("Скидки", "Функция в разработке")
+        from modules.discounts import DiscountsDialog
+        sales = self.modules.get('sales')
+        DiscountsDialog(self.root, self.db, on_change=sales.reload_discounts if sales else None)
         
     def open_returns(self):
         """Возвраты"""
@@ -490,6 +698,7 @@ class VetPOSApp:
     def exit_app(self):
         """Выход из приложения"""
         if messagebox.askquestion("Выход", "Вы действительно хотите выйти?") == 'yes':
+            self.auth.shutdown()
             self.root.quit()
             
     def run(self):
@@ -498,5 +707,17 @@ class VetPOSApp:
 
 
 if __name__ == "__main__":
-    app = VetPOSApp()
+    # python main.py --profile - вывод длительности этапов запуска
+    profiler = StartupProfiler('--profile' in sys.argv or os.environ.get('VETPOS_PROFILE') == '1',
+                               started=STARTED)
+    profiler.record('Импорт модулей', IMPORT_SECONDS)
+    
+    # python main.py --server 192.168.1.10:8765 - работа с общей базой через сервер (server.py),
+    # ключ доступа к серверу - VETPOS_SERVER_TOKEN
+    server = os.environ.get('VETPOS_SERVER')
+    if '--server' in sys.argv[1:-1]:
+        server = sys.argv[sys.argv.index('--server') + 1]
+        
+    app = VetPOSApp(profiler, server=server)
+    app.root.after_idle(profiler.report)
     app.run()
\ No newline at end of file
@@ -0,0 +1,208 @@
+"""
+Обслуживание базы по расписанию: статистика планировщика (ANALYZE / PRAGMA optimize),
+возврат свободных страниц небольшими шагами (auto_vacuum=INCREMENTAL), проверка целостности
+и сверка остатков товаров с журналом движения.
+Выполняется в простое кассы и после закрытия смены; каждая задача пишется в maintenance_log
+с размером файла до и после
+"""
+
+import time
+
+import timestamps
+
+
+# Простой кассы без ввода, после которого начинается обслуживание (секунды)
+MAINTENANCE_IDLE_SECONDS = 120
+
+# Страниц за один шаг incremental_vacuum: блокировка записи на миллисекунды
+VACUUM_STEP_PAGES = 256
+
+# Время одного прохода в простое (секунды): касса не ждёт дольше
+IDLE_BUDGET_SECONDS = 0.2
+
+# Периодичность обновления статистики и проверки целостности (секунды)
+ANALYZE_INTERVAL = 24 * 3600
+INTEGRITY_INTERVAL = 7 * 24 * 3600
+
+# Строк таблиц, просматриваемых ANALYZE на индекс (PRAGMA analysis_limit)
+ANALYSIS_LIMIT = 1000
+
+# Ошибок integrity_check в журнале
+INTEGRITY_MAX_ERRORS = 20
+
+# Записей журнала обслуживания
+MAINTENANCE_LOG_KEEP = 500
+
+# Товаров с расхождением остатка в записи журнала обслуживания
+DRIFT_LOG_ROWS = 10
+
+# Режим PRAGMA auto_vacuum
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+class DatabaseMaintenance:
+    """Задачи обслуживания базы с записью метрик до и после в журнал"""
+    
+    def __init__(self, db):
+        self.db = db
+        # Текущий проход возврата страниц: (начало, метрики до)
+        self.vacuum_pass = None
+        
+    def metrics(self):
+        """Размер базы: страницы, свободные страницы, байты и режим auto_vacuum"""
+        connection = self.db.get_connection()
+        page_size = connection.execute('PRAGMA main.page_size').fetchone()[0]
+        page_count = connection.execute('PRAGMA main.page_count').fetchone()[0]
+        return {
+            'page_size': page_size,
+            'page_count': page_count,
+            'freelist_count': connection.execute('PRAGMA main.freelist_count').fetchone()[0],
+            'size': page_size * page_count,
+            'auto_vacuum': connection.execute('PRAGMA main.auto_vacuum').fetchone()[0],
+        }
+        
+    def log(self, task, trigger, started, before, result='ok'):
+        """Запись задачи в журнал обслуживания"""
+        after = self.metrics()
+        duration_ms = (time.perf_counter() - started) * 1000
+        self.db.execute_query('''
+            INSERT INTO maintenance_log (started_at, task, trigger, duration_ms, pages_before, pages_after,
+                                         free_before, free_after, result)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (timestamps.now(), task, trigger, duration_ms, before['page_count'], after['page_count'],
+              before['freelist_count'], after['freelist_count'], result))
+        self.db.execute_query('''
+            DELETE FROM maintenance_log WHERE id <= (SELECT MAX(id) FROM maintenance_log) - ?
+        ''', (MAINTENANCE_LOG_KEEP,))
+        self.db.commit()
+        print(f"Обслуживание базы: {task} ({trigger}) {duration_ms:.0f} мс, "
+              f"страниц {before['page_count']} -> {after['page_count']}, "
+              f"свободных {before['freelist_count']} -> {after['freelist_count']}: {result}")
+        return after
+        
+    def due(self, key, interval):
+        """Прошло ли interval секунд с отметки key в настройках"""
+        return timestamps.now() - int(self.db.get_setting(key) or 0) >= interval
+        
+    def mark(self, key):
+        """Отметка времени выполнения задачи"""
+        self.db.execute_query('''
+            INSERT OR REPLACE INTO settings (key, value, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)
+        ''', (key, str(timestamps.now())))
+        self.db.commit()
+        
+    # Задачи
+    def enable_incremental_vacuum(self, trigger):
+        """Перевод базы в auto_vacuum=INCREMENTAL полным VACUUM (только без открытых смен)"""
+        before = self.metrics()
+        if before['auto_vacuum'] == AUTO_VACUUM_INCREMENTAL:
+            return False
+        if self.db.fetch_one("SELECT 1 FROM shifts WHERE status = 'open'"):
+            return False
+            
+        started = time.perf_counter()
+        connection = self.db.get_connection()
+        # VACUUM не выполняется внутри транзакции
+        self.db.commit()
+        connection.execute('PRAGMA main.auto_vacuum = INCREMENTAL')
+        connection.execute('VACUUM main')
+        self.log('convert', trigger, started, before)
+        return True
+        
+    def refresh_statistics(self, trigger):
+        """Статистика для планировщика: полный ANALYZE в первый раз, дальше PRAGMA optimize"""
+        before = self.metrics()
+        started = time.perf_counter()
+        connection = self.db.get_connection()
+        self.db.commit()
+        connection.execute(f'PRAGMA analysis_limit = {ANALYSIS_LIMIT}')
+        if connection.execute("SELECT 1 FROM main.sqlite_master WHERE name = 'sqlite_stat1'").fetchone():
+            task = 'optimize'
+            # 0x10002: проверить все таблицы, а не только использованные этим соединением
+            connection.execute('PRAGMA main.optimize(0x10002)')
+        else:
+            task = 'analyze'
+            connection.execute('ANALYZE main')
+        connection.commit()
+        self.mark('maintenance_analyzed_at')
+        self.log(task, trigger, started, before)
+        
+    def check_integrity(self, trigger):
+        """PRAGMA integrity_check; возвращает True, если ошибок нет"""
+        before = self.metrics()
+        started = time.perf_counter()
+        rows = [row[0] for row in self.db.get_connection().execute(
+            f'PRAGMA main.integrity_check({INTEGRITY_MAX_ERRORS})')]
+        ok = rows == ['ok']
+        self.mark('maintenance_checked_at')
+        self.log('integrity', trigger, started, before, 'ok' if ok else '; '.join(rows))
+        return ok
+        
+    def reconcile_stock(self, trigger):
+        """Сверка остатков в карточках товаров с журналом движения; возвращает расхождения"""
+        before = self.metrics()
+        started = time.perf_counter()
+        drift = self.db.reconcile_stock()
+        result = 'ok' if not drift else f"расхождений {len(drift)}: " + ', '.join(
+            f"#{row['id']} {row['quantity']:g} ≠ {row['ledger_quantity']:g}" for row in drift[:DRIFT_LOG_ROWS])
+        self.log('reconcile', trigger, started, before, result)
+        return drift
+        
+    def vacuum_step(self, pages=VACUUM_STEP_PAGES):
+        """Возврат не больше pages свободных страниц; возвращает число оставшихся"""
+        metrics = self.metrics()
+        if metrics['auto_vacuum'] != AUTO_VACUUM_INCREMENTAL or not metrics['freelist_count']:
+            return 0
+        if self.vacuum_pass is None:
+            self.vacuum_pass = (time.perf_counter(), metrics)
+        self.db.commit()
+        # Прагма освобождает по странице на шаг выполнения, а execute() делает один шаг:
+        # executescript выполняет её до конца
+        self.db.get_connection().executescript(f'PRAGMA main.incremental_vacuum({pages})')
+        return self.db.get_connection().execute('PRAGMA main.freelist_count').fetchone()[0]
+        
+    def finish_vacuum(self, trigger):
+        """Запись прохода возврата страниц в журнал (по окончании или при возобновлении работы)"""
+        if self.vacuum_pass is not None:
+            started, before = self.vacuum_pass
+            self.vacuum_pass = None
+            self.log('vacuum', trigger, started, before)
+            
+    # Расписание
+    def run_idle(self, budget=IDLE_BUDGET_SECONDS):
+        """Проход в простое не дольше budget секунд; возвращает True, если работа осталась"""
+        deadline = time.perf_counter() + budget
+        if self.due('maintenance_analyzed_at', ANALYZE_INTERVAL):
+            self.refresh_statistics('idle')
+            return True
+        while time.perf_counter() < deadline:
+            if not self.vacuum_step():
+                self.finish_vacuum('idle')
+                return False
+        return True
+        
+    def run_after_shift_close(self):
+        """Обслуживание после закрытия смены: перевод в INCREMENTAL, статистика, проверка целостности"""
+        self.enable_incremental_vacuum('shift_close')
+        self.refresh_statistics('shift_close')
+        if self.due('maintenance_checked_at', INTEGRITY_INTERVAL):
+            self.check_integrity('shift_close')
+        self.reconcile_stock('shift_close')
+        # Свободные страницы возвращаются шагами в простое
+        
+    def run_now(self):
+        """Полное обслуживание по кнопке: все задачи и возврат всех свободных страниц"""
+        self.enable_incremental_vacuum('manual')
+        self.refresh_statistics('manual')
+        ok = self.check_integrity('manual')
+        self.reconcile_stock('manual')
+        while self.vacuum_step():
+            pass
+        self.finish_vacuum('manual')
+        return ok
+        
+    def history(self, limit=50):
+        """Последние записи журнала обслуживания"""
+        return self.db.fetch_all('''
+            SELECT * FROM maintenance_log ORDER BY id DESC LIMIT ?
+        ''', (limit,))
@@ -0,0 +1,193 @@
+"""
+Авторизация: проверка пароля в фоновом потоке и быстрая разблокировка кассы по PIN
+"""
+
+import tkinter as tk
+from tkinter import ttk, messagebox
+import hmac
+import hashlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import bcrypt
+from queries import USER_FOR_LOGIN
+
+
+# Время действия PIN заблокированной сессии (с)
+PIN_TTL_SECONDS = 15 * 60
+
+# Неверных вводов PIN до требования пароля
+PIN_ATTEMPTS = 5
+
+# Допустимая длина PIN
+PIN_MIN_LENGTH = 4
+PIN_MAX_LENGTH = 8
+
+# Период опроса фоновой проверки пароля (мс)
+POLL_MS = 20
+
+# Хеш для несуществующего логина: время ответа не выдаёт, есть ли такой пользователь
+DUMMY_HASH = b'$2b$12$yqzjtPVHljfQbAbwHassfePeElIKiGk25Xkh53SFzmLlX7gepIJgu'
+
+
+class AuthService:
+    """Проверка учётных данных без блокировки интерфейса и PIN-сессии кассиров"""
+    
+    def __init__(self, db):
+        self.db = db
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='auth')
+        # Ключ процесса: производные ключи PIN существуют только в памяти
+        self.secret = os.urandom(32)
+        # username -> {'user', 'key', 'expires', 'attempts'}
+        self.sessions = {}
+        
+    def login(self, widget, username, password, callback):
+        """Проверка пароля в фоне; callback(user или None) вызывается в потоке интерфейса"""
+        row = self.db.queries.one(USER_FOR_LOGIN, (username,))
+        password_hash = row.password.encode('utf-8') if row else DUMMY_HASH
+        future = self.executor.submit(bcrypt.checkpw, password.encode('utf-8'), password_hash)
+        
+        def poll():
+            if not future.done():
+                widget.after(POLL_MS, poll)
+                return
+            try:
+                valid = future.result() and row is not None
+            except ValueError:
+                valid = False  # Повреждённый хеш в базе
+            callback(self.user_info(row) if valid else None)
+            
+        widget.after(POLL_MS, poll)
+        
+    @staticmethod
+    def user_info(row):
+        """Данные пользователя для сессии (без хеша пароля)"""
+        return {'id': row.id, 'username': row.username, 'name': row.name, 'role': row.role}
+        
+    def derive_key(self, username, pin):
+        """Производный ключ PIN (HMAC с ключом процесса)"""
+        return hmac.new(self.secret, f'{username}\0{pin}'.encode('utf-8'), hashlib.sha256).digest()
+        
+    def lock(self, user, pin):
+        """Блокировка сессии пользователя с PIN для разблокировки"""
+        if not pin.isdigit() or not PIN_MIN_LENGTH <= len(pin) <= PIN_MAX_LENGTH:
+            raise ValueError(f"PIN должен состоять из {PIN_MIN_LENGTH}–{PIN_MAX_LENGTH} цифр")
+        self.sessions[user['username']] = {
+            'user': user,
+            'key': self.derive_key(user['username'], pin),
+            'expires': time.monotonic() + PIN_TTL_SECONDS,
+            'attempts': 0,
+        }
+        
+    def unlock(self, username, pin):
+        """Разблокировка по PIN; возвращает пользователя или None"""
+        session = self.sessions.get(username)
+        if session is None:
+            return None
+        if time.monotonic() >= session['expires']:
+            del self.sessions[username]
+            return None
+            
+        if hmac.compare_digest(session['key'], self.derive_key(username, pin)):
+            session['attempts'] = 0
+            return session['user']
+            
+        session['attempts'] += 1
+        if session['attempts'] >= PIN_ATTEMPTS:
+            del self.sessions[username]
+        return None
+        
+    def locked_users(self):
+        """Пользователи, которых можно разблокировать по PIN"""
+        now = time.monotonic()
+        for username in [name for name, session in self.sessions.items() if session['expires'] <= now]:
+            del self.sessions[username]
+        return [session['user'] for session in self.sessions.values()]
+        
+    def forget(self, username):
+        """Сброс PIN-сессии (смена пароля, выход)"""
+        self.sessions.pop(username, None)
+        
+    def shutdown(self):
+        """Остановка фонового потока"""
+        self.executor.shutdown(wait=False)
+
+
+class LockDialog:
+    """Экран блокировки кассы: разблокировка по PIN или вход другим пользователем"""
+    
+    def __init__(self, parent, auth, username, on_unlock, on_password_login):
+        self.auth = auth
+        self.on_unlock = on_unlock
+        self.on_password_login = on_password_login
+        
+        self.dialog = tk.Toplevel(parent)
+        self.dialog.title("Касса заблокирована")
+        self.dialog.geometry("380x240")
+        self.dialog.transient(parent)
+        self.dialog.grab_set()
+        self.dialog.resizable(False, False)
+        # Закрыть экран блокировки можно только разблокировкой
+        self.dialog.protocol("WM_DELETE_WINDOW", lambda: None)
+        
+        self.dialog.geometry("+%d+%d" % (
+            parent.winfo_rootx() + 500,
+            parent.winfo_rooty() + 200
+        ))
+        
+        self.users = {user['name']: user['username'] for user in auth.locked_users()}
+        self.create_interface(username)
+        
+    def create_interface(self, username):
+        """Создание интерфейса экрана блокировки"""
+        ttk.Label(self.dialog, text="Касса заблокирована",
+                 font=('Segoe UI', 14, 'bold')).pack(pady=15)
+                 
+        form = ttk.Frame(self.dialog)
+        form.pack(pady=5)
+        
+        ttk.Label(form, text="Кассир:").grid(row=0, column=0, padx=5, pady=5, sticky=tk.W)
+        self.user_var = tk.StringVar()
+        ttk.Combobox(form, textvariable=self.user_var, values=list(self.users),
+                    state="readonly", width=22).grid(row=0, column=1, padx=5, pady=5)
+        for name, login in self.users.items():
+            if login == username:
+                self.user_var.set(name)
+                
+        ttk.Label(form, text="PIN:").grid(row=1, column=0, padx=5, pady=5, sticky=tk.W)
+        self.pin_var = tk.StringVar()
+        pin_entry = ttk.Entry(form, textvariable=self.pin_var, show="*", width=24)
+        pin_entry.grid(row=1, column=1, padx=5, pady=5)
+        
+        btn_frame = ttk.Frame(self.dialog)
+        btn_frame.pack(pady=15)
+        
+        ttk.Button(btn_frame, text="Разблокировать",
+                  command=self.unlock).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="Вход по паролю",
+                  command=self.password_login).pack(side=tk.LEFT, padx=5)
+                  
+        pin_entry.focus()
+        self.dialog.bind('<Return>', lambda e: self.unlock())
+        
+    def unlock(self):
+        """Проверка PIN выбранного кассира"""
+        username = self.users.get(self.user_var.get())
+        user = self.auth.unlock(username, self.pin_var.get()) if username else None
+        self.pin_var.set("")
+        
+        if user is None:
+            if username not in [locked['username'] for locked in self.auth.locked_users()]:
+                messagebox.showerror("Ошибка", "PIN больше не действует, войдите по паролю",
+                                    parent=self.dialog)
+            else:
+                messagebox.showerror("Ошибка", "Неверный PIN", parent=self.dialog)
+            return
+            
+        self.dialog.destroy()
+        self.on_unlock(user)
+        
+    def password_login(self):
+        """Переход к входу по логину и паролю"""
+        self.dialog.destroy()
+        self.on_password_login()
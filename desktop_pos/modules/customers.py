@@ -4,7 +4,11 @@
 
 import tkinter as tk
 from tkinter import ttk, messagebox
-from datetime import datetime
+from money import rub
+from timestamps import format_date, format_datetime
+from .live_search import DebouncedSearch
+from queries import (CUSTOMER_BY_ID, CUSTOMER_RECENT_PURCHASES, CUSTOMER_PURCHASE_HISTORY,
+                     CUSTOMER_DEACTIVATE, CUSTOMER_SET_DISCOUNT, CUSTOMER_UPDATE)
 
 
 class CustomersModule:
@@ -14,6 +18,8 @@ class CustomersModule:
         self.main_app = main_app
         
         self.frame = ttk.Frame(parent)
+        self.search = DebouncedSearch(self.frame, self.db.search_customers, self.show_search_results)
+        
         self.create_interface()
         self.load_customers()
         
@@ -157,7 +163,7 @@ class CustomersModule:
                 customer['email'] or '',
                 f"{customer['discount_percent']:.0f}%",
                 customer['bonus_points'],
-                f"{customer['total_purchases']:.2f} ₽"
+                rub(customer['total_purchases'])
             ))
             
         self.main_app.status_label.config(text=f"Загружено клиентов: {len(customers)}")
@@ -167,19 +173,19 @@ class CustomersModule:
         search_term = self.search_var.get()
         
         if len(search_term) >= 2:
-            self.search_customers(search_term)
+            self.search.schedule(search_term)
         elif len(search_term) == 0:
+            self.search.cancel()
             self.load_customers()
+        else:
+            self.search.cancel()
             
-    def search_customers(self, search_term):
-        """Поиск клиентов"""
+    def show_search_results(self, search_term, customers):
+        """Вывод найденных клиентов (первые CUSTOMER_SEARCH_LIMIT)"""
         # Очистка таблицы
         for item in self.customers_tree.get_children():
             self.customers_tree.delete(item)
             
-        # Поиск и загрузка
-        customers = self.db.search_customers(search_term)
-        
         for customer in customers:
             self.customers_tree.insert('', 'end', values=(
                 customer['id'],
@@ -188,9 +194,11 @@ class CustomersModule:
                 customer['email'] or '',
                 f"{customer['discount_percent']:.0f}%",
                 customer['bonus_points'],
-                f"{customer['total_purchases']:.2f} ₽"
+                rub(customer['total_purchases'])
             ))
             
+        self.main_app.status_label.config(text=f"Найдено клиентов: {len(customers)}")
+        
     def on_customer_select(self, event):
         """Обработчик выбора клиента"""
         selection = self.customers_tree.selection()
@@ -202,7 +210,7 @@ class CustomersModule:
         customer_id = item['values'][0]
         
         # Получение полной информации о клиенте
-        customer = self.db.fetch_one('SELECT * FROM customers WHERE id = ?', (customer_id,))
+        customer = self.db.queries.one(CUSTOMER_BY_ID, (customer_id,))
         
         if customer:
             self.show_customer_info(customer)
@@ -216,18 +224,10 @@ class CustomersModule:
         self.info_labels['address'].config(text=customer['address'] or 'Не указан')
         self.info_labels['discount_percent'].config(text=f"{customer['discount_percent']:.0f}%")
         self.info_labels['bonus_points'].config(text=str(customer['bonus_points']))
-        self.info_labels['total_purchases'].config(text=f"{customer['total_purchases']:.2f} ₽")
+        self.info_labels['total_purchases'].config(text=rub(customer['total_purchases']))
         
         # Форматирование даты
-        if customer['created_at']:
-            try:
-                date_obj = datetime.strptime(customer['created_at'], '%Y-%m-%d %H:%M:%S')
-                formatted_date = date_obj.strftime('%d.%m.%Y')
-            except:
-                formatted_date = customer['created_at']
-            self.info_labels['created_at'].config(text=formatted_date)
-        else:
-            self.info_labels['created_at'].config(text='Не указана')
+        self.info_labels['created_at'].config(text=format_date(customer['created_at'], 'Не указана'))
             
     def clear_customer_info(self):
         """Очистка информации о клиенте"""
@@ -245,25 +245,12 @@ class CustomersModule:
             self.purchases_tree.delete(item)
             
         # Загрузка последних покупок
-        purchases = self.db.fetch_all('''
-            SELECT created_at, final_amount, payment_method 
-            FROM sales 
-            WHERE customer_id = ? 
-            ORDER BY created_at DESC 
-            LIMIT 10
-        ''', (customer_id,))
+        purchases = self.db.queries.all(CUSTOMER_RECENT_PURCHASES, (customer_id, 10))
         
         for purchase in purchases:
-            # Форматирование даты
-            try:
-                date_obj = datetime.strptime(purchase['created_at'], '%Y-%m-%d %H:%M:%S')
-                formatted_date = date_obj.strftime('%d.%m.%Y')
-            except:
-                formatted_date = purchase['created_at']
-                
             self.purchases_tree.insert('', 'end', values=(
-                formatted_date,
-                f"{purchase['final_amount']:.2f} ₽",
+                format_date(purchase['created_at']),
+                rub(purchase['final_amount']),
                 purchase['payment_method']
             ))
             
@@ -284,7 +271,7 @@ class CustomersModule:
         customer_id = item['values'][0]
         
         # Получение полных данных клиента
-        customer = self.db.fetch_one('SELECT * FROM customers WHERE id = ?', (customer_id,))
+        customer = self.db.queries.one(CUSTOMER_BY_ID, (customer_id,))
         
         dialog = CustomerDialog(self.frame, self.db, "Редактирование клиента", customer)
         if dialog.result:
@@ -304,7 +291,7 @@ class CustomersModule:
         
         if messagebox.askyesno("Подтверждение", f"Удалить клиента '{customer_name}'?"):
             customer_id = item['values'][0]
-            self.db.execute_query('UPDATE customers SET is_active = 0 WHERE id = ?', (customer_id,))
+            self.db.queries.execute(CUSTOMER_DEACTIVATE, (customer_id,))
             self.db.commit()
             self.load_customers()
             self.clear_customer_info()
@@ -334,28 +321,14 @@ class CustomersModule:
             history_tree.heading(col, text=col)
             
         # Загрузка истории
-        history = self.db.fetch_all('''
-            SELECT s.created_at, s.id, s.final_amount, s.discount_amount, 
-                   s.payment_method, u.name as cashier_name
-            FROM sales s
-            JOIN shifts sh ON s.shift_id = sh.id
-            JOIN users u ON sh.cashier_id = u.id
-            WHERE s.customer_id = ?
-            ORDER BY s.created_at DESC
-        ''', (customer_id,))
+        history = self.db.queries.all(CUSTOMER_PURCHASE_HISTORY, (customer_id,))
         
         for record in history:
-            try:
-                date_obj = datetime.strptime(record['created_at'], '%Y-%m-%d %H:%M:%S')
-                formatted_date = date_obj.strftime('%d.%m.%Y %H:%M')
-            except:
-                formatted_date = record['created_at']
-                
             history_tree.insert('', 'end', values=(
-                formatted_date,
+                format_datetime(record['created_at']),
                 record['id'],
-                f"{record['final_amount']:.2f} ₽",
-                f"{record['discount_amount']:.2f} ₽",
+                rub(record['final_amount']),
+                rub(record['discount_amount']),
                 record['payment_method'],
                 record['cashier_name']
             ))
@@ -397,12 +370,9 @@ class CustomersModule:
             item = self.customers_tree.item(selection[0])
             customer_id = item['values'][0]
             
-            self.db.execute_query('''
-                UPDATE customers 
-                SET bonus_points = bonus_points + ? 
-                WHERE id = ?
-            ''', (points, customer_id))
-            self.db.commit()
+            user = self.main_app.current_user
+            self.db.adjust_bonus_points(customer_id, points, reason="Начисление вручную",
+                                        user_id=user['id'] if user else None)
             
             self.load_customers()
             self.on_customer_select(None)
@@ -423,11 +393,7 @@ class CustomersModule:
             item = self.customers_tree.item(selection[0])
             customer_id = item['values'][0]
             
-            self.db.execute_query('''
-                UPDATE customers 
-                SET discount_percent = ? 
-                WHERE id = ?
-            ''', (new_discount, customer_id))
+            self.db.queries.execute(CUSTOMER_SET_DISCOUNT, (new_discount, customer_id))
             self.db.commit()
             
             self.load_customers()
@@ -555,26 +521,22 @@ class CustomerDialog:
         try:
             if self.customer:
                 # Обновление
-                self.db.execute_query('''
-                    UPDATE customers 
-                    SET name=?, phone=?, email=?, address=?, discount_percent=?, bonus_points=?
-                    WHERE id=?
-                ''', (name, phone, email, address, discount, bonus_points, self.customer['id']))
-                messagebox.showinfo("Успех", "Клиент обновлён")
+                self.db.queries.execute(CUSTOMER_UPDATE, (name, phone, email, address, discount,
+                                                          self.customer['id']))
+                customer_id = self.customer['id']
             else:
                 # Добавление
-                self.db.add_customer((name, phone, email, address, discount))
-                # Обновление бонусов если нужно
-                if bonus_points > 0:
-                    customer_id = self.db.connection.lastrowid
-                    self.db.execute_query('''
-                        UPDATE customers SET bonus_points = ? WHERE id = ?
-                    ''', (bonus_points, customer_id))
-                messagebox.showinfo("Успех", "Клиент добавлен")
+                customer_id = self.db.add_customer((name, phone, email, address, discount))
                 
+            # Изменение остатка баллов - корректирующая запись бонусного журнала
+            delta = bonus_points - self.db.get_bonus_balance(customer_id)
+            if delta:
+                self.db.add_bonus_event(customer_id, 'manual', delta, reason="Корректировка в карточке клиента")
             self.db.commit()
+            messagebox.showinfo("Успех", "Клиент обновлён" if self.customer else "Клиент добавлен")
             self.result = True
             self.dialog.destroy()
             
         except Exception as e:
+            self.db.rollback()
             messagebox.showerror("Ошибка", f"Ошибка сохранения: {str(e)}")
\ No newline at end of file
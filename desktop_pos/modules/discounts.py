@@ -0,0 +1,468 @@
+"""
+Скидки и акции: правила, скомпилированные в таблицы по товарам, и пересчёт чека по изменённым позициям
+"""
+
+import tkinter as tk
+from tkinter import ttk, messagebox
+import json
+from datetime import datetime
+from money import to_kopecks, line_total, percent_of, format_amount
+from queries import (DISCOUNT_RULES_ACTIVE, DISCOUNT_RULES_ALL, DISCOUNT_RULE_INSERT,
+                     DISCOUNT_RULE_SET_ACTIVE, DISCOUNT_RULE_DELETE, PRODUCTS_IN_CATEGORIES,
+                     PRODUCT_CATEGORIES)
+
+
+RULE_TYPES = {
+    'percent': 'Скидка %',
+    'n_for_m': 'N по цене M',
+}
+
+WEEKDAY_TITLES = ('Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс')
+
+# Стоимость балла (копейки) и доля чека, оплачиваемая баллами (%), если не заданы в настройках
+BONUS_POINT_VALUE = 100
+BONUS_MAX_PERCENT = 50
+
+
+class CompiledRule:
+    """Правило скидки, подготовленное к проверке на позиции чека"""
+    __slots__ = ('id', 'name', 'rule_type', 'percent', 'buy_quantity', 'pay_quantity',
+                 'date_from', 'date_to', 'time_from', 'time_to', 'weekdays')
+                 
+    def __init__(self, row):
+        self.id = row.id
+        self.name = row.name
+        self.rule_type = row.rule_type
+        self.percent = row.percent or 0
+        self.buy_quantity = row.buy_quantity or 0
+        self.pay_quantity = row.pay_quantity or 0
+        self.date_from = row.date_from or None
+        self.date_to = row.date_to or None
+        self.time_from = row.time_from or None
+        self.time_to = row.time_to or None
+        # Номера дней недели по datetime.weekday()
+        self.weekdays = frozenset(int(day) - 1 for day in row.weekdays) if row.weekdays else None
+        
+    def active_at(self, now):
+        """Действует ли правило в момент now"""
+        if self.weekdays is not None and now.weekday() not in self.weekdays:
+            return False
+        if self.date_from or self.date_to:
+            today = now.strftime('%Y-%m-%d')
+            if (self.date_from and today < self.date_from) or (self.date_to and today > self.date_to):
+                return False
+        if self.time_from and self.time_to:
+            moment = now.strftime('%H:%M')
+            if self.time_from <= self.time_to:
+                return self.time_from <= moment < self.time_to
+            return moment >= self.time_from or moment < self.time_to  # Окно через полночь
+        return True
+        
+    def discount(self, price, quantity):
+        """Скидка на позицию в копейках"""
+        if self.rule_type == 'percent':
+            return percent_of(line_total(price, quantity), self.percent)
+        if self.rule_type == 'n_for_m' and self.buy_quantity > self.pay_quantity:
+            # Только на целые штуки: из каждых N бесплатны N - M
+            free = int(quantity) // self.buy_quantity * (self.buy_quantity - self.pay_quantity)
+            return price * free
+        return 0
+
+
+class DiscountEngine:
+    """Действующие правила скидок, разложенные по товарам при загрузке"""
+    
+    def __init__(self, db):
+        self.db = db
+        self.load()
+        
+    def load(self):
+        """Загрузка правил и построение таблицы товар -> применимые правила"""
+        product_rules = {}
+        category_rules = {}
+        general = []
+        for row in self.db.queries.all(DISCOUNT_RULES_ACTIVE):
+            rule = CompiledRule(row)
+            if row.product_id:
+                product_rules.setdefault(row.product_id, []).append(rule)
+            elif row.category:
+                category_rules.setdefault(row.category, []).append(rule)
+            else:
+                general.append(rule)
+                
+        # Товар без своих правил и правил категории получает общий набор
+        self.general = tuple(general)
+        self.lookup = {product_id: tuple(rules) + self.general for product_id, rules in product_rules.items()}
+        if category_rules:
+            for product in self.db.queries.all(PRODUCTS_IN_CATEGORIES, (json.dumps(list(category_rules)),)):
+                self.lookup[product.id] = (self.lookup.get(product.id, self.general)
+                                           + tuple(category_rules[product.category]))
+                                           
+        self.point_value = int(self.db.get_setting('bonus_point_value') or BONUS_POINT_VALUE)
+        self.bonus_max_percent = float(self.db.get_setting('bonus_max_percent') or BONUS_MAX_PERCENT)
+        
+    def line_discount(self, product_id, price, quantity, now):
+        """Лучшая скидка на позицию: (копейки, правило или None); правила не суммируются"""
+        best, best_rule = 0, None
+        for rule in self.lookup.get(product_id, self.general):
+            if rule.active_at(now):
+                discount = rule.discount(price, quantity)
+                if discount > best:
+                    best, best_rule = discount, rule
+        return min(best, line_total(price, quantity)), best_rule
+
+
+class ReceiptPricing:
+    """Итоги чека: при изменении позиции пересчитывается только она"""
+    
+    def __init__(self, engine):
+        self.engine = engine
+        # product_id -> (сумма позиции, скидка по правилам, правило)
+        self.lines = {}
+        self.subtotal = 0
+        self.rules_discount = 0
+        self.customer_percent = 0
+        self.manual_percent = 0
+        self.available_points = 0
+        self.requested_points = 0
+        
+    def update_line(self, item, now=None):
+        """Пересчёт одной позиции (добавление или изменение количества)"""
+        self.remove_line(item['product_id'])
+        discount, rule = self.engine.line_discount(item['product_id'], item['price'], item['quantity'],
+                                                   now or datetime.now())
+        self.lines[item['product_id']] = (item['total'], discount, rule)
+        self.subtotal += item['total']
+        self.rules_discount += discount
+        
+    def remove_line(self, product_id):
+        """Исключение позиции из итогов"""
+        line = self.lines.pop(product_id, None)
+        if line:
+            self.subtotal -= line[0]
+            self.rules_discount -= line[1]
+            
+    def reset(self, items=()):
+        """Полный пересчёт (новый или восстановленный чек, оплата)"""
+        self.lines.clear()
+        self.subtotal = self.rules_discount = 0
+        now = datetime.now()
+        for item in items:
+            self.update_line(item, now)
+            
+    def set_customer(self, customer):
+        """Скидка и баллы клиента чека"""
+        self.customer_percent = (customer.get('discount_percent') or 0) if customer else 0
+        self.available_points = (customer.get('bonus_points') or 0) if customer else 0
+        self.requested_points = 0
+        
+    def sale_items(self, items):
+        """Позиции для проведения продажи со скидкой правил на каждую (копейки)"""
+        return [dict(item, discount=self.lines[item['product_id']][1]) for item in items]
+        
+    def applied_rules(self):
+        """Названия сработавших правил"""
+        return sorted({line[2].name for line in self.lines.values() if line[2]})
+        
+    def totals(self):
+        """Итоги чека в копейках: правила, затем процент клиента и ручной, затем баллы"""
+        after_rules = self.subtotal - self.rules_discount
+        percent = min(100, self.customer_percent + self.manual_percent)
+        percent_discount = percent_of(after_rules, percent)
+        after_percent = after_rules - percent_discount
+        
+        points = min(self.requested_points, self.available_points, self.max_points(after_percent))
+        bonus_discount = points * self.engine.point_value
+        discount = self.rules_discount + percent_discount + bonus_discount
+        return {
+            'subtotal': self.subtotal,
+            'rules_discount': self.rules_discount,
+            'percent_discount': percent_discount,
+            'bonus_points': points,
+            'bonus_discount': bonus_discount,
+            'discount': discount,
+            'total': self.subtotal - discount,
+        }
+        
+    def max_points(self, amount):
+        """Баллов, которыми можно оплатить не больше допустимой доли суммы"""
+        if self.engine.point_value <= 0:
+            return 0
+        return percent_of(amount, self.engine.bonus_max_percent) // self.engine.point_value
+
+
+class DiscountsDialog:
+    """Справочник правил скидок и настройки бонусных баллов"""
+    
+    def __init__(self, parent, db, on_change=None):
+        self.db = db
+        self.on_change = on_change
+        
+        self.window = tk.Toplevel(parent)
+        self.window.title("Скидки и бонусы")
+        self.window.geometry("900x620")
+        self.window.transient(parent)
+        
+        self.create_interface()
+        self.load_rules()
+        
+    def create_interface(self):
+        """Создание интерфейса справочника"""
+        toolbar = ttk.Frame(self.window)
+        toolbar.pack(fill=tk.X, padx=10, pady=10)
+        
+        ttk.Button(toolbar, text="⏯ Включить/выключить", command=self.toggle_rule).pack(side=tk.LEFT, padx=2)
+        ttk.Button(toolbar, text="🗑 Удалить", command=self.delete_rule).pack(side=tk.LEFT, padx=2)
+        
+        table_frame = ttk.Frame(self.window)
+        table_frame.pack(fill=tk.BOTH, expand=True, padx=10)
+        
+        columns = ('Название', 'Тип', 'Применяется к', 'Условие', 'Период', 'Время', 'Дни', 'Статус')
+        self.rules_tree = ttk.Treeview(table_frame, columns=columns, show='headings', height=10)
+        for col in columns:
+            self.rules_tree.heading(col, text=col)
+            self.rules_tree.column(col, width=100)
+        self.rules_tree.column('Название', width=160)
+        self.rules_tree.column('Применяется к', width=150)
+        
+        scrollbar = ttk.Scrollbar(table_frame, orient=tk.VERTICAL, command=self.rules_tree.yview)
+        self.rules_tree.configure(yscrollcommand=scrollbar.set)
+        self.rules_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        
+        self.create_rule_form()
+        self.create_bonus_settings()
+        
+    def create_rule_form(self):
+        """Форма нового правила"""
+        form = ttk.LabelFrame(self.window, text="Новое правило", padding="10")
+        form.pack(fill=tk.X, padx=10, pady=10)
+        
+        self.name_var = tk.StringVar()
+        self.type_var = tk.StringVar(value=RULE_TYPES['percent'])
+        self.category_var = tk.StringVar()
+        self.barcode_var = tk.StringVar()
+        self.percent_var = tk.StringVar(value="10")
+        self.buy_var = tk.StringVar(value="3")
+        self.pay_var = tk.StringVar(value="2")
+        self.date_from_var = tk.StringVar()
+        self.date_to_var = tk.StringVar()
+        self.time_from_var = tk.StringVar()
+        self.time_to_var = tk.StringVar()
+        
+        categories = [''] + [row.category for row in self.db.queries.all(PRODUCT_CATEGORIES)]
+        
+        fields = [
+            ("Название:", ttk.Entry(form, textvariable=self.name_var, width=30)),
+            ("Тип:", ttk.Combobox(form, textvariable=self.type_var, values=list(RULE_TYPES.values()),
+                                  state="readonly", width=18)),
+            ("Категория:", ttk.Combobox(form, textvariable=self.category_var, values=categories, width=18)),
+            ("Штрихкод товара:", ttk.Entry(form, textvariable=self.barcode_var, width=20)),
+            ("Скидка, %:", ttk.Entry(form, textvariable=self.percent_var, width=8)),
+            ("N (берёт):", ttk.Entry(form, textvariable=self.buy_var, width=8)),
+            ("M (платит):", ttk.Entry(form, textvariable=self.pay_var, width=8)),
+            ("Дата с (ГГГГ-ММ-ДД):", ttk.Entry(form, textvariable=self.date_from_var, width=12)),
+            ("Дата по:", ttk.Entry(form, textvariable=self.date_to_var, width=12)),
+            ("Время с (ЧЧ:ММ):", ttk.Entry(form, textvariable=self.time_from_var, width=8)),
+            ("Время по:", ttk.Entry(form, textvariable=self.time_to_var, width=8)),
+        ]
+        for index, (label, widget) in enumerate(fields):
+            row, column = divmod(index, 4)
+            ttk.Label(form, text=label).grid(row=row, column=column * 2, sticky=tk.W, padx=5, pady=3)
+            widget.grid(row=row, column=column * 2 + 1, sticky=tk.W, padx=5, pady=3)
+            
+        days_frame = ttk.Frame(form)
+        days_frame.grid(row=3, column=0, columnspan=8, sticky=tk.W, pady=5)
+        ttk.Label(days_frame, text="Дни недели:").pack(side=tk.LEFT, padx=5)
+        self.weekday_vars = []
+        for title in WEEKDAY_TITLES:
+            var = tk.BooleanVar(value=True)
+            ttk.Checkbutton(days_frame, text=title, variable=var).pack(side=tk.LEFT)
+            self.weekday_vars.append(var)
+            
+        ttk.Button(form, text="➕ Добавить правило",
+                  command=self.add_rule).grid(row=4, column=0, columnspan=2, sticky=tk.W, padx=5, pady=5)
+        ttk.Label(form, text="Без категории и товара правило действует на весь ассортимент",
+                 foreground='gray').grid(row=4, column=2, columnspan=6, sticky=tk.W)
+                 
+    def create_bonus_settings(self):
+        """Настройки списания бонусных баллов"""
+        bonus = ttk.LabelFrame(self.window, text="Бонусные баллы", padding="10")
+        bonus.pack(fill=tk.X, padx=10, pady=(0, 10))
+        
+        point_value = int(self.db.get_setting('bonus_point_value') or BONUS_POINT_VALUE)
+        self.point_value_var = tk.StringVar(value=format_amount(point_value))
+        self.bonus_max_var = tk.StringVar(value=self.db.get_setting('bonus_max_percent') or str(BONUS_MAX_PERCENT))
+        self.accrual_var = tk.StringVar(value=self.db.get_setting('bonus_accrual_percent') or '0')
+        self.expiry_days_var = tk.StringVar(value=self.db.get_setting('bonus_expiry_days') or '0')
+        
+        ttk.Label(bonus, text="Стоимость балла, ₽:").grid(row=0, column=0, padx=5, pady=2, sticky=tk.W)
+        ttk.Entry(bonus, textvariable=self.point_value_var, width=8).grid(row=0, column=1, sticky=tk.W)
+        ttk.Label(bonus, text="Оплата баллами до, % чека:").grid(row=0, column=2, padx=(15, 5), sticky=tk.W)
+        ttk.Entry(bonus, textvariable=self.bonus_max_var, width=8).grid(row=0, column=3, sticky=tk.W)
+        ttk.Label(bonus, text="Начисление, % оплаты:").grid(row=1, column=0, padx=5, pady=2, sticky=tk.W)
+        ttk.Entry(bonus, textvariable=self.accrual_var, width=8).grid(row=1, column=1, sticky=tk.W)
+        ttk.Label(bonus, text="Срок действия, дней (0 - бессрочно):").grid(row=1, column=2, padx=(15, 5),
+                                                                          sticky=tk.W)
+        ttk.Entry(bonus, textvariable=self.expiry_days_var, width=8).grid(row=1, column=3, sticky=tk.W)
+        ttk.Button(bonus, text="Сохранить", command=self.save_bonus_settings).grid(row=0, column=4, rowspan=2,
+                                                                                  padx=15)
+        
+    def load_rules(self):
+        """Загрузка правил"""
+        for item in self.rules_tree.get_children():
+            self.rules_tree.delete(item)
+            
+        for rule in self.db.queries.all(DISCOUNT_RULES_ALL):
+            if rule.rule_type == 'n_for_m':
+                condition = f"{rule.buy_quantity} по цене {rule.pay_quantity}"
+            else:
+                condition = f"{rule.percent:g}%"
+            target = rule.product_name or (f"Категория: {rule.category}" if rule.category else "Все товары")
+            period = f"{rule.date_from or '…'} – {rule.date_to or '…'}" if rule.date_from or rule.date_to else "-"
+            hours = f"{rule.time_from}–{rule.time_to}" if rule.time_from and rule.time_to else "-"
+            days = ' '.join(WEEKDAY_TITLES[int(day) - 1] for day in rule.weekdays) if rule.weekdays else "Все"
+            
+            self.rules_tree.insert('', 'end', iid=str(rule.id), values=(
+                rule.name,
+                RULE_TYPES.get(rule.rule_type, rule.rule_type),
+                target,
+                condition,
+                period,
+                hours,
+                days,
+                "Действует" if rule.is_active else "Выключено"
+            ))
+            
+    def parse_rule(self):
+        """Проверка формы; возвращает параметры DISCOUNT_RULE_INSERT"""
+        name = self.name_var.get().strip()
+        if not name:
+            raise ValueError("Укажите название правила")
+        rule_type = next(key for key, title in RULE_TYPES.items() if title == self.type_var.get())
+        
+        product_id = None
+        barcode = self.barcode_var.get().strip()
+        if barcode:
+            product = self.db.get_product_by_barcode(barcode)
+            if not product:
+                raise ValueError(f"Товар со штрихкодом '{barcode}' не найден")
+            product_id = product['id']
+        category = None if product_id else (self.category_var.get().strip() or None)
+        
+        percent, buy_quantity, pay_quantity = 0, None, None
+        if rule_type == 'percent':
+            percent = float(self.percent_var.get().replace(',', '.'))
+            if not 0 < percent <= 100:
+                raise ValueError("Скидка должна быть от 0 до 100%")
+        else:
+            buy_quantity, pay_quantity = int(self.buy_var.get()), int(self.pay_var.get())
+            if not 0 < pay_quantity < buy_quantity:
+                raise ValueError("Для акции N по цене M нужно 0 < M < N")
+                
+        dates = []
+        for var in (self.date_from_var, self.date_to_var):
+            value = var.get().strip() or None
+            if value:
+                try:
+                    datetime.strptime(value, '%Y-%m-%d')
+                except ValueError:
+                    raise ValueError(f"Неверная дата: {value} (нужно ГГГГ-ММ-ДД)")
+            dates.append(value)
+            
+        times = []
+        for var in (self.time_from_var, self.time_to_var):
+            value = var.get().strip() or None
+            if value:
+                try:
+                    value = datetime.strptime(value, '%H:%M').strftime('%H:%M')
+                except ValueError:
+                    raise ValueError(f"Неверное время: {value} (нужно ЧЧ:ММ)")
+            times.append(value)
+        if bool(times[0]) != bool(times[1]):
+            raise ValueError("Укажите начало и конец временного окна")
+            
+        days = ''.join(str(day) for day, var in enumerate(self.weekday_vars, start=1) if var.get())
+        if not days:
+            raise ValueError("Выберите хотя бы один день недели")
+        weekdays = None if len(days) == len(WEEKDAY_TITLES) else days
+        
+        return (name, rule_type, product_id, category, percent, buy_quantity, pay_quantity,
+                *dates, *times, weekdays)
+                
+    def add_rule(self):
+        """Добавление правила"""
+        try:
+            params = self.parse_rule()
+        except ValueError as e:
+            messagebox.showerror("Ошибка", str(e), parent=self.window)
+            return
+            
+        try:
+            self.db.queries.execute(DISCOUNT_RULE_INSERT, params)
+            self.db.commit()
+        except Exception as e:
+            self.db.rollback()
+            messagebox.showerror("Ошибка", f"Ошибка сохранения правила: {str(e)}", parent=self.window)
+            return
+            
+        self.name_var.set("")
+        self.load_rules()
+        self.changed()
+        
+    def selected_rule_id(self):
+        """ID выбранного правила"""
+        selection = self.rules_tree.selection()
+        if not selection:
+            messagebox.showwarning("Внимание", "Выберите правило", parent=self.window)
+            return None
+        return int(selection[0])
+        
+    def toggle_rule(self):
+        """Включение или выключение правила"""
+        rule_id = self.selected_rule_id()
+        if rule_id is None:
+            return
+        is_active = self.rules_tree.item(str(rule_id))['values'][-1] != "Действует"
+        self.db.queries.execute(DISCOUNT_RULE_SET_ACTIVE, (1 if is_active else 0, rule_id))
+        self.db.commit()
+        self.load_rules()
+        self.changed()
+        
+    def delete_rule(self):
+        """Удаление правила"""
+        rule_id = self.selected_rule_id()
+        if rule_id is None:
+            return
+        if messagebox.askyesno("Подтверждение", "Удалить правило?", parent=self.window):
+            self.db.queries.execute(DISCOUNT_RULE_DELETE, (rule_id,))
+            self.db.commit()
+            self.load_rules()
+            self.changed()
+            
+    def save_bonus_settings(self):
+        """Сохранение настроек баллов"""
+        try:
+            point_value = to_kopecks(self.point_value_var.get())
+            max_percent = float(self.bonus_max_var.get().replace(',', '.'))
+            accrual_percent = float(self.accrual_var.get().replace(',', '.'))
+            expiry_days = int(self.expiry_days_var.get())
+            if point_value <= 0 or expiry_days < 0:
+                raise ValueError()
+            if not 0 <= max_percent <= 100 or not 0 <= accrual_percent <= 100:
+                raise ValueError()
+        except ValueError:
+            messagebox.showerror("Ошибка", "Неверные настройки баллов", parent=self.window)
+            return
+            
+        self.db.set_setting('bonus_point_value', str(point_value))
+        self.db.set_setting('bonus_max_percent', f"{max_percent:g}")
+        self.db.set_setting('bonus_accrual_percent', f"{accrual_percent:g}")
+        self.db.set_setting('bonus_expiry_days', str(expiry_days))
+        self.changed()
+        messagebox.showinfo("Бонусы", "Настройки сохранены", parent=self.window)
+        
+    def changed(self):
+        """Перезагрузка правил в кассе"""
+        if self.on_change:
+            self.on_change()
@@ -2,9 +2,7 @@
 Модуль интеграций с внешними сервисами
 """
 
-import requests
 import json
-import serial
 import time
 from datetime import datetime
 
@@ -23,6 +21,8 @@ class MoySkladAPI:
     def test_connection(self):
         """Тест соединения с МойСклад"""
         try:
+            import requests
+            
             response = requests.get(
                 f"{self.base_url}/entity/organization",
                 headers=self.headers,
@@ -36,6 +36,8 @@ class MoySkladAPI:
     def get_products(self, limit=100):
         """Получение товаров из МойСклад"""
         try:
+            import requests
+            
             response = requests.get(
                 f"{self.base_url}/entity/product",
                 headers=self.headers,
@@ -57,6 +59,8 @@ class MoySkladAPI:
     def sync_product_to_moysklad(self, product_data):
         """Синхронизация товара в МойСклад"""
         try:
+            import requests
+            
             payload = {
                 "name": product_data["name"],
                 "description": product_data.get("description", ""),
@@ -99,6 +103,7 @@ class YooKassaPayments:
     def test_connection(self):
         """Тест соединения с YooKassa"""
         try:
+            import requests
             import uuid
             idempotence_key = str(uuid.uuid4())
             
@@ -137,6 +142,7 @@ class YooKassaPayments:
     def create_payment(self, amount, description, return_url):
         """Создание платежа в YooKassa"""
         try:
+            import requests
             import uuid
             idempotence_key = str(uuid.uuid4())
             
@@ -189,6 +195,8 @@ class FiscalPrinter:
     def connect(self):
         """Подключение к принтеру"""
         try:
+            import serial
+            
             self.connection = serial.Serial(
                 port=self.port,
                 baudrate=self.speed,
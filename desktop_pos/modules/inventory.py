@@ -0,0 +1,469 @@
+"""
+Модуль складских документов: приход товаров и инвентаризация
+"""
+
+import tkinter as tk
+from tkinter import ttk, messagebox, simpledialog
+from queries import PRODUCT_BY_ID, PRODUCTS_ACTIVE, STOCK_DOCUMENT_BY_ID
+
+
+DOCUMENT_TITLES = {
+    'receiving': 'Приход товаров',
+    'stocktake': 'Инвентаризация'
+}
+
+STATUS_TITLES = {
+    'draft': 'Черновик',
+    'posted': 'Проведён'
+}
+
+
+class StockDocumentsWindow:
+    """Журнал документов прихода или инвентаризации"""
+    
+    def __init__(self, parent, db, doc_type, user_id=None):
+        self.db = db
+        self.doc_type = doc_type
+        self.user_id = user_id
+        
+        self.window = tk.Toplevel(parent)
+        self.window.title(DOCUMENT_TITLES[doc_type])
+        self.window.geometry("800x450")
+        self.window.transient(parent)
+        
+        self.create_interface()
+        self.load_documents()
+        
+    def create_interface(self):
+        """Создание интерфейса журнала"""
+        toolbar = ttk.Frame(self.window)
+        toolbar.pack(fill=tk.X, padx=10, pady=10)
+        
+        ttk.Button(toolbar, text="➕ Новый документ", command=self.new_document).pack(side=tk.LEFT, padx=2)
+        ttk.Button(toolbar, text="📄 Открыть", command=self.open_document).pack(side=tk.LEFT, padx=2)
+        if self.doc_type == 'stocktake':
+            ttk.Button(toolbar, text="📊 Расхождения", command=self.show_variance).pack(side=tk.LEFT, padx=2)
+        ttk.Button(toolbar, text="🔄 Обновить", command=self.load_documents).pack(side=tk.LEFT, padx=2)
+        
+        table_frame = ttk.Frame(self.window)
+        table_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=(0, 10))
+        
+        columns = ('Номер', 'Дата', 'Статус', 'Поставщик', 'Строк', 'Количество', 'Сумма')
+        self.documents_tree = ttk.Treeview(table_frame, columns=columns, show='headings')
+        
+        for col in columns:
+            self.documents_tree.heading(col, text=col)
+            self.documents_tree.column(col, width=100)
+            
+        scrollbar = ttk.Scrollbar(table_frame, orient=tk.VERTICAL, command=self.documents_tree.yview)
+        self.documents_tree.configure(yscrollcommand=scrollbar.set)
+        
+        self.documents_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        
+        self.documents_tree.bind('<Double-1>', lambda e: self.open_document())
+        
+    def load_documents(self):
+        """Загрузка документов"""
+        for item in self.documents_tree.get_children():
+            self.documents_tree.delete(item)
+            
+        for document in self.db.get_stock_documents(self.doc_type):
+            self.documents_tree.insert('', 'end', iid=str(document['id']), values=(
+                document['number'],
+                document['created_at'],
+                STATUS_TITLES.get(document['status'], document['status']),
+                document['supplier'] or '',
+                document['lines_count'],
+                f"{document['total_quantity']:.3f}",
+                f"{document['total_amount']:.2f} ₽"
+            ))
+            
+    def selected_document_id(self):
+        """ID выбранного документа"""
+        selection = self.documents_tree.selection()
+        if not selection:
+            messagebox.showwarning("Внимание", "Выберите документ")
+            return None
+        return int(selection[0])
+        
+    def new_document(self):
+        """Создание документа"""
+        supplier = None
+        if self.doc_type == 'receiving':
+            supplier = simpledialog.askstring("Приход товаров", "Поставщик:", parent=self.window)
+            if supplier is None:
+                return
+                
+        document_id = self.db.create_stock_document(self.doc_type, self.user_id, supplier=supplier or None)
+        StockDocumentDialog(self.window, self.db, document_id, self.user_id)
+        self.load_documents()
+        
+    def open_document(self):
+        """Открытие документа"""
+        document_id = self.selected_document_id()
+        if document_id:
+            StockDocumentDialog(self.window, self.db, document_id, self.user_id)
+            self.load_documents()
+            
+    def show_variance(self):
+        """Отчёт о расхождениях выбранной инвентаризации"""
+        document_id = self.selected_document_id()
+        if document_id:
+            VarianceDialog(self.window, self.db, document_id)
+
+
+class StockDocumentDialog:
+    """Документ прихода или инвентаризации: строки копятся в памяти и сохраняются пакетом"""
+    
+    def __init__(self, parent, db, document_id, user_id=None):
+        self.db = db
+        self.document_id = document_id
+        self.user_id = user_id
+        self.document = db.queries.one(STOCK_DOCUMENT_BY_ID, (document_id,))
+        self.doc_type = self.document['doc_type']
+        self.read_only = self.document['status'] == 'posted'
+        
+        # Строки документа: product_id -> [количество, цена]
+        self.lines = {}
+        self.products = {}
+        self.barcodes = {}
+        self.modified = False
+        
+        self.dialog = tk.Toplevel(parent)
+        self.dialog.title(f"{DOCUMENT_TITLES[self.doc_type]} {self.document['number']}")
+        self.dialog.geometry("800x550")
+        self.dialog.transient(parent)
+        self.dialog.grab_set()
+        self.dialog.protocol("WM_DELETE_WINDOW", self.close)
+        
+        self.load_products()
+        self.create_interface()
+        self.load_lines()
+        
+        self.dialog.wait_window()
+        
+    def load_products(self):
+        """Справочник товаров для сканирования без обращений к базе"""
+        for product in self.db.queries.all(PRODUCTS_ACTIVE):
+            self.products[product['id']] = product
+            if product['barcode']:
+                self.barcodes[product['barcode']] = product['id']
+                
+    def create_interface(self):
+        """Создание интерфейса документа"""
+        header = ttk.Frame(self.dialog)
+        header.pack(fill=tk.X, padx=10, pady=10)
+        
+        status = STATUS_TITLES.get(self.document['status'], self.document['status'])
+        info = f"№ {self.document['number']} от {self.document['created_at']} — {status}"
+        if self.document['supplier']:
+            info += f"\nПоставщик: {self.document['supplier']}"
+        ttk.Label(header, text=info).pack(anchor=tk.W)
+        
+        if not self.read_only:
+            scan_frame = ttk.Frame(self.dialog)
+            scan_frame.pack(fill=tk.X, padx=10)
+            
+            ttk.Label(scan_frame, text="Штрихкод/Название:").pack(side=tk.LEFT)
+            self.scan_var = tk.StringVar()
+            scan_entry = ttk.Entry(scan_frame, textvariable=self.scan_var, font=('Segoe UI', 12), width=25)
+            scan_entry.pack(side=tk.LEFT, padx=5)
+            scan_entry.bind('<Return>', self.on_scan)
+            scan_entry.focus()
+            
+            ttk.Label(scan_frame, text="Кол-во:").pack(side=tk.LEFT, padx=(10, 0))
+            self.step_var = tk.DoubleVar(value=1.0)
+            ttk.Entry(scan_frame, textvariable=self.step_var, width=8).pack(side=tk.LEFT, padx=5)
+            
+        table_frame = ttk.Frame(self.dialog)
+        table_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        
+        if self.doc_type == 'receiving':
+            columns = ('Штрихкод', 'Название', 'Количество', 'Цена закупки', 'Сумма')
+        else:
+            columns = ('Штрихкод', 'Название', 'Учёт', 'Факт', 'Разница')
+        self.lines_tree = ttk.Treeview(table_frame, columns=columns, show='headings')
+        
+        for col in columns:
+            self.lines_tree.heading(col, text=col)
+            self.lines_tree.column(col, width=100)
+        self.lines_tree.column('Название', width=250)
+        
+        scrollbar = ttk.Scrollbar(table_frame, orient=tk.VERTICAL, command=self.lines_tree.yview)
+        self.lines_tree.configure(yscrollcommand=scrollbar.set)
+        
+        self.lines_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        
+        self.totals_var = tk.StringVar()
+        ttk.Label(self.dialog, textvariable=self.totals_var,
+                  font=('Segoe UI', 10, 'bold')).pack(anchor=tk.E, padx=10)
+                  
+        btn_frame = ttk.Frame(self.dialog)
+        btn_frame.pack(fill=tk.X, padx=10, pady=10)
+        
+        if not self.read_only:
+            ttk.Button(btn_frame, text="Изменить количество", command=self.change_quantity).pack(side=tk.LEFT, padx=2)
+            if self.doc_type == 'receiving':
+                ttk.Button(btn_frame, text="Изменить цену", command=self.change_price).pack(side=tk.LEFT, padx=2)
+            ttk.Button(btn_frame, text="Удалить строку", command=self.remove_line).pack(side=tk.LEFT, padx=2)
+            
+            ttk.Button(btn_frame, text="Провести", command=self.post).pack(side=tk.RIGHT, padx=2)
+            ttk.Button(btn_frame, text="Сохранить", command=self.save).pack(side=tk.RIGHT, padx=2)
+            
+        if self.doc_type == 'stocktake':
+            ttk.Button(btn_frame, text="Расхождения", command=self.show_variance).pack(side=tk.RIGHT, padx=2)
+            
+        self.lines_tree.bind('<Double-1>', lambda e: None if self.read_only else self.change_quantity())
+        
+    def load_lines(self):
+        """Загрузка сохранённых строк документа"""
+        for line in self.db.get_document_lines(self.document_id):
+            self.lines[line['product_id']] = [line['quantity'], line['price']]
+            if line['product_id'] not in self.products:
+                self.products[line['product_id']] = self.db.queries.one(PRODUCT_BY_ID, (line['product_id'],))
+            # В проведённой инвентаризации показываем зафиксированный учётный остаток
+            if self.read_only and line['expected_quantity'] is not None:
+                self.products[line['product_id']] = self.products[line['product_id']]._replace(
+                    quantity=line['expected_quantity'])
+                
+        for product_id in self.lines:
+            self.refresh_line(product_id)
+        self.update_totals()
+        
+    def find_product(self, term):
+        """Поиск товара: сначала по штрихкоду в памяти, затем по названию в базе"""
+        product_id = self.barcodes.get(term)
+        if product_id:
+            return product_id
+            
+        product = self.db.get_product_by_barcode(term)
+        if not product:
+            matches = self.db.search_products(term)
+            if len(matches) != 1:
+                return None
+            product = matches[0]
+            
+        self.products[product['id']] = product
+        if product['barcode']:
+            self.barcodes[product['barcode']] = product['id']
+        return product['id']
+        
+    def on_scan(self, event=None):
+        """Сканирование: добавление количества к строке без записи в базу"""
+        term = self.scan_var.get().strip()
+        if not term:
+            return
+            
+        try:
+            step = float(self.step_var.get())
+        except (tk.TclError, ValueError):
+            step = 1.0
+            
+        product_id = self.find_product(term)
+        if not product_id:
+            messagebox.showwarning("Товар не найден", f"Товар '{term}' не найден", parent=self.dialog)
+            return
+            
+        if product_id in self.lines:
+            self.lines[product_id][0] += step
+        else:
+            product = self.products[product_id]
+            price = product['cost_price'] if self.doc_type == 'receiving' else None
+            self.lines[product_id] = [step, price]
+            
+        self.modified = True
+        self.refresh_line(product_id)
+        self.update_totals()
+        self.lines_tree.selection_set(str(product_id))
+        self.lines_tree.see(str(product_id))
+        self.scan_var.set("")
+        
+    def refresh_line(self, product_id):
+        """Обновление одной строки таблицы"""
+        product = self.products[product_id]
+        quantity, price = self.lines[product_id]
+        
+        if self.doc_type == 'receiving':
+            values = (
+                product['barcode'] or '',
+                product['name'],
+                f"{quantity:.3f} {product['unit']}",
+                f"{price:.2f} ₽" if price is not None else '',
+                f"{quantity * price:.2f} ₽" if price is not None else ''
+            )
+        else:
+            values = (
+                product['barcode'] or '',
+                product['name'],
+                f"{product['quantity']:.3f}",
+                f"{quantity:.3f}",
+                f"{quantity - product['quantity']:+.3f}"
+            )
+            
+        iid = str(product_id)
+        if self.lines_tree.exists(iid):
+            self.lines_tree.item(iid, values=values)
+        else:
+            self.lines_tree.insert('', 'end', iid=iid, values=values)
+            
+    def update_totals(self):
+        """Итоги документа"""
+        total_quantity = sum(quantity for quantity, _ in self.lines.values())
+        text = f"Строк: {len(self.lines)}   Количество: {total_quantity:.3f}"
+        if self.doc_type == 'receiving':
+            total_amount = sum(quantity * (price or 0) for quantity, price in self.lines.values())
+            text += f"   Сумма: {total_amount:.2f} ₽"
+        self.totals_var.set(text)
+        
+    def selected_product_id(self):
+        """ID товара выбранной строки"""
+        selection = self.lines_tree.selection()
+        if not selection:
+            messagebox.showwarning("Внимание", "Выберите строку", parent=self.dialog)
+            return None
+        return int(selection[0])
+        
+    def change_quantity(self):
+        """Изменение количества строки"""
+        product_id = self.selected_product_id()
+        if not product_id:
+            return
+            
+        quantity = simpledialog.askfloat("Количество", self.products[product_id]['name'],
+                                         initialvalue=self.lines[product_id][0],
+                                         minvalue=0, parent=self.dialog)
+        if quantity is not None:
+            self.lines[product_id][0] = quantity
+            self.modified = True
+            self.refresh_line(product_id)
+            self.update_totals()
+            
+    def change_price(self):
+        """Изменение цены закупки строки"""
+        product_id = self.selected_product_id()
+        if not product_id:
+            return
+            
+        price = simpledialog.askfloat("Цена закупки", self.products[product_id]['name'],
+                                      initialvalue=self.lines[product_id][1] or 0,
+                                      minvalue=0, parent=self.dialog)
+        if price is not None:
+            self.lines[product_id][1] = price
+            self.modified = True
+            self.refresh_line(product_id)
+            self.update_totals()
+            
+    def remove_line(self):
+        """Удаление строки"""
+        product_id = self.selected_product_id()
+        if product_id:
+            del self.lines[product_id]
+            self.lines_tree.delete(str(product_id))
+            self.modified = True
+            self.update_totals()
+            
+    def save(self):
+        """Сохранение черновика одним пакетом"""
+        try:
+            self.db.save_stock_document(self.document_id, self.lines)
+            self.modified = False
+        except Exception as e:
+            self.db.rollback()
+            messagebox.showerror("Ошибка", f"Ошибка сохранения документа: {str(e)}", parent=self.dialog)
+            return False
+        return True
+        
+    def post(self):
+        """Проведение документа"""
+        if not self.lines:
+            messagebox.showwarning("Внимание", "Документ не содержит строк", parent=self.dialog)
+            return
+            
+        if self.doc_type == 'receiving':
+            question = f"Оприходовать {len(self.lines)} позиций?"
+        else:
+            question = f"Привести остатки {len(self.lines)} товаров к фактическим?"
+        if not messagebox.askyesno("Проведение", question, parent=self.dialog):
+            return
+            
+        try:
+            self.db.post_stock_document(self.document_id, self.lines, self.user_id)
+        except Exception as e:
+            messagebox.showerror("Ошибка", f"Ошибка проведения документа: {str(e)}", parent=self.dialog)
+            return
+            
+        messagebox.showinfo("Успех", f"Документ {self.document['number']} проведён", parent=self.dialog)
+        self.dialog.destroy()
+        
+    def show_variance(self):
+        """Отчёт о расхождениях (черновик сохраняется перед расчётом)"""
+        if not self.read_only and self.modified and not self.save():
+            return
+        VarianceDialog(self.dialog, self.db, self.document_id)
+        
+    def close(self):
+        """Закрытие документа"""
+        if self.modified:
+            answer = messagebox.askyesnocancel("Документ", "Сохранить изменения?", parent=self.dialog)
+            if answer is None:
+                return
+            if answer and not self.save():
+                return
+        self.dialog.destroy()
+
+
+class VarianceDialog:
+    """Расхождения инвентаризации"""
+    
+    def __init__(self, parent, db, document_id):
+        self.db = db
+        self.document_id = document_id
+        
+        self.dialog = tk.Toplevel(parent)
+        self.dialog.title("Расхождения инвентаризации")
+        self.dialog.geometry("750x450")
+        self.dialog.transient(parent)
+        self.dialog.grab_set()
+        
+        self.create_interface()
+        
+        self.dialog.wait_window()
+        
+    def create_interface(self):
+        """Создание отчёта"""
+        table_frame = ttk.Frame(self.dialog)
+        table_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        
+        columns = ('Штрихкод', 'Название', 'Учёт', 'Факт', 'Разница', 'Сумма')
+        tree = ttk.Treeview(table_frame, columns=columns, show='headings')
+        
+        for col in columns:
+            tree.heading(col, text=col)
+            tree.column(col, width=100)
+        tree.column('Название', width=220)
+        
+        scrollbar = ttk.Scrollbar(table_frame, orient=tk.VERTICAL, command=tree.yview)
+        tree.configure(yscrollcommand=scrollbar.set)
+        
+        tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        
+        for row in self.db.get_stocktake_variance(self.document_id):
+            tree.insert('', 'end', values=(
+                row['barcode'] or '',
+                row['name'],
+                f"{row['expected']:.3f}",
+                f"{row['counted']:.3f}",
+                f"{row['variance']:+.3f} {row['unit']}",
+                f"{row['variance_amount']:+.2f} ₽"
+            ))
+            
+        totals = self.db.get_stocktake_variance_totals(self.document_id)
+        ttk.Label(self.dialog, font=('Segoe UI', 10, 'bold'), text=(
+            f"Излишки: {totals['surplus']:.3f} на {totals['surplus_amount']:.2f} ₽   "
+            f"Недостачи: {totals['shortage']:.3f} на {totals['shortage_amount']:.2f} ₽"
+        )).pack(anchor=tk.W, padx=10)
+        
+        ttk.Button(self.dialog, text="Закрыть", command=self.dialog.destroy).pack(pady=10)
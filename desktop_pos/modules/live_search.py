@@ -0,0 +1,124 @@
+"""
+Поиск по мере ввода: запрос выполняется после паузы в наборе, устаревшие запросы отменяются;
+сканирование штрихкода отделяется от набора человеком по интервалам между нажатиями
+"""
+
+
+# Пауза ввода перед поиском (мс)
+SEARCH_DEBOUNCE_MS = 250
+
+
+class DebouncedSearch:
+    """Отложенный поиск для поля ввода: search(term) -> результаты, on_result(term, результаты)"""
+    
+    def __init__(self, widget, search, on_result, delay=SEARCH_DEBOUNCE_MS):
+        self.widget = widget
+        self.search = search
+        self.on_result = on_result
+        self.delay = delay
+        self.pending = None
+        
+    def schedule(self, term):
+        """Поиск term после паузы; предыдущий ещё не выполненный запрос отменяется"""
+        self.cancel()
+        self.pending = self.widget.after(self.delay, self.run, term)
+        
+    def cancel(self):
+        """Отмена ожидающего запроса"""
+        if self.pending is not None:
+            self.widget.after_cancel(self.pending)
+            self.pending = None
+            
+    def run(self, term):
+        """Выполнение запроса и передача результатов"""
+        self.pending = None
+        self.on_result(term, self.search(term))
+
+
+# Наибольший интервал между символами сканера в режиме клавиатуры (мс): сканер вводит символ
+# за 1-10 мс, человек набирает не быстрее 50-80 мс на символ
+SCANNER_KEY_INTERVAL_MS = 30
+
+# Минимальная длина штрихкода, распознаваемого как сканирование
+SCANNER_MIN_LENGTH = 6
+
+# Пауза после быстрой серии, после которой она завершена без Enter (мс)
+SCANNER_IDLE_MS = 80
+
+
+class ScannerInput:
+    """Разделение ввода поля на сканирование штрихкода и набор человеком по интервалам между нажатиями"""
+    
+    def __init__(self, entry, variable, on_scan, on_typing, on_enter):
+        # on_scan(штрихкод); on_typing(текст) - набор человеком, None во время быстрой серии;
+        # on_enter(текст) - Enter после набора человеком
+        self.entry = entry
+        self.variable = variable
+        self.on_scan = on_scan
+        self.on_typing = on_typing
+        self.on_enter = on_enter
+        # Текущая серия быстрых символов и время последнего нажатия (event.time, мс)
+        self.burst = ''
+        self.last_time = None
+        self.idle = None
+        
+        entry.bind('<KeyPress>', self.on_key, add='+')
+        entry.bind('<Return>', self.on_return)
+        entry.bind('<KP_Enter>', self.on_return)
+        
+    def on_key(self, event):
+        """Нажатие клавиши: продолжение или начало серии"""
+        if event.keysym in ('Return', 'KP_Enter'):
+            return
+        if event.char and event.char.isprintable():
+            fast = self.last_time is not None and 0 <= event.time - self.last_time <= SCANNER_KEY_INTERVAL_MS
+            self.burst = self.burst + event.char if fast else event.char
+            self.last_time = event.time
+        else:
+            # Удаление, вставка и перемещение курсора - правка человеком
+            self.burst = ''
+            self.last_time = None
+        # Текст поля меняется после обработчика - разбор откладывается до его обновления
+        self.entry.after_idle(self.after_edit)
+        
+    def after_edit(self):
+        """Изменение текста: набор передаётся в поиск, быстрая серия ждёт завершения"""
+        self.cancel_idle()
+        if len(self.burst) > 1:
+            self.on_typing(None)
+            self.idle = self.entry.after(SCANNER_IDLE_MS, self.burst_idle)
+        else:
+            self.on_typing(self.variable.get())
+            
+    def burst_idle(self):
+        """Серия закончилась без Enter: сканер без суффикса или быстрый набор человеком"""
+        self.idle = None
+        if len(self.burst) >= SCANNER_MIN_LENGTH:
+            self.finish_scan()
+        else:
+            self.burst = ''
+            self.on_typing(self.variable.get())
+            
+    def on_return(self, event):
+        """Enter: завершение сканирования или ввод человеком"""
+        self.cancel_idle()
+        if len(self.burst) >= SCANNER_MIN_LENGTH:
+            self.finish_scan()
+        else:
+            self.burst = ''
+            self.on_enter(self.variable.get().strip())
+        return 'break'
+        
+    def finish_scan(self):
+        """Передача штрихкода; набранный до сканирования текст остаётся в поле"""
+        barcode, self.burst = self.burst, ''
+        text = self.variable.get()
+        if text.endswith(barcode):
+            self.variable.set(text[:-len(barcode)])
+        self.on_scan(barcode.strip())
+        
+    def cancel_idle(self):
+        """Отмена ожидания конца серии"""
+        if self.idle is not None:
+            self.entry.after_cancel(self.idle)
+            self.idle = None
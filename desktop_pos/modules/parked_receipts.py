@@ -0,0 +1,186 @@
+"""
+Отложенные чеки и журнал текущего чека кассы
+"""
+
+import tkinter as tk
+from tkinter import ttk, messagebox
+import json
+from money import line_total, rub
+from queries import (PRODUCT_NAMES, ACTIVE_RECEIPT, PARKED_RECEIPTS, PARKED_RECEIPT_BY_ID,
+                     PARKED_RECEIPT_INSERT, PARKED_RECEIPT_UPDATE, PARKED_RECEIPT_PARK,
+                     PARKED_RECEIPT_ACTIVATE, PARKED_RECEIPT_DELETE, RECEIPT_RESERVATIONS_DELETE)
+
+
+class ReceiptStore:
+    """Хранение текущего и отложенных чеков кассы в SQLite"""
+    
+    def __init__(self, db):
+        self.db = db
+        
+    @staticmethod
+    def serialize(items):
+        """Компактная запись позиций: [[product_id, quantity, price в копейках], ...]"""
+        return json.dumps([[item['product_id'], item['quantity'], item['price']] for item in items],
+                          separators=(',', ':'))
+                          
+    def deserialize(self, payload):
+        """Восстановление позиций чека с названиями товаров одним запросом"""
+        rows = json.loads(payload)
+        if not rows:
+            return []
+            
+        products = {product.id: product for product in self.db.queries.all(
+            PRODUCT_NAMES, (json.dumps([row[0] for row in rows]),)
+        )}
+        
+        items = []
+        for product_id, quantity, price in rows:
+            product = products.get(product_id)
+            if not product:
+                continue
+            items.append({
+                'product_id': product_id,
+                'name': product['name'],
+                'price': price,
+                'quantity': quantity,
+                'total': line_total(price, quantity),
+                'unit': product['unit']
+            })
+        return items
+        
+    def save_active(self, receipt_id, items, customer_id=None, discount_percent=0, user_id=None):
+        """Журналирование текущего чека и его резервов; возвращает ID записи"""
+        if not items and customer_id is None:
+            if receipt_id is not None:
+                self.discard(receipt_id)
+            return None
+            
+        payload = self.serialize(items)
+        if receipt_id is None:
+            cursor = self.db.queries.execute(PARKED_RECEIPT_INSERT, (
+                self.db.register_id, customer_id, discount_percent, payload, user_id))
+            receipt_id = cursor.lastrowid
+        else:
+            self.db.queries.execute(PARKED_RECEIPT_UPDATE, (
+                customer_id, discount_percent, payload, receipt_id))
+            
+        self.reserve(receipt_id, items)
+        self.db.commit()
+        return receipt_id
+        
+    def reserve(self, receipt_id, items):
+        """Замена резервов чека текущими позициями (без фиксации транзакции)"""
+        quantities = {}
+        for item in items:
+            quantities[item['product_id']] = quantities.get(item['product_id'], 0) + item['quantity']
+            
+        self.db.reserve_stock(receipt_id, quantities)
+        
+    def get_active(self):
+        """Незавершённый текущий чек кассы (после сбоя или перезапуска)"""
+        return self.db.queries.one(ACTIVE_RECEIPT, (self.db.register_id,))
+        
+    def park(self, receipt_id):
+        """Отложить текущий чек (резервы сохраняются)"""
+        self.db.queries.execute(PARKED_RECEIPT_PARK, (receipt_id,))
+        self.db.commit()
+        
+    def activate(self, receipt_id):
+        """Сделать отложенный чек текущим"""
+        self.db.queries.execute(PARKED_RECEIPT_ACTIVATE, (self.db.register_id, receipt_id))
+        self.db.commit()
+        return self.db.queries.one(PARKED_RECEIPT_BY_ID, (receipt_id,))
+        
+    def list_parked(self):
+        """Отложенные чеки кассы в порядке откладывания"""
+        return self.db.queries.all(PARKED_RECEIPTS, (self.db.register_id,))
+        
+    def discard(self, receipt_id):
+        """Удаление чека и снятие его резервов"""
+        self.db.queries.execute(RECEIPT_RESERVATIONS_DELETE, (receipt_id,))
+        self.db.queries.execute(PARKED_RECEIPT_DELETE, (receipt_id,))
+        self.db.commit()
+
+
+class ParkedReceiptsDialog:
+    """Список отложенных чеков"""
+    
+    def __init__(self, parent, store):
+        self.store = store
+        self.selected_receipt_id = None
+        
+        self.dialog = tk.Toplevel(parent)
+        self.dialog.title("Отложенные чеки")
+        self.dialog.geometry("600x350")
+        self.dialog.transient(parent)
+        self.dialog.grab_set()
+        
+        self.create_interface()
+        self.load_receipts()
+        
+        self.dialog.wait_window()
+        
+    def create_interface(self):
+        """Создание интерфейса списка"""
+        table_frame = ttk.Frame(self.dialog)
+        table_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        
+        columns = ('№', 'Отложен', 'Клиент', 'Позиций', 'Сумма')
+        self.receipts_tree = ttk.Treeview(table_frame, columns=columns, show='headings')
+        
+        for col in columns:
+            self.receipts_tree.heading(col, text=col)
+            self.receipts_tree.column(col, width=100)
+            
+        scrollbar = ttk.Scrollbar(table_frame, orient=tk.VERTICAL, command=self.receipts_tree.yview)
+        self.receipts_tree.configure(yscrollcommand=scrollbar.set)
+        
+        self.receipts_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        
+        btn_frame = ttk.Frame(self.dialog)
+        btn_frame.pack(fill=tk.X, padx=10, pady=10)
+        
+        ttk.Button(btn_frame, text="Восстановить", command=self.restore).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(btn_frame, text="Закрыть", command=self.dialog.destroy).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(btn_frame, text="Удалить", command=self.discard).pack(side=tk.LEFT)
+        
+        self.receipts_tree.bind('<Double-1>', lambda e: self.restore())
+        self.dialog.bind('<Return>', lambda e: self.restore())
+        
+    def load_receipts(self):
+        """Загрузка отложенных чеков"""
+        for item in self.receipts_tree.get_children():
+            self.receipts_tree.delete(item)
+            
+        for number, receipt in enumerate(self.store.list_parked(), start=1):
+            rows = json.loads(receipt['payload'])
+            total = sum(line_total(price, quantity) for _, quantity, price in rows)
+            self.receipts_tree.insert('', 'end', iid=str(receipt['id']), values=(
+                number,
+                receipt['updated_at'],
+                receipt['customer_name'] or 'Без клиента',
+                len(rows),
+                rub(total)
+            ))
+            
+    def restore(self):
+        """Выбор чека для восстановления"""
+        selection = self.receipts_tree.selection()
+        if not selection:
+            messagebox.showwarning("Внимание", "Выберите чек")
+            return
+            
+        self.selected_receipt_id = int(selection[0])
+        self.dialog.destroy()
+        
+    def discard(self):
+        """Удаление отложенного чека"""
+        selection = self.receipts_tree.selection()
+        if not selection:
+            messagebox.showwarning("Внимание", "Выберите чек")
+            return
+            
+        if messagebox.askyesno("Подтверждение", "Удалить отложенный чек и снять резерв товаров?"):
+            self.store.discard(int(selection[0]))
+            self.load_receipts()
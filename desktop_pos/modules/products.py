@@ -4,7 +4,9 @@
 
 import tkinter as tk
 from tkinter import ttk, messagebox, simpledialog
-from datetime import datetime
+from datetime import datetime, timedelta
+from queries import PRODUCT_CARD, PRODUCT_DEACTIVATE
+from timestamps import format_seconds
 from .integrations import MoySkladAPI
 
 
@@ -41,6 +43,8 @@ class ProductsModule:
                   command=self.edit_product).pack(side=tk.LEFT, padx=2)
         ttk.Button(btn_frame, text="Удалить", 
                   command=self.delete_product).pack(side=tk.LEFT, padx=2)
+        ttk.Button(btn_frame, text="Движение", 
+                  command=self.show_movements).pack(side=tk.LEFT, padx=2)
         ttk.Button(btn_frame, text="Обновить", 
                   command=self.load_products).pack(side=tk.LEFT, padx=2)
         
@@ -151,7 +155,7 @@ class ProductsModule:
         product_id = item['values'][0]
         
         # Получение полных данных товара
-        product = self.db.fetch_one('SELECT * FROM products WHERE id = ?', (product_id,))
+        product = self.db.queries.one(PRODUCT_CARD, (product_id,))
         
         dialog = ProductDialog(self.frame, self.db, "Редактирование товара", product)
         if dialog.result:
@@ -169,11 +173,101 @@ class ProductsModule:
         
         if messagebox.askyesno("Подтверждение", f"Удалить товар '{product_name}'?"):
             product_id = item['values'][0]
-            self.db.execute_query('UPDATE products SET is_active = 0 WHERE id = ?', (product_id,))
+            self.db.queries.execute(PRODUCT_DEACTIVATE, (product_id,))
             self.db.commit()
             self.load_products()
 
 
+    def show_movements(self):
+        """Журнал движения выбранного товара"""
+        selection = self.products_tree.selection()
+        if not selection:
+            messagebox.showwarning("Внимание", "Выберите товар")
+            return
+            
+        item = self.products_tree.item(selection[0])
+        StockMovementsDialog(self.frame, self.db, item['values'][0], item['values'][2])
+
+
+class StockMovementsDialog:
+    """Движения товара за период с остатком после каждого движения"""
+    
+    MOVEMENT_TYPES = {
+        'opening': 'Начальный остаток',
+        'in': 'Приход',
+        'sale': 'Продажа',
+        'return': 'Возврат',
+        'adjustment': 'Корректировка',
+    }
+    
+    def __init__(self, parent, db, product_id, product_name):
+        self.db = db
+        self.product_id = product_id
+        
+        self.dialog = tk.Toplevel(parent)
+        self.dialog.title(f"Движение товара: {product_name}")
+        self.dialog.geometry("900x500")
+        self.dialog.transient(parent)
+        
+        # Период
+        period_frame = ttk.Frame(self.dialog)
+        period_frame.pack(fill=tk.X, padx=10, pady=10)
+        
+        ttk.Label(period_frame, text="с:").pack(side=tk.LEFT)
+        self.date_from_var = tk.StringVar(value=(datetime.now() - timedelta(days=30)).strftime("%Y-%m-%d"))
+        ttk.Entry(period_frame, textvariable=self.date_from_var, width=12).pack(side=tk.LEFT, padx=2)
+        ttk.Label(period_frame, text="по:").pack(side=tk.LEFT, padx=(10, 0))
+        self.date_to_var = tk.StringVar(value=datetime.now().strftime("%Y-%m-%d"))
+        ttk.Entry(period_frame, textvariable=self.date_to_var, width=12).pack(side=tk.LEFT, padx=2)
+        ttk.Button(period_frame, text="Показать", command=self.load_movements).pack(side=tk.LEFT, padx=10)
+        
+        # Движения
+        columns = ('№', 'Время', 'Операция', 'Количество', 'Остаток', 'Документ', 'Основание', 'Пользователь')
+        self.tree = ttk.Treeview(self.dialog, columns=columns, show='headings')
+        for col in columns:
+            self.tree.heading(col, text=col)
+            self.tree.column(col, width=100)
+        self.tree.column('№', width=50)
+        self.tree.column('Время', width=140)
+        self.tree.column('Основание', width=200)
+        self.tree.pack(fill=tk.BOTH, expand=True, padx=10)
+        
+        self.summary_label = ttk.Label(self.dialog, text="")
+        self.summary_label.pack(anchor=tk.W, padx=10, pady=10)
+        
+        self.load_movements()
+        
+    def load_movements(self):
+        """Загрузка движений за период"""
+        date_from = self.date_from_var.get()
+        date_to = self.date_to_var.get()
+        try:
+            datetime.strptime(date_from, "%Y-%m-%d")
+            datetime.strptime(date_to, "%Y-%m-%d")
+            movements = self.db.get_stock_movements(self.product_id, date_from, date_to)
+        except ValueError:
+            messagebox.showerror("Ошибка", "Неверный формат даты. Используйте ГГГГ-ММ-ДД", parent=self.dialog)
+            return
+            
+        self.tree.delete(*self.tree.get_children())
+        for movement, balance in movements:
+            self.tree.insert('', 'end', values=(
+                movement.seq,
+                format_seconds(movement.created_at),
+                self.MOVEMENT_TYPES.get(movement.movement_type, movement.movement_type),
+                f"{movement.quantity:+.3f}",
+                f"{balance:.3f}",
+                movement.document_number or '',
+                movement.reason or '',
+                movement.user_name or ''
+            ))
+            
+        product = self.db.queries.one(PRODUCT_CARD, (self.product_id,))
+        self.summary_label.config(
+            text=f"Движений: {len(movements)}   Остаток по журналу сейчас: {self.db.get_stock_at(self.product_id):.3f}"
+                 f"   в карточке: {product['quantity']:.3f}")
+
+
 class ProductDialog:
     def __init__(self, parent, db, title, product=None):
         self.db = db
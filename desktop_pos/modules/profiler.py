@@ -0,0 +1,45 @@
+"""
+Замер времени этапов запуска (python main.py --profile)
+"""
+
+import time
+from contextlib import contextmanager
+
+
+class StartupProfiler:
+    """Сбор длительности этапов запуска приложения"""
+    
+    def __init__(self, enabled=False, started=None):
+        self.enabled = enabled
+        self.started = started if started is not None else time.perf_counter()
+        self.phases = []
+        
+    @contextmanager
+    def phase(self, name):
+        """Замер этапа: with profiler.phase('...'):"""
+        phase_started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - phase_started)
+            
+    def record(self, name, seconds):
+        """Запись длительности этапа"""
+        self.phases.append((name, seconds))
+        if self.enabled:
+            print(f"[профиль] {name}: {seconds * 1000:.1f} мс")
+            
+    def elapsed(self):
+        """Время с начала запуска (с)"""
+        return time.perf_counter() - self.started
+        
+    def report(self, title="Окно готово"):
+        """Итог: время от старта процесса до готовности окна"""
+        self.record(title, self.elapsed())
+        
+    def as_dict(self):
+        """Результаты в виде словаря {этап: мс} (повторы этапов суммируются)"""
+        result = {}
+        for name, seconds in self.phases:
+            result[name] = result.get(name, 0) + seconds * 1000
+        return result
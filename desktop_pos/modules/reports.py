@@ -5,9 +5,9 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
 from datetime import datetime, timedelta
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-import matplotlib.dates as mdates
+from money import KOPECKS, rub, average
+from timestamps import format_datetime
+from queries import SALES_JOURNAL, SALES_JOURNAL_ARCHIVE
 
 
 class ReportsModule:
@@ -231,36 +231,20 @@ class ReportsModule:
             self.report_tree.column(col, width=100)
             
         # Получение данных
-        sales_data = self.db.fetch_all('''
-            SELECT s.created_at, s.id, c.name as customer_name, 
-                   s.total_amount, s.discount_amount, s.final_amount, 
-                   s.payment_method, u.name as cashier_name
-            FROM sales s
-            LEFT JOIN customers c ON s.customer_id = c.id
-            JOIN shifts sh ON s.shift_id = sh.id
-            JOIN users u ON sh.cashier_id = u.id
-            WHERE DATE(s.created_at) BETWEEN ? AND ?
-            ORDER BY s.created_at DESC
-        ''', (date_from, date_to))
+        # Годы архива подключаются, только если период заходит в перенесённые даты
+        sales_data = self.db.archive.fetch_period(SALES_JOURNAL, SALES_JOURNAL_ARCHIVE, date_from, date_to)
         
         total_sales = 0
         total_discount = 0
         
         for sale in sales_data:
-            # Форматирование даты
-            try:
-                date_obj = datetime.strptime(sale['created_at'], '%Y-%m-%d %H:%M:%S')
-                formatted_date = date_obj.strftime('%d.%m.%Y %H:%M')
-            except:
-                formatted_date = sale['created_at']
-                
             self.report_tree.insert('', 'end', values=(
-                formatted_date,
+                format_datetime(sale['created_at']),
                 sale['id'],
                 sale['customer_name'] or 'Без клиента',
-                f"{sale['total_amount']:.2f} ₽",
-                f"{sale['discount_amount']:.2f} ₽",
-                f"{sale['final_amount']:.2f} ₽",
+                rub(sale['total_amount']),
+                rub(sale['discount_amount']),
+                rub(sale['final_amount']),
                 sale['payment_method'],
                 sale['cashier_name']
             ))
@@ -269,24 +253,24 @@ class ReportsModule:
             total_discount += sale['discount_amount']
             
         # Обновление метрик
-        self.metrics_labels['total_sales'].config(text=f"{total_sales:.2f} ₽")
+        self.metrics_labels['total_sales'].config(text=rub(total_sales))
         self.metrics_labels['total_transactions'].config(text=str(len(sales_data)))
         
         if len(sales_data) > 0:
-            avg_check = total_sales / len(sales_data)
-            self.metrics_labels['avg_check'].config(text=f"{avg_check:.2f} ₽")
+            avg_check = average(total_sales, len(sales_data))
+            self.metrics_labels['avg_check'].config(text=rub(avg_check))
         else:
-            self.metrics_labels['avg_check'].config(text="0.00 ₽")
+            self.metrics_labels['avg_check'].config(text=rub(0))
             
         # Обновление деталей
         self.details_text.delete(1.0, tk.END)
         self.details_text.insert(tk.END, f"Отчёт по продажам за период с {date_from} по {date_to}\\n\\n")
         self.details_text.insert(tk.END, f"Всего операций: {len(sales_data)}\\n")
-        self.details_text.insert(tk.END, f"Общая сумма: {total_sales:.2f} ₽\\n")
-        self.details_text.insert(tk.END, f"Общая скидка: {total_discount:.2f} ₽\\n")
+        self.details_text.insert(tk.END, f"Общая сумма: {rub(total_sales)}\\n")
+        self.details_text.insert(tk.END, f"Общая скидка: {rub(total_discount)}\\n")
         
         if len(sales_data) > 0:
-            self.details_text.insert(tk.END, f"Средний чек: {avg_check:.2f} ₽\\n")
+            self.details_text.insert(tk.END, f"Средний чек: {rub(avg_check)}\\n")
             
         # Создание графика
         self.create_sales_chart(sales_data)
@@ -303,28 +287,27 @@ class ReportsModule:
             ttk.Label(self.chart_container, text="Нет данных для отображения графика").pack(expand=True)
             return
             
-        # Группировка по дням
+        # Группировка по бизнес-датам смен (местное время, продажи после полуночи - в день смены)
         daily_sales = {}
         for sale in sales_data:
-            try:
-                date_obj = datetime.strptime(sale['created_at'], '%Y-%m-%d %H:%M:%S')
-                date_key = date_obj.strftime('%Y-%m-%d')
-                
-                if date_key not in daily_sales:
-                    daily_sales[date_key] = 0
-                daily_sales[date_key] += sale['final_amount']
-            except:
-                continue
+            date_key = sale['business_date']
+            if date_key:
+                daily_sales[date_key] = daily_sales.get(date_key, 0) + sale['final_amount']
                 
         if not daily_sales:
             ttk.Label(self.chart_container, text="Нет данных для отображения графика").pack(expand=True)
             return
             
+        # matplotlib загружается при первом построении графика (долгий импорт)
+        import matplotlib.pyplot as plt
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+        import matplotlib.dates as mdates
+        
         # Создание графика
         fig, ax = plt.subplots(figsize=(10, 6))
         
         dates = [datetime.strptime(date, '%Y-%m-%d') for date in sorted(daily_sales.keys())]
-        amounts = [daily_sales[date.strftime('%Y-%m-%d')] for date in dates]
+        amounts = [daily_sales[date.strftime('%Y-%m-%d')] / KOPECKS for date in dates]
         
         ax.plot(dates, amounts, marker='o', linewidth=2, markersize=6)
         ax.set_title('Продажи по дням')
@@ -4,19 +4,23 @@
 
 import tkinter as tk
 from tkinter import ttk, messagebox
+from database import QUANTITY_EPSILON, line_refund
+from money import rub
+from timestamps import format_datetime
 
 
 class ReturnDialog:
     """Диалог обработки возврата товара"""
     
-    def __init__(self, parent, db):
+    def __init__(self, parent, db, shift_id):
         self.parent = parent
         self.db = db
+        self.shift_id = shift_id
         self.result = None
         
         self.dialog = tk.Toplevel(parent)
         self.dialog.title("Возврат товара")
-        self.dialog.geometry("600x500")
+        self.dialog.geometry("640x520")
         self.dialog.transient(parent)
         self.dialog.grab_set()
         self.dialog.resizable(False, False)
@@ -39,12 +43,26 @@ class ReturnDialog:
         search_frame.pack(fill=tk.X, pady=(0, 10))
         
         ttk.Label(search_frame, text="Номер чека:").grid(row=0, column=0, sticky=tk.W)
-        self.sale_id_var = tk.StringVar()
-        sale_entry = ttk.Entry(search_frame, textvariable=self.sale_id_var, width=20)
-        sale_entry.grid(row=0, column=1, padx=5)
+        self.receipt_var = tk.StringVar()
+        receipt_entry = ttk.Entry(search_frame, textvariable=self.receipt_var, width=10)
+        receipt_entry.grid(row=0, column=1, padx=5)
+        receipt_entry.bind('<Return>', lambda e: self.search_sale())
+        receipt_entry.focus()
+        
+        # Номер чека сквозной в смене кассы: по умолчанию текущая смена и эта касса
+        ttk.Label(search_frame, text="Смена:").grid(row=0, column=2, sticky=tk.W)
+        self.shift_var = tk.StringVar(value=str(self.shift_id))
+        ttk.Entry(search_frame, textvariable=self.shift_var, width=8).grid(row=0, column=3, padx=5)
+        
+        ttk.Label(search_frame, text="Касса:").grid(row=0, column=4, sticky=tk.W)
+        self.register_var = tk.StringVar(value=self.db.register_id)
+        ttk.Entry(search_frame, textvariable=self.register_var, width=14).grid(row=0, column=5, padx=5)
         
         ttk.Button(search_frame, text="Найти", 
-                  command=self.search_sale).grid(row=0, column=2, padx=5)
+                  command=self.search_sale).grid(row=0, column=6, padx=5)
+        
+        ttk.Label(search_frame, text="#ID - поиск по номеру продажи (чеки без номера в смене)",
+                 foreground='gray', font=('Segoe UI', 9)).grid(row=1, column=0, columnspan=7, sticky=tk.W)
         
         # Информация о чеке
         info_frame = ttk.LabelFrame(main_frame, text="Информация о чеке", padding="5")
@@ -104,77 +122,57 @@ class ReturnDialog:
     def search_sale(self):
         """Поиск чека по номеру"""
         try:
-            sale_id = int(self.sale_id_var.get())
+            text = self.receipt_var.get().strip()
             
-            # Получение данных чека
-            sale = self.db.fetch_one('''
-                SELECT s.*, u.name as cashier_name 
-                FROM sales s
-                LEFT JOIN shifts sh ON s.shift_id = sh.id
-                LEFT JOIN users u ON sh.cashier_id = u.id
-                WHERE s.id = ?
-            ''', (sale_id,))
+            # Шапка и позиции чека с возвращённым количеством одним запросом
+            if text.startswith('#'):
+                lines = self.db.get_sale_for_return(int(text[1:]))
+            else:
+                lines = self.db.get_receipt_for_return(int(text), int(self.shift_var.get()),
+                                                       self.register_var.get().strip())
             
-            if not sale:
+            if not lines:
                 messagebox.showerror("Ошибка", "Чек не найден")
                 return
                 
-            # Получение уже возвращенных товаров по позициям чека
-            returned_items = self.db.fetch_all('''
-                SELECT ri.sale_item_id, SUM(ri.quantity) as returned_quantity
-                FROM returns r
-                JOIN return_items ri ON r.id = ri.return_id
-                WHERE r.sale_id = ?
-                GROUP BY ri.sale_item_id
-            ''', (sale_id,))
-                
-            # Получение позиций чека
-            items = self.db.fetch_all('''
-                SELECT si.*, p.name, p.unit 
-                FROM sale_items si
-                JOIN products p ON si.product_id = p.id
-                WHERE si.sale_id = ?
-            ''', (sale_id,))
-            
             # Заполнение информации о чеке
-            sale_info = (f"Чек №{sale['id']} от {sale['created_at']}\n"
-                        f"Кассир: {sale.get('cashier_name', 'Неизвестно')}\n"
-                        f"Сумма: {sale['final_amount']:.2f} ₽\n"
+            sale = lines[0]
+            if sale['receipt_number'] is not None:
+                self.sale_title = f"№{sale['receipt_number']} (смена {sale['shift_id']}, касса {sale['register_id']})"
+            else:
+                self.sale_title = f"#{sale['sale_id']}"
+            sale_info = (f"Чек {self.sale_title} от {format_datetime(sale['created_at'])}\n"
+                        f"Кассир: {sale['cashier_name'] or 'Неизвестно'}\n"
+                        f"Сумма: {rub(sale['final_amount'])}\n"
                         f"Способ оплаты: {sale['payment_method']}")
             self.sale_info_var.set(sale_info)
             
-            # Создание словаря возвращенных количеств по sale_item_id
-            returned_quantities = {item['sale_item_id']: item['returned_quantity'] for item in returned_items}
-            
             # Заполнение таблицы с учетом возвратов
             for item in self.items_tree.get_children():
                 self.items_tree.delete(item)
                 
-            for item in items:
-                returned_qty = returned_quantities.get(item['id'], 0)
-                available_qty = item['quantity'] - returned_qty
+            for item in lines:
+                available_qty = item['quantity'] - item['returned_quantity']
                 
-                if available_qty > 0:
+                if available_qty > QUANTITY_EPSILON:
                     self.items_tree.insert('', 'end', values=(
                         item['name'],
                         f"{available_qty:.1f}/{item['quantity']:.1f} {item['unit']}",
-                        f"{item['price']:.2f} ₽",
-                        f"{available_qty * item['price']:.2f} ₽"
+                        rub(item['price']),
+                        rub(line_refund(item, available_qty))
                     ), tags=(item['id'],))  # Сохраняем sale_item_id в тегах
                 else:
                     # Показываем полностью возвращенные товары серым цветом
                     item_id = self.items_tree.insert('', 'end', values=(
                         f"{item['name']} (возвращен)",
                         f"0/{item['quantity']:.1f} {item['unit']}",
-                        f"{item['price']:.2f} ₽",
-                        "0.00 ₽"
+                        rub(item['price']),
+                        rub(0)
                     ), tags=(item['id'],))
                     self.items_tree.set(item_id, '#0', 'returned')
                 
             self.current_sale = sale
-            self.current_items = items
-            self.returned_quantities = returned_quantities
-            self.items_dict = {item['id']: item for item in items}  # Словарь для быстрого поиска
+            self.items_dict = {item['id']: item for item in lines}  # Словарь для быстрого поиска
             
         except ValueError:
             messagebox.showerror("Ошибка", "Введите корректный номер чека")
@@ -188,57 +186,19 @@ class ReturnDialog:
             return
             
         if messagebox.askyesno("Подтверждение", 
-                              f"Вернуть весь чек №{self.current_sale['id']} на сумму {self.current_sale['final_amount']:.2f} ₽?"):
+                              f"Вернуть все невозвращённые позиции чека {self.sale_title}?"):
             try:
-                # Создание записи возврата
-                return_id = self.db.execute_query('''
-                    INSERT INTO returns (sale_id, total_amount, reason)
-                    VALUES (?, ?, 'Полный возврат')
-                ''', (self.current_sale['id'], self.current_sale['final_amount']))
-                
-                # Возврат товаров на склад и создание записей
-                for item in self.current_items:
-                    returned_qty = self.returned_quantities.get(item['id'], 0)
-                    remaining_qty = item['quantity'] - returned_qty
-                    
-                    if remaining_qty > 0:
-                        self.db.execute_query('''
-                            UPDATE products 
-                            SET quantity = quantity + ? 
-                            WHERE id = ?
-                        ''', (remaining_qty, item['product_id']))
-                        
-                        # Создание записи движения товара
-                        self.db.execute_query('''
-                            INSERT INTO inventory_movements 
-                            (product_id, movement_type, quantity, reason, document_number)
-                            VALUES (?, 'in', ?, ?, ?)
-                        ''', (item['product_id'], remaining_qty, 
-                             f"Возврат по чеку №{self.current_sale['id']}", 
-                             f"return_{self.current_sale['id']}"))
-                        
-                        # Создание записи позиции возврата
-                        self.db.execute_query('''
-                            INSERT INTO return_items (return_id, sale_item_id, product_id, quantity, price, total_amount)
-                            VALUES (?, ?, ?, ?, ?, ?)
-                        ''', (return_id, item['id'], item['product_id'], remaining_qty, 
-                             item['price'], remaining_qty * item['price']))
-                
-                # Обновление статуса чека
-                self.db.execute_query('''
-                    UPDATE sales SET status = 'returned' WHERE id = ?
-                ''', (self.current_sale['id'],))
-                
-                self.db.commit()
+                # Остаток позиций, склад, счётчики смены и кассовый журнал - одной транзакцией
+                return_id, amount = self.db.create_return(self.shift_id, self.current_sale['sale_id'],
+                                                          reason='Полный возврат')
                 
                 messagebox.showinfo("Успех", 
-                                   f"Возврат чека №{self.current_sale['id']} выполнен\n"
-                                   f"Сумма возврата: {self.current_sale['final_amount']:.2f} ₽")
+                                   f"Возврат чека {self.sale_title} выполнен\n"
+                                   f"Сумма возврата: {rub(amount)}")
                 self.result = True
                 self.dialog.destroy()
                 
             except Exception as e:
-                self.db.rollback()
                 messagebox.showerror("Ошибка", f"Ошибка возврата: {str(e)}")
                 
     def partial_return(self):
@@ -263,62 +223,32 @@ class ReturnDialog:
             return
             
         # Проверка что товар еще можно вернуть
-        returned_qty = self.returned_quantities.get(selected_item['id'], 0)
-        available_qty = selected_item['quantity'] - returned_qty
+        available_qty = selected_item['quantity'] - selected_item['returned_quantity']
         
-        if available_qty <= 0:
+        if available_qty <= QUANTITY_EPSILON:
             messagebox.showwarning("Внимание", "Этот товар уже полностью возвращен")
             return
             
         # Диалог ввода количества для возврата
-        partial_dialog = PartialReturnDialog(self.dialog, selected_item, self.db)
+        partial_dialog = PartialReturnDialog(self.dialog, selected_item, available_qty, self.db)
         if partial_dialog.result:
             return_quantity = partial_dialog.return_quantity
-            return_amount = return_quantity * selected_item['price']
             
             try:
-                # Возврат товара на склад
-                self.db.execute_query('''
-                    UPDATE products 
-                    SET quantity = quantity + ? 
-                    WHERE id = ?
-                ''', (return_quantity, selected_item['product_id']))
-                
-                # Создание записи движения товара
-                self.db.execute_query('''
-                    INSERT INTO inventory_movements 
-                    (product_id, movement_type, quantity, reason, document_number)
-                    VALUES (?, 'in', ?, ?, ?)
-                ''', (selected_item['product_id'], return_quantity, 
-                     f"Частичный возврат по чеку №{self.current_sale['id']}", 
-                     f"partial_return_{self.current_sale['id']}"))
-                
-                # Создание записи возврата
-                return_id = self.db.execute_query('''
-                    INSERT INTO returns (sale_id, total_amount, reason)
-                    VALUES (?, ?, ?)
-                ''', (self.current_sale['id'], return_amount, 
-                     f"Частичный возврат: {selected_item['name']} ({return_quantity} шт)"))
-                
-                # Создание записи позиции возврата
-                self.db.execute_query('''
-                    INSERT INTO return_items (return_id, sale_item_id, product_id, quantity, price, total_amount)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', (return_id, selected_item['id'], selected_item['product_id'], 
-                     return_quantity, selected_item['price'], return_amount))
-                
-                self.db.commit()
+                # Сумма считается с учётом скидки чека; превышение остатка отклоняется в транзакции
+                return_id, amount = self.db.create_return(
+                    self.shift_id, self.current_sale['sale_id'], {sale_item_id: return_quantity},
+                    f"Частичный возврат: {selected_item['name']} ({return_quantity} {selected_item['unit']})")
                 
                 messagebox.showinfo("Успех", 
                                    f"Частичный возврат выполнен\n"
                                    f"Товар: {selected_item['name']}\n"
                                    f"Количество: {return_quantity}\n"
-                                   f"Сумма возврата: {return_amount:.2f} ₽")
+                                   f"Сумма возврата: {rub(amount)}")
                 self.result = True
                 self.dialog.destroy()
                 
             except Exception as e:
-                self.db.rollback()
                 messagebox.showerror("Ошибка", f"Ошибка частичного возврата: {str(e)}")
         
     def cancel(self):
@@ -329,16 +259,17 @@ class ReturnDialog:
 class PartialReturnDialog:
     """Диалог для ввода количества при частичном возврате"""
     
-    def __init__(self, parent, item, db):
+    def __init__(self, parent, item, available, db):
         self.parent = parent
         self.item = item
+        self.available = available
         self.db = db
         self.result = False
         self.return_quantity = 0
         
         self.dialog = tk.Toplevel(parent)
         self.dialog.title("Частичный возврат")
-        self.dialog.geometry("400x250")
+        self.dialog.geometry("400x280")
         self.dialog.transient(parent)
         self.dialog.grab_set()
         self.dialog.resizable(False, False)
@@ -351,6 +282,8 @@ class PartialReturnDialog:
             parent.winfo_rooty() + 100
         ))
         
+        self.dialog.wait_window()
+        
     def create_interface(self):
         """Создание интерфейса частичного возврата"""
         main_frame = ttk.Frame(self.dialog, padding="20")
@@ -362,9 +295,10 @@ class PartialReturnDialog:
         
         ttk.Label(info_frame, text=f"Товар: {self.item['name']}", 
                  font=('Segoe UI', 10, 'bold')).pack(anchor=tk.W)
-        ttk.Label(info_frame, text=f"Цена: {self.item['price']:.2f} ₽").pack(anchor=tk.W)
+        ttk.Label(info_frame, text=f"Цена: {rub(self.item['price'])}").pack(anchor=tk.W)
         ttk.Label(info_frame, text=f"Продано: {self.item['quantity']:.1f} {self.item['unit']}").pack(anchor=tk.W)
-        ttk.Label(info_frame, text=f"Общая сумма: {self.item['total_amount']:.2f} ₽").pack(anchor=tk.W)
+        ttk.Label(info_frame, text=f"Можно вернуть: {self.available:.1f} {self.item['unit']}").pack(anchor=tk.W)
+        ttk.Label(info_frame, text=f"Общая сумма: {rub(self.item['total_amount'])}").pack(anchor=tk.W)
         
         # Ввод количества для возврата
         quantity_frame = ttk.LabelFrame(main_frame, text="Количество для возврата", padding="10")
@@ -372,9 +306,9 @@ class PartialReturnDialog:
         
         ttk.Label(quantity_frame, text="Количество:").grid(row=0, column=0, sticky=tk.W, padx=(0, 10))
         
-        self.quantity_var = tk.DoubleVar(value=self.item['quantity'])
+        self.quantity_var = tk.DoubleVar(value=self.available)
         quantity_spinbox = ttk.Spinbox(quantity_frame, textvariable=self.quantity_var, 
-                                      from_=0.1, to=self.item['quantity'], 
+                                      from_=0.1, to=self.available, 
                                       increment=0.1, width=15)
         quantity_spinbox.grid(row=0, column=1)
         
@@ -409,10 +343,9 @@ class PartialReturnDialog:
         """Обновление суммы возврата"""
         try:
             quantity = self.quantity_var.get()
-            amount = quantity * self.item['price']
-            self.return_amount_var.set(f"{amount:.2f} ₽")
+            self.return_amount_var.set(rub(line_refund(self.item, quantity)))
         except:
-            self.return_amount_var.set("0.00 ₽")
+            self.return_amount_var.set(rub(0))
             
     def confirm(self):
         """Подтверждение частичного возврата"""
@@ -423,8 +356,8 @@ class PartialReturnDialog:
                 messagebox.showerror("Ошибка", "Количество должно быть больше 0")
                 return
                 
-            if quantity > self.item['quantity']:
-                messagebox.showerror("Ошибка", "Количество для возврата не может быть больше проданного")
+            if quantity > self.available + QUANTITY_EPSILON:
+                messagebox.showerror("Ошибка", "Количество для возврата не может быть больше невозвращённого")
                 return
                 
             self.return_quantity = quantity
@@ -6,8 +6,16 @@ import tkinter as tk
 from tkinter import ttk, messagebox
 from datetime import datetime
 import json
+from money import to_kopecks, to_rubles, line_total, rub
+from queries import PRODUCT_BY_ID, CUSTOMER_BY_ID
 from .integrations import FiscalPrinter, YooKassaPayments
 from .return_dialog import ReturnDialog
+from .parked_receipts import ReceiptStore, ParkedReceiptsDialog
+from .discounts import DiscountEngine, ReceiptPricing
+from .live_search import DebouncedSearch, ScannerInput
+
+# Период продления своих резервов и сборки просроченных (мс)
+RESERVATION_SWEEP_INTERVAL = 60000
 
 
 class SalesModule:
@@ -21,7 +29,18 @@ class SalesModule:
         self.current_customer = None
         self.manual_discount_percent = 0.0
         
+        # Правила скидок и итоги чека с пересчётом по изменённым позициям
+        self.discounts = DiscountEngine(db)
+        self.pricing = ReceiptPricing(self.discounts)
+        
+        # Журнал текущего чека и отложенные чеки
+        self.receipts = ReceiptStore(db)
+        self.active_receipt_id = None
+        
         self.create_interface()
+        self.bind_receipt_hotkeys()
+        self.recover_active_receipt()
+        self.frame.after(RESERVATION_SWEEP_INTERVAL, self.sweep_reservations)
         
     def create_interface(self):
         """Создание интерфейса кассы"""
@@ -49,10 +68,13 @@ class SalesModule:
         self.product_search_var = tk.StringVar()
         search_entry = ttk.Entry(search_frame, textvariable=self.product_search_var, font=('Segoe UI', 12))
         search_entry.pack(fill=tk.X, pady=(2, 10))
-        search_entry.bind('<Return>', self.on_barcode_enter)
-        search_entry.bind('<KeyRelease>', self.on_search_change)
         search_entry.focus()
         
+        # Сканер сразу ищет штрихкод, набор человеком - поиск по паузе ввода
+        self.product_search = DebouncedSearch(self.frame, self.db.search_products, self.show_search_results)
+        self.scanner_input = ScannerInput(search_entry, self.product_search_var, on_scan=self.on_barcode_scan,
+                                          on_typing=self.on_search_change, on_enter=self.on_barcode_enter)
+        
         # Кнопки быстрых действий
         quick_frame = ttk.Frame(left_frame)
         quick_frame.pack(fill=tk.X, padx=5, pady=5)
@@ -206,6 +228,18 @@ class SalesModule:
         ttk.Button(discount_frame, text="Применить", 
                   command=self.apply_manual_discount).pack(side=tk.LEFT, padx=5)
         
+        # Списание бонусных баллов клиента
+        bonus_frame = ttk.Frame(totals_frame)
+        bonus_frame.grid(row=4, column=0, columnspan=2, sticky=tk.W+tk.E, padx=5, pady=5)
+        
+        ttk.Label(bonus_frame, text="Списать баллов:").pack(side=tk.LEFT)
+        self.bonus_points_var = tk.IntVar(value=0)
+        ttk.Entry(bonus_frame, textvariable=self.bonus_points_var, width=10).pack(side=tk.LEFT, padx=5)
+        ttk.Button(bonus_frame, text="Списать", 
+                  command=self.apply_bonus_points).pack(side=tk.LEFT, padx=5)
+        self.bonus_available_label = ttk.Label(bonus_frame, text="", foreground='gray')
+        self.bonus_available_label.pack(side=tk.LEFT, padx=5)
+        
         # Кнопки оплаты
         pay_frame = ttk.Frame(totals_frame)
         pay_frame.grid(row=5, column=0, columnspan=2, sticky=tk.W+tk.E, padx=5, pady=5)
@@ -214,40 +248,52 @@ class SalesModule:
                   style='Action.TButton').pack(fill=tk.X, pady=2)
         ttk.Button(pay_frame, text="🔄 ВОЗВРАТ", command=self.process_return,
                   style='Action.TButton').pack(fill=tk.X, pady=2)
-        ttk.Button(pay_frame, text="📋 Отложить чек", command=self.hold_receipt).pack(fill=tk.X, pady=2)
+        ttk.Button(pay_frame, text="📋 Отложить чек (F8)", command=self.hold_receipt).pack(fill=tk.X, pady=2)
+        ttk.Button(pay_frame, text="📂 Отложенные чеки (F7)", command=self.show_parked_receipts).pack(fill=tk.X, pady=2)
         
-    def on_search_change(self, event=None):
-        """Обработчик изменения поиска"""
-        search_term = self.product_search_var.get()
-        
-        if len(search_term) >= 2:
-            self.search_products_live(search_term)
-        elif len(search_term) == 0:
-            self.clear_search_results()
+    def on_search_change(self, search_term):
+        """Набор в поле поиска (None - идёт сканирование, поиск не нужен)"""
+        if search_term is not None and len(search_term) >= 2:
+            self.product_search.schedule(search_term)
+        else:
+            self.product_search.cancel()
+            if not search_term:
+                self.clear_search_results()
+                
+    def on_barcode_scan(self, barcode):
+        """Штрихкод со сканера: сразу в чек без живого поиска"""
+        self.product_search.cancel()
+        product = self.db.get_product_by_barcode(barcode)
+        if product:
+            self.add_product_to_receipt(product)
+        else:
+            messagebox.showwarning("Товар не найден", f"Товар со штрихкодом '{barcode}' не найден")
             
-    def on_barcode_enter(self, event=None):
-        """Обработчик ввода штрихкода"""
-        barcode = self.product_search_var.get().strip()
-        
-        if barcode:
-            # Поиск товара по штрихкоду
-            product = self.db.get_product_by_barcode(barcode)
+    def on_barcode_enter(self, search_term):
+        """Enter после ввода вручную: штрихкод или немедленный поиск по названию"""
+        self.product_search.cancel()
+        if not search_term:
+            return
+            
+        product = self.db.get_product_by_barcode(search_term)
+        if product:
+            self.add_product_to_receipt(product)
+            self.product_search_var.set("")  # Очистка поля
+        elif not self.search_products_live(search_term):
+            messagebox.showwarning("Товар не найден", f"Товар «{search_term}» не найден")
             
-            if product:
-                self.add_product_to_receipt(product)
-                self.product_search_var.set("")  # Очистка поля
-            else:
-                messagebox.showwarning("Товар не найден", f"Товар со штрихкодом '{barcode}' не найден")
-                
     def search_products_live(self, search_term):
-        """Живой поиск товаров"""
+        """Живой поиск товаров без ожидания; возвращает число найденных"""
+        products = self.db.search_products(search_term)
+        self.show_search_results(search_term, products)
+        return len(products)
+        
+    def show_search_results(self, search_term, products):
+        """Вывод результатов поиска товаров"""
         # Очистка результатов
         for item in self.search_tree.get_children():
             self.search_tree.delete(item)
             
-        # Поиск и вывод результатов
-        products = self.db.search_products(search_term)
-        
         for product in products[:10]:  # Ограничиваем 10 результатами
             self.search_tree.insert('', 'end', values=(
                 product['id'],
@@ -271,17 +317,18 @@ class SalesModule:
         product_id = item['values'][0]
         
         # Получение полных данных товара
-        product = self.db.fetch_one('SELECT * FROM products WHERE id = ?', (product_id,))
+        product = self.db.queries.one(PRODUCT_BY_ID, (product_id,))
         
         if product:
             self.add_product_to_receipt(product)
             
     def add_product_to_receipt(self, product, quantity=1):
         """Добавление товара в чек"""
-        # Проверка остатков
-        if product['quantity'] < quantity:
+        # Проверка остатков с учётом резервов других чеков
+        available = self.db.get_available_quantity(product['id'], self.active_receipt_id)
+        if available < quantity:
             messagebox.showwarning("Недостаточно товара", 
-                                 f"На складе только {product['quantity']} {product['unit']}")
+                                 f"Доступно только {available} {product['unit']}")
             return
             
         # Проверка, есть ли уже такой товар в чеке
@@ -289,27 +336,31 @@ class SalesModule:
             if item['product_id'] == product['id']:
                 # Увеличиваем количество
                 new_quantity = item['quantity'] + quantity
-                if product['quantity'] >= new_quantity:
+                if available >= new_quantity:
                     self.current_sale_items[i]['quantity'] = new_quantity
-                    self.current_sale_items[i]['total'] = new_quantity * item['price']
+                    self.current_sale_items[i]['total'] = line_total(item['price'], new_quantity)
+                    self.pricing.update_line(self.current_sale_items[i])
                 else:
                     messagebox.showwarning("Недостаточно товара", 
-                                         f"На складе только {product['quantity']} {product['unit']}")
+                                         f"Доступно только {available} {product['unit']}")
                     return
                 break
         else:
-            # Добавляем новую позицию
+            # Добавляем новую позицию (суммы чека в копейках)
+            price = to_kopecks(product['price'])
             sale_item = {
                 'product_id': product['id'],
                 'name': product['name'],
-                'price': float(product['price']),
+                'price': price,
                 'quantity': quantity,
-                'total': float(product['price']) * quantity,
+                'total': line_total(price, quantity),
                 'unit': product['unit']
             }
             self.current_sale_items.append(sale_item)
+            self.pricing.update_line(sale_item)
             
         self.update_receipt_display()
+        self.journal_receipt()
         
     def update_receipt_display(self):
         """Обновление отображения чека"""
@@ -318,30 +369,25 @@ class SalesModule:
             self.receipt_tree.delete(item)
             
         # Заполнение позициями
-        subtotal = 0
         for i, item in enumerate(self.current_sale_items):
             self.receipt_tree.insert('', 'end', values=(
                 item['name'],
                 f"{item['quantity']:.1f} {item['unit']}",
-                f"{item['price']:.2f} ₽",
-                f"{item['total']:.2f} ₽"
+                rub(item['price']),
+                rub(item['total'])
             ), tags=(i,))
-            subtotal += item['total']
-            
-        # Обновление итогов
-        discount = 0
-        # Скидка клиента
-        if self.current_customer and self.current_customer.get('discount_percent', 0) > 0:
-            discount += subtotal * self.current_customer['discount_percent'] / 100
-        # Ручная скидка
-        if self.manual_discount_percent > 0:
-            discount += subtotal * self.manual_discount_percent / 100
             
-        total = subtotal - discount
+        # Итоги ведутся по позициям в ReceiptPricing (правила, клиент, ручная скидка, баллы)
+        totals = self.pricing.totals()
+        self.subtotal_var.set(rub(totals['subtotal']))
+        self.discount_var.set(rub(totals['discount']))
+        self.total_var.set(rub(totals['total']))
         
-        self.subtotal_var.set(f"{subtotal:.2f} ₽")
-        self.discount_var.set(f"{discount:.2f} ₽")
-        self.total_var.set(f"{total:.2f} ₽")
+        if self.pricing.available_points:
+            self.bonus_available_label.config(
+                text=f"доступно {self.pricing.available_points}, списано {totals['bonus_points']}")
+        else:
+            self.bonus_available_label.config(text="")
         
     def remove_item(self):
         """Удаление позиции из чека"""
@@ -354,8 +400,10 @@ class SalesModule:
         item_index = int(item['tags'][0])
         
         if messagebox.askyesno("Подтверждение", f"Удалить '{item['values'][0]}'?"):
+            self.pricing.remove_line(self.current_sale_items[item_index]['product_id'])
             del self.current_sale_items[item_index]
             self.update_receipt_display()
+            self.journal_receipt()
             
     def change_quantity(self):
         """Изменение количества товара"""
@@ -374,35 +422,59 @@ class SalesModule:
                                                initialvalue=sale_item['quantity'],
                                                minvalue=0.1)
         if new_quantity:
-            # Проверка остатков
-            product = self.db.fetch_one('SELECT * FROM products WHERE id = ?', (sale_item['product_id'],))
-            if product['quantity'] >= new_quantity:
+            # Проверка остатков с учётом резервов других чеков
+            available = self.db.get_available_quantity(sale_item['product_id'], self.active_receipt_id)
+            if available >= new_quantity:
                 sale_item['quantity'] = new_quantity
-                sale_item['total'] = new_quantity * sale_item['price']
+                sale_item['total'] = line_total(sale_item['price'], new_quantity)
+                self.pricing.update_line(sale_item)
                 self.update_receipt_display()
+                self.journal_receipt()
             else:
                 messagebox.showwarning("Недостаточно товара", 
-                                     f"На складе только {product['quantity']} {product['unit']}")
+                                     f"Доступно только {available} {sale_item['unit']}")
                 
     def clear_receipt(self):
         """Очистка чека"""
         if self.current_sale_items and messagebox.askyesno("Подтверждение", "Очистить весь чек?"):
-            self.current_sale_items.clear()
-            self.current_customer = None
-            self.customer_label.config(text="Не выбран", foreground='gray')
-            # Сброс ручной скидки
-            self.manual_discount_percent = 0.0
-            if hasattr(self, 'manual_discount_var'):
-                self.manual_discount_var.set(0.0)
-            self.update_receipt_display()
+            if self.active_receipt_id is not None:
+                self.receipts.discard(self.active_receipt_id)
+            self.reset_receipt()
             
+    def reset_receipt(self):
+        """Сброс текущего чека (журнал уже снят или передан в отложенные)"""
+        self.current_sale_items.clear()
+        self.current_customer = None
+        self.active_receipt_id = None
+        self.customer_label.config(text="Не выбран", foreground='gray')
+        # Сброс ручной скидки и списания баллов
+        self.manual_discount_percent = 0.0
+        if hasattr(self, 'manual_discount_var'):
+            self.manual_discount_var.set(0.0)
+            self.bonus_points_var.set(0)
+        self.pricing.reset()
+        self.pricing.manual_percent = 0
+        self.pricing.set_customer(None)
+        self.update_receipt_display()
+        
     def select_customer(self):
         """Выбор клиента"""
         dialog = CustomerSelectDialog(self.frame, self.db)
         if dialog.selected_customer:
-            self.current_customer = dialog.selected_customer
-            self.customer_label.config(text=dialog.selected_customer['name'], foreground='black')
-            self.update_receipt_display()  # Пересчёт скидки
+            self.set_customer(dict(dialog.selected_customer))
+            self.journal_receipt()
+            
+    def set_customer(self, customer):
+        """Установка клиента чека"""
+        self.current_customer = customer
+        self.pricing.set_customer(customer)
+        if hasattr(self, 'bonus_points_var'):
+            self.bonus_points_var.set(0)
+        if customer:
+            self.customer_label.config(text=customer['name'], foreground='black')
+        else:
+            self.customer_label.config(text="Не выбран", foreground='gray')
+        self.update_receipt_display()  # Пересчёт скидки
             
     def process_payment(self):
         """Обработка оплаты"""
@@ -414,17 +486,16 @@ class SalesModule:
             messagebox.showerror("Ошибка", "Откройте смену для проведения продаж")
             return
             
-        # Подтверждение оплаты
-        total = sum(item['total'] for item in self.current_sale_items)
-        discount = 0
-        if self.current_customer and self.current_customer.get('discount_percent', 0) > 0:
-            discount = total * self.current_customer['discount_percent'] / 100
-            
-        final_amount = total - discount
+        # Итоги с пересчётом правил на момент оплаты (временные акции могли начаться или закончиться)
+        self.pricing.reset(self.current_sale_items)
+        self.update_receipt_display()
+        totals = self.pricing.totals()
+        discount = totals['discount']
+        final_amount = totals['total']
         
         # Обработка онлайн-платежей через YooKassa
         if self.payment_method_var.get() == "Банковская карта" and self.db.get_setting('yookassa_enabled') == '1':
-            if self.process_yookassa_payment(final_amount):
+            if self.process_yookassa_payment(to_rubles(final_amount)):
                 # Платеж через YooKassa успешен, продолжаем
                 pass
             else:
@@ -432,7 +503,7 @@ class SalesModule:
                 return
         
         if messagebox.askyesno("Подтверждение оплаты", 
-                              f"Сумма к оплате: {final_amount:.2f} ₽\n"
+                              f"Сумма к оплате: {rub(final_amount)}\n"
                               f"Способ оплаты: {self.payment_method_var.get()}\n\n"
                               "Подтвердить оплату?"):
             
@@ -444,45 +515,40 @@ class SalesModule:
                 sale_id = self.db.create_sale(
                     shift_id=shift['id'],
                     customer_id=customer_id,
-                    items=self.current_sale_items,
+                    items=self.pricing.sale_items(self.current_sale_items),
                     payment_method=self.payment_method_var.get(),
-                    discount_amount=discount
+                    discount_amount=discount,
+                    receipt_id=self.active_receipt_id,
+                    bonus_points=totals['bonus_points']
                 )
                 
-                # Печать чека (заглушка)
-                self.print_receipt(sale_id, final_amount)
+                # Печать чека (заглушка) с номером в смене кассы
+                receipt = self.db.get_sale_receipt(sale_id)
+                self.print_receipt(sale_id, final_amount, receipt.receipt_number)
                 
-                # Обновление наличности в кассе
-                if self.payment_method_var.get() == "Наличные":
-                    shift['current_amount'] += final_amount
-                    self.main_app.cash_amount_label.config(text=f"{shift['current_amount']:.2f} ₽")
+                # Обновление наличности в кассе по счётчикам смены
+                self.main_app.update_cash_info()
                 
-                # Очистка чека
-                self.current_sale_items.clear()
-                self.current_customer = None
-                self.customer_label.config(text="Не выбран", foreground='gray')
-                # Сброс ручной скидки
-                self.manual_discount_percent = 0.0
-                if hasattr(self, 'manual_discount_var'):
-                    self.manual_discount_var.set(0.0)
-                self.update_receipt_display()
+                # Очистка чека (журнал снят в транзакции продажи)
+                self.reset_receipt()
                 
-                self.main_app.status_label.config(text=f"Продажа #{sale_id} завершена")
-                messagebox.showinfo("Успех", f"Продажа #{sale_id} успешно проведена!")
+                self.main_app.status_label.config(text=f"Чек №{receipt.receipt_number} завершён")
+                messagebox.showinfo("Успех", f"Чек №{receipt.receipt_number} успешно проведён!")
                 
             except Exception as e:
                 messagebox.showerror("Ошибка", f"Ошибка проведения продажи: {str(e)}")
                 
-    def print_receipt(self, sale_id, amount):
-        """Печать чека"""
+    def print_receipt(self, sale_id, amount, receipt_number):
+        """Печать чека (amount - копейки, receipt_number - номер в смене кассы)"""
+        shift_id = self.main_app.current_shift['id']
         # Сначала печатаем в консоль
-        print(f"=== ЧЕК №{sale_id} ===")
+        print(f"=== ЧЕК №{receipt_number} (смена {shift_id}, касса {self.db.register_id}) ===")
         print(f"Время: {datetime.now().strftime('%d.%m.%Y %H:%M:%S')}")
         if self.current_customer:
             print(f"Клиент: {self.current_customer['name']}")
         for item in self.current_sale_items:
-            print(f"{item['name']} - {item['quantity']:.1f} x {item['price']:.2f} = {item['total']:.2f} ₽")
-        print(f"ИТОГО: {amount:.2f} ₽")
+            print(f"{item['name']} - {item['quantity']:.1f} x {rub(item['price'])} = {rub(item['total'])}")
+        print(f"ИТОГО: {rub(amount)}")
         print(f"Способ оплаты: {self.payment_method_var.get()}")
         print("===================")
         
@@ -495,11 +561,15 @@ class SalesModule:
                 
                 printer = FiscalPrinter(fiscal_type, fiscal_port, fiscal_speed)
                 
+                # Фискальный документ получает суммы в рублях
                 receipt_data = {
                     'id': sale_id,
+                    'number': receipt_number,
+                    'shift': shift_id,
                     'date': datetime.now().strftime('%d.%m.%Y %H:%M:%S'),
-                    'items': self.current_sale_items,
-                    'total': amount,
+                    'items': [dict(item, price=to_rubles(item['price']), total=to_rubles(item['total']))
+                              for item in self.current_sale_items],
+                    'total': to_rubles(amount),
                     'payment_method': self.payment_method_var.get(),
                     'customer': self.current_customer['name'] if self.current_customer else None
                 }
@@ -564,30 +634,176 @@ class SalesModule:
             discount = self.manual_discount_var.get()
             if 0 <= discount <= 100:
                 self.manual_discount_percent = discount
+                self.pricing.manual_percent = discount
                 self.update_receipt_display()
+                self.journal_receipt()
                 messagebox.showinfo("Скидка", f"Применена скидка {discount}%")
             else:
                 messagebox.showerror("Ошибка", "Скидка должна быть от 0 до 100%")
         except Exception as e:
             messagebox.showerror("Ошибка", f"Неверное значение скидки: {str(e)}")
             
+    def apply_bonus_points(self):
+        """Списание бонусных баллов клиента в счёт оплаты"""
+        if not self.current_customer:
+            messagebox.showwarning("Внимание", "Выберите клиента для списания баллов")
+            return
+        try:
+            points = self.bonus_points_var.get()
+        except tk.TclError:
+            messagebox.showerror("Ошибка", "Введите целое число баллов")
+            return
+        if points < 0:
+            messagebox.showerror("Ошибка", "Число баллов не может быть отрицательным")
+            return
+            
+        self.pricing.requested_points = points
+        self.update_receipt_display()
+        spent = self.pricing.totals()['bonus_points']
+        if spent < points:
+            self.bonus_points_var.set(spent)
+            messagebox.showinfo("Баллы", f"Списано {spent} баллов: ограничение по остатку "
+                                        f"и доле чека ({self.discounts.bonus_max_percent:g}%)")
+                                        
+    def reload_discounts(self):
+        """Перезагрузка правил скидок и пересчёт текущего чека"""
+        self.discounts.load()
+        self.pricing.reset(self.current_sale_items)
+        self.update_receipt_display()
+        
     def process_return(self):
         """Обработка возврата товара"""
-        dialog = ReturnDialog(self.frame, self.db)
+        if not self.main_app.current_shift:
+            messagebox.showerror("Ошибка", "Откройте смену для проведения возвратов")
+            return
+            
+        dialog = ReturnDialog(self.frame, self.db, self.main_app.current_shift['id'])
         if dialog.result:
             # Обновление отображения после возврата
+            self.main_app.update_cash_info()
             self.main_app.status_label.config(text="Возврат обработан")
             
-    def check_stock_availability(self, product, quantity):
-        """Проверка доступности товара на складе"""
-        if product['quantity'] < quantity:
-            return False, f"Недостаточно товара на складе. Доступно: {product['quantity']}"
-        return True, ""
+    def journal_receipt(self):
+        """Запись состояния текущего чека в журнал (восстановление после сбоя)"""
+        customer_id = self.current_customer['id'] if self.current_customer else None
+        user = self.main_app.current_user
+        try:
+            self.active_receipt_id = self.receipts.save_active(
+                self.active_receipt_id,
+                self.current_sale_items,
+                customer_id=customer_id,
+                discount_percent=self.manual_discount_percent,
+                user_id=user['id'] if user else None
+            )
+        except Exception as e:
+            self.db.rollback()
+            print(f"Ошибка журналирования чека: {e}")
+            
+    def load_receipt(self, receipt):
+        """Загрузка чека из журнала в кассу"""
+        self.current_sale_items = self.receipts.deserialize(receipt['payload'])
+        self.active_receipt_id = receipt['id']
+        
+        customer = None
+        if receipt['customer_id']:
+            customer = self.db.queries.one(CUSTOMER_BY_ID, (receipt['customer_id'],))
+        self.set_customer(dict(customer) if customer else None)
+        
+        self.manual_discount_percent = float(receipt['discount_percent'] or 0)
+        self.manual_discount_var.set(self.manual_discount_percent)
+        self.pricing.manual_percent = self.manual_discount_percent
+        self.pricing.reset(self.current_sale_items)
+        self.update_receipt_display()
         
+    def recover_active_receipt(self):
+        """Восстановление незавершённого чека после сбоя или перезапуска"""
+        receipt = self.receipts.get_active()
+        if receipt:
+            self.load_receipt(receipt)
+            self.check_receipt_stock()
+            self.main_app.status_label.config(text="Восстановлен незавершённый чек")
+            
+    def check_receipt_stock(self):
+        """Новые резервы восстановленного чека и предупреждение о нехватке: его резервы могли истечь"""
+        quantities = {}
+        for item in self.current_sale_items:
+            quantities[item['product_id']] = quantities.get(item['product_id'], 0) + item['quantity']
+            
+        short = []
+        for item in self.current_sale_items:
+            quantity = quantities.pop(item['product_id'], None)
+            if quantity is None:
+                continue
+            available = self.db.get_available_quantity(item['product_id'], self.active_receipt_id)
+            if available < quantity:
+                short.append(f"{item['name']}: в чеке {quantity:g}, доступно {available:g} {item['unit']}")
+                
+        # Резервы чека ставятся заново на полный срок
+        self.journal_receipt()
+        if short:
+            messagebox.showwarning("Недостаточно товара",
+                                   "Остатка не хватает для позиций чека:\n" + "\n".join(short))
+            
+    def sweep_reservations(self):
+        """Продление резервов текущего чека, снятие просроченных резервов и сгорание баллов"""
+        try:
+            if self.active_receipt_id is not None:
+                self.db.touch_reservations(self.active_receipt_id)
+            self.db.sweep_expired_reservations()
+            # Сгорание выполняется раз в сутки: повторные вызовы в тот же день ничего не делают
+            self.db.expire_bonus_points()
+        except Exception as e:
+            self.db.rollback()
+            print(f"Ошибка обслуживания резервов: {e}")
+        self.frame.after(RESERVATION_SWEEP_INTERVAL, self.sweep_reservations)
+        
+    def bind_receipt_hotkeys(self):
+        """Горячие клавиши отложенных чеков"""
+        root = self.main_app.root
+        root.bind('<F8>', lambda e: self.hold_receipt())
+        root.bind('<F7>', lambda e: self.show_parked_receipts())
+        for number in range(1, 10):
+            root.bind(f'<Control-Key-{number}>', lambda e, n=number: self.restore_parked_by_number(n))
+            
     def hold_receipt(self):
         """Отложить чек"""
-        messagebox.showinfo("Отложенный чек", "Функция в разработке")
+        if not self.current_sale_items:
+            messagebox.showwarning("Внимание", "Чек пуст")
+            return
+            
+        self.journal_receipt()
+        self.receipts.park(self.active_receipt_id)
+        self.reset_receipt()
+        self.main_app.status_label.config(text="Чек отложен")
         
+    def restore_parked_receipt(self, receipt_id):
+        """Восстановление отложенного чека; текущий чек откладывается"""
+        if receipt_id == self.active_receipt_id:
+            return
+            
+        if self.current_sale_items:
+            self.journal_receipt()
+            self.receipts.park(self.active_receipt_id)
+        elif self.active_receipt_id is not None:
+            self.receipts.discard(self.active_receipt_id)
+            
+        self.reset_receipt()
+        self.load_receipt(self.receipts.activate(receipt_id))
+        self.check_receipt_stock()
+        self.main_app.status_label.config(text="Отложенный чек восстановлен")
+        
+    def restore_parked_by_number(self, number):
+        """Восстановление N-го отложенного чека (Ctrl+1..9)"""
+        parked = self.receipts.list_parked()
+        if number <= len(parked):
+            self.restore_parked_receipt(parked[number - 1]['id'])
+            
+    def show_parked_receipts(self):
+        """Список отложенных чеков"""
+        dialog = ParkedReceiptsDialog(self.frame, self.receipts)
+        if dialog.selected_receipt_id:
+            self.restore_parked_receipt(dialog.selected_receipt_id)
+            
     def scan_barcode(self):
         """Сканирование штрихкода"""
         messagebox.showinfo("Сканер", "Подключите сканер штрихкодов и сканируйте товар")
@@ -613,6 +829,8 @@ class CustomerSelectDialog:
         self.dialog.transient(parent)
         self.dialog.grab_set()
         
+        self.search = DebouncedSearch(self.dialog, self.db.search_customers, self.show_customers)
+        
         self.create_interface()
         self.load_customers()
         
@@ -658,29 +876,22 @@ class CustomerSelectDialog:
         
     def load_customers(self):
         """Загрузка клиентов"""
-        for item in self.customers_tree.get_children():
-            self.customers_tree.delete(item)
-            
-        customers = self.db.get_all_customers()
-        for customer in customers:
-            self.customers_tree.insert('', 'end', values=(
-                customer['id'],
-                customer['name'],
-                customer['phone'] or '',
-                f"{customer['discount_percent']:.0f}%"
-            ), tags=(customer['id'],))
-            
+        self.show_customers('', self.db.get_all_customers())
+        
     def on_search(self, *args):
-        """Поиск клиентов"""
-        search_term = self.search_var.get()
+        """Поиск клиентов по паузе ввода"""
+        search_term = self.search_var.get().strip()
         
-        for item in self.customers_tree.get_children():
-            self.customers_tree.delete(item)
-            
         if search_term:
-            customers = self.db.search_customers(search_term)
+            self.search.schedule(search_term)
         else:
-            customers = self.db.get_all_customers()
+            self.search.cancel()
+            self.load_customers()
+            
+    def show_customers(self, search_term, customers):
+        """Вывод найденных клиентов"""
+        for item in self.customers_tree.get_children():
+            self.customers_tree.delete(item)
             
         for customer in customers:
             self.customers_tree.insert('', 'end', values=(
@@ -700,7 +911,7 @@ class CustomerSelectDialog:
         item = self.customers_tree.item(selection[0])
         customer_id = item['values'][0]
         
-        self.selected_customer = self.db.fetch_one('SELECT * FROM customers WHERE id = ?', (customer_id,))
+        self.selected_customer = self.db.queries.one(CUSTOMER_BY_ID, (customer_id,))
         self.dialog.destroy()
         
     def no_customer(self):
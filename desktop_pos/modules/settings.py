@@ -6,6 +6,9 @@ import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 import json
 import os
+from database import SLOW_QUERY_MS
+from queries import SETTINGS_ALL
+from timestamps import format_seconds
 from .integrations import MoySkladAPI, YooKassaPayments, FiscalPrinter, BackupManager
 
 
@@ -30,6 +33,7 @@ class SettingsModule:
         self.create_printer_settings()
         self.create_integration_settings()
         self.create_backup_settings()
+        self.create_diagnostics_settings()
         
         # Кнопки управления
         btn_frame = ttk.Frame(self.frame)
@@ -260,6 +264,24 @@ class SettingsModule:
         ttk.Button(backup_btn_frame, text="Восстановить из резервной копии", 
                   command=self.restore_backup).pack(side=tk.LEFT, padx=5)
         
+        # Архив продаж: закрытые годы в отдельных файлах
+        archive_frame = ttk.LabelFrame(backup_frame, text="Архив продаж")
+        archive_frame.pack(fill=tk.X, padx=10, pady=10)
+        
+        self.archive_info_var = tk.StringVar()
+        ttk.Label(archive_frame, textvariable=self.archive_info_var, justify=tk.LEFT).grid(
+            row=0, column=0, columnspan=3, sticky=tk.W, padx=5, pady=5)
+        
+        ttk.Label(archive_frame, text="Перенести год:").grid(row=1, column=0, sticky=tk.W, padx=5, pady=5)
+        self.archive_year_var = tk.StringVar()
+        self.archive_year_combo = ttk.Combobox(archive_frame, textvariable=self.archive_year_var,
+                                               state="readonly", width=10)
+        self.archive_year_combo.grid(row=1, column=1, padx=5, pady=5, sticky=tk.W)
+        ttk.Button(archive_frame, text="Перенести в архив",
+                  command=self.archive_selected_year).grid(row=1, column=2, padx=5, pady=5, sticky=tk.W)
+        
+        self.load_archive_info()
+        
         # История резервных копий
         history_frame = ttk.LabelFrame(backup_frame, text="История резервных копий")
         history_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
@@ -281,6 +303,100 @@ class SettingsModule:
         # Загрузка истории резервных копий
         self.load_backup_history()
         
+    def create_diagnostics_settings(self):
+        """Диагностика: статистика запросов к базе данных"""
+        diagnostics_frame = self.diagnostics_frame = ttk.Frame(self.settings_notebook)
+        self.settings_notebook.add(diagnostics_frame, text="Диагностика")
+        
+        # Управление сбором статистики
+        control_frame = ttk.LabelFrame(diagnostics_frame, text="Статистика SQL-запросов")
+        control_frame.pack(fill=tk.X, padx=10, pady=10)
+        
+        self.sql_stats_var = tk.BooleanVar()
+        ttk.Checkbutton(control_frame, text="Собирать статистику запросов", 
+                       variable=self.sql_stats_var,
+                       command=self.toggle_query_stats).grid(row=0, column=0, columnspan=2, sticky=tk.W, padx=5, pady=5)
+        
+        ttk.Label(control_frame, text="Медленный запрос, мс:").grid(row=1, column=0, sticky=tk.W, padx=5, pady=5)
+        self.sql_slow_ms_var = tk.StringVar()
+        ttk.Entry(control_frame, textvariable=self.sql_slow_ms_var, width=10).grid(row=1, column=1, sticky=tk.W, padx=5, pady=5)
+        
+        stats_btn_frame = ttk.Frame(control_frame)
+        stats_btn_frame.grid(row=2, column=0, columnspan=2, sticky=tk.W, padx=5, pady=5)
+        
+        ttk.Button(stats_btn_frame, text="Обновить", 
+                  command=self.refresh_query_stats).pack(side=tk.LEFT, padx=(0, 5))
+        ttk.Button(stats_btn_frame, text="Сбросить", 
+                  command=self.reset_query_stats).pack(side=tk.LEFT, padx=5)
+        ttk.Button(stats_btn_frame, text="Экспорт JSON", 
+                  command=self.export_query_stats).pack(side=tk.LEFT, padx=5)
+        
+        self.sql_stats_label = ttk.Label(control_frame, text="")
+        self.sql_stats_label.grid(row=3, column=0, columnspan=2, sticky=tk.W, padx=5, pady=5)
+        
+        # Запросы по суммарному времени
+        queries_frame = ttk.LabelFrame(diagnostics_frame, text="Запросы")
+        queries_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=(0, 10))
+        
+        columns = ('Запрос', 'Число', 'Всего, мс', 'Среднее, мс', 'Максимум, мс', 'Строк')
+        self.query_stats_tree = ttk.Treeview(queries_frame, columns=columns, show='headings', height=8)
+        
+        for col in columns:
+            self.query_stats_tree.heading(col, text=col)
+            self.query_stats_tree.column(col, width=90, anchor=tk.E)
+        self.query_stats_tree.column('Запрос', width=450, anchor=tk.W)
+        
+        queries_scrollbar = ttk.Scrollbar(queries_frame, orient=tk.VERTICAL, command=self.query_stats_tree.yview)
+        self.query_stats_tree.configure(yscrollcommand=queries_scrollbar.set)
+        
+        self.query_stats_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        queries_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        
+        # Медленные запросы с планом выполнения
+        slow_frame = ttk.LabelFrame(diagnostics_frame, text="Медленные запросы")
+        slow_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=(0, 10))
+        
+        slow_columns = ('Время', 'мс', 'Запрос')
+        self.slow_query_tree = ttk.Treeview(slow_frame, columns=slow_columns, show='headings', height=5)
+        self.slow_query_tree.heading('Время', text='Время')
+        self.slow_query_tree.heading('мс', text='мс')
+        self.slow_query_tree.heading('Запрос', text='Запрос')
+        self.slow_query_tree.column('Время', width=140)
+        self.slow_query_tree.column('мс', width=70, anchor=tk.E)
+        self.slow_query_tree.column('Запрос', width=450)
+        self.slow_query_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.slow_query_tree.bind('<<TreeviewSelect>>', self.show_slow_query_plan)
+        
+        self.slow_plan_text = tk.Text(slow_frame, width=50, height=8, wrap=tk.WORD)
+        self.slow_plan_text.pack(side=tk.RIGHT, fill=tk.BOTH, padx=(5, 0))
+        
+        # Обслуживание базы: размер, свободные страницы и журнал задач
+        maintenance_frame = ttk.LabelFrame(diagnostics_frame, text="Обслуживание базы")
+        maintenance_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=(0, 10))
+        
+        maintenance_top = ttk.Frame(maintenance_frame)
+        maintenance_top.pack(fill=tk.X)
+        self.maintenance_label = ttk.Label(maintenance_top, text="")
+        self.maintenance_label.pack(side=tk.LEFT, padx=5, pady=5)
+        ttk.Button(maintenance_top, text="Выполнить сейчас", 
+                  command=self.run_maintenance_now).pack(side=tk.RIGHT, padx=5, pady=5)
+        ttk.Button(maintenance_top, text="Сверка остатков", 
+                  command=self.reconcile_stock).pack(side=tk.RIGHT, padx=5, pady=5)
+        
+        maintenance_columns = ('Время', 'Задача', 'Запуск', 'мс', 'Страниц', 'Свободных', 'Результат')
+        self.maintenance_tree = ttk.Treeview(maintenance_frame, columns=maintenance_columns,
+                                             show='headings', height=5)
+        for col in maintenance_columns:
+            self.maintenance_tree.heading(col, text=col)
+            self.maintenance_tree.column(col, width=90)
+        self.maintenance_tree.column('Время', width=140)
+        self.maintenance_tree.column('Результат', width=250)
+        self.maintenance_tree.pack(fill=tk.BOTH, expand=True)
+        
+        self.slow_queries = []
+        self.schedule_query_stats_refresh()
+        self.load_maintenance_history()
+        
     def load_settings(self):
         """Загрузка настроек из базы данных"""
         # Общие настройки
@@ -306,6 +422,10 @@ class SettingsModule:
         self.backup_path_var.set(self.db.get_setting('backup_path') or os.path.expanduser('~/VetPOS_Backups'))
         self.backup_frequency_var.set(self.db.get_setting('backup_frequency') or 'Ежедневно')
         
+        # Диагностика
+        self.sql_stats_var.set(self.db.query_stats is not None)
+        self.sql_slow_ms_var.set(self.db.get_setting('sql_slow_ms') or str(SLOW_QUERY_MS))
+        
     def save_settings(self):
         """Сохранение настроек в базу данных"""
         try:
@@ -332,6 +452,11 @@ class SettingsModule:
             self.db.set_setting('backup_path', self.backup_path_var.get())
             self.db.set_setting('backup_frequency', self.backup_frequency_var.get())
             
+            # Диагностика
+            self.db.set_setting('sql_stats', '1' if self.sql_stats_var.get() else '0')
+            self.db.set_setting('sql_slow_ms', self.sql_slow_ms_var.get())
+            self.toggle_query_stats()
+            
             messagebox.showinfo("Успех", "Настройки сохранены")
             self.main_app.status_label.config(text="Настройки сохранены")
             
@@ -373,7 +498,7 @@ class SettingsModule:
             try:
                 # Получение всех настроек
                 settings = {}
-                all_settings = self.db.fetch_all('SELECT key, value FROM settings')
+                all_settings = self.db.queries.all(SETTINGS_ALL)
                 
                 for setting in all_settings:
                     settings[setting['key']] = setting['value']
@@ -538,10 +663,10 @@ class SettingsModule:
         if folder:
             self.backup_path_var.set(folder)
             
-    def get_db_size(self):
-        """Получение размера базы данных"""
+    def get_db_size(self, path=None):
+        """Получение размера базы данных (или файла архива)"""
         try:
-            size = os.path.getsize(self.db.db_path)
+            size = os.path.getsize(path or self.db.db_path)
             if size < 1024:
                 return f"{size} байт"
             elif size < 1024 * 1024:
@@ -551,6 +676,42 @@ class SettingsModule:
         except:
             return "Неизвестно"
             
+    def load_archive_info(self):
+        """Годы архива с размерами файлов и закрытые годы, которые можно перенести"""
+        archive = self.db.archive
+        years = archive.years()
+        if years:
+            files = ', '.join(f"{year} ({self.get_db_size(archive.path(year))})" for year in years)
+            info = f"Файлы архива: {files}\nПеренесены продажи по {archive.archived_through()}"
+        else:
+            info = "Архив пуст: все продажи в основной базе"
+        self.archive_info_var.set(info)
+        
+        candidates = [str(year) for year in archive.candidate_years()]
+        self.archive_year_combo['values'] = candidates
+        self.archive_year_var.set(candidates[0] if candidates else '')
+        
+    def archive_selected_year(self):
+        """Перенос выбранного года в архив"""
+        year = self.archive_year_var.get()
+        if not year:
+            messagebox.showinfo("Архив", "Нет закрытых лет для переноса")
+            return
+        if not messagebox.askyesno("Архив",
+                                   f"Перенести продажи, возвраты и движения товаров за {year} год в архив?\n"
+                                   "Отчёты за этот год останутся доступны, возвраты по чекам года - нет."):
+            return
+            
+        try:
+            counts = self.db.archive.archive_year(int(year))
+        except Exception as e:
+            messagebox.showerror("Ошибка", f"Не удалось перенести год в архив: {e}")
+            return
+            
+        self.load_archive_info()
+        messagebox.showinfo("Архив", f"{year} год перенесён в архив: продаж {counts['sales']}, "
+                                     f"возвратов {counts['returns']}")
+        
     def create_backup(self):
         """Создание резервной копии"""
         backup_path = self.backup_path_var.get()
@@ -558,6 +719,11 @@ class SettingsModule:
             messagebox.showwarning("Внимание", "Выберите папку для резервных копий")
             return
             
+        if getattr(self.db, 'remote', False):
+            messagebox.showinfo("Резервное копирование", "Касса работает через сервер базы: "
+                                "резервные копии создаются на сервере")
+            return
+            
         try:
             backup_manager = BackupManager(self.db.db_path)
             backup_filepath = backup_manager.create_backup(backup_path)
@@ -573,6 +739,11 @@ class SettingsModule:
             
     def restore_backup(self):
         """Восстановление из резервной копии"""
+        if getattr(self.db, 'remote', False):
+            messagebox.showinfo("Восстановление", "Касса работает через сервер базы: "
+                                "восстановление выполняется на сервере при остановленном сервере")
+            return
+            
         backup_file = filedialog.askopenfilename(
             title="Выберите файл резервной копии",
             filetypes=[("DB файлы", "*.db"), ("Все файлы", "*.*")]
@@ -634,4 +805,153 @@ class SettingsModule:
                     ))
                     
         except Exception as e:
-            print(f"Ошибка загрузки истории резервных копий: {e}")
\ No newline at end of file
+            print(f"Ошибка загрузки истории резервных копий: {e}")
+            
+    def toggle_query_stats(self):
+        """Включение или выключение статистики запросов"""
+        if not self.sql_stats_var.get():
+            self.db.disable_query_stats()
+            self.refresh_query_stats()
+            return
+            
+        try:
+            slow_ms = float(self.sql_slow_ms_var.get().replace(',', '.'))
+        except ValueError:
+            messagebox.showerror("Ошибка", "Порог медленного запроса должен быть числом")
+            self.sql_stats_var.set(self.db.query_stats is not None)
+            return
+            
+        self.db.enable_query_stats(slow_ms)
+        self.refresh_query_stats()
+        
+    def schedule_query_stats_refresh(self):
+        """Периодическое обновление панели, пока вкладка открыта"""
+        try:
+            visible = self.diagnostics_frame.winfo_ismapped()
+        except tk.TclError:
+            return
+        if visible and self.db.query_stats is not None:
+            self.refresh_query_stats()
+        self.frame.after(2000, self.schedule_query_stats_refresh)
+        
+    def refresh_query_stats(self):
+        """Обновление таблиц статистики запросов"""
+        self.query_stats_tree.delete(*self.query_stats_tree.get_children())
+        self.slow_query_tree.delete(*self.slow_query_tree.get_children())
+        
+        stats = self.db.query_stats
+        if stats is None:
+            self.slow_queries = []
+            self.sql_stats_label.config(text="Статистика выключена")
+            return
+            
+        snapshot = stats.snapshot()
+        for item in snapshot:
+            self.query_stats_tree.insert('', 'end', values=(
+                item['sql'], item['count'], f"{item['total_ms']:.1f}",
+                f"{item['avg_ms']:.2f}", f"{item['max_ms']:.1f}", item['rows']
+            ))
+            
+        self.slow_queries = list(reversed(stats.slow))
+        for index, entry in enumerate(self.slow_queries):
+            self.slow_query_tree.insert('', 'end', iid=str(index),
+                                        values=(entry['at'], f"{entry['ms']:.1f}", entry['sql']))
+            
+        total_ms = sum(item['total_ms'] for item in snapshot)
+        calls = sum(item['count'] for item in snapshot)
+        self.sql_stats_label.config(
+            text=f"С {stats.started:%d.%m.%Y %H:%M:%S}: запросов {calls}, "
+                 f"всего {total_ms:.0f} мс, медленных {len(stats.slow)}")
+        
+    def load_maintenance_history(self):
+        """Размер базы и журнал обслуживания"""
+        metrics = self.db.maintenance.metrics()
+        mode = 'INCREMENTAL' if metrics['auto_vacuum'] == 2 else 'нет (перевод после закрытия смены)'
+        self.maintenance_label.config(
+            text=f"Размер {metrics['size'] / (1024 * 1024):.1f} МБ, страниц {metrics['page_count']}, "
+                 f"свободных {metrics['freelist_count']}, auto_vacuum: {mode}")
+        
+        self.maintenance_tree.delete(*self.maintenance_tree.get_children())
+        for row in self.db.maintenance.history():
+            self.maintenance_tree.insert('', 'end', values=(
+                format_seconds(row['started_at']), row['task'], row['trigger'], f"{row['duration_ms']:.0f}",
+                f"{row['pages_before']} → {row['pages_after']}", f"{row['free_before']} → {row['free_after']}",
+                row['result']
+            ))
+            
+    def run_maintenance_now(self):
+        """Полное обслуживание базы по кнопке"""
+        if not messagebox.askyesno("Обслуживание базы",
+                                   "Обновить статистику, проверить целостность и вернуть свободное место?\n"
+                                   "Касса на это время недоступна."):
+            return
+            
+        try:
+            ok = self.db.maintenance.run_now()
+        except Exception as e:
+            self.db.rollback()
+            messagebox.showerror("Ошибка", f"Ошибка обслуживания базы: {e}")
+            return
+            
+        self.load_maintenance_history()
+        if ok:
+            messagebox.showinfo("Обслуживание базы", "Обслуживание выполнено, ошибок целостности нет")
+        else:
+            messagebox.showerror("Обслуживание базы", "Проверка целостности нашла ошибки, см. журнал обслуживания")
+            
+    def reconcile_stock(self):
+        """Сверка остатков товаров с журналом движения и восстановление по журналу"""
+        try:
+            drift = self.db.maintenance.reconcile_stock('manual')
+        except Exception as e:
+            messagebox.showerror("Ошибка", f"Ошибка сверки остатков: {e}")
+            return
+        self.load_maintenance_history()
+        
+        if not drift:
+            messagebox.showinfo("Сверка остатков", "Остатки в карточках совпадают с журналом движения")
+            return
+        lines = '\n'.join(f"{row['name']}: в карточке {row['quantity']:g}, по журналу {row['ledger_quantity']:g}"
+                          for row in drift[:10])
+        if messagebox.askyesno("Сверка остатков",
+                               f"Расхождений: {len(drift)}\n\n{lines}\n\n"
+                               "Восстановить остатки в карточках по журналу движения?"):
+            repaired = self.db.repair_stock([row['id'] for row in drift])
+            messagebox.showinfo("Сверка остатков", f"Восстановлено остатков: {repaired}")
+            
+    def show_slow_query_plan(self, event=None):
+        """План выполнения выбранного медленного запроса"""
+        selection = self.slow_query_tree.selection()
+        if not selection:
+            return
+        entry = self.slow_queries[int(selection[0])]
+        
+        self.slow_plan_text.delete('1.0', tk.END)
+        self.slow_plan_text.insert(tk.END, f"{entry['sql']}\n\nПараметры: {', '.join(entry['params'])}\n\n"
+                                           f"План:\n{entry['plan']}")
+        
+    def reset_query_stats(self):
+        """Сброс статистики запросов"""
+        if self.db.query_stats is not None:
+            self.db.query_stats.reset()
+        self.slow_plan_text.delete('1.0', tk.END)
+        self.refresh_query_stats()
+        
+    def export_query_stats(self):
+        """Экспорт статистики запросов в JSON"""
+        if self.db.query_stats is None:
+            messagebox.showwarning("Внимание", "Статистика запросов выключена")
+            return
+            
+        filename = filedialog.asksaveasfilename(
+            title="Экспорт статистики запросов",
+            defaultextension=".json",
+            filetypes=[("JSON файлы", "*.json"), ("Все файлы", "*.*")]
+        )
+        
+        if filename:
+            try:
+                self.db.query_stats.export_json(filename)
+                messagebox.showinfo("Успех", f"Статистика экспортирована в файл:\n{filename}")
+            except Exception as e:
+                messagebox.showerror("Ошибка", f"Ошибка экспорта: {str(e)}")
@@ -5,6 +5,10 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
 from datetime import datetime
+from database import PAYMENT_COLUMNS, MONEY_COLUMNS
+from money import to_kopecks, format_amount, rub, average
+from timestamps import now, format_datetime, format_seconds, format_duration, to_epoch
+from queries import SHIFTS_RECENT, SHIFT_CLOSE
 
 
 class ShiftsModule:
@@ -124,6 +128,8 @@ class ShiftsModule:
                   command=self.detailed_report).pack(fill=tk.X, pady=2)
         ttk.Button(actions_frame, text="Продажи смены", 
                   command=self.show_shift_sales).pack(fill=tk.X, pady=2)
+        ttk.Button(actions_frame, text="Сверка счётчиков", 
+                  command=self.verify_shift_totals).pack(fill=tk.X, pady=2)
         
     def load_shifts(self):
         """Загрузка смен в таблицу"""
@@ -132,30 +138,12 @@ class ShiftsModule:
             self.shifts_tree.delete(item)
             
         # Загрузка данных
-        shifts = self.db.fetch_all('''
-            SELECT s.*, u.name as cashier_name
-            FROM shifts s
-            JOIN users u ON s.cashier_id = u.id
-            ORDER BY s.start_time DESC
-            LIMIT 50
-        ''')
+        shifts = self.db.queries.all(SHIFTS_RECENT, (50,))
         
         for shift in shifts:
             # Форматирование времени
-            try:
-                start_time = datetime.strptime(shift['start_time'], '%Y-%m-%d %H:%M:%S')
-                formatted_start = start_time.strftime('%d.%m.%Y %H:%M')
-            except:
-                formatted_start = shift['start_time']
-                
-            if shift['end_time']:
-                try:
-                    end_time = datetime.strptime(shift['end_time'], '%Y-%m-%d %H:%M:%S')
-                    formatted_end = end_time.strftime('%d.%m.%Y %H:%M')
-                except:
-                    formatted_end = shift['end_time']
-            else:
-                formatted_end = "Открыта"
+            formatted_start = format_datetime(shift['start_time'])
+            formatted_end = format_datetime(shift['end_time'], "Открыта")
                 
             # Статус
             status = "Открыта" if shift['status'] == 'open' else "Закрыта"
@@ -165,9 +153,9 @@ class ShiftsModule:
                 shift['cashier_name'],
                 formatted_start,
                 formatted_end,
-                f"{shift['start_amount']:.2f} ₽",
-                f"{shift['end_amount']:.2f} ₽" if shift['end_amount'] else "-",
-                f"{shift['total_sales']:.2f} ₽",
+                rub(shift['start_amount']),
+                rub(shift['end_amount']) if shift['end_amount'] else "-",
+                rub(shift['total_sales']),
                 shift['transactions_count'],
                 status
             ))
@@ -239,13 +227,8 @@ class ShiftsModule:
         """Формирование X-отчёта"""
         shift = self.main_app.current_shift
         
-        # Получение данных о продажах за смену
-        sales_data = self.db.fetch_all('''
-            SELECT payment_method, SUM(final_amount) as total, COUNT(*) as count
-            FROM sales 
-            WHERE shift_id = ?
-            GROUP BY payment_method
-        ''', (shift['id'],))
+        # Итоги смены из счётчиков (одна строка)
+        totals = self.db.get_shift_totals(shift['id'])
         
         # Создание окна отчёта
         report_window = tk.Toplevel(self.frame)
@@ -275,26 +258,30 @@ class ShiftsModule:
 -------------------------------------
 """
         
-        total_amount = 0
-        total_count = 0
-        
-        for sale in sales_data:
-            report_content += f"{sale['payment_method']:.<20} {sale['total']:>8.2f} ₽ ({sale['count']} чеков)\\n"
-            total_amount += sale['total']
-            total_count += sale['count']
+        for label, bucket in PAYMENT_COLUMNS.items():
+            if totals[f'count_{bucket}']:
+                report_content += (f"{label:.<20} {format_amount(totals[f'sales_{bucket}']):>8} ₽ "
+                                   f"({totals[f'count_{bucket}']} чеков)\n")
+            
+        total_amount = totals['total_sales']
+        total_count = totals['transactions_count']
             
         report_content += f"""
 -------------------------------------
-ИТОГО:                    {total_amount:>8.2f} ₽
+ИТОГО:                    {format_amount(total_amount):>8} ₽
 Количество чеков:         {total_count:>8} шт
-Средний чек:              {total_amount/total_count if total_count > 0 else 0:>8.2f} ₽
+Средний чек:              {format_amount(average(total_amount, total_count)):>8} ₽
+Возвраты:                 {format_amount(totals['total_returns']):>8} ₽ ({totals['returns_count']} шт)
 
 -------------------------------------
            КАССА
 -------------------------------------
-Сумма на начало смены:    {shift['start_amount']:>8.2f} ₽
-Наличные продажи:         {shift.get('current_amount', shift['start_amount']) - shift['start_amount']:>8.2f} ₽
-Сумма в кассе:            {shift.get('current_amount', shift['start_amount']):>8.2f} ₽
+Сумма на начало смены:    {format_amount(totals['start_amount']):>8} ₽
+Наличные продажи:         {format_amount(totals['sales_cash']):>8} ₽
+Возвраты наличными:       {format_amount(totals['returns_cash']):>8} ₽
+Внесения:                 {format_amount(totals['cash_in']):>8} ₽
+Изъятия:                  {format_amount(totals['cash_out']):>8} ₽
+Сумма в кассе:            {format_amount(totals['cash_balance']):>8} ₽
 
 =====================================
         """
@@ -322,12 +309,7 @@ class ShiftsModule:
         shift_id = item['values'][0]
         
         # Получение полной информации о смене
-        shift = self.db.fetch_one('''
-            SELECT s.*, u.name as cashier_name
-            FROM shifts s
-            JOIN users u ON s.cashier_id = u.id
-            WHERE s.id = ?
-        ''', (shift_id,))
+        shift = self.db.get_shift_totals(shift_id)
         
         if shift:
             self.show_shift_details(shift)
@@ -337,58 +319,30 @@ class ShiftsModule:
         self.detail_labels['cashier'].config(text=shift['cashier_name'])
         
         # Форматирование времени
-        try:
-            start_time = datetime.strptime(shift['start_time'], '%Y-%m-%d %H:%M:%S')
-            self.detail_labels['start_time'].config(text=start_time.strftime('%d.%m.%Y %H:%M:%S'))
+        start_time = to_epoch(shift['start_time'])
+        end_time = to_epoch(shift['end_time'])
+        self.detail_labels['start_time'].config(text=format_seconds(start_time))
+        
+        if end_time is not None:
+            self.detail_labels['end_time'].config(text=format_seconds(end_time))
             
-            if shift['end_time']:
-                end_time = datetime.strptime(shift['end_time'], '%Y-%m-%d %H:%M:%S')
-                self.detail_labels['end_time'].config(text=end_time.strftime('%d.%m.%Y %H:%M:%S'))
-                
-                # Продолжительность
-                duration = end_time - start_time
-                hours = duration.seconds // 3600
-                minutes = (duration.seconds % 3600) // 60
-                self.detail_labels['duration'].config(text=f"{hours}ч {minutes}м")
-            else:
-                self.detail_labels['end_time'].config(text="Смена открыта")
-                
-                # Текущая продолжительность
-                current_time = datetime.now()
-                duration = current_time - start_time
-                hours = duration.seconds // 3600
-                minutes = (duration.seconds % 3600) // 60
-                self.detail_labels['duration'].config(text=f"{hours}ч {minutes}м (текущая)")
-        except:
-            self.detail_labels['start_time'].config(text=shift['start_time'])
-            self.detail_labels['end_time'].config(text=shift['end_time'] or "Смена открыта")
-            self.detail_labels['duration'].config(text="-")
+            # Продолжительность
+            self.detail_labels['duration'].config(text=format_duration(end_time - start_time))
+        else:
+            self.detail_labels['end_time'].config(text="Смена открыта")
+            
+            # Текущая продолжительность
+            self.detail_labels['duration'].config(text=f"{format_duration(now() - start_time)} (текущая)")
             
         # Суммы
-        self.detail_labels['start_amount'].config(text=f"{shift['start_amount']:.2f} ₽")
-        self.detail_labels['end_amount'].config(text=f"{shift['end_amount']:.2f} ₽" if shift['end_amount'] else "-")
-        self.detail_labels['total_sales'].config(text=f"{shift['total_sales']:.2f} ₽")
+        self.detail_labels['start_amount'].config(text=rub(shift['start_amount']))
+        self.detail_labels['end_amount'].config(text=rub(shift['end_amount']) if shift['end_amount'] else "-")
+        self.detail_labels['total_sales'].config(text=rub(shift['total_sales']))
         self.detail_labels['transactions_count'].config(text=str(shift['transactions_count']))
         
-        # Продажи по типам оплаты
-        sales_by_payment = self.db.fetch_all('''
-            SELECT payment_method, SUM(final_amount) as total
-            FROM sales 
-            WHERE shift_id = ?
-            GROUP BY payment_method
-        ''', (shift['id'],))
-        
-        cash_sales = 0
-        card_sales = 0
-        
-        for sale in sales_by_payment:
-            if sale['payment_method'] == 'Наличные':
-                cash_sales = sale['total']
-            elif sale['payment_method'] == 'Банковская карта':
-                card_sales = sale['total']
-                
-        self.detail_labels['cash_sales'].config(text=f"{cash_sales:.2f} ₽")
-        self.detail_labels['card_sales'].config(text=f"{card_sales:.2f} ₽")
+        # Продажи по типам оплаты (из счётчиков смены)
+        self.detail_labels['cash_sales'].config(text=rub(shift['sales_cash']))
+        self.detail_labels['card_sales'].config(text=rub(shift['sales_card']))
         
     def clear_shift_details(self):
         """Очистка деталей смены"""
@@ -412,6 +366,33 @@ class ShiftsModule:
             
         messagebox.showinfo("Продажи", "Просмотр продаж смены в разработке")
         
+    def verify_shift_totals(self):
+        """Сверка счётчиков выбранной смены с продажами и возвратами"""
+        selection = self.shifts_tree.selection()
+        if not selection:
+            messagebox.showwarning("Внимание", "Выберите смену")
+            return
+            
+        shift_id = self.shifts_tree.item(selection[0])['values'][0]
+        mismatches = self.db.verify_shift_totals(shift_id)
+        
+        if not mismatches:
+            messagebox.showinfo("Сверка", f"Счётчики смены #{shift_id} совпадают с данными продаж")
+            return
+            
+        money = set(MONEY_COLUMNS['shifts']) | {'cash_balance'}
+        lines = []
+        for column, (stored, actual) in mismatches.items():
+            if column in money:
+                stored, actual = format_amount(stored), format_amount(actual)
+            lines.append(f"{column}: {stored} (по данным {actual})")
+        details = "\n".join(lines)
+        if messagebox.askyesno("Сверка", 
+                               f"Найдены расхождения в смене #{shift_id}:\n\n{details}\n\n"
+                               "Пересчитать счётчики по данным продаж?"):
+            self.db.rebuild_shift_totals(shift_id)
+            self.load_shifts()
+            
     def print_report(self, content):
         """Печать отчёта"""
         print("=== ПЕЧАТЬ ОТЧЁТА ===")
@@ -474,7 +455,7 @@ class ShiftOpenDialog:
     def open_shift(self):
         """Открытие смены"""
         try:
-            amount = float(self.amount_var.get())
+            amount = to_kopecks(self.amount_var.get())
             if amount < 0:
                 raise ValueError()
         except ValueError:
@@ -489,12 +470,11 @@ class ShiftOpenDialog:
             self.main_app.current_shift = {
                 'id': shift_id,
                 'start_time': datetime.now(),
-                'start_amount': amount,
-                'current_amount': amount
+                'start_amount': amount
             }
             
             self.main_app.update_user_info()
-            self.main_app.cash_amount_label.config(text=f"{amount:.2f} ₽")
+            self.main_app.update_cash_info()
             
             self.result = True
             self.dialog.destroy()
@@ -536,7 +516,7 @@ class ShiftCloseDialog:
 Смена: {shift['id']}
 Кассир: {self.main_app.current_user['name']}
 Время открытия: {shift['start_time'].strftime('%d.%m.%Y %H:%M')}
-Начальная сумма: {shift['start_amount']:.2f} ₽
+Начальная сумма: {rub(shift['start_amount'])}
         """
         
         ttk.Label(main_frame, text=info_text, justify=tk.LEFT).pack(pady=10)
@@ -546,7 +526,8 @@ class ShiftCloseDialog:
         amount_frame.pack(pady=10)
         
         ttk.Label(amount_frame, text="Фактическая сумма в кассе:").pack()
-        self.amount_var = tk.StringVar(value=str(shift.get('current_amount', shift['start_amount'])))
+        totals = self.db.get_shift_totals(shift['id'])
+        self.amount_var = tk.StringVar(value=format_amount(totals['cash_balance']))
         amount_entry = ttk.Entry(amount_frame, textvariable=self.amount_var, 
                                width=15, font=('Segoe UI', 12))
         amount_entry.pack(pady=5)
@@ -565,7 +546,7 @@ class ShiftCloseDialog:
     def close_shift(self):
         """Закрытие смены"""
         try:
-            end_amount = float(self.amount_var.get())
+            end_amount = to_kopecks(self.amount_var.get())
             if end_amount < 0:
                 raise ValueError()
         except ValueError:
@@ -575,45 +556,37 @@ class ShiftCloseDialog:
         try:
             shift = self.main_app.current_shift
             
-            # Получение статистики смены
-            sales_stats = self.db.fetch_one('''
-                SELECT COUNT(*) as count, COALESCE(SUM(final_amount), 0) as total
-                FROM sales 
-                WHERE shift_id = ?
-            ''', (shift['id'],))
-            
-            # Закрытие смены в БД
-            self.db.execute_query('''
-                UPDATE shifts 
-                SET end_time = CURRENT_TIMESTAMP, 
-                    end_amount = ?, 
-                    total_sales = ?, 
-                    transactions_count = ?,
-                    status = 'closed'
-                WHERE id = ?
-            ''', (end_amount, sales_stats['total'], sales_stats['count'], shift['id']))
+            # Закрытие смены в БД (итоги уже накоплены в счётчиках)
+            self.db.queries.execute(SHIFT_CLOSE, (now(), end_amount, shift['id']))
             
             self.db.commit()
             
             # Формирование Z-отчёта
-            self.generate_z_report(shift, end_amount, sales_stats)
+            self.generate_z_report(shift, end_amount, self.db.get_shift_totals(shift['id']))
             
             self.result = True
             self.dialog.destroy()
             
             messagebox.showinfo("Успех", f"Смена #{shift['id']} закрыта")
+            # Статистика, проверка целостности и перевод в auto_vacuum=INCREMENTAL вне работы кассы
+            self.main_app.root.after_idle(self.main_app.run_shift_close_maintenance)
             
         except Exception as e:
             messagebox.showerror("Ошибка", f"Ошибка закрытия смены: {str(e)}")
             
-    def generate_z_report(self, shift, end_amount, sales_stats):
+    def generate_z_report(self, shift, end_amount, totals):
         """Формирование Z-отчёта"""
         # Здесь будет код формирования и печати Z-отчёта
         print(f"=== Z-ОТЧЁТ СМЕНЫ {shift['id']} ===")
         print(f"Дата закрытия: {datetime.now().strftime('%d.%m.%Y %H:%M:%S')}")
         print(f"Кассир: {self.main_app.current_user['name']}")
-        print(f"Начальная сумма: {shift['start_amount']:.2f} ₽")
-        print(f"Конечная сумма: {end_amount:.2f} ₽")
-        print(f"Продано на сумму: {sales_stats['total']:.2f} ₽")
-        print(f"Количество операций: {sales_stats['count']}")
+        print(f"Начальная сумма: {format_amount(totals['start_amount'])} ₽")
+        print(f"Конечная сумма: {format_amount(end_amount)} ₽")
+        for label, bucket in PAYMENT_COLUMNS.items():
+            print(f"{label}: {format_amount(totals[f'sales_{bucket}'])} ₽ ({totals[f'count_{bucket}']} чеков)")
+        print(f"Продано на сумму: {format_amount(totals['total_sales'])} ₽")
+        print(f"Возвраты: {format_amount(totals['total_returns'])} ₽ ({totals['returns_count']} шт)")
+        print(f"Внесения/изъятия: {format_amount(totals['cash_in'])} / {format_amount(totals['cash_out'])} ₽")
+        print(f"Расчётная сумма в кассе: {format_amount(totals['cash_balance'])} ₽")
+        print(f"Количество операций: {totals['transactions_count']}")
         print("=== КОНЕЦ Z-ОТЧЁТА ===")
\ No newline at end of file
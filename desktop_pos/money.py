@@ -0,0 +1,95 @@
+"""
+Денежные суммы в копейках: точная арифметика чека и форматирование
+Суммы продаж, возвратов, смен и кассового журнала хранятся в базе целыми копейками,
+цены справочника товаров - в рублях (переводятся при добавлении в чек)
+"""
+
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from functools import lru_cache
+
+
+# Копеек в рубле
+KOPECKS = 100
+
+# Размер кэша строк форматирования (суммы чеков повторяются)
+FORMAT_CACHE_SIZE = 8192
+
+ONE = Decimal(1)
+
+
+def round_half_up(value):
+    """Округление Decimal до целого по правилам кассы (0.5 вверх)"""
+    return int(value.quantize(ONE, ROUND_HALF_UP))
+
+
+def to_kopecks(value):
+    """Рубли (число, строка с точкой или запятой, Decimal) -> целые копейки"""
+    if value is None or value == '':
+        return 0
+    if isinstance(value, int):
+        return value * KOPECKS
+    try:
+        rubles = Decimal(str(value).strip().replace(',', '.').replace(' ', ''))
+    except InvalidOperation:
+        raise ValueError(f"Неверная сумма: {value}")
+    if not rubles.is_finite():
+        raise ValueError(f"Неверная сумма: {value}")
+    return round_half_up(rubles * KOPECKS)
+
+
+def to_rubles(kopecks):
+    """Копейки -> Decimal рублей с двумя знаками (для API и фискальных документов)"""
+    return Decimal(int(kopecks)) / KOPECKS
+
+
+def line_total(price, quantity):
+    """Сумма позиции: цена в копейках на количество (в том числе дробное)"""
+    if isinstance(quantity, int) or float(quantity).is_integer():
+        return int(price) * int(quantity)
+    return round_half_up(Decimal(int(price)) * Decimal(str(quantity)))
+
+
+def prorate(amount, part, whole):
+    """Доля суммы в копейках: amount * part / whole с округлением до копейки"""
+    if not whole:
+        return int(amount)
+    return round_half_up(Decimal(int(amount)) * Decimal(int(part)) / Decimal(int(whole)))
+
+
+def allocate(amount, weights):
+    """Распределение суммы в копейках пропорционально весам; остаток округления - на наибольший вес"""
+    whole = sum(weights)
+    shares = [prorate(amount, weight, whole) if whole else 0 for weight in weights]
+    if shares:
+        largest = max(range(len(weights)), key=lambda index: weights[index])
+        shares[largest] += int(amount) - sum(shares)
+    return shares
+
+
+def percent_of(amount, percent):
+    """Процент от суммы в копейках с округлением до копейки"""
+    if not percent:
+        return 0
+    return round_half_up(Decimal(int(amount)) * Decimal(str(percent)) / 100)
+
+
+@lru_cache(maxsize=FORMAT_CACHE_SIZE)
+def format_amount(kopecks):
+    """Копейки -> '1234.50' (колонки REAL отдают целые копейки как float)"""
+    kopecks = int(kopecks)
+    sign = '-' if kopecks < 0 else ''
+    rubles, rest = divmod(abs(kopecks), KOPECKS)
+    return f"{sign}{rubles}.{rest:02d}"
+
+
+@lru_cache(maxsize=FORMAT_CACHE_SIZE)
+def rub(kopecks):
+    """Копейки -> '1234.50 ₽'"""
+    return f"{format_amount(kopecks)} ₽"
+
+
+def average(amount, count):
+    """Средняя сумма в копейках (средний чек)"""
+    if not count:
+        return 0
+    return round_half_up(Decimal(int(amount)) / count)
@@ -0,0 +1,432 @@
+"""
+Репозиторий запросов: именованные выражения SQL с выборкой только нужных колонок
+и лёгкие типы строк результата вместо sqlite3.Row
+"""
+
+from collections import namedtuple
+
+
+# Размер кэша подготовленных выражений соединения (по умолчанию в sqlite3 - 128)
+CACHED_STATEMENTS = 256
+
+
+def row_type(name, columns):
+    """Тип строки по списку выражений SELECT ('p.name', 'u.name as cashier_name')"""
+    fields = [column.split()[-1].split('.')[-1] for column in columns]
+    base = namedtuple(name, fields)
+    new = tuple.__new__
+    
+    class Row(base):
+        __slots__ = ()
+        
+        def __getitem__(self, key):
+            # Доступ по имени колонки, как у sqlite3.Row
+            if isinstance(key, str):
+                return getattr(self, key)
+            return tuple.__getitem__(self, key)
+            
+        def get(self, key, default=None):
+            """Значение колонки или значение по умолчанию"""
+            return getattr(self, key, default)
+            
+        def keys(self):
+            """Имена колонок (для dict(row))"""
+            return self._fields
+            
+    Row.__name__ = Row.__qualname__ = name
+    Row.columns = ', '.join(columns)
+    Row.from_row = staticmethod(lambda cursor, row: new(Row, row))
+    return Row
+
+
+class Statement:
+    """Именованный запрос и тип его строк"""
+    __slots__ = ('sql', 'row_type')
+    
+    def __init__(self, sql, row_type=None):
+        self.sql = sql
+        self.row_type = row_type
+        
+    def __repr__(self):
+        return f"Statement({' '.join(self.sql.split())!r})"
+
+
+class QueryRepository:
+    """Выполнение именованных запросов через DatabaseManager (с учётом статистики)"""
+    
+    def __init__(self, db):
+        self.db = db
+        
+    def one(self, statement, params=None):
+        """Одна строка результата или None"""
+        return self.db.fetch_one(statement.sql, params, statement.row_type)
+        
+    def all(self, statement, params=None):
+        """Все строки результата"""
+        return self.db.fetch_all(statement.sql, params, statement.row_type)
+        
+    def execute(self, statement, params=None):
+        """Изменяющий запрос; возвращает курсор"""
+        return self.db.execute_query(statement.sql, params)
+        
+    def many(self, statement, rows):
+        """Изменяющий запрос для пакета строк; возвращает курсор (rowcount - сумма по пакету)"""
+        return self.db.execute_many(statement.sql, rows)
+
+
+# Пользователи
+UserLogin = row_type('UserLogin', ('id', 'username', 'password', 'name', 'role'))
+
+USER_FOR_LOGIN = Statement(f'''
+    SELECT {UserLogin.columns} FROM users
+    WHERE username = ? AND is_active = 1
+''', UserLogin)
+
+# Товары
+Product = row_type('Product', (
+    'id', 'barcode', 'name', 'price', 'cost_price', 'category', 'unit', 'quantity',
+))
+ProductCard = row_type('ProductCard', (
+    'id', 'barcode', 'name', 'description', 'price', 'cost_price', 'category', 'unit',
+    'quantity', 'min_quantity',
+))
+ProductName = row_type('ProductName', ('id', 'name', 'unit'))
+
+PRODUCT_BY_ID = Statement(f'SELECT {Product.columns} FROM products WHERE id = ?', Product)
+PRODUCT_CARD = Statement(f'SELECT {ProductCard.columns} FROM products WHERE id = ?', ProductCard)
+PRODUCT_BY_BARCODE = Statement(f'''
+    SELECT {Product.columns} FROM products
+    WHERE barcode = ? AND is_active = 1
+''', Product)
+PRODUCTS_ACTIVE = Statement(f'''
+    SELECT {Product.columns} FROM products
+    WHERE is_active = 1
+    ORDER BY name
+''', Product)
+PRODUCTS_SEARCH = Statement(f'''
+    SELECT {Product.columns} FROM products
+    WHERE is_active = 1
+    AND (name LIKE ? OR barcode LIKE ? OR description LIKE ?)
+    ORDER BY name
+''', Product)
+# Список id передаётся одним параметром JSON - одно выражение на любое число товаров
+PRODUCT_NAMES = Statement(f'''
+    SELECT {ProductName.columns} FROM products
+    WHERE id IN (SELECT value FROM json_each(?))
+''', ProductName)
+PRODUCT_DEACTIVATE = Statement('UPDATE products SET is_active = 0 WHERE id = ?')
+
+# Журнал движения товаров: номер движения - products.stock_seq + 1, остаток меняет триггер журнала
+StockLevel = row_type('StockLevel', ('quantity',))
+StockMovement = row_type('StockMovement', (
+    'm.seq', 'm.created_at', 'm.movement_type', 'm.quantity', 'm.price', 'm.reason', 'm.document_number',
+    'u.name as user_name',
+))
+
+# Остаток на момент :at (UTC, как created_at): последний снимок до момента и движения
+# после него, но до следующего снимка - не больше интервала снимков строк
+STOCK_AT_SQL = '''
+    SELECT COALESCE(s.quantity, 0) + COALESCE((
+        SELECT SUM(m.quantity) FROM {movements} m
+        WHERE m.product_id = :product_id AND m.created_at <= :at
+        AND m.seq > COALESCE(s.seq, 0)
+        AND m.seq < COALESCE((
+            SELECT MIN(n.seq) FROM stock_snapshots n
+            WHERE n.product_id = :product_id AND n.seq > COALESCE(s.seq, 0)), 9e18)
+    ), 0) as quantity
+    FROM (SELECT 1) LEFT JOIN (
+        SELECT seq, quantity FROM stock_snapshots
+        WHERE product_id = :product_id AND created_at <= :at
+        ORDER BY created_at DESC, seq DESC
+        LIMIT 1
+    ) s
+'''
+STOCK_AT = Statement(STOCK_AT_SQL.format(movements='inventory_movements'), StockLevel)
+STOCK_AT_ARCHIVE = Statement(STOCK_AT_SQL.format(movements='all_inventory_movements'), StockLevel)
+STOCK_MOVEMENTS_SQL = f'''
+    SELECT {StockMovement.columns}
+    FROM {{movements}} m
+    LEFT JOIN users u ON m.user_id = u.id
+    WHERE m.product_id = ? AND m.created_at BETWEEN ? AND ?
+    ORDER BY m.seq
+'''
+STOCK_MOVEMENTS = Statement(STOCK_MOVEMENTS_SQL.format(movements='inventory_movements'), StockMovement)
+STOCK_MOVEMENTS_ARCHIVE = Statement(STOCK_MOVEMENTS_SQL.format(movements='all_inventory_movements'),
+                                    StockMovement)
+
+# Клиенты
+Customer = row_type('Customer', (
+    'id', 'name', 'phone', 'email', 'discount_percent', 'bonus_points', 'total_purchases',
+))
+CustomerCard = row_type('CustomerCard', (
+    'id', 'name', 'phone', 'email', 'address', 'discount_percent', 'bonus_points',
+    'total_purchases', 'created_at',
+))
+Purchase = row_type('Purchase', ('created_at', 'final_amount', 'payment_method'))
+PurchaseHistory = row_type('PurchaseHistory', (
+    's.created_at', 's.id', 's.final_amount', 's.discount_amount', 's.payment_method',
+    'u.name as cashier_name',
+))
+
+CUSTOMER_BY_ID = Statement(f'SELECT {CustomerCard.columns} FROM customers WHERE id = ?', CustomerCard)
+CUSTOMERS_ACTIVE = Statement(f'''
+    SELECT {Customer.columns} FROM customers
+    WHERE is_active = 1
+    ORDER BY name
+''', Customer)
+# Начало имени: диапазон по индексу idx_customers_name
+CUSTOMERS_SEARCH = Statement(f'''
+    SELECT {Customer.columns} FROM customers
+    WHERE name >= ? AND name < ? AND is_active = 1
+    ORDER BY name
+    LIMIT ?
+''', Customer)
+CUSTOMERS_BY_PHONE = Statement(f'''
+    SELECT {Customer.columns} FROM customers
+    WHERE phone_digits = ? AND is_active = 1
+    ORDER BY name
+    LIMIT ?
+''', Customer)
+CUSTOMERS_BY_PHONE_PREFIX = Statement(f'''
+    SELECT {Customer.columns} FROM customers
+    WHERE phone_digits >= ? AND phone_digits < ? AND is_active = 1
+    ORDER BY phone_digits
+    LIMIT ?
+''', Customer)
+# Выражение MATCH по триграммному индексу customers_fts (имя или цифры телефона)
+CUSTOMERS_FTS_SEARCH = Statement(f'''
+    SELECT {Customer.columns} FROM customers
+    WHERE id IN (SELECT rowid FROM customers_fts WHERE customers_fts MATCH ?)
+    AND is_active = 1
+    ORDER BY name
+    LIMIT ?
+''', Customer)
+CUSTOMER_RECENT_PURCHASES = Statement(f'''
+    SELECT {Purchase.columns}
+    FROM sales
+    WHERE customer_id = ?
+    ORDER BY created_at DESC
+    LIMIT ?
+''', Purchase)
+CUSTOMER_PURCHASE_HISTORY = Statement(f'''
+    SELECT {PurchaseHistory.columns}
+    FROM sales s
+    JOIN shifts sh ON s.shift_id = sh.id
+    JOIN users u ON sh.cashier_id = u.id
+    WHERE s.customer_id = ?
+    ORDER BY s.created_at DESC
+''', PurchaseHistory)
+CUSTOMER_UPDATE = Statement('''
+    UPDATE customers
+    SET name=?, phone=?, email=?, address=?, discount_percent=?
+    WHERE id=?
+''')
+CUSTOMER_SET_DISCOUNT = Statement('UPDATE customers SET discount_percent = ? WHERE id = ?')
+CUSTOMER_DEACTIVATE = Statement('UPDATE customers SET is_active = 0 WHERE id = ?')
+
+# Продажи и возвраты
+SalesJournalRow = row_type('SalesJournalRow', (
+    's.created_at', 's.id', 'c.name as customer_name', 's.total_amount', 's.discount_amount',
+    's.final_amount', 's.payment_method', 'u.name as cashier_name', 's.business_date',
+))
+# Чек для возврата: шапка повторяется в каждой строке позиции
+SaleReturnLine = row_type('SaleReturnLine', (
+    's.id as sale_id', 's.created_at', 's.total_amount as sale_total', 's.final_amount',
+    's.payment_method', 's.status', 's.register_id', 's.shift_id', 's.receipt_number', 's.customer_id',
+    'u.name as cashier_name', 'si.id', 'si.product_id',
+    'si.quantity', 'si.returned_quantity', 'si.price', 'si.total_amount', 'si.discount_amount',
+    'p.name', 'p.unit',
+))
+SaleRefunded = row_type('SaleRefunded', ('COALESCE(SUM(total_amount), 0) as refunded',))
+# Баллы по чеку: начислено и списано продажей, отменено и восстановлено возвратами (без знака)
+SaleBonus = row_type('SaleBonus', (
+    "COALESCE(SUM(CASE WHEN event_type = 'accrual' THEN points END), 0) as accrued",
+    "COALESCE(-SUM(CASE WHEN event_type = 'redeem' THEN points END), 0) as redeemed",
+    "COALESCE(-SUM(CASE WHEN event_type = 'reversal' THEN points END), 0) as reversed",
+    "COALESCE(SUM(CASE WHEN event_type = 'restore' THEN points END), 0) as restored",
+))
+SaleReceipt = row_type('SaleReceipt', ('register_id', 'shift_id', 'receipt_number'))
+ReceiptNumber = row_type('ReceiptNumber', ('last_number',))
+
+# Журнал продаж по основной базе или по представлению all_sales с подключёнными годами архива
+SALES_JOURNAL_SQL = f'''
+    SELECT {SalesJournalRow.columns}
+    FROM {{sales}} s
+    LEFT JOIN customers c ON s.customer_id = c.id
+    JOIN shifts sh ON s.shift_id = sh.id
+    JOIN users u ON sh.cashier_id = u.id
+    WHERE s.business_date BETWEEN ? AND ?
+    ORDER BY s.created_at DESC
+'''
+SALES_JOURNAL = Statement(SALES_JOURNAL_SQL.format(sales='sales'), SalesJournalRow)
+SALES_JOURNAL_ARCHIVE = Statement(SALES_JOURNAL_SQL.format(sales='all_sales'), SalesJournalRow)
+SALE_RETURN_LINES = f'''
+    SELECT {SaleReturnLine.columns}
+    FROM sales s
+    JOIN sale_items si ON si.sale_id = s.id
+    JOIN products p ON si.product_id = p.id
+    LEFT JOIN shifts sh ON s.shift_id = sh.id
+    LEFT JOIN users u ON sh.cashier_id = u.id
+'''
+SALE_FOR_RETURN = Statement(SALE_RETURN_LINES + 'WHERE s.id = ? ORDER BY si.id', SaleReturnLine)
+# Поиск по номеру чека - точное совпадение по уникальному индексу idx_sales_receipt_number
+RECEIPT_FOR_RETURN = Statement(
+    SALE_RETURN_LINES + 'WHERE s.register_id = ? AND s.shift_id = ? AND s.receipt_number = ? ORDER BY si.id',
+    SaleReturnLine)
+SALE_RECEIPT = Statement(f'SELECT {SaleReceipt.columns} FROM sales WHERE id = ?', SaleReceipt)
+# Следующий номер чека кассы в смене: счётчик увеличивается в транзакции продажи,
+# откат продажи возвращает номер
+RECEIPT_NUMBER_NEXT = Statement('''
+    INSERT INTO receipt_sequences (register_id, shift_id, last_number) VALUES (?, ?, 1)
+    ON CONFLICT (register_id, shift_id) DO UPDATE SET last_number = last_number + 1
+    RETURNING last_number
+''', ReceiptNumber)
+# Списание остатка к возврату со сравнением: не больше, чем осталось невозвращённым
+SALE_ITEM_RETURN = Statement('''
+    UPDATE sale_items SET returned_quantity = returned_quantity + ?
+    WHERE id = ? AND sale_id = ? AND quantity - returned_quantity >= ? - 0.0005
+''')
+SALE_REFUNDED = Statement(f'SELECT {SaleRefunded.columns} FROM returns WHERE sale_id = ?', SaleRefunded)
+SALE_BONUS = Statement(f'SELECT {SaleBonus.columns} FROM bonus_ledger WHERE sale_id = ?', SaleBonus)
+SALE_MARK_RETURNED = Statement('''
+    UPDATE sales SET status = 'returned'
+    WHERE id = ? AND NOT EXISTS (
+        SELECT 1 FROM sale_items WHERE sale_id = sales.id AND quantity - returned_quantity > 0.0005
+    )
+''')
+RETURN_INSERT = Statement('''
+    INSERT INTO returns (sale_id, total_amount, reason, shift_id, return_date, business_date)
+    VALUES (?, ?, ?, ?, ?, (SELECT business_date FROM shifts WHERE id = ?))
+''')
+RETURN_ITEM_INSERT = Statement('''
+    INSERT INTO return_items (return_id, sale_item_id, product_id, quantity, price, total_amount)
+    VALUES (?, ?, ?, ?, ?, ?)
+''')
+RETURN_MOVEMENT_INSERT = Statement('''
+    INSERT INTO inventory_movements
+    (product_id, seq, movement_type, quantity, reason, document_number)
+    SELECT id, stock_seq + 1, 'return', ?, ?, ? FROM products WHERE id = ?
+''')
+
+# Смены
+ShiftListRow = row_type('ShiftListRow', (
+    's.id', 'u.name as cashier_name', 's.start_time', 's.end_time', 's.start_amount',
+    's.end_amount', 's.total_sales', 's.transactions_count', 's.status',
+))
+
+SHIFTS_RECENT = Statement(f'''
+    SELECT {ShiftListRow.columns}
+    FROM shifts s
+    JOIN users u ON s.cashier_id = u.id
+    ORDER BY s.start_time DESC
+    LIMIT ?
+''', ShiftListRow)
+SHIFT_CLOSE = Statement('''
+    UPDATE shifts
+    SET end_time = ?,
+        end_amount = ?,
+        status = 'closed'
+    WHERE id = ?
+''')
+
+# Отложенные чеки
+ParkedReceipt = row_type('ParkedReceipt', (
+    'id', 'customer_id', 'discount_percent', 'payload', 'updated_at',
+))
+ParkedReceiptListRow = row_type('ParkedReceiptListRow', (
+    'r.id', 'r.payload', 'r.updated_at', 'c.name as customer_name',
+))
+
+PARKED_RECEIPT_BY_ID = Statement(f'SELECT {ParkedReceipt.columns} FROM parked_receipts WHERE id = ?',
+                                 ParkedReceipt)
+ACTIVE_RECEIPT = Statement(f'''
+    SELECT {ParkedReceipt.columns} FROM parked_receipts
+    WHERE register_id = ? AND status = 'active'
+    ORDER BY updated_at DESC
+    LIMIT 1
+''', ParkedReceipt)
+PARKED_RECEIPTS = Statement(f'''
+    SELECT {ParkedReceiptListRow.columns}
+    FROM parked_receipts r
+    LEFT JOIN customers c ON r.customer_id = c.id
+    WHERE r.register_id = ? AND r.status = 'parked'
+    ORDER BY r.id
+''', ParkedReceiptListRow)
+PARKED_RECEIPT_INSERT = Statement('''
+    INSERT INTO parked_receipts
+    (register_id, status, customer_id, discount_percent, payload, user_id)
+    VALUES (?, 'active', ?, ?, ?, ?)
+''')
+PARKED_RECEIPT_UPDATE = Statement('''
+    UPDATE parked_receipts
+    SET customer_id = ?, discount_percent = ?, payload = ?, updated_at = CURRENT_TIMESTAMP
+    WHERE id = ?
+''')
+PARKED_RECEIPT_PARK = Statement('''
+    UPDATE parked_receipts
+    SET status = 'parked', updated_at = CURRENT_TIMESTAMP
+    WHERE id = ?
+''')
+PARKED_RECEIPT_ACTIVATE = Statement('''
+    UPDATE parked_receipts
+    SET status = 'active', register_id = ?, updated_at = CURRENT_TIMESTAMP
+    WHERE id = ?
+''')
+PARKED_RECEIPT_DELETE = Statement('DELETE FROM parked_receipts WHERE id = ?')
+RECEIPT_RESERVATIONS_DELETE = Statement('DELETE FROM stock_reservations WHERE receipt_id = ?')
+
+# Складские документы
+StockDocument = row_type('StockDocument', (
+    'id', 'doc_type', 'number', 'status', 'supplier', 'comment', 'created_at', 'posted_at',
+))
+
+STOCK_DOCUMENT_BY_ID = Statement(f'SELECT {StockDocument.columns} FROM stock_documents WHERE id = ?',
+                                 StockDocument)
+
+# Скидки и акции
+DiscountRule = row_type('DiscountRule', (
+    'r.id', 'r.name', 'r.rule_type', 'r.product_id', 'p.name as product_name', 'r.category',
+    'r.percent', 'r.buy_quantity', 'r.pay_quantity', 'r.date_from', 'r.date_to', 'r.time_from',
+    'r.time_to', 'r.weekdays', 'r.is_active',
+))
+ProductCategory = row_type('ProductCategory', ('id', 'category'))
+CategoryName = row_type('CategoryName', ('category',))
+
+# Правила с истёкшим периодом не загружаются в кассу
+DISCOUNT_RULES_ACTIVE = Statement(f'''
+    SELECT {DiscountRule.columns}
+    FROM discount_rules r
+    LEFT JOIN products p ON r.product_id = p.id
+    WHERE r.is_active = 1
+    AND (r.date_to IS NULL OR r.date_to >= date('now', 'localtime'))
+    ORDER BY r.id
+''', DiscountRule)
+DISCOUNT_RULES_ALL = Statement(f'''
+    SELECT {DiscountRule.columns}
+    FROM discount_rules r
+    LEFT JOIN products p ON r.product_id = p.id
+    ORDER BY r.is_active DESC, r.id
+''', DiscountRule)
+DISCOUNT_RULE_INSERT = Statement('''
+    INSERT INTO discount_rules
+    (name, rule_type, product_id, category, percent, buy_quantity, pay_quantity,
+     date_from, date_to, time_from, time_to, weekdays)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+''')
+DISCOUNT_RULE_SET_ACTIVE = Statement('UPDATE discount_rules SET is_active = ? WHERE id = ?')
+DISCOUNT_RULE_DELETE = Statement('DELETE FROM discount_rules WHERE id = ?')
+# Список категорий передаётся одним параметром JSON
+PRODUCTS_IN_CATEGORIES = Statement(f'''
+    SELECT {ProductCategory.columns} FROM products
+    WHERE is_active = 1 AND category IN (SELECT value FROM json_each(?))
+''', ProductCategory)
+PRODUCT_CATEGORIES = Statement(f'''
+    SELECT DISTINCT {CategoryName.columns} FROM products
+    WHERE is_active = 1 AND category IS NOT NULL AND category != ''
+    ORDER BY category
+''', CategoryName)
+
+# Настройки
+Setting = row_type('Setting', ('key', 'value'))
+
+SETTINGS_ALL = Statement(f'SELECT {Setting.columns} FROM settings', Setting)
@@ -0,0 +1,361 @@
+"""
+Касса, работающая с общей базой через сервер (server.py): RemoteDatabaseManager повторяет API
+DatabaseManager для модулей. Изменяющие запросы, результат которых не нужен сразу, копятся
+и уходят на сервер одним пакетом со следующим вызовом (обычно commit); товары по штрихкоду
+и id берутся из кэша, пока сервер не сообщит об изменении каталога
+"""
+
+import os
+import socket
+import sqlite3
+import time
+
+from database import QueryStats, SLOW_QUERY_MS
+from queries import PRODUCT_BY_ID
+import rpc
+
+
+# Ожидание ответа сервера (секунды): дольше ожидания писателя на сервере
+REQUEST_TIMEOUT = 60
+
+# Полная перезагрузка кэша товаров (секунды): изменения каталога приходят с каждым ответом сервера,
+# срок - страховка
+PRODUCT_CACHE_SECONDS = 3600
+
+# Вызовы, результат которых (курсор) нужен не сразу: копятся до следующего вызова
+DEFERRED_CALLS = frozenset(('execute_query', 'execute_many', 'queries.execute', 'queries.many'))
+
+
+class PendingCursor:
+    """Курсор отложенного вызова: lastrowid и rowcount доступны после отправки пакета"""
+    __slots__ = ('client', 'result', 'error')
+    
+    def __init__(self, client):
+        self.client = client
+        self.result = None
+        self.error = None
+        
+    def resolve(self):
+        """Отправка накопленного пакета, если вызов ещё не выполнен"""
+        if self.result is None and self.error is None:
+            self.client.flush()
+        if self.error is not None:
+            raise self.error
+        return self.result
+        
+    @property
+    def lastrowid(self):
+        return self.resolve().lastrowid
+        
+    @property
+    def rowcount(self):
+        return self.resolve().rowcount
+
+
+class CallStats(QueryStats):
+    """Статистика обращений кассы к серверу: пакет вызовов вместе со временем сети"""
+    
+    def __init__(self, slow_ms=SLOW_QUERY_MS):
+        super().__init__(None, slow_ms)
+        
+    def normalize(self, query):
+        return query
+        
+    def explain(self, query, params):
+        return "Пакет выполняется на сервере базы"
+
+
+class ProductCache:
+    """Активные товары каталога по штрихкоду и id; изменённые на сервере товары удаляются из кэша.
+    Остаток в строке товара из кэша не используется: свободный остаток касса запрашивает отдельно"""
+    
+    def __init__(self):
+        self.loaded = False
+        self.expires = 0
+        self.by_barcode = {}
+        self.by_id = {}
+        
+    def reset(self):
+        """Сброс кэша: каталог загрузится заново при следующем поиске товара"""
+        self.loaded = False
+        self.by_barcode.clear()
+        self.by_id.clear()
+        
+    def load(self, products):
+        """Заполнение кэша активными товарами каталога"""
+        self.reset()
+        for product in products:
+            self.put(product)
+        self.loaded = True
+        self.expires = time.monotonic() + PRODUCT_CACHE_SECONDS
+        
+    def put(self, product):
+        """Активный товар (найден по штрихкоду или в каталоге)"""
+        self.by_id[product.id] = product
+        if product.barcode:
+            self.by_barcode[product.barcode] = product
+            
+    def apply(self, changed):
+        """Изменения каталога из ответа сервера (None - сброс целиком)"""
+        if changed is None:
+            self.reset()
+            return
+        for product_id in changed:
+            product = self.by_id.pop(product_id, None)
+            if product is not None and self.by_barcode.get(product.barcode) is product:
+                del self.by_barcode[product.barcode]
+
+
+class RemoteObject:
+    """Объект DatabaseManager на сервере (db.archive, db.maintenance): методы вызываются удалённо"""
+    
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        path = f'{self.name}.{name}'
+        
+        def method(*args, **kwargs):
+            return self.client.call(path, *args, **kwargs)
+        method.__name__ = name
+        return method
+
+
+class RemoteQueries:
+    """db.queries кассы: именованные запросы выполняются на сервере"""
+    
+    def __init__(self, client):
+        self.client = client
+        
+    def one(self, statement, params=None):
+        """Одна строка результата или None (товар по id - из кэша)"""
+        if statement is PRODUCT_BY_ID:
+            product = self.client.cached_product('by_id', params[0])
+            # Неактивный товар (не из каталога) в кэш не попадает
+            return product or self.client.call('queries.one', statement, params)
+        return self.client.call('queries.one', statement, params)
+        
+    def all(self, statement, params=None):
+        """Все строки результата"""
+        return self.client.call('queries.all', statement, params)
+        
+    def execute(self, statement, params=None):
+        """Изменяющий запрос (отложенный); возвращает курсор"""
+        return self.client.call('queries.execute', statement, params)
+        
+    def many(self, statement, rows):
+        """Изменяющий запрос для пакета строк (отложенный); возвращает курсор"""
+        return self.client.call('queries.many', statement, list(rows))
+
+
+class RemoteMaintenance(RemoteObject):
+    """db.maintenance кассы: обслуживание в простое выполняет сам сервер, остальное - по вызову"""
+    
+    def run_idle(self, budget=None):
+        return False
+        
+    def finish_vacuum(self, trigger):
+        pass
+
+
+class RemoteDatabaseManager:
+    """Касса, подключённая к серверу базы: тот же API, что у DatabaseManager"""
+    
+    # Признак работы через сервер (резервные копии и восстановление - на сервере)
+    remote = True
+    
+    def __init__(self, address, register_id=None, timeout=REQUEST_TIMEOUT, token=None):
+        self.server_address = address
+        self.host, self.port = rpc.parse_address(address)
+        # Общий ключ касс и сервера (VETPOS_SERVER_TOKEN)
+        self.token = token or os.environ.get('VETPOS_SERVER_TOKEN') or ''
+        # Идентификатор кассы: сервер нумерует чеки и отложенные чеки по нему
+        self.register_id = register_id or os.environ.get('VETPOS_REGISTER') or socket.gethostname()
+        self.timeout = timeout
+        self.sock = None
+        # Отложенные вызовы: ([путь, аргументы, именованные], курсор)
+        self.pending = []
+        # Сервер держит писателя под открытую транзакцию этой кассы
+        self.in_transaction = False
+        self.row_classes = {}
+        self.products = ProductCache()
+        self.query_stats = None
+        self.queries = RemoteQueries(self)
+        self.archive = RemoteObject(self, 'archive')
+        self.maintenance = RemoteMaintenance(self, 'maintenance')
+        # Вызовы, обращения к серверу, кэш товаров
+        self.counters = {'calls': 0, 'round_trips': 0, 'cache_hits': 0, 'cache_misses': 0}
+        self.db_path = self.connect()['db_path']
+        
+        if os.environ.get('VETPOS_SQL_STATS') == '1':
+            self.enable_query_stats()
+            
+    # Соединение
+    def connect(self):
+        """Подключение и приветствие; возвращает сведения сервера"""
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        # Пакеты маленькие и идут по одному: без задержки Нейгла
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock = sock
+        try:
+            self.sock.sendall(rpc.pack({'register_id': self.register_id, 'token': self.token}))
+            info = self.receive()
+        except OSError:
+            self.disconnect()
+            raise
+        if 'error' in info:
+            self.disconnect()
+            raise rpc.decode_error(info['error'])
+        # Изменения каталога до подключения неизвестны
+        self.products.reset()
+        return info
+        
+    def disconnect(self):
+        """Закрытие сокета (следующий вызов подключится заново)"""
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            finally:
+                self.sock = None
+                
+    def receive(self):
+        """Сообщение сервера"""
+        header = self.receive_exactly(rpc.HEADER.size)
+        return rpc.unpack(self.receive_exactly(rpc.message_size(header)))
+        
+    def receive_exactly(self, size):
+        """Ровно size байт из сокета"""
+        buffer = bytearray(size)
+        view = memoryview(buffer)
+        received = 0
+        while received < size:
+            count = self.sock.recv_into(view[received:])
+            if not count:
+                raise ConnectionError("Сервер базы закрыл соединение")
+            received += count
+        return bytes(buffer)
+        
+    def request(self, calls):
+        """Пакет вызовов на сервер и ответ"""
+        if self.sock is None:
+            self.connect()
+        self.counters['round_trips'] += 1
+        try:
+            self.sock.sendall(rpc.pack({'calls': calls}))
+            return self.receive()
+        except OSError as e:
+            # Пакет не повторяется: сервер мог успеть его выполнить. Транзакция откатывается сервером
+            self.disconnect()
+            self.in_transaction = False
+            raise sqlite3.OperationalError(f"Нет связи с сервером базы {self.server_address}: {e}") from e
+            
+    # Вызовы
+    def call(self, path, *args, **kwargs):
+        """Вызов метода DatabaseManager на сервере (изменяющие запросы - отложенно)"""
+        self.counters['calls'] += 1
+        encoded = [path, rpc.encode(args), rpc.encode(kwargs)]
+        if path in DEFERRED_CALLS:
+            cursor = PendingCursor(self)
+            self.pending.append((encoded, cursor))
+            return cursor
+        return self.send_calls([encoded])[-1]
+        
+    def flush(self):
+        """Отправка накопленных вызовов"""
+        if self.pending:
+            self.send_calls([])
+            
+    def send_calls(self, calls):
+        """Накопленные вызовы и calls одним пакетом; возвращает результаты calls"""
+        pending, self.pending = self.pending, []
+        batch = [encoded for encoded, _ in pending] + calls
+        started = time.perf_counter()
+        response = self.request(batch)
+        if self.query_stats is not None:
+            self.query_stats.record(' + '.join(describe(encoded) for encoded in batch), None,
+                                    time.perf_counter() - started, len(response['results']))
+                                    
+        self.in_transaction = response['tx']
+        self.products.apply(response['changed'])
+        results = [rpc.decode(result, self.row_classes) for result in response['results']]
+        error = rpc.decode_error(response['error']) if response['error'] else None
+        for number, (_, cursor) in enumerate(pending):
+            if number < len(results):
+                cursor.result = results[number]
+            else:
+                cursor.error = error
+        if error is not None:
+            raise error
+        return results[len(pending):]
+        
+    def __getattr__(self, name):
+        # Методы DatabaseManager без своей реализации здесь вызываются на сервере
+        if name.startswith('_'):
+            raise AttributeError(name)
+            
+        def method(*args, **kwargs):
+            return self.call(name, *args, **kwargs)
+        method.__name__ = name
+        return method
+        
+    def commit(self):
+        """Сохранение изменений: накопленные вызовы и commit - одним пакетом"""
+        if self.pending or self.in_transaction:
+            self.send_calls([['commit', [], {}]])
+            
+    def rollback(self):
+        """Откат: накопленные вызовы не отправляются, открытая транзакция откатывается сервером"""
+        for _, cursor in self.pending:
+            cursor.error = sqlite3.OperationalError("Запрос отменён откатом транзакции")
+        self.pending = []
+        if self.in_transaction:
+            self.send_calls([['rollback', [], {}]])
+            
+    def close(self):
+        """Отключение от сервера (незафиксированные изменения откатываются)"""
+        self.pending = []
+        self.disconnect()
+        
+    # Кэш товаров
+    def cached_product(self, index, key):
+        """Активный товар из кэша (index - 'by_barcode' или 'by_id'); каталог загружается одним вызовом"""
+        if not self.products.loaded or time.monotonic() >= self.products.expires:
+            self.products.load(self.call('get_all_products'))
+        product = getattr(self.products, index).get(key)
+        self.counters['cache_hits' if product is not None else 'cache_misses'] += 1
+        return product
+        
+    def get_product_by_barcode(self, barcode):
+        """Получение товара по штрихкоду (из кэша; товар, добавленный после загрузки, - с сервера)"""
+        product = self.cached_product('by_barcode', barcode)
+        if product is None:
+            product = self.call('get_product_by_barcode', barcode)
+            if product is not None:
+                self.products.put(product)
+        return product
+        
+    # Статистика обращений к серверу
+    def enable_query_stats(self, slow_ms=SLOW_QUERY_MS):
+        """Включение статистики пакетов вызовов"""
+        if self.query_stats is None:
+            self.query_stats = CallStats(slow_ms)
+        else:
+            self.query_stats.slow_ms = slow_ms
+        return self.query_stats
+        
+    def disable_query_stats(self):
+        """Выключение статистики пакетов вызовов"""
+        self.query_stats = None
+
+
+def describe(encoded):
+    """Вызов для статистики: путь и имя запроса"""
+    path, args, _ = encoded
+    if args and isinstance(args[0], dict) and '$statement' in args[0]:
+        return f"{path}({args[0]['$statement']})"
+    if args and isinstance(args[0], str):
+        return f"{path}({' '.join(args[0].split())[:80]})"
+    return path
@@ -0,0 +1,704 @@
+"""
+Репликация филиалов в центральную базу: изменения строк кассы копятся в журнале replication_log
+(триггеры; одна запись на строку с номером её последнего изменения), передаются сжатыми пакетами
+только после последнего подтверждённого номера - файлами или по HTTP - и применяются в центральной
+базе повторяемо, с правилами разрешения конфликтов по таблицам
+
+Запуск из каталога desktop_pos:
+    python replication.py enable --db vetpos.db --site branch1
+    VETPOS_REPLICATION_TOKEN=<ключ> python replication.py serve --head head.db --host 0.0.0.0 --port 8770
+    python replication.py push --db vetpos.db --url http://office:8770
+    python replication.py export --db vetpos.db --out outbox                 # передача файлами
+    python replication.py import --head head.db outbox/*.changes.gz
+    python replication.py ack --db vetpos.db --file outbox/branch1_0-1500.ack
+"""
+
+import argparse
+import json
+import os
+import re
+import sqlite3
+import sys
+
+from money import format_amount
+import timestamps
+
+
+# Реплицируемые таблицы и правило применения в центральной базе:
+# 'mirror' - справочник: изменения и удаления по номеру изменения (последнее побеждает);
+# 'history' - документы: изменения по номеру, удаления (перенос в архив филиала) не передаются;
+# 'ledger' - журнал только добавления: первая версия строки остаётся, другая версия - конфликт
+REPLICATED_TABLES = {
+    'users': 'mirror',
+    'products': 'mirror',
+    'customers': 'mirror',
+    'shifts': 'history',
+    'sales': 'history',
+    'sale_items': 'history',
+    'returns': 'history',
+    'return_items': 'history',
+    'inventory_movements': 'ledger',
+    'cash_ledger': 'ledger',
+    'bonus_ledger': 'ledger',
+}
+
+# Колонки, которые не покидают кассу
+EXCLUDED_COLUMNS = {'users': ('password',)}
+
+# Изменений в одном пакете (первая передача всей базы идёт несколькими пакетами)
+CHANGESET_ROWS = 20000
+
+# Версия формата пакета и наибольший размер сжатого пакета
+CHANGESET_FORMAT = 1
+MAX_CHANGESET_SIZE = 64 * 1024 * 1024
+
+# Порт центральной базы по умолчанию и ожидание ответа (секунды)
+DEFAULT_PORT = 8770
+HTTP_TIMEOUT = 120
+
+# Имена таблиц и колонок из пакета подставляются в SQL центральной базы
+IDENTIFIER = re.compile(r'^[a-z_][a-z0-9_]*$')
+
+# Индексы центральной базы для сводных отчётов
+HEAD_INDEXES = (
+    ('sales', 'business_date'),
+    ('returns', 'business_date'),
+    ('sale_items', 'site_id, sale_id'),
+)
+
+
+class SequenceGap(ValueError):
+    """Пакет начинается после неподтверждённых изменений: нужна передача с номера acked"""
+    
+    def __init__(self, site, acked, start):
+        super().__init__(f"Филиал {site}: центральная база подтвердила изменения по {acked}, "
+                         f"пакет начинается после {start}")
+        self.acked = acked
+
+
+def pack_changeset(changeset):
+    """Пакет -> сжатые байты"""
+    import gzip
+    data = json.dumps(changeset, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return gzip.compress(data, compresslevel=6)
+
+
+def unpack_changeset(data):
+    """Сжатые байты -> пакет"""
+    import gzip
+    changeset = json.loads(gzip.decompress(data).decode('utf-8'))
+    if changeset.get('format') != CHANGESET_FORMAT:
+        raise ValueError(f"Неизвестный формат пакета изменений: {changeset.get('format')}")
+    return changeset
+
+
+def changeset_name(changeset):
+    """Имя файла пакета: <филиал>_<от>-<до>"""
+    return f"{changeset['site']}_{changeset['from']}-{changeset['to']}"
+
+
+class ChangeCapture:
+    """Журнал изменений филиала: триггеры таблиц, пакеты после подтверждённого номера, подтверждения"""
+    
+    def __init__(self, db):
+        self.db = db
+        
+    def enabled(self):
+        """Ведётся ли журнал изменений"""
+        return bool(self.db.get_setting('replication_site'))
+        
+    def site(self):
+        """Идентификатор филиала в центральной базе"""
+        site = self.db.get_setting('replication_site')
+        if not site:
+            raise ValueError("Репликация не включена: replication.py enable --site <филиал>")
+        return site
+        
+    def acked(self):
+        """Последний номер изменения, подтверждённый центральной базой"""
+        return int(self.db.get_setting('replication_acked_seq') or 0)
+        
+    def sent(self):
+        """Последний номер изменения в выгруженных пакетах"""
+        return int(self.db.get_setting('replication_sent_seq') or 0)
+        
+    def last_seq(self):
+        """Последний выданный номер изменения"""
+        row = self.db.fetch_one("SELECT seq FROM sqlite_sequence WHERE name = 'replication_log'")
+        return row['seq'] if row else 0
+        
+    def pending(self):
+        """Изменённых строк, ещё не подтверждённых центральной базой"""
+        return self.db.fetch_one('SELECT COUNT(*) as count FROM replication_log WHERE seq > ?',
+                                 (self.acked(),))['count']
+                                 
+    # Включение
+    def enable(self, site):
+        """Журнал изменений и триггеры таблиц; первая передача - все строки реплицируемых таблиц"""
+        if not IDENTIFIER.match(site.replace('-', '_').lower()):
+            raise ValueError(f"Недопустимый идентификатор филиала: {site}")
+        current = self.db.get_setting('replication_site')
+        if current and current != site:
+            raise ValueError(f"Репликация уже включена для филиала {current}")
+            
+        cursor = self.db.get_connection().cursor()
+        try:
+            # Одна запись на строку: повторное изменение заменяет запись с новым номером
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS replication_log (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    table_name TEXT NOT NULL,
+                    row_id INTEGER NOT NULL,
+                    op TEXT NOT NULL, -- 'U' - строка добавлена или изменена, 'D' - удалена
+                    UNIQUE (table_name, row_id)
+                )
+            ''')
+            self.create_triggers(cursor)
+            if not current:
+                self.seed(cursor)
+                cursor.execute('''
+                    INSERT OR REPLACE INTO settings (key, value, description)
+                    VALUES ('replication_site', ?, 'Идентификатор филиала в центральной базе')
+                ''', (site,))
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+            
+    def create_triggers(self, cursor):
+        """Запись изменений реплицируемых таблиц в журнал (удаления - только для справочников)"""
+        for table, rule in REPLICATED_TABLES.items():
+            for event, op in (('INSERT', 'U'), ('UPDATE', 'U'), ('DELETE', 'D')):
+                if event == 'DELETE' and rule != 'mirror':
+                    continue
+                row = 'OLD' if event == 'DELETE' else 'NEW'
+                cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS replication_{table}_{event.lower()}
+                    AFTER {event} ON {table}
+                    BEGIN
+                        INSERT OR REPLACE INTO replication_log (table_name, row_id, op)
+                        VALUES ('{table}', {row}.id, '{op}');
+                    END
+                ''')
+                
+    def seed(self, cursor):
+        """Все строки реплицируемых таблиц - в журнал с новыми номерами"""
+        for table in REPLICATED_TABLES:
+            cursor.execute(f'''
+                INSERT OR REPLACE INTO replication_log (table_name, row_id, op)
+                SELECT '{table}', id, 'U' FROM {table} ORDER BY id
+            ''')
+            
+    # Пакеты
+    def export(self, since=None, limit=CHANGESET_ROWS):
+        """Пакет изменений после номера since (по умолчанию - подтверждённого); None - изменений нет"""
+        site = self.site()
+        since = self.acked() if since is None else since
+        connection = self.db.get_connection()
+        self.db.commit()
+        # Журнал и строки читаются из одного снимка базы: у строки в журнале одна запись -
+        # её последнее изменение, поэтому строка соответствует своему номеру
+        connection.execute('BEGIN')
+        try:
+            to = connection.execute('''
+                SELECT MAX(seq) FROM (SELECT seq FROM replication_log WHERE seq > ? ORDER BY seq LIMIT ?)
+            ''', (since, limit)).fetchone()[0]
+            if to is None:
+                return None
+            tables = {}
+            for table in REPLICATED_TABLES:
+                columns = [row[1] for row in connection.execute(f'PRAGMA main.table_info({table})')
+                           if row[1] not in EXCLUDED_COLUMNS.get(table, ())]
+                selected = ', '.join(f't.{column}' for column in columns)
+                # Строки, перенесённые в архив до передачи, в основной базе уже отсутствуют
+                rows = [list(row) for row in connection.execute(f'''
+                    SELECT l.seq, {selected} FROM replication_log l JOIN {table} t ON t.id = l.row_id
+                    WHERE l.seq > ? AND l.seq <= ? AND l.table_name = ? AND l.op = 'U'
+                    ORDER BY l.seq
+                ''', (since, to, table))]
+                deleted = [list(row) for row in connection.execute('''
+                    SELECT seq, row_id FROM replication_log
+                    WHERE seq > ? AND seq <= ? AND table_name = ? AND op = 'D'
+                    ORDER BY seq
+                ''', (since, to, table))]
+                if rows or deleted:
+                    tables[table] = {'columns': columns, 'rows': rows, 'deleted': deleted}
+        finally:
+            connection.rollback()
+        # Выгруженный пакет считается отправленным: подтверждение в этих пределах - ответ на него
+        if to > self.sent():
+            self.db.set_setting('replication_sent_seq', str(to))
+        return {'format': CHANGESET_FORMAT, 'site': site, 'from': since, 'to': to,
+                'created': timestamps.now(), 'tables': tables}
+                
+    def acknowledge(self, acked):
+        """Подтверждение центральной базы: номер запоминается, переданные записи журнала удаляются"""
+        if acked <= self.acked():
+            return False
+        if acked > self.last_seq():
+            raise ValueError(f"Подтверждён номер {acked}, а журнал выдал только {self.last_seq()}")
+        self.db.execute_query('DELETE FROM replication_log WHERE seq <= ?', (acked,))
+        self.db.execute_query('''
+            INSERT OR REPLACE INTO settings (key, value, description)
+            VALUES ('replication_acked_seq', ?, 'Последнее изменение, подтверждённое центральной базой')
+        ''', (str(acked),))
+        self.db.commit()
+        return True
+        
+    def sync_with(self, head_acked):
+        """Сверка с номером, подтверждённым центральной базой; возвращает True, если нужна полная передача.
+        Ответ о выгруженном пакете мог потеряться - номер центральной базы принимается. Если он меньше
+        подтверждённого (центральная база восстановлена из копии) или больше выгруженных (копия восстановлена
+        здесь), журнал продолжается после него и все строки передаются заново"""
+        if self.acked() <= head_acked <= max(self.acked(), self.sent()):
+            self.acknowledge(head_acked)
+            return False
+        self.resync(head_acked)
+        return True
+        
+    def resync(self, head_acked):
+        """Полная передача: номера журнала продолжаются после head_acked, все строки - в журнал заново"""
+        cursor = self.db.get_connection().cursor()
+        try:
+            if not cursor.execute('''
+                UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'replication_log'
+            ''', (head_acked,)).rowcount:
+                cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('replication_log', ?)",
+                               (head_acked,))
+            cursor.execute('DELETE FROM replication_log')
+            self.seed(cursor)
+            for key in ('replication_acked_seq', 'replication_sent_seq'):
+                cursor.execute('''
+                    INSERT OR REPLACE INTO settings (key, value, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)
+                ''', (key, str(head_acked)))
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+            
+    # Передача по HTTP
+    def push(self, url, token=None):
+        """Передача всех неподтверждённых изменений центральной базе; возвращает число пакетов"""
+        site = self.site()
+        head_acked = http_request(f"{url.rstrip('/')}/sites/{site}", token=token)['acked']
+        if self.sync_with(head_acked):
+            print(f"Филиал {site}: номера журнала разошлись с центральной базой, все строки передаются заново")
+        sent = 0
+        while True:
+            changeset = self.export()
+            if changeset is None:
+                return sent
+            result = http_request(f"{url.rstrip('/')}/changes", pack_changeset(changeset), token)
+            self.acknowledge(result['acked'])
+            sent += 1
+            print(f"Пакет {changeset_name(changeset)}: применено {result['applied']}, "
+                  f"пропущено {result['skipped']}, конфликтов {result['conflicts']}")
+
+
+class HeadOffice:
+    """Центральная база: строки филиалов с ключом (site_id, id), подтверждённые номера и конфликты"""
+    
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=15, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS replication_sites (
+                site_id TEXT PRIMARY KEY,
+                acked_seq INTEGER NOT NULL DEFAULT 0,
+                changesets INTEGER NOT NULL DEFAULT 0,
+                rows INTEGER NOT NULL DEFAULT 0,
+                applied_at INTEGER -- секунды эпохи
+            )
+        ''')
+        # Строки, не применённые по правилу таблицы: версия центральной базы сохраняется
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS replication_conflicts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                site_id TEXT NOT NULL,
+                table_name TEXT NOT NULL,
+                row_id INTEGER NOT NULL,
+                seq INTEGER NOT NULL,
+                incoming TEXT NOT NULL, -- отклонённая строка филиала (JSON)
+                created_at INTEGER NOT NULL
+            )
+        ''')
+        self.connection.commit()
+        
+    def close(self):
+        self.connection.close()
+        
+    def acked(self, site):
+        """Последний применённый номер изменения филиала"""
+        row = self.connection.execute('SELECT acked_seq FROM replication_sites WHERE site_id = ?',
+                                      (site,)).fetchone()
+        return row['acked_seq'] if row else 0
+        
+    def prepare_table(self, table, columns):
+        """Таблица филиалов с колонками пакета (недостающие колонки добавляются)"""
+        for name in [table] + columns:
+            if not IDENTIFIER.match(name) or name in ('site_id', 'change_seq'):
+                raise ValueError(f"Недопустимое имя в пакете изменений: {name}")
+        if 'id' not in columns:
+            raise ValueError(f"В пакете нет колонки id таблицы {table}")
+        existing = {row[1] for row in self.connection.execute(f'PRAGMA main.table_info({table})')}
+        if not existing:
+            definitions = ', '.join(f'{name} INTEGER NOT NULL' if name == 'id' else name for name in columns)
+            self.connection.execute(f'''
+                CREATE TABLE {table} (
+                    site_id TEXT NOT NULL, {definitions}, change_seq INTEGER NOT NULL,
+                    PRIMARY KEY (site_id, id)
+                )
+            ''')
+            for indexed, indexed_columns in HEAD_INDEXES:
+                if indexed == table:
+                    self.connection.execute(f'''
+                        CREATE INDEX IF NOT EXISTS idx_{table}_head ON {table}({indexed_columns})
+                    ''')
+        else:
+            # Колонки, добавленные миграциями филиала после прошлых пакетов
+            for name in columns:
+                if name not in existing:
+                    self.connection.execute(f'ALTER TABLE {table} ADD COLUMN {name}')
+                    
+    def apply(self, changeset):
+        """Применение пакета (повторный пакет ничего не меняет); возвращает счётчики и подтверждённый номер"""
+        site, start, to = changeset['site'], changeset['from'], changeset['to']
+        if not IDENTIFIER.match(site.replace('-', '_').lower()):
+            raise ValueError(f"Недопустимый идентификатор филиала: {site}")
+        acked = self.acked(site)
+        result = {'acked': acked, 'applied': 0, 'skipped': 0, 'conflicts': 0}
+        if start > acked:
+            raise SequenceGap(site, acked, start)
+        if to <= acked:
+            return result
+            
+        connection = self.connection
+        try:
+            for table, data in changeset['tables'].items():
+                rule = REPLICATED_TABLES.get(table, 'history')
+                columns = data['columns']
+                self.prepare_table(table, columns)
+                names = ', '.join(columns)
+                placeholders = ', '.join('?' * len(columns))
+                if rule == 'ledger':
+                    statement = f'''
+                        INSERT INTO {table} (site_id, {names}, change_seq) VALUES (?, {placeholders}, ?)
+                        ON CONFLICT (site_id, id) DO NOTHING
+                    '''
+                else:
+                    assignments = ', '.join(f'{name} = excluded.{name}' for name in columns if name != 'id')
+                    statement = f'''
+                        INSERT INTO {table} (site_id, {names}, change_seq) VALUES (?, {placeholders}, ?)
+                        ON CONFLICT (site_id, id) DO UPDATE SET {assignments}, change_seq = excluded.change_seq
+                        WHERE excluded.change_seq > {table}.change_seq
+                    '''
+                id_index = columns.index('id')
+                for seq, *values in data['rows']:
+                    # Изменения до подтверждённого номера уже применены прошлым пакетом
+                    if seq <= acked:
+                        result['skipped'] += 1
+                        continue
+                    if connection.execute(statement, [site] + values + [seq]).rowcount:
+                        result['applied'] += 1
+                    elif rule == 'ledger' and self.ledger_conflict(table, columns, site, values):
+                        result['conflicts'] += 1
+                        connection.execute('''
+                            INSERT INTO replication_conflicts (site_id, table_name, row_id, seq, incoming, created_at)
+                            VALUES (?, ?, ?, ?, ?, ?)
+                        ''', (site, table, values[id_index], seq, json.dumps(dict(zip(columns, values)),
+                                                                            ensure_ascii=False),
+                              timestamps.now()))
+                    else:
+                        result['skipped'] += 1
+                        
+                for seq, row_id in data['deleted']:
+                    if seq > acked and rule == 'mirror' and connection.execute(f'''
+                        DELETE FROM {table} WHERE site_id = ? AND id = ? AND change_seq < ?
+                    ''', (site, row_id, seq)).rowcount:
+                        result['applied'] += 1
+                    else:
+                        result['skipped'] += 1
+                        
+            connection.execute('''
+                INSERT INTO replication_sites (site_id, acked_seq, changesets, rows, applied_at)
+                VALUES (?, ?, 1, ?, ?)
+                ON CONFLICT (site_id) DO UPDATE SET acked_seq = excluded.acked_seq,
+                    changesets = changesets + 1, rows = rows + excluded.rows, applied_at = excluded.applied_at
+            ''', (site, to, result['applied'], timestamps.now()))
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        result['acked'] = to
+        return result
+        
+    def ledger_conflict(self, table, columns, site, values):
+        """Строка журнала с тем же id уже есть: конфликт, если её содержимое другое"""
+        names = ', '.join(columns)
+        row = self.connection.execute(f'SELECT {names} FROM {table} WHERE site_id = ? AND id = ?',
+                                      (site, values[columns.index('id')])).fetchone()
+        return row is not None and list(row) != values
+        
+    def sites(self):
+        """Филиалы: подтверждённый номер, пакеты, строки и число конфликтов"""
+        return self.connection.execute('''
+            SELECT s.*, (SELECT COUNT(*) FROM replication_conflicts c WHERE c.site_id = s.site_id) as conflicts
+            FROM replication_sites s ORDER BY s.site_id
+        ''').fetchall()
+        
+    def sales_summary(self, date_from, date_to):
+        """Продажи и возвраты филиалов за период (бизнес-даты)"""
+        tables = {row[0] for row in self.connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        if 'sales' not in tables:
+            return []
+        returns = '''
+            (SELECT COALESCE(SUM(r.total_amount), 0) FROM returns r
+             WHERE r.site_id = s.site_id AND r.business_date BETWEEN ? AND ?)
+        ''' if 'returns' in tables else '0'
+        params = (date_from, date_to) if 'returns' in tables else ()
+        return self.connection.execute(f'''
+            SELECT s.site_id, COUNT(*) as checks, SUM(s.final_amount) as total, {returns} as returns
+            FROM sales s
+            WHERE s.business_date BETWEEN ? AND ?
+            GROUP BY s.site_id ORDER BY s.site_id
+        ''', params + (date_from, date_to)).fetchall()
+
+
+def http_request(url, data=None, token=None):
+    """Запрос к центральной базе (data - сжатый пакет для POST); возвращает ответ JSON"""
+    # HTTP нужен только утилите репликации: касса его не загружает
+    import urllib.error
+    import urllib.request
+    request = urllib.request.Request(url, data=data, method='POST' if data is not None else 'GET')
+    if data is not None:
+        request.add_header('Content-Type', 'application/gzip')
+    if token:
+        request.add_header('X-Replication-Token', token)
+    try:
+        with urllib.request.urlopen(request, timeout=HTTP_TIMEOUT) as response:
+            return json.loads(response.read().decode('utf-8'))
+    except urllib.error.HTTPError as e:
+        try:
+            message = json.loads(e.read().decode('utf-8'))['error']
+        except (ValueError, KeyError):
+            message = str(e)
+        raise ValueError(f"Центральная база отклонила запрос: {message}") from e
+
+
+def head_office_handler(head, token):
+    """Класс обработчика HTTP центральной базы (http.server загружается только для serve)"""
+    import hmac
+    import threading
+    from http.server import BaseHTTPRequestHandler
+    
+    class HeadOfficeHandler(BaseHTTPRequestHandler):
+        """HTTP центральной базы: GET /sites/<филиал> - подтверждённый номер, POST /changes - пакет"""
+        
+        lock = threading.Lock()
+        
+        def reply(self, status, body):
+            data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            
+        def authorized(self):
+            # Без ключа не принимается ни один запрос (main и не запускает сервер без ключа)
+            sent = self.headers.get('X-Replication-Token', '')
+            if not self.token or not hmac.compare_digest(sent, self.token):
+                self.reply(403, {'error': 'Неверный ключ репликации'})
+                return False
+            return True
+            
+        def do_GET(self):
+            if not self.authorized():
+                return
+            parts = self.path.strip('/').split('/')
+            if len(parts) != 2 or parts[0] != 'sites':
+                self.reply(404, {'error': 'Неизвестный адрес'})
+                return
+            with self.lock:
+                self.reply(200, {'site': parts[1], 'acked': self.head.acked(parts[1])})
+                
+        def do_POST(self):
+            if not self.authorized():
+                return
+            if self.path.rstrip('/') != '/changes':
+                self.reply(404, {'error': 'Неизвестный адрес'})
+                return
+            size = int(self.headers.get('Content-Length') or 0)
+            if size > MAX_CHANGESET_SIZE:
+                self.reply(413, {'error': f'Пакет {size} байт больше допустимого'})
+                return
+            try:
+                changeset = unpack_changeset(self.rfile.read(size))
+                with self.lock:
+                    result = self.head.apply(changeset)
+            except SequenceGap as e:
+                self.reply(409, {'error': str(e), 'acked': e.acked})
+            except (ValueError, KeyError, TypeError, OSError, sqlite3.Error) as e:
+                self.reply(400, {'error': str(e)})
+            else:
+                print(f"Пакет {changeset_name(changeset)}: применено {result['applied']}, "
+                      f"пропущено {result['skipped']}, конфликтов {result['conflicts']}")
+                self.reply(200, result)
+                
+        def log_message(self, format, *args):
+            pass
+            
+    HeadOfficeHandler.head = head
+    HeadOfficeHandler.token = token
+    return HeadOfficeHandler
+
+
+def open_branch(path):
+    """База филиала, уже созданная кассой: без схемы, миграций и тестовых данных"""
+    from database import DatabaseManager
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"База филиала не найдена: {path}")
+    return DatabaseManager(path, register_id='replication', initialize=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Репликация филиалов VetPOS в центральную базу')
+    commands = parser.add_subparsers(dest='command', required=True)
+    token = os.environ.get('VETPOS_REPLICATION_TOKEN')
+    
+    command = commands.add_parser('enable', help='включить журнал изменений филиала')
+    command.add_argument('--db', default='vetpos.db', help='база филиала')
+    command.add_argument('--site', required=True, help='идентификатор филиала')
+    
+    command = commands.add_parser('status', help='состояние журнала изменений филиала')
+    command.add_argument('--db', default='vetpos.db', help='база филиала')
+    
+    command = commands.add_parser('push', help='передать изменения центральной базе по HTTP')
+    command.add_argument('--db', default='vetpos.db', help='база филиала')
+    command.add_argument('--url', required=True, help='адрес центральной базы, например http://office:8770')
+    command.add_argument('--token', default=token, help='ключ репликации (VETPOS_REPLICATION_TOKEN)')
+    
+    command = commands.add_parser('export', help='выгрузить неподтверждённые изменения в файлы')
+    command.add_argument('--db', default='vetpos.db', help='база филиала')
+    command.add_argument('--out', default='.', help='каталог пакетов')
+    
+    command = commands.add_parser('ack', help='принять подтверждение центральной базы')
+    command.add_argument('--db', default='vetpos.db', help='база филиала')
+    source = command.add_mutually_exclusive_group(required=True)
+    source.add_argument('--file', help='файл подтверждения (.ack)')
+    source.add_argument('--seq', type=int, help='подтверждённый номер')
+    
+    command = commands.add_parser('serve', help='принимать пакеты филиалов по HTTP')
+    command.add_argument('--head', default='head.db', help='центральная база')
+    command.add_argument('--host', default='127.0.0.1',
+                         help='адрес приёма подключений (0.0.0.0 - все сетевые интерфейсы)')
+    command.add_argument('--port', type=int, default=DEFAULT_PORT, help='порт')
+    command.add_argument('--token', default=token, help='ключ репликации (VETPOS_REPLICATION_TOKEN)')
+    
+    command = commands.add_parser('import', help='применить файлы пакетов в центральной базе')
+    command.add_argument('--head', default='head.db', help='центральная база')
+    command.add_argument('files', nargs='+', help='файлы пакетов (.changes.gz)')
+    
+    command = commands.add_parser('sites', help='филиалы центральной базы и продажи за период')
+    command.add_argument('--head', default='head.db', help='центральная база')
+    command.add_argument('--from', dest='date_from', default=timestamps.business_date()[:8] + '01',
+                         help='начало периода (ГГГГ-ММ-ДД)')
+    command.add_argument('--to', dest='date_to', default=timestamps.business_date(), help='конец периода')
+    args = parser.parse_args()
+    if args.command == 'serve' and not args.token:
+        parser.error("нужен ключ репликации: --token или VETPOS_REPLICATION_TOKEN")
+        
+    if args.command == 'serve':
+        from http.server import ThreadingHTTPServer
+        head = HeadOffice(args.head)
+        server = ThreadingHTTPServer((args.host, args.port), head_office_handler(head, args.token))
+        print(f"Центральная база {args.head}: http://{args.host}:{args.port}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            head.close()
+        return 0
+        
+    if args.command in ('import', 'sites'):
+        head = HeadOffice(args.head)
+        try:
+            if args.command == 'import':
+                # Пакеты филиала применяются по порядку номеров
+                changesets = []
+                for path in args.files:
+                    with open(path, 'rb') as f:
+                        changesets.append((unpack_changeset(f.read()), path))
+                for changeset, path in sorted(changesets, key=lambda item: (item[0]['site'], item[0]['from'])):
+                    result = head.apply(changeset)
+                    with open(os.path.splitext(path)[0] + '.ack', 'w', encoding='utf-8') as f:
+                        json.dump({'site': changeset['site'], 'acked': result['acked']}, f)
+                    print(f"{os.path.basename(path)}: применено {result['applied']}, "
+                          f"пропущено {result['skipped']}, конфликтов {result['conflicts']}, "
+                          f"подтверждено по {result['acked']}")
+            else:
+                for site in head.sites():
+                    print(f"{site['site_id']}: подтверждено по {site['acked_seq']}, пакетов {site['changesets']}, "
+                          f"строк {site['rows']}, конфликтов {site['conflicts']}, "
+                          f"последний пакет {timestamps.format_datetime(site['applied_at'])}")
+                print(f"\nПродажи {args.date_from} - {args.date_to}:")
+                for row in head.sales_summary(args.date_from, args.date_to):
+                    print(f"{row['site_id']}: чеков {row['checks']}, продажи {format_amount(row['total'])}, "
+                          f"возвраты {format_amount(row['returns'])}")
+        finally:
+            head.close()
+        return 0
+        
+    try:
+        db = open_branch(args.db)
+    except OSError as e:
+        print(f"Ошибка: {e}")
+        return 1
+    capture = db.replication
+    try:
+        if args.command == 'enable':
+            capture.enable(args.site)
+            print(f"Журнал изменений филиала {args.site}: к передаче {capture.pending()} строк")
+        elif args.command == 'status':
+            print(f"Филиал {capture.site()}: подтверждено по {capture.acked()}, "
+                  f"последнее изменение {capture.last_seq()}, к передаче {capture.pending()} строк")
+        elif args.command == 'push':
+            print(f"Передано пакетов: {capture.push(args.url, args.token)}")
+        elif args.command == 'export':
+            os.makedirs(args.out, exist_ok=True)
+            # Файлы не подтверждаются сразу: следующая выгрузка до подтверждения повторяет изменения
+            since = capture.acked()
+            while True:
+                changeset = capture.export(since)
+                if changeset is None:
+                    break
+                path = os.path.join(args.out, changeset_name(changeset) + '.changes.gz')
+                with open(path, 'wb') as f:
+                    f.write(pack_changeset(changeset))
+                print(path)
+                since = changeset['to']
+        elif args.command == 'ack':
+            if args.file:
+                with open(args.file, encoding='utf-8') as f:
+                    ack = json.load(f)
+                if ack['site'] != capture.site():
+                    raise ValueError(f"Подтверждение филиала {ack['site']}, а не {capture.site()}")
+                acked = ack['acked']
+            else:
+                acked = args.seq
+            capture.acknowledge(acked)
+            print(f"Подтверждено по {capture.acked()}, к передаче {capture.pending()} строк")
+    except (ValueError, OSError) as e:
+        print(f"Ошибка: {e}")
+        return 1
+    finally:
+        db.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
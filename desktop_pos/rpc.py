@@ -0,0 +1,172 @@
+"""
+Протокол сервера базы для нескольких касс в локальной сети: сообщения JSON с длиной впереди,
+кодирование аргументов и результатов DatabaseManager (строки запросов, курсоры, ошибки)
+"""
+
+import base64
+import json
+import sqlite3
+import struct
+
+import queries
+
+
+# Порт сервера по умолчанию
+DEFAULT_PORT = 8765
+
+# Длина сообщения впереди JSON (4 байта, big-endian) и наибольший размер сообщения
+HEADER = struct.Struct('>I')
+MAX_MESSAGE_SIZE = 256 * 1024 * 1024
+
+# Именованные запросы и типы строк передаются по имени в модуле queries
+STATEMENTS = {name: value for name, value in vars(queries).items() if isinstance(value, queries.Statement)}
+STATEMENT_NAMES = {id(value): name for name, value in STATEMENTS.items()}
+ROW_TYPES = {name: value for name, value in vars(queries).items()
+             if isinstance(value, type) and hasattr(value, 'from_row')}
+ROW_TYPE_NAMES = {value: name for name, value in ROW_TYPES.items()}
+
+# Ошибки, которые клиент поднимает тем же типом, что и локальный DatabaseManager
+ERRORS = {error.__name__: error for error in (
+    ValueError, KeyError, TypeError, PermissionError, FileNotFoundError,
+    sqlite3.IntegrityError, sqlite3.OperationalError, sqlite3.DatabaseError, sqlite3.Error,
+)}
+
+
+class RemoteError(Exception):
+    """Ошибка сервера, для которой нет локального типа"""
+
+
+class RemoteRow:
+    """Строка sqlite3.Row, полученная с сервера: доступ по индексу и по имени колонки"""
+    __slots__ = ('_index', '_values')
+    
+    def __init__(self, index, values):
+        self._index = index
+        self._values = values
+        
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self._values[self._index[key]]
+        return self._values[key]
+        
+    def __iter__(self):
+        return iter(self._values)
+        
+    def __len__(self):
+        return len(self._values)
+        
+    def __eq__(self, other):
+        return isinstance(other, RemoteRow) and self._values == other._values
+        
+    def __hash__(self):
+        return hash(tuple(self._values))
+        
+    def __repr__(self):
+        return f"RemoteRow({dict(zip(self.keys(), self._values))!r})"
+        
+    def keys(self):
+        """Имена колонок (для dict(row))"""
+        return list(self._index)
+
+
+class RemoteCursor:
+    """Результат изменяющего запроса на сервере: lastrowid и rowcount"""
+    __slots__ = ('lastrowid', 'rowcount')
+    
+    def __init__(self, lastrowid, rowcount):
+        self.lastrowid = lastrowid
+        self.rowcount = rowcount
+
+
+def encode(value):
+    """Значение Python -> JSON-совместимое (служебные объекты - с ключом '$...')"""
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    row_type = ROW_TYPE_NAMES.get(type(value))
+    if row_type is not None:
+        return {'$row': row_type, 'v': list(value)}
+    if isinstance(value, sqlite3.Row):
+        return {'$keys': value.keys(), 'v': list(value)}
+    if isinstance(value, (list, tuple)):
+        return [encode(item) for item in value]
+    if isinstance(value, dict):
+        if all(isinstance(key, str) and not key.startswith('$') for key in value):
+            return {key: encode(item) for key, item in value.items()}
+        # Ключи-числа (товар -> количество) JSON превратил бы в строки
+        return {'$items': [[encode(key), encode(item)] for key, item in value.items()]}
+    if isinstance(value, queries.Statement):
+        return {'$statement': STATEMENT_NAMES[id(value)]}
+    if isinstance(value, type) and value in ROW_TYPE_NAMES:
+        return {'$type': ROW_TYPE_NAMES[value]}
+    if isinstance(value, (sqlite3.Cursor, RemoteCursor)):
+        return {'$cursor': [value.lastrowid, value.rowcount]}
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {'$bytes': base64.b64encode(bytes(value)).decode('ascii')}
+    raise TypeError(f"Значение {type(value).__name__} не передаётся на сервер")
+
+
+def decode(value, row_classes=None):
+    """JSON-совместимое значение -> Python (row_classes - кэш индексов колонок sqlite3.Row)"""
+    if isinstance(value, list):
+        return [decode(item, row_classes) for item in value]
+    if not isinstance(value, dict):
+        return value
+    if '$row' in value:
+        return ROW_TYPES[value['$row']]._make(value['v'])
+    if '$keys' in value:
+        keys = tuple(value['$keys'])
+        index = row_classes.get(keys) if row_classes is not None else None
+        if index is None:
+            index = {key: number for number, key in enumerate(keys)}
+            if row_classes is not None:
+                row_classes[keys] = index
+        return RemoteRow(index, value['v'])
+    if '$items' in value:
+        return {decode(key, row_classes): decode(item, row_classes) for key, item in value['$items']}
+    if '$statement' in value:
+        return STATEMENTS[value['$statement']]
+    if '$type' in value:
+        return ROW_TYPES[value['$type']]
+    if '$cursor' in value:
+        return RemoteCursor(*value['$cursor'])
+    if '$bytes' in value:
+        return base64.b64decode(value['$bytes'])
+    return {key: decode(item, row_classes) for key, item in value.items()}
+
+
+def encode_error(error):
+    """Исключение сервера -> [тип, текст]"""
+    return [type(error).__name__, str(error)]
+
+
+def decode_error(error):
+    """[тип, текст] -> исключение того же типа, что поднял бы локальный DatabaseManager"""
+    name, message = error
+    return ERRORS.get(name, RemoteError)(message)
+
+
+def pack(message):
+    """Сообщение -> байты для отправки"""
+    data = json.dumps(message, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return HEADER.pack(len(data)) + data
+
+
+def unpack(data):
+    """Тело сообщения (без длины) -> объект"""
+    return json.loads(data.decode('utf-8'))
+
+
+def message_size(header, max_size=MAX_MESSAGE_SIZE):
+    """Длина тела сообщения по заголовку"""
+    (size,) = HEADER.unpack(header)
+    if size > max_size:
+        raise ValueError(f"Сообщение {size} байт больше допустимого")
+    return size
+
+
+def parse_address(address, default_port=DEFAULT_PORT):
+    """'host:port' или 'host' -> (host, port)"""
+    if ':' not in address:
+        return address, default_port
+    host, _, port = address.rpartition(':')
+    return host, int(port)
@@ -0,0 +1,389 @@
+"""
+Сервер базы для нескольких касс в локальной сети: один процесс владеет vetpos.db, изменения
+всех касс идут через одного писателя, чтения - через пул читателей (WAL). Кассы подключаются
+через RemoteDatabaseManager (remote.py): python main.py --server <адрес>:8765. Касса подключается
+с общим ключом (VETPOS_SERVER_TOKEN) и вызывает только методы из списка REMOTE_CALLS
+
+Запуск из каталога desktop_pos:
+    VETPOS_SERVER_TOKEN=<ключ> python server.py --db vetpos.db --host 0.0.0.0 --port 8765 --readers 4
+"""
+
+import argparse
+import asyncio
+import hmac
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from database import DatabaseManager
+from maintenance import MAINTENANCE_IDLE_SECONDS
+from queries import Statement
+import rpc
+
+
+# Читателей в пуле (соединений и потоков)
+READER_POOL_SIZE = 4
+
+# Ожидание писателя, занятого транзакцией другой кассы (секунды) - как timeout соединения SQLite
+WRITER_WAIT_SECONDS = 15
+
+# Открытая транзакция кассы без запросов (секунды): откат и освобождение писателя
+WRITER_HOLD_SECONDS = 10
+
+# Проверка простоя для обслуживания базы (секунды)
+MAINTENANCE_CHECK_SECONDS = 30
+
+# Методы DatabaseManager, доступные кассам. Произвольный SQL (execute_query, fetch_all и т.п.)
+# по сети не выполняется: queries.* принимают только именованные запросы модуля queries
+REMOTE_CALLS = frozenset((
+    'commit', 'rollback', 'get_setting', 'set_setting',
+    # Товары и остатки
+    'get_all_products', 'search_products', 'get_product_by_barcode', 'add_product', 'update_product',
+    'get_available_quantity', 'reserve_stock', 'touch_reservations', 'sweep_expired_reservations',
+    'get_stock_at', 'get_stock_movements', 'repair_stock', 'reconcile_stock',
+    'get_stock_documents', 'get_document_lines', 'create_stock_document', 'save_stock_document',
+    'post_stock_document', 'get_stocktake_variance', 'get_stocktake_variance_totals',
+    # Клиенты и бонусы
+    'get_all_customers', 'search_customers', 'add_customer', 'get_bonus_balance', 'add_bonus_event',
+    'adjust_bonus_points', 'expire_bonus_points',
+    # Смены, продажи и возвраты
+    'get_current_shift', 'open_shift', 'get_shift_totals', 'get_cash_balance', 'cash_in', 'cash_out',
+    'compute_shift_totals', 'verify_shift_totals', 'rebuild_shift_totals', 'create_sale', 'get_sale_receipt',
+    'get_sale_for_return', 'get_receipt_for_return', 'create_return',
+    # Именованные запросы, архив и обслуживание
+    'queries.one', 'queries.all', 'queries.execute', 'queries.many',
+    'archive.fetch_period', 'archive.years', 'archive.path', 'archive.archived_through',
+    'archive.candidate_years', 'archive.archive_year',
+    'maintenance.metrics', 'maintenance.history', 'maintenance.reconcile_stock', 'maintenance.run_now',
+    'maintenance.run_after_shift_close',
+))
+STATEMENT_CALLS = frozenset(('queries.one', 'queries.all', 'queries.execute', 'queries.many'))
+
+# Вызовы только для чтения: выполняются пулом читателей
+READ_CALLS = frozenset((
+    'queries.one', 'queries.all', 'compute_shift_totals', 'verify_shift_totals', 'reconcile_stock',
+    'archive.fetch_period', 'archive.years', 'archive.path', 'archive.archived_through',
+    'archive.candidate_years', 'maintenance.metrics', 'maintenance.history',
+))
+READ_PREFIXES = ('get_', 'search_')
+
+# Наибольший размер приветствия: до проверки ключа сервер не принимает больших сообщений
+HELLO_MAX_SIZE = 4096
+
+# Колонки каталога: их изменение сбрасывает товар в кэше касс (остаток и номер движения - нет)
+CATALOG_COLUMNS = 'barcode, name, description, price, cost_price, category, unit, is_active'
+
+# Изменений каталога в журнале сервера: касса, отставшая больше, загружает каталог заново
+CATALOG_LOG_SIZE = 1000
+
+# Действия авторизатора, изменяющие данные
+WRITE_ACTIONS = frozenset((sqlite3.SQLITE_INSERT, sqlite3.SQLITE_UPDATE, sqlite3.SQLITE_DELETE))
+
+
+def is_read(path):
+    """Вызов только читает базу"""
+    return path in READ_CALLS or ('.' not in path and path.startswith(READ_PREFIXES))
+
+
+def resolve(db, path, args):
+    """Метод DatabaseManager по имени вызова ('create_sale', 'queries.one') из списка REMOTE_CALLS"""
+    if path not in REMOTE_CALLS:
+        raise PermissionError(f"Вызов {path} недоступен кассам")
+    if path in STATEMENT_CALLS and not (args and isinstance(args[0], Statement)):
+        raise PermissionError(f"Вызов {path} принимает только именованные запросы")
+    target = db
+    for name in path.split('.'):
+        target = getattr(target, name)
+    return target
+
+
+def deny_writes(action, arg1, arg2, database, source):
+    """Авторизатор читателя: изменения основной базы и архива запрещены (представления TEMP - можно)"""
+    if action in WRITE_ACTIONS and database != 'temp':
+        return sqlite3.SQLITE_DENY
+    return sqlite3.SQLITE_OK
+
+
+async def read_message(reader, max_size=rpc.MAX_MESSAGE_SIZE):
+    """Сообщение из потока (asyncio.IncompleteReadError - касса отключилась)"""
+    header = await reader.readexactly(rpc.HEADER.size)
+    return rpc.unpack(await reader.readexactly(rpc.message_size(header, max_size)))
+
+
+class Session:
+    """Подключение кассы: владение писателем на время её транзакции"""
+    
+    def __init__(self, register_id):
+        self.register_id = register_id
+        self.owns_writer = False
+        # Откат транзакции, брошенной кассой (asyncio.TimerHandle)
+        self.hold_timer = None
+        # Транзакция отменена сервером - следующий запрос кассы получает ошибку
+        self.expired = False
+        # Версия каталога, изменения до которой касса уже получила
+        self.catalog_seen = 0
+
+
+class DatabaseServer:
+    """Владелец базы: один писатель, пул читателей и сессии касс по TCP"""
+    
+    def __init__(self, db_path, readers=READER_POOL_SIZE, token=None):
+        if not token:
+            raise ValueError("Не задан ключ доступа касс к серверу (VETPOS_SERVER_TOKEN)")
+        self.token = token
+        self.db_path = os.path.abspath(db_path)
+        self.writer = DatabaseManager(self.db_path, register_id='server')
+        # WAL: читатели не ждут писателя, писатель - читателей
+        self.writer.fetch_one('PRAGMA journal_mode=WAL')
+        self.install_catalog_triggers()
+        
+        self.readers = queue.SimpleQueue()
+        for _ in range(readers):
+            # Схему и миграции выполнил писатель: читатель только подключается к файлу
+            reader = DatabaseManager(self.db_path, register_id='server', initialize=False)
+            reader.get_connection().set_authorizer(deny_writes)
+            self.readers.put(reader)
+        self.reader_count = readers
+        
+        # Писатель - один поток: пакеты выполняются строго по очереди
+        self.writer_executor = ThreadPoolExecutor(1, thread_name_prefix='writer')
+        self.reader_executor = ThreadPoolExecutor(readers, thread_name_prefix='reader')
+        # Касса с открытой транзакцией держит писателя до commit/rollback
+        self.writer_lock = asyncio.Lock()
+        self.sessions = set()
+        self.server = None
+        self.maintenance_task = None
+        self.last_request = time.monotonic()
+        self.stats = {'requests': 0, 'calls': 0, 'reads': 0, 'writes': 0, 'writer_wait': 0.0, 'expired': 0}
+        
+    # Изменения каталога для кэша товаров касс
+    def install_catalog_triggers(self):
+        """Временные триггеры писателя: изменённые товары каталога пишутся в журнал сервера"""
+        self.catalog_version = 0
+        # (версия, id товара); пишет поток писателя, читает цикл событий
+        self.catalog_log = deque(maxlen=CATALOG_LOG_SIZE)
+        self.catalog_guard = threading.Lock()
+        connection = self.writer.get_connection()
+        connection.create_function('catalog_changed', 1, self.catalog_changed)
+        for name, event, row in (('insert', 'INSERT', 'NEW'), ('update', f'UPDATE OF {CATALOG_COLUMNS}', 'NEW'),
+                                 ('delete', 'DELETE', 'OLD')):
+            connection.execute(f'''
+                CREATE TEMP TRIGGER IF NOT EXISTS catalog_{name} AFTER {event} ON main.products
+                BEGIN
+                    SELECT catalog_changed({row}.id);
+                END
+            ''')
+            
+    def catalog_changed(self, product_id):
+        """Функция SQL для триггеров каталога"""
+        with self.catalog_guard:
+            self.catalog_version += 1
+            self.catalog_log.append((self.catalog_version, product_id))
+            
+    def catalog_changes(self, session):
+        """Товары, изменённые с прошлого ответа кассе (None - кэш кассы сбрасывается целиком)"""
+        with self.catalog_guard:
+            seen, session.catalog_seen = session.catalog_seen, self.catalog_version
+            if seen == self.catalog_version:
+                return []
+            if self.catalog_log[0][0] > seen + 1:
+                return None
+            # Откаченные изменения тоже попадают в журнал: лишний сброс товара безопасен
+            return sorted({product_id for version, product_id in self.catalog_log if version > seen})
+            
+    # Выполнение вызовов
+    def run_calls(self, db, register_id, calls):
+        """Вызовы пакета по порядку; возвращает результаты и ошибку (на ней пакет останавливается)"""
+        # Нумерация чеков и отложенные чеки - по кассе, от которой пришёл пакет
+        db.register_id = register_id
+        results = []
+        for path, args, kwargs in calls:
+            try:
+                args = rpc.decode(args)
+                target = resolve(db, path, args)
+                results.append(rpc.encode(target(*args, **rpc.decode(kwargs))))
+            except Exception as e:
+                return results, rpc.encode_error(e)
+        return results, None
+        
+    def run_read(self, register_id, calls):
+        """Пакет чтения на свободном читателе"""
+        reader = self.readers.get()
+        try:
+            return self.run_calls(reader, register_id, calls)
+        finally:
+            # Читатель не держит снимок базы между пакетами
+            if reader.get_connection().in_transaction:
+                reader.rollback()
+            self.readers.put(reader)
+            
+    def run_write(self, register_id, calls):
+        """Пакет на писателе; третье значение - осталась ли открытой транзакция"""
+        results, error = self.run_calls(self.writer, register_id, calls)
+        return results, error, self.writer.get_connection().in_transaction
+        
+    async def execute(self, session, calls):
+        """Пакет вызовов кассы: чтения - пулом читателей, иначе - писателем"""
+        loop = asyncio.get_running_loop()
+        self.last_request = time.monotonic()
+        self.stats['requests'] += 1
+        self.stats['calls'] += len(calls)
+        if session.hold_timer is not None:
+            session.hold_timer.cancel()
+            session.hold_timer = None
+        if session.expired:
+            session.expired = False
+            return [], ['OperationalError', f"Транзакция отменена сервером: касса не отвечала "
+                                           f"{WRITER_HOLD_SECONDS} с"]
+                                           
+        # Касса со своей открытой транзакцией читает на писателе: видит свои изменения
+        if not session.owns_writer and all(is_read(path) for path, _, _ in calls):
+            self.stats['reads'] += 1
+            return await loop.run_in_executor(self.reader_executor, self.run_read, session.register_id, calls)
+            
+        self.stats['writes'] += 1
+        if not session.owns_writer:
+            started = time.perf_counter()
+            try:
+                await asyncio.wait_for(self.writer_lock.acquire(), WRITER_WAIT_SECONDS)
+            except asyncio.TimeoutError:
+                return [], ['OperationalError', 'database is locked']
+            self.stats['writer_wait'] += time.perf_counter() - started
+            session.owns_writer = True
+            
+        results, error, in_transaction = await loop.run_in_executor(
+            self.writer_executor, self.run_write, session.register_id, calls)
+        if in_transaction:
+            session.hold_timer = loop.call_later(WRITER_HOLD_SECONDS, self.expire, session)
+        else:
+            self.release(session)
+        return results, error
+        
+    def release(self, session, rollback=False):
+        """Освобождение писателя сессией (с откатом её транзакции)"""
+        if not session.owns_writer:
+            return
+        if rollback:
+            # Очередь писателя одна: откат выполнится раньше пакета следующей кассы
+            self.writer_executor.submit(self.writer.rollback)
+        session.owns_writer = False
+        self.writer_lock.release()
+        
+    def expire(self, session):
+        """Откат транзакции кассы, которая держит писателя без запросов"""
+        session.hold_timer = None
+        session.expired = True
+        self.stats['expired'] += 1
+        print(f"Касса {session.register_id}: транзакция без запросов {WRITER_HOLD_SECONDS} с, откат")
+        self.release(session, rollback=True)
+        
+    # Подключения касс
+    async def handle_client(self, reader, writer):
+        """Сессия кассы: приветствие, затем пакеты вызовов до отключения"""
+        session = None
+        try:
+            hello = await read_message(reader, HELLO_MAX_SIZE)
+            peer = writer.get_extra_info('peername')
+            if not isinstance(hello, dict) or not hmac.compare_digest(str(hello.get('token') or ''), self.token):
+                print(f"Подключение {peer[0] if peer else 'unknown'} отклонено: неверный ключ")
+                writer.write(rpc.pack({'error': rpc.encode_error(PermissionError("Неверный ключ доступа к серверу"))}))
+                await writer.drain()
+                return
+            session = Session(hello.get('register_id') or (peer[0] if peer else 'unknown'))
+            self.sessions.add(session)
+            # Новая касса начинает с пустого кэша
+            self.catalog_changes(session)
+            writer.write(rpc.pack({'db_path': self.db_path, 'readers': self.reader_count}))
+            await writer.drain()
+            
+            while True:
+                message = await read_message(reader)
+                results, error = await self.execute(session, message['calls'])
+                writer.write(rpc.pack({'results': results, 'error': error, 'tx': session.owns_writer,
+                                       'changed': self.catalog_changes(session)}))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            # ValueError - сообщение больше допустимого или не JSON
+            pass
+        finally:
+            if session is not None:
+                if session.hold_timer is not None:
+                    session.hold_timer.cancel()
+                # Отключение посреди транзакции - откат, как при закрытии соединения SQLite
+                self.release(session, rollback=True)
+                self.sessions.discard(session)
+            writer.close()
+            
+    # Обслуживание базы
+    async def maintenance_loop(self):
+        """Обслуживание в простое всех касс: писатель берётся, как для пакета кассы"""
+        loop = asyncio.get_running_loop()
+        maintenance = self.writer.maintenance
+        while True:
+            await asyncio.sleep(MAINTENANCE_CHECK_SECONDS)
+            if time.monotonic() - self.last_request < MAINTENANCE_IDLE_SECONDS or self.writer_lock.locked():
+                continue
+            async with self.writer_lock:
+                try:
+                    # Проход прерывается первым запросом кассы
+                    while (await loop.run_in_executor(self.writer_executor, maintenance.run_idle)
+                           and time.monotonic() - self.last_request >= MAINTENANCE_IDLE_SECONDS):
+                        pass
+                    await loop.run_in_executor(self.writer_executor, maintenance.finish_vacuum, 'idle')
+                except Exception as e:
+                    await loop.run_in_executor(self.writer_executor, self.writer.rollback)
+                    print(f"Ошибка обслуживания базы: {e}")
+                    
+    # Запуск
+    async def start(self, host, port):
+        """Приём подключений; возвращает порт (port=0 - любой свободный)"""
+        self.server = await asyncio.start_server(self.handle_client, host, port)
+        self.maintenance_task = asyncio.create_task(self.maintenance_loop())
+        return self.server.sockets[0].getsockname()[1]
+        
+    async def serve(self, host, port):
+        """Работа до остановки процесса"""
+        port = await self.start(host, port)
+        print(f"Сервер базы {self.db_path}: {host}:{port}, читателей {self.reader_count}")
+        async with self.server:
+            await self.server.serve_forever()
+            
+    def close(self):
+        """Закрытие соединений писателя и читателей"""
+        self.writer_executor.shutdown()
+        self.reader_executor.shutdown()
+        self.writer.close()
+        while not self.readers.empty():
+            self.readers.get().close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Сервер базы VetPOS для нескольких касс')
+    parser.add_argument('--db', default='vetpos.db', help='файл базы')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='адрес приёма подключений (0.0.0.0 - все сетевые интерфейсы)')
+    parser.add_argument('--port', type=int, default=rpc.DEFAULT_PORT, help='порт')
+    parser.add_argument('--readers', type=int, default=READER_POOL_SIZE, help='читателей в пуле')
+    parser.add_argument('--token', default=os.environ.get('VETPOS_SERVER_TOKEN'),
+                        help='ключ доступа касс (лучше через VETPOS_SERVER_TOKEN: аргументы видны в списке процессов)')
+    args = parser.parse_args()
+    if not args.token:
+        parser.error("нужен ключ доступа касс: --token или VETPOS_SERVER_TOKEN")
+        
+    server = DatabaseServer(args.db, args.readers, args.token)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,82 @@
+"""
+Время в базе - целые секунды эпохи Unix (UTC); бизнес-дата - местная дата смены (ГГГГ-ММ-ДД)
+Форматирование для интерфейса кэшируется по минутам, циклы отображения не разбирают строки
+"""
+
+import calendar
+import time
+from datetime import datetime
+from functools import lru_cache
+
+
+# Размер кэша строк форматирования (время чеков повторяется с точностью до минуты)
+FORMAT_CACHE_SIZE = 8192
+
+# Формат CURRENT_TIMESTAMP SQLite (UTC) в базах до перевода в секунды эпохи
+SQLITE_TIMESTAMP = '%Y-%m-%d %H:%M:%S'
+
+
+def now():
+    """Текущее время в секундах эпохи"""
+    return int(time.time())
+
+
+def to_epoch(value):
+    """Секунды эпохи из числа или строки CURRENT_TIMESTAMP (UTC); None для пустого значения"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, str):
+        return calendar.timegm(time.strptime(value[:19], SQLITE_TIMESTAMP))
+    return int(value)
+
+
+def sqlite_text(epoch):
+    """Секунды эпохи -> строка CURRENT_TIMESTAMP (UTC) для сравнения со старыми колонками времени"""
+    return time.strftime(SQLITE_TIMESTAMP, time.gmtime(to_epoch(epoch)))
+
+
+def business_date(epoch=None):
+    """Местная дата момента (ГГГГ-ММ-ДД), по умолчанию - текущего"""
+    return time.strftime('%Y-%m-%d', time.localtime(now() if epoch is None else to_epoch(epoch)))
+
+
+def to_datetime(epoch):
+    """Местное время как datetime (None для пустого значения)"""
+    epoch = to_epoch(epoch)
+    return None if epoch is None else datetime.fromtimestamp(epoch)
+
+
+@lru_cache(maxsize=FORMAT_CACHE_SIZE)
+def minute_text(minute):
+    """Минута эпохи -> 'ДД.ММ.ГГГГ ЧЧ:ММ' местного времени"""
+    return time.strftime('%d.%m.%Y %H:%M', time.localtime(minute * 60))
+
+
+def format_datetime(epoch, empty=''):
+    """Секунды эпохи -> 'ДД.ММ.ГГГГ ЧЧ:ММ'"""
+    epoch = to_epoch(epoch)
+    return empty if epoch is None else minute_text(epoch // 60)
+
+
+def format_date(epoch, empty=''):
+    """Секунды эпохи -> 'ДД.ММ.ГГГГ'"""
+    epoch = to_epoch(epoch)
+    return empty if epoch is None else minute_text(epoch // 60)[:10]
+
+
+def format_time(epoch, empty=''):
+    """Секунды эпохи -> 'ЧЧ:ММ'"""
+    epoch = to_epoch(epoch)
+    return empty if epoch is None else minute_text(epoch // 60)[11:]
+
+
+def format_seconds(epoch, empty=''):
+    """Секунды эпохи -> 'ДД.ММ.ГГГГ ЧЧ:ММ:СС' (карточки и отчёты одной записи)"""
+    epoch = to_epoch(epoch)
+    return empty if epoch is None else time.strftime('%d.%m.%Y %H:%M:%S', time.localtime(epoch))
+
+
+def format_duration(seconds):
+    """Продолжительность -> 'Чч Мм'"""
+    hours, rest = divmod(max(int(seconds), 0), 3600)
+    return f"{hours}ч {rest // 60}м"
@@ -0,0 +1,350 @@
+"""
+Генератор тестовой базы VetPOS заданного размера (детерминированный по seed):
+товары с приходом, клиенты, смены, продажи с позициями, возвраты.
+
+Запуск из каталога desktop_pos:
+    python tools/datagen.py bench.db --products 50000 --customers 20000 --sales 100000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import DatabaseManager, payment_column
+from money import to_kopecks, percent_of, allocate
+from timestamps import sqlite_text
+
+# Размер пакета executemany
+BATCH_SIZE = 10000
+
+# Продаж в одной смене
+SALES_PER_SHIFT = 150
+
+# Размен на начало смены (копейки)
+START_AMOUNT = 500000
+
+# Касса сгенерированных продаж (номера чеков сквозные в её сменах)
+REGISTER_ID = 'datagen'
+
+PRODUCT_KINDS = ['Корм', 'Лакомство', 'Витамины', 'Шампунь', 'Игрушка', 'Ошейник',
+                 'Наполнитель', 'Капли', 'Миска', 'Переноска', 'Когтеточка', 'Поводок']
+PRODUCT_TARGETS = ['для собак', 'для кошек', 'для щенков', 'для котят', 'для грызунов',
+                   'для птиц', 'для рыб', 'для пожилых собак', 'для стерилизованных кошек']
+PRODUCT_BRANDS = ['Royal', 'Purina', 'Hill\'s', 'Acana', 'Grandorf', 'Мнямс', 'Barsik',
+                  'Четвероногий гурман', 'Trixie', 'Ferplast', 'Beaphar', 'Зоомир']
+CATEGORIES = ['Корма', 'Лакомства', 'Ветпрепараты', 'Гигиена', 'Аксессуары', 'Игрушки']
+UNITS = ['шт', 'шт', 'шт', 'кг', 'уп']
+FIRST_NAMES = ['Иван', 'Анна', 'Пётр', 'Мария', 'Сергей', 'Ольга', 'Дмитрий', 'Елена',
+               'Алексей', 'Наталья', 'Андрей', 'Татьяна', 'Михаил', 'Юлия']
+LAST_NAMES = ['Иванов', 'Петров', 'Сидоров', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев',
+              'Соколов', 'Михайлов', 'Новиков', 'Фёдоров', 'Морозов', 'Волков', 'Лебедев']
+DISCOUNTS = [0, 0, 0, 0, 3, 5, 5, 7, 10]
+PAYMENT_METHODS = ['Наличные', 'Наличные', 'Банковская карта', 'Банковская карта',
+                   'Банковская карта', 'Безналичный расчёт']
+
+
+def batched(rows, size=BATCH_SIZE):
+    """Разбиение потока строк на пакеты"""
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def insert_rows(connection, query, rows):
+    """Пакетная вставка потока строк"""
+    count = 0
+    for batch in batched(rows):
+        connection.executemany(query, batch)
+        count += len(batch)
+    return count
+
+
+def product_rows(rng, count, first_id):
+    """Строки товаров: (id, barcode, name, category, unit, price, cost_price, quantity)"""
+    for number in range(count):
+        price = round(rng.uniform(30, 5000), 2)
+        name = (f"{rng.choice(PRODUCT_KINDS)} {rng.choice(PRODUCT_BRANDS)} "
+                f"{rng.choice(PRODUCT_TARGETS)} {rng.randint(1, 999)}")
+        yield (
+            first_id + number,
+            f"46{first_id + number:011d}",
+            name,
+            rng.choice(CATEGORIES),
+            rng.choice(UNITS),
+            price,
+            round(price * rng.uniform(0.5, 0.8), 2),
+            rng.randint(0, 500)
+        )
+
+
+def customer_rows(rng, count, first_id):
+    """Строки клиентов: (id, name, phone, discount_percent, bonus_points)"""
+    for number in range(count):
+        customer_id = first_id + number
+        phone = f"+7-9{customer_id // 10000000 % 100:02d}-{customer_id // 10000 % 1000:03d}-" \
+                f"{customer_id // 100 % 100:02d}-{customer_id % 100:02d}"
+        yield (
+            customer_id,
+            f"{rng.choice(LAST_NAMES)} {rng.choice(FIRST_NAMES)}",
+            phone,
+            rng.choice(DISCOUNTS),
+            rng.randint(0, 2000)
+        )
+
+
+def receiving_rows(products, created_at):
+    """Движения начального прихода по каждому товару (остаток ставит триггер журнала)"""
+    for product_id, _, _, _, _, _, cost_price, quantity in products:
+        yield ('in', quantity, cost_price, 'Начальный остаток', 'ПР-GEN', created_at, product_id)
+
+
+class SalesGenerator:
+    """Поток продаж с позициями, возвратами и итогами смен"""
+    
+    def __init__(self, rng, sales, product_prices, customer_discounts, cashier_id, end_date,
+                 return_rate=0.02, customer_rate=0.4):
+        self.rng = rng
+        self.sales = sales
+        self.product_prices = product_prices
+        self.customer_discounts = customer_discounts
+        self.cashier_id = cashier_id
+        self.return_rate = return_rate
+        self.customer_rate = customer_rate if customer_discounts else 0
+        self.shifts_count = max(1, (sales + SALES_PER_SHIFT - 1) // SALES_PER_SHIFT)
+        self.first_day = end_date - timedelta(days=self.shifts_count)
+        self.items = []
+        self.returns = []
+        self.return_items = []
+        self.movements = []
+        self.shifts = []
+        self.sequences = []
+        
+    def sale_rows(self, first_sale_id, first_item_id, first_shift_id, first_return_id):
+        """Строки продаж; позиции, возвраты и смены копятся для отдельной вставки"""
+        sale_id = first_sale_id
+        item_id = first_item_id
+        return_id = first_return_id
+        for shift_number in range(self.shifts_count):
+            shift_id = first_shift_id + shift_number
+            opened = self.first_day + timedelta(days=shift_number, hours=9)
+            business_date = opened.strftime('%Y-%m-%d')
+            sales_in_shift = min(SALES_PER_SHIFT, self.sales - shift_number * SALES_PER_SHIFT)
+            totals = {'total_sales': 0, 'transactions_count': 0,
+                      'sales_cash': 0, 'sales_card': 0, 'sales_transfer': 0,
+                      'count_cash': 0, 'count_card': 0, 'count_transfer': 0,
+                      'total_returns': 0, 'returns_count': 0, 'returns_cash': 0}
+                      
+            for sale_number in range(sales_in_shift):
+                created = opened + timedelta(seconds=(sale_number + 1) * 12 * 3600 // (sales_in_shift + 1))
+                created_at = int(created.timestamp())
+                
+                customer_id, discount_percent = None, 0
+                if self.rng.random() < self.customer_rate:
+                    customer_id, discount_percent = self.rng.choice(self.customer_discounts)
+                    
+                sale_items = []
+                for _ in range(self.rng.choice((1, 1, 2, 2, 3, 4))):
+                    product_id, price = self.rng.choice(self.product_prices)
+                    quantity = self.rng.choice((1, 1, 1, 2, 3))
+                    sale_items.append((item_id, sale_id, product_id, quantity, price, quantity * price))
+                    self.movements.append(('sale', -quantity, None, 'Продажа', f"sale_{sale_id}",
+                                           sqlite_text(created_at), product_id))
+                    item_id += 1
+                
+                subtotal = sum(item[5] for item in sale_items)
+                discount = percent_of(subtotal, discount_percent)
+                final_amount = subtotal - discount
+                
+                payment_method = self.rng.choice(PAYMENT_METHODS)
+                bucket = payment_column(payment_method)
+                totals['total_sales'] += final_amount
+                totals['transactions_count'] += 1
+                totals[f'sales_{bucket}'] += final_amount
+                totals[f'count_{bucket}'] += 1
+                
+                status = 'completed'
+                if self.rng.random() < self.return_rate:
+                    status = 'returned'
+                    self.add_return(return_id, sale_id, shift_id, sale_items, final_amount,
+                                    created + timedelta(minutes=30), business_date)
+                    return_id += 1
+                    totals['total_returns'] += final_amount
+                    totals['returns_count'] += 1
+                    if bucket == 'cash':
+                        totals['returns_cash'] += final_amount
+                        
+                # Скидка позиции и возвращённое количество (полный возврат - всё проданное)
+                line_discounts = allocate(discount, [item[5] for item in sale_items])
+                self.items.extend(item + (line_discount, item[3] if status == 'returned' else 0)
+                                  for item, line_discount in zip(sale_items, line_discounts))
+                                  
+                yield (sale_id, shift_id, customer_id, subtotal, discount, final_amount,
+                       payment_method, status, created_at, REGISTER_ID, sale_number + 1, business_date)
+                sale_id += 1
+                
+            closed = opened + timedelta(hours=12)
+            self.sequences.append((REGISTER_ID, shift_id, sales_in_shift))
+            self.shifts.append((
+                shift_id, self.cashier_id, int(opened.timestamp()), int(closed.timestamp()), business_date,
+                START_AMOUNT, START_AMOUNT + totals['sales_cash'] - totals['returns_cash'], 'closed',
+                totals['total_sales'], totals['transactions_count'],
+                totals['sales_cash'], totals['sales_card'], totals['sales_transfer'],
+                totals['count_cash'], totals['count_card'], totals['count_transfer'],
+                totals['total_returns'], totals['returns_count'], totals['returns_cash']
+            ))
+            
+    def add_return(self, return_id, sale_id, shift_id, sale_items, amount, returned, business_date):
+        """Полный возврат чека с движениями товара"""
+        returned_at = sqlite_text(int(returned.timestamp()))
+        self.returns.append((return_id, sale_id, amount, int(returned.timestamp()), 'Полный возврат', shift_id,
+                             business_date))
+        for item_id, _, product_id, quantity, price, total in sale_items:
+            self.return_items.append((return_id, item_id, product_id, quantity, price, total))
+            self.movements.append(('return', quantity, None, f"Возврат по чеку №{sale_id}",
+                                   f"return_{sale_id}", returned_at, product_id))
+                                   
+    def take(self):
+        """Накопленные позиции, возвраты и движения (движения - по времени, как их записала бы касса)"""
+        self.movements.sort(key=lambda movement: movement[5])
+        taken = (self.items, self.returns, self.return_items, self.movements)
+        self.items, self.returns, self.return_items, self.movements = [], [], [], []
+        return taken
+
+
+def next_id(connection, table):
+    """Следующий свободный ID таблицы"""
+    return connection.execute(f'SELECT COALESCE(MAX(id), 0) + 1 FROM {table}').fetchone()[0]
+
+
+# Номер движения товара берётся из карточки, остаток и снимки ведёт триггер журнала
+MOVEMENT_INSERT = '''
+    INSERT INTO inventory_movements
+    (product_id, seq, movement_type, quantity, price, reason, document_number, created_at)
+    SELECT id, stock_seq + 1, ?, ?, ?, ?, ?, ? FROM products WHERE id = ?
+'''
+
+
+def generate(path, products=1000, sales=0, seed=1, end_date=None, customers=0, return_rate=0.02):
+    """Заполнение базы одной транзакцией; возвращает число вставленных строк по таблицам"""
+    rng = random.Random(seed)
+    end_date = end_date or datetime(2025, 1, 1)
+    
+    db = DatabaseManager(path, register_id=REGISTER_ID)
+    connection = db.get_connection()
+    cashier_id = db.get_user_by_username('admin')['id']
+    counts = {}
+    
+    try:
+        # Товары создаются с нулевым остатком, остаток - приходом до первой продажи
+        new_products = list(product_rows(rng, products, next_id(connection, 'products')))
+        counts['products'] = insert_rows(connection, '''
+            INSERT INTO products (id, barcode, name, category, unit, price, cost_price, quantity)
+            VALUES (?, ?, ?, ?, ?, ?, ?, 0)
+        ''', (row[:7] for row in new_products))
+        
+        received_days = max(365, sales // SALES_PER_SHIFT + 2)
+        counts['inventory_movements'] = insert_rows(connection, MOVEMENT_INSERT, receiving_rows(
+            new_products, sqlite_text(int((end_date - timedelta(days=received_days)).timestamp()))))
+        
+        counts['customers'] = insert_rows(connection, '''
+            INSERT INTO customers (id, name, phone, discount_percent, bonus_points, created_at)
+            VALUES (?, ?, ?, ?, ?, CAST(strftime('%s', 'now') AS INTEGER))
+        ''', customer_rows(rng, customers, next_id(connection, 'customers')))
+        
+        # Цены справочника в рублях, суммы продаж - в копейках. Продаются только созданные здесь товары:
+        # у остальных журнал движения начинается текущим временем, а продажи генератора - в прошлом
+        product_prices = [(row[0], to_kopecks(row[1])) for row in connection.execute(
+            'SELECT id, price FROM products WHERE id >= ?', (new_products[0][0],))]
+        customer_discounts = [tuple(row) for row in connection.execute(
+            'SELECT id, discount_percent FROM customers WHERE is_active = 1')]
+            
+        if sales:
+            generator = SalesGenerator(rng, sales, product_prices, customer_discounts, cashier_id,
+                                       end_date, return_rate=return_rate)
+            for table in ('sales', 'sale_items', 'returns', 'return_items'):
+                counts[table] = 0
+                
+            rows = generator.sale_rows(next_id(connection, 'sales'), next_id(connection, 'sale_items'),
+                                       next_id(connection, 'shifts'), next_id(connection, 'returns'))
+            for batch in batched(rows):
+                connection.executemany('''
+                    INSERT INTO sales
+                    (id, shift_id, customer_id, total_amount, discount_amount, final_amount,
+                     payment_method, status, created_at, register_id, receipt_number, business_date)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', batch)
+                items, returns, return_items, movements = generator.take()
+                connection.executemany('''
+                    INSERT INTO sale_items
+                    (id, sale_id, product_id, quantity, price, total_amount, discount_amount, returned_quantity)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', items)
+                connection.executemany('''
+                    INSERT INTO returns (id, sale_id, total_amount, return_date, reason, shift_id, business_date)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', returns)
+                connection.executemany('''
+                    INSERT INTO return_items (return_id, sale_item_id, product_id, quantity, price, total_amount)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', return_items)
+                connection.executemany(MOVEMENT_INSERT, movements)
+                
+                counts['sales'] += len(batch)
+                counts['sale_items'] += len(items)
+                counts['returns'] += len(returns)
+                counts['return_items'] += len(return_items)
+                counts['inventory_movements'] += len(movements)
+                
+            counts['shifts'] = insert_rows(connection, '''
+                INSERT INTO shifts
+                (id, cashier_id, start_time, end_time, business_date, start_amount, end_amount, status,
+                 total_sales, transactions_count, sales_cash, sales_card, sales_transfer,
+                 count_cash, count_card, count_transfer, total_returns, returns_count, returns_cash)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', generator.shifts)
+            connection.executemany('''
+                INSERT INTO receipt_sequences (register_id, shift_id, last_number) VALUES (?, ?, ?)
+            ''', generator.sequences)
+            
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+        
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Генератор тестовой базы VetPOS')
+    parser.add_argument('path', help='файл базы (создаётся или дополняется)')
+    parser.add_argument('--products', type=int, default=1000, help='число товаров')
+    parser.add_argument('--customers', type=int, default=0, help='число клиентов')
+    parser.add_argument('--sales', type=int, default=0, help='число продаж')
+    parser.add_argument('--return-rate', type=float, default=0.02, help='доля возвращённых чеков')
+    parser.add_argument('--seed', type=int, default=1, help='зерно генератора')
+    args = parser.parse_args()
+    
+    started = time.perf_counter()
+    counts = generate(args.path, args.products, args.sales, args.seed,
+                      customers=args.customers, return_rate=args.return_rate)
+    elapsed = time.perf_counter() - started
+    
+    for table, count in counts.items():
+        print(f"{table}: {count}")
+    print(f"Готово за {elapsed:.1f} с: {args.path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+"""
+Советник индексов: воспроизведение записанной нагрузки (экспорт статистики SQL-запросов
+из «Настройки → Диагностика» или load_driver.py --workload) на копии базы через
+EXPLAIN QUERY PLAN и отчёт о полных просмотрах больших таблиц.
+
+Литералы в записанных запросах заменены параметрами, поэтому планы строятся для
+параметров NULL; частичные индексы с условием на литерал могут не учитываться.
+
+Запуск из каталога desktop_pos:
+    python tools/index_advisor.py workload.json --db vetpos.db
+    python tools/index_advisor.py workload.json --db bench.db --min-rows 10000 \
+        --index "CREATE INDEX idx_test ON sales(payment_method)" --output advice.json
+"""
+
+import argparse
+import json
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import DatabaseManager
+
+# Таблица меньше порога просматривается целиком дешевле поиска по индексу
+MIN_ROWS = 1000
+
+# Запросы, для которых строится план
+PLANNED = ('SELECT', 'WITH', 'UPDATE', 'DELETE', 'INSERT', 'REPLACE')
+
+# Имена таблиц и псевдонимы в FROM/JOIN/UPDATE/INTO
+TABLE_REFERENCE = re.compile(r'\b(?:FROM|JOIN|UPDATE|INTO)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?', re.IGNORECASE)
+NOT_ALIAS = {'WHERE', 'ON', 'JOIN', 'LEFT', 'INNER', 'CROSS', 'GROUP', 'ORDER', 'LIMIT', 'SET',
+             'VALUES', 'SELECT', 'USING', 'AND', 'OR', 'UNION', 'HAVING', 'WINDOW', 'NATURAL'}
+
+# Строка плана: SCAN <таблица или псевдоним> [USING [COVERING] INDEX ...]
+SCAN = re.compile(r'^SCAN (\w+)( USING (?:COVERING )?INDEX \w+)?$')
+NAMED_PARAMETER = re.compile(r'[:@$](\w+)')
+
+
+def copy_database(path):
+    """Копия базы во временном каталоге (исходная база не изменяется)"""
+    copy_path = os.path.join(tempfile.mkdtemp(), os.path.basename(path))
+    source = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    target = sqlite3.connect(copy_path)
+    source.backup(target)
+    target.close()
+    source.close()
+    return copy_path
+
+
+def load_workload(paths):
+    """Запросы из файлов экспорта статистики; повторяющиеся объединяются"""
+    workload = {}
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        for query in data.get('queries', []):
+            entry = workload.setdefault(query['sql'], {'sql': query['sql'], 'count': 0, 'total_ms': 0.0})
+            entry['count'] += query.get('count', 0)
+            entry['total_ms'] += query.get('total_ms', 0.0)
+    return sorted(workload.values(), key=lambda item: item['total_ms'], reverse=True)
+
+
+def table_aliases(sql):
+    """Соответствие псевдонимов и имён таблиц запроса"""
+    aliases = {}
+    for table, alias in TABLE_REFERENCE.findall(sql):
+        aliases[table] = table
+        if alias and alias.upper() not in NOT_ALIAS:
+            aliases[alias] = table
+    return aliases
+
+
+def parameters(sql):
+    """Параметры NULL для плана: именованные или по числу «?»"""
+    names = NAMED_PARAMETER.findall(sql)
+    if names:
+        return dict.fromkeys(names)
+    return (None,) * sql.count('?')
+
+
+class IndexAdvisor:
+    """Планы запросов нагрузки и поиск полных просмотров"""
+    
+    def __init__(self, connection, min_rows=MIN_ROWS):
+        self.connection = connection
+        self.min_rows = min_rows
+        self.row_counts = {}
+        
+    def table_rows(self, table):
+        """Число строк таблицы (0 для виртуальных и неизвестных)"""
+        if table not in self.row_counts:
+            kind = self.connection.execute(
+                "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
+            if kind is None or (kind[0] or '').upper().startswith('CREATE VIRTUAL'):
+                self.row_counts[table] = 0
+            else:
+                self.row_counts[table] = self.connection.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+        return self.row_counts[table]
+        
+    def plan(self, sql):
+        """Строки EXPLAIN QUERY PLAN"""
+        return [row[-1] for row in self.connection.execute('EXPLAIN QUERY PLAN ' + sql, parameters(sql))]
+        
+    def analyze(self, workload):
+        """Находки по запросам: полные просмотры таблиц и индексов больших таблиц"""
+        findings = []
+        errors = []
+        for query in workload:
+            sql = query['sql']
+            if not sql.lstrip().upper().startswith(PLANNED):
+                continue
+            try:
+                plan = self.plan(sql)
+            except sqlite3.Error as e:
+                errors.append({'sql': sql, 'error': str(e)})
+                continue
+                
+            aliases = table_aliases(sql)
+            for detail in plan:
+                match = SCAN.match(detail)
+                if not match:
+                    continue
+                table = aliases.get(match.group(1), match.group(1))
+                rows = self.table_rows(table)
+                if rows < self.min_rows:
+                    continue
+                findings.append({
+                    'kind': 'index_scan' if match.group(2) else 'table_scan',
+                    'table': table,
+                    'rows': rows,
+                    'detail': detail,
+                    'sql': sql,
+                    'count': query['count'],
+                    'total_ms': round(query['total_ms'], 2),
+                    'plan': plan,
+                })
+        return findings, errors
+
+
+def print_report(findings, errors, queries):
+    """Отчёт в консоль"""
+    titles = (('table_scan', 'Полный просмотр таблицы'), ('index_scan', 'Полный просмотр индекса'))
+    print(f"Запросов в нагрузке: {queries}")
+    for kind, title in titles:
+        items = [item for item in findings if item['kind'] == kind]
+        print(f"\n{title}: {len(items)}")
+        for item in items:
+            print(f"  {item['table']} ({item['rows']} строк), вызовов {item['count']}, "
+                  f"всего {item['total_ms']:.1f} мс: {item['detail']}")
+            print(f"    {item['sql'][:200]}")
+            
+    if errors:
+        print(f"\nПлан не построен: {len(errors)}")
+        for item in errors:
+            print(f"  {item['error']}: {item['sql'][:200]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Советник индексов по записанной нагрузке')
+    parser.add_argument('workload', nargs='+', help='файлы экспорта статистики запросов (JSON)')
+    parser.add_argument('--db', default='vetpos.db', help='база данных (анализируется копия)')
+    parser.add_argument('--min-rows', type=int, default=MIN_ROWS, help='порог размера таблицы')
+    parser.add_argument('--index', action='append', default=[],
+                        help='проверяемый индекс: выражение CREATE INDEX для копии базы')
+    parser.add_argument('--analyze', action='store_true', help='собрать статистику ANALYZE на копии')
+    parser.add_argument('--output', help='файл JSON с находками')
+    args = parser.parse_args()
+    
+    copy_path = copy_database(args.db)
+    # Схема и индексы текущей версии приложения применяются к копии
+    db = DatabaseManager(copy_path, register_id='advisor')
+    connection = db.get_connection()
+    for statement in args.index:
+        connection.execute(statement)
+    if args.analyze:
+        connection.execute('ANALYZE')
+    connection.commit()
+    
+    workload = load_workload(args.workload)
+    findings, errors = IndexAdvisor(connection, args.min_rows).analyze(workload)
+    db.close()
+    
+    print_report(findings, errors, len(workload))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'db': args.db, 'min_rows': args.min_rows, 'indexes': args.index,
+                       'findings': findings, 'errors': errors}, f, ensure_ascii=False, indent=2)
+        print(f"Результаты записаны: {args.output}")
+        
+    shutil.rmtree(os.path.dirname(copy_path), ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""
+Нагрузочный прогон сервера базы: несколько касс (процессов) выполняют сессии кассира
+(load_driver.py) через RemoteDatabaseManager одного сервера; для сравнения - те же кассы
+с прямым доступом к файлу базы (у каждой своё соединение SQLite в режиме WAL).
+
+Запуск из каталога desktop_pos:
+    python tools/lan_benchmark.py --tills 5 --sessions 300
+    python tools/lan_benchmark.py --db bench.db --tills 10 --mode server --readers 4
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import secrets
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from database import DatabaseManager
+from remote import RemoteDatabaseManager
+from server import DatabaseServer, READER_POOL_SIZE
+from load_driver import LoadDriver, percentile
+import datagen
+
+
+def till_worker(path, address, token, till, sessions, seed, barrier, results):
+    """Процесс кассы: сессии кассира через сервер (address) или напрямую с файлом (path)"""
+    register_id = f'till{till}'
+    if address:
+        db = RemoteDatabaseManager(address, register_id=register_id, token=token)
+    else:
+        db = DatabaseManager(path, register_id=register_id)
+    driver = LoadDriver(db, seed)
+    
+    barrier.wait()
+    started = time.perf_counter()
+    locked = 0
+    for _ in range(sessions):
+        try:
+            driver.session()
+        except sqlite3.OperationalError:
+            # Прямой доступ: база занята другой кассой дольше timeout
+            locked += 1
+            db.rollback()
+    elapsed = time.perf_counter() - started
+    counters = dict(db.counters) if address else None
+    db.close()
+    results.put((till, driver.latencies, locked, elapsed, counters))
+
+
+def start_server(path, readers, token):
+    """Сервер базы в потоке этого процесса; возвращает сервер и адрес"""
+    server = DatabaseServer(path, readers, token)
+    ready = threading.Event()
+    ports = []
+    
+    async def serve():
+        ports.append(await server.start('127.0.0.1', 0))
+        ready.set()
+        await server.server.serve_forever()
+        
+    threading.Thread(target=asyncio.run, args=(serve(),), daemon=True).start()
+    ready.wait()
+    return server, f'127.0.0.1:{ports[0]}'
+
+
+def run_tills(path, address, token, tills, sessions, seed):
+    """Одновременный прогон касс; возвращает отчёты процессов и время прогона"""
+    results = multiprocessing.Queue()
+    barrier = multiprocessing.Barrier(tills)
+    workers = [multiprocessing.Process(target=till_worker, args=(
+        path, address, token, till, sessions, seed + till, barrier, results)) for till in range(1, tills + 1)]
+    for worker in workers:
+        worker.start()
+    reports = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+    return reports, max(report[3] for report in reports)
+
+
+def print_report(title, reports, elapsed, tills, sessions):
+    """Пропускная способность и перцентили задержек по операциям всех касс"""
+    total = tills * sessions
+    locked = sum(report[2] for report in reports)
+    print(f"\n{title}: касс {tills}, сессий {total} за {elapsed:.2f} с "
+          f"({total / elapsed:.1f} сессий/с), отказов из-за блокировки {locked}")
+    print(f"{'операция':18}{'число':>8}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}  мс")
+    operations = sorted({operation for report in reports for operation in report[1]})
+    for operation in operations:
+        values = sorted(value for report in reports for value in report[1].get(operation, ()))
+        print(f"{operation:18}{len(values):>8}{percentile(values, 0.5) * 1000:>10.2f}"
+              f"{percentile(values, 0.95) * 1000:>10.2f}{percentile(values, 0.99) * 1000:>10.2f}"
+              f"{values[-1] * 1000:>10.2f}")
+              
+    counters = [report[4] for report in reports if report[4]]
+    if counters:
+        calls = sum(counter['calls'] for counter in counters)
+        round_trips = sum(counter['round_trips'] for counter in counters)
+        hits = sum(counter['cache_hits'] for counter in counters)
+        misses = sum(counter['cache_misses'] for counter in counters)
+        print(f"Вызовов {calls}, обращений к серверу {round_trips} ({round_trips / total:.1f} на сессию), "
+              f"кэш товаров: попаданий {hits}, промахов {misses} "
+              f"({hits * 100 / max(hits + misses, 1):.0f}%)")
+    return {'tills': tills, 'sessions': total, 'seconds': elapsed, 'locked': locked}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный прогон сервера базы для нескольких касс')
+    parser.add_argument('--db', help='готовая база (иначе генерируется временная)')
+    parser.add_argument('--products', type=int, default=5000, help='товаров при генерации')
+    parser.add_argument('--customers', type=int, default=2000, help='клиентов при генерации')
+    parser.add_argument('--sales', type=int, default=10000, help='продаж при генерации')
+    parser.add_argument('--tills', type=int, default=5, help='касс (процессов)')
+    parser.add_argument('--sessions', type=int, default=300, help='сессий покупателей на кассу')
+    parser.add_argument('--readers', type=int, default=READER_POOL_SIZE, help='читателей сервера')
+    parser.add_argument('--mode', choices=('both', 'server', 'direct'), default='both',
+                        help='через сервер, напрямую с файлом или оба прогона')
+    parser.add_argument('--seed', type=int, default=1, help='зерно генератора')
+    args = parser.parse_args()
+    
+    path = args.db
+    if not path:
+        path = os.path.join(tempfile.mkdtemp(), 'lan.db')
+        started = time.perf_counter()
+        datagen.generate(path, args.products, args.sales, args.seed, customers=args.customers)
+        print(f"Сгенерирована база за {time.perf_counter() - started:.1f} с: {path}")
+    db = DatabaseManager(path, register_id='setup')
+    db.fetch_one('PRAGMA journal_mode=WAL')
+    db.close()
+    
+    if args.mode in ('both', 'direct'):
+        reports, elapsed = run_tills(path, None, None, args.tills, args.sessions, args.seed)
+        print_report("Напрямую с файлом", reports, elapsed, args.tills, args.sessions)
+        
+    if args.mode in ('both', 'server'):
+        token = secrets.token_hex(16)
+        server, address = start_server(path, args.readers, token)
+        reports, elapsed = run_tills(path, address, token, args.tills, args.sessions, args.seed)
+        print_report(f"Через сервер ({args.readers} читателей)", reports, elapsed, args.tills, args.sessions)
+        stats = server.stats
+        print(f"Сервер: пакетов {stats['requests']}, чтений {stats['reads']}, записей {stats['writes']}, "
+              f"ожидание писателя {stats['writer_wait'] * 1000:.0f} мс, отменённых транзакций {stats['expired']}")
+              
+    db = DatabaseManager(path, register_id='check')
+    drift = db.reconcile_stock()
+    db.close()
+    print("\nОстатки сходятся с журналом движения:", "OK" if not drift else f"ОШИБКА ({len(drift)} товаров)")
+    return 0 if not drift else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,166 @@
+"""
+Нагрузочный прогон слоя базы данных: сессии кассира (сканирование, поиск,
+оплата, возврат) через DatabaseManager с перцентилями задержек по операциям.
+
+Запуск из каталога desktop_pos:
+    python tools/load_driver.py --products 50000 --customers 20000 --sales 100000 --sessions 2000
+    python tools/load_driver.py --db bench.db --sessions 500 --output load.json
+    python tools/load_driver.py --db bench.db --workload workload.json  # нагрузка для index_advisor.py
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from database import DatabaseManager
+import datagen
+from money import to_kopecks
+
+# Вероятности действий в сессии
+SEARCH_RATE = 0.3
+CUSTOMER_RATE = 0.3
+RETURN_RATE = 0.03
+
+
+class LoadDriver:
+    """Воспроизведение сессий кассира с замером каждой операции"""
+    
+    def __init__(self, db, seed=1):
+        self.db = db
+        self.rng = random.Random(seed)
+        self.latencies = {}
+        
+        # Методы DatabaseManager, а не SQL: сервер базы (server.py) не выполняет запросы касс
+        products = db.get_all_products()
+        self.barcodes = [product.barcode for product in products if product.barcode]
+        self.search_terms = sorted({product.name.split()[0] + ' ' + product.name.split()[1]
+                                    for product in products[:1000] if len(product.name.split()) > 1})
+        self.phones = [customer.phone for customer in db.get_all_customers() if customer.phone][:1000]
+        self.sale_ids = []
+        self.shift_id = db.open_shift('admin', datagen.START_AMOUNT)
+        
+    @contextmanager
+    def measure(self, operation):
+        """Замер операции"""
+        started = time.perf_counter()
+        yield
+        self.latencies.setdefault(operation, []).append(time.perf_counter() - started)
+        
+    def session(self):
+        """Один покупатель: сканирование позиций, поиск, клиент, оплата, иногда возврат"""
+        items = {}
+        for _ in range(self.rng.choice((1, 2, 2, 3, 4, 6))):
+            with self.measure('scan'):
+                product = self.db.get_product_by_barcode(self.rng.choice(self.barcodes))
+            if product and product['id'] not in items:
+                items[product['id']] = {'product_id': product['id'], 'name': product['name'],
+                                        'price': to_kopecks(product['price']), 'quantity': 1}
+                                        
+        if self.search_terms and self.rng.random() < SEARCH_RATE:
+            term = self.rng.choice(self.search_terms)
+            with self.measure('search'):
+                self.db.search_products(term[:self.rng.randint(3, len(term))])
+                
+        customer_id = None
+        if self.phones and self.rng.random() < CUSTOMER_RATE:
+            phone = self.rng.choice(self.phones)
+            with self.measure('customer_search'):
+                customers = self.db.search_customers(phone[-5:])
+            if customers:
+                customer_id = customers[0]['id']
+                
+        if items:
+            with self.measure('pay'):
+                try:
+                    sale_id = self.db.create_sale(self.shift_id, customer_id, list(items.values()),
+                                                  self.rng.choice(datagen.PAYMENT_METHODS))
+                    self.sale_ids.append(sale_id)
+                except ValueError:
+                    pass  # Товар закончился
+                    
+        if self.sale_ids and self.rng.random() < RETURN_RATE:
+            sale_id = self.sale_ids.pop(self.rng.randrange(len(self.sale_ids)))
+            receipt = self.db.get_sale_receipt(sale_id)
+            with self.measure('return_lookup'):
+                self.db.get_receipt_for_return(receipt.receipt_number, receipt.shift_id)
+            with self.measure('return'):
+                self.db.create_return(self.shift_id, sale_id, reason='Полный возврат')
+                
+    def report(self):
+        """Перцентили задержек по операциям (мс)"""
+        result = {}
+        for operation, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            result[operation] = {
+                'count': len(values),
+                'p50': percentile(values, 0.50) * 1000,
+                'p95': percentile(values, 0.95) * 1000,
+                'p99': percentile(values, 0.99) * 1000,
+                'max': values[-1] * 1000,
+            }
+        return result
+
+
+def percentile(values, fraction):
+    """Перцентиль по отсортированному списку"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный прогон сессий кассира')
+    parser.add_argument('--db', help='готовая база (иначе генерируется временная)')
+    parser.add_argument('--products', type=int, default=10000, help='товаров при генерации')
+    parser.add_argument('--customers', type=int, default=5000, help='клиентов при генерации')
+    parser.add_argument('--sales', type=int, default=20000, help='продаж при генерации')
+    parser.add_argument('--sessions', type=int, default=1000, help='сессий покупателей')
+    parser.add_argument('--seed', type=int, default=1, help='зерно генератора')
+    parser.add_argument('--output', help='файл JSON с результатами')
+    parser.add_argument('--workload', help='файл JSON со статистикой запросов прогона')
+    args = parser.parse_args()
+    
+    path = args.db
+    if not path:
+        path = os.path.join(tempfile.mkdtemp(), 'load.db')
+        started = time.perf_counter()
+        datagen.generate(path, args.products, args.sales, args.seed, customers=args.customers)
+        print(f"Сгенерирована база за {time.perf_counter() - started:.1f} с: {path}")
+        
+    db = DatabaseManager(path, register_id='load')
+    driver = LoadDriver(db, args.seed)
+    if args.workload:
+        db.enable_query_stats()
+        
+    started = time.perf_counter()
+    for _ in range(args.sessions):
+        driver.session()
+    elapsed = time.perf_counter() - started
+    if args.workload:
+        db.query_stats.export_json(args.workload)
+    db.close()
+    
+    report = driver.report()
+    print(f"Сессий: {args.sessions} за {elapsed:.2f} с ({args.sessions / elapsed:.1f} сессий/с)")
+    print(f"{'операция':18}{'число':>8}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}  мс")
+    for operation, stats in report.items():
+        print(f"{operation:18}{stats['count']:>8}{stats['p50']:>10.2f}{stats['p95']:>10.2f}"
+              f"{stats['p99']:>10.2f}{stats['max']:>10.2f}")
+              
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'db': path, 'sessions': args.sessions, 'seconds': elapsed,
+                       'operations': report}, f, ensure_ascii=False, indent=2)
+        print(f"Результаты записаны: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+"""
+Нагрузочная проверка нумерации чеков: несколько процессов продают из одного файла
+SQLite в режиме WAL на нескольких кассах; часть продаж откатывается после выдачи номера.
+Проверяется, что номера каждой кассы в смене идут подряд с 1 без пропусков и повторов.
+
+Запуск из каталога desktop_pos:
+    python tools/receipt_stress.py --processes 8 --registers 2 --sales 300 --fail-rate 0.2
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import DatabaseManager
+
+
+def prepare_database(path, registers):
+    """База с товаром для продаж, пустым товаром для откатов и сменой на каждую кассу"""
+    db = DatabaseManager(path, register_id='setup')
+    db.execute_query('PRAGMA journal_mode=WAL')
+    product_ids = []
+    for name, quantity in (('Нагрузочный товар', 10 ** 9), ('Нет в наличии', 0)):
+        cursor = db.execute_query('''
+            INSERT INTO products (name, price, quantity, unit)
+            VALUES (?, ?, ?, 'шт')
+        ''', (name, 100.0, quantity))
+        product_ids.append(cursor.lastrowid)
+    db.commit()
+    shifts = {f'till{number}': db.open_shift('admin', 0) for number in range(1, registers + 1)}
+    db.close()
+    return product_ids, shifts
+
+
+def sale_worker(path, register_id, shift_id, product_ids, sales, fail_rate, seed, barrier, results):
+    """Процесс кассы: продажи, часть из которых отклоняется после получения номера"""
+    rng = random.Random(seed)
+    db = DatabaseManager(path, register_id=register_id)
+    stocked, empty = product_ids
+    
+    barrier.wait()
+    started_at = time.perf_counter()
+    
+    sold = failed = locked = 0
+    latencies = []
+    while sold < sales:
+        # Пустой товар последней позицией: ошибка возникает после выдачи номера и вставки продажи
+        items = [{'product_id': stocked, 'name': 'Нагрузочный товар', 'price': 10000, 'quantity': 1}]
+        fail = rng.random() < fail_rate
+        if fail:
+            items.append({'product_id': empty, 'name': 'Нет в наличии', 'price': 10000, 'quantity': 1})
+            
+        started = time.perf_counter()
+        try:
+            db.create_sale(shift_id, None, items, 'Наличные')
+            sold += 1
+        except ValueError:
+            failed += 1
+        except sqlite3.OperationalError:
+            locked += 1
+        latencies.append(time.perf_counter() - started)
+        
+    elapsed = time.perf_counter() - started_at
+    db.close()
+    results.put((register_id, seed, sold, failed, locked, latencies, elapsed))
+
+
+def check_numbers(path, shifts):
+    """Номера чеков каждой кассы: пропуски, повторы и расхождение со счётчиком"""
+    db = DatabaseManager(path, register_id='check')
+    problems = {}
+    for register_id, shift_id in shifts.items():
+        numbers = [row['number'] for row in db.fetch_all('''
+            SELECT CAST(receipt_number AS INTEGER) as number FROM sales
+            WHERE register_id = ? AND shift_id = ?
+            ORDER BY number
+        ''', (register_id, shift_id))]
+        sequence = db.fetch_one('''
+            SELECT last_number FROM receipt_sequences WHERE register_id = ? AND shift_id = ?
+        ''', (register_id, shift_id))
+        last_number = sequence['last_number'] if sequence else 0
+        
+        expected = list(range(1, len(numbers) + 1))
+        if numbers != expected or last_number != len(numbers):
+            missing = sorted(set(expected) - set(numbers))
+            duplicates = sorted({number for number in numbers if numbers.count(number) > 1})
+            problems[register_id] = {'count': len(numbers), 'last_number': last_number,
+                                     'missing': missing[:20], 'duplicates': duplicates[:20]}
+    counts = {register_id: db.fetch_one('''
+        SELECT COUNT(*) as count FROM sales WHERE register_id = ? AND shift_id = ?
+    ''', (register_id, shift_id))['count'] for register_id, shift_id in shifts.items()}
+    db.close()
+    return counts, problems
+
+
+def percentile(values, fraction):
+    """Перцентиль по отсортированному списку"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочная проверка нумерации чеков')
+    parser.add_argument('--processes', type=int, default=8, help='число процессов')
+    parser.add_argument('--registers', type=int, default=2, help='число касс (процессы делят их поровну)')
+    parser.add_argument('--sales', type=int, default=300, help='успешных продаж на процесс')
+    parser.add_argument('--fail-rate', type=float, default=0.2, help='доля откатываемых продаж')
+    parser.add_argument('--db', help='файл базы (по умолчанию временный)')
+    args = parser.parse_args()
+    
+    path = args.db or os.path.join(tempfile.mkdtemp(), 'receipts.db')
+    product_ids, shifts = prepare_database(path, args.registers)
+    registers = sorted(shifts)
+    
+    # Несколько процессов на одной кассе - худший случай: общий счётчик под конкуренцией
+    results = multiprocessing.Queue()
+    barrier = multiprocessing.Barrier(args.processes)
+    workers = []
+    for number in range(args.processes):
+        register_id = registers[number % len(registers)]
+        workers.append(multiprocessing.Process(target=sale_worker, args=(
+            path, register_id, shifts[register_id], product_ids, args.sales, args.fail_rate,
+            number, barrier, results)))
+            
+    for worker in workers:
+        worker.start()
+    reports = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+    elapsed = max(report[6] for report in reports)
+    
+    counts, problems = check_numbers(path, shifts)
+    
+    latencies = sorted(latency for report in reports for latency in report[5])
+    for register_id, seed, sold, failed, locked, _, _ in sorted(reports):
+        print(f"Процесс {seed} ({register_id}): продаж {sold}, откатов {failed}, блокировок {locked}")
+    total_sold = sum(report[2] for report in reports)
+    print(f"Продаж всего: {total_sold} за {elapsed:.2f} с ({total_sold / elapsed:.1f} продаж/с)")
+    print(f"Задержка продажи: p50 {percentile(latencies, 0.5) * 1000:.1f} мс, "
+          f"p95 {percentile(latencies, 0.95) * 1000:.1f} мс, p99 {percentile(latencies, 0.99) * 1000:.1f} мс")
+    for register_id in registers:
+        sold = sum(report[2] for report in reports if report[0] == register_id)
+        print(f"Касса {register_id}, смена {shifts[register_id]}: чеков {counts[register_id]}, "
+              f"продано процессами {sold}")
+              
+    for register_id, problem in problems.items():
+        print(f"Касса {register_id}: {problem}")
+    consistent = not problems and total_sold == sum(counts.values())
+    print("Нумерация без пропусков и повторов:", "OK" if consistent else "ОШИБКА")
+    return 0 if consistent else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,151 @@
+"""
+Нагрузочная проверка резервов товара: несколько касс (процессов) продают
+из одного файла SQLite в режиме WAL.
+
+Запуск из каталога desktop_pos:
+    python tools/reservation_stress.py --tills 4 --products 5 --stock 200
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import DatabaseManager
+from modules.parked_receipts import ReceiptStore
+
+
+def prepare_database(path, products, stock):
+    """Создание базы с тестовыми товарами; возвращает ID товаров"""
+    db = DatabaseManager(path, register_id='setup')
+    db.execute_query('PRAGMA journal_mode=WAL')
+    db.execute_query('UPDATE products SET is_active = 0')
+    product_ids = []
+    for number in range(products):
+        cursor = db.execute_query('''
+            INSERT INTO products (name, price, quantity, unit)
+            VALUES (?, ?, ?, 'шт')
+        ''', (f'Нагрузочный товар {number + 1}', 100.0, stock))
+        product_ids.append(cursor.lastrowid)
+    db.commit()
+    db.close()
+    return product_ids
+
+
+def till_worker(path, till_number, product_ids, seed, barrier, results):
+    """Касса: резерв позиций и продажа, пока есть товар"""
+    random.seed(seed)
+    db = DatabaseManager(path, register_id=f'till{till_number}')
+    store = ReceiptStore(db)
+    shift_id = db.open_shift('admin', 0)
+    
+    # Все кассы начинают продавать одновременно
+    barrier.wait()
+    started_at = time.perf_counter()
+    
+    sold = rejected = locked = 0
+    latencies = []
+    exhausted = set()
+    
+    while len(exhausted) < len(product_ids):
+        product_id = random.choice(product_ids)
+        items = [{'product_id': product_id, 'name': f'#{product_id}',
+                  'price': 10000, 'quantity': random.randint(1, 3)}]
+        
+        started = time.perf_counter()
+        receipt_id = None
+        try:
+            receipt_id = store.save_active(None, items)
+            db.create_sale(shift_id, None, items, 'Наличные', receipt_id=receipt_id)
+            sold += 1
+        except ValueError:
+            # Остатка не хватило: снимаем чек с резервом, если он успел записаться
+            if receipt_id is not None:
+                store.discard(receipt_id)
+            else:
+                db.rollback()
+            rejected += 1
+            if db.get_available_quantity(product_id) <= 0:
+                exhausted.add(product_id)
+        except sqlite3.OperationalError:
+            db.rollback()
+            locked += 1
+        latencies.append(time.perf_counter() - started)
+        
+    elapsed = time.perf_counter() - started_at
+    db.close()
+    results.put((till_number, sold, rejected, locked, latencies, elapsed))
+
+
+def percentile(values, fraction):
+    """Перцентиль по отсортированному списку"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочная проверка резервов товара')
+    parser.add_argument('--tills', type=int, default=4, help='число касс (процессов)')
+    parser.add_argument('--products', type=int, default=5, help='число товаров')
+    parser.add_argument('--stock', type=int, default=200, help='начальный остаток каждого товара')
+    parser.add_argument('--db', help='файл базы (по умолчанию временный)')
+    args = parser.parse_args()
+    
+    path = args.db or os.path.join(tempfile.mkdtemp(), 'stress.db')
+    product_ids = prepare_database(path, args.products, args.stock)
+    
+    results = multiprocessing.Queue()
+    barrier = multiprocessing.Barrier(args.tills)
+    workers = [
+        multiprocessing.Process(target=till_worker,
+                                args=(path, number, product_ids, number, barrier, results))
+        for number in range(1, args.tills + 1)
+    ]
+    
+    for worker in workers:
+        worker.start()
+    reports = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+    elapsed = max(report[5] for report in reports)
+    
+    # Проверка: ни одна продажа не увела остаток в минус
+    db = DatabaseManager(path, register_id='check')
+    placeholders = ','.join('?' * len(product_ids))
+    remaining = db.fetch_one(f'''
+        SELECT SUM(quantity) as total, MIN(quantity) as minimum
+        FROM products WHERE id IN ({placeholders})
+    ''', product_ids)
+    sold_quantity = db.fetch_one(f'''
+        SELECT COALESCE(SUM(quantity), 0) as total
+        FROM sale_items WHERE product_id IN ({placeholders})
+    ''', product_ids)['total']
+    reservations = db.fetch_one('SELECT COUNT(*) as count FROM stock_reservations')['count']
+    db.close()
+    
+    total_sold = sum(report[1] for report in reports)
+    latencies = sorted(latency for report in reports for latency in report[4])
+    
+    for till_number, sold, rejected, locked, _, _ in sorted(reports):
+        print(f"Касса {till_number}: продаж {sold}, отказов {rejected}, блокировок {locked}")
+    print(f"Продаж всего: {total_sold} за {elapsed:.2f} с ({total_sold / elapsed:.1f} продаж/с)")
+    print(f"Задержка операции: p50 {percentile(latencies, 0.5) * 1000:.1f} мс, "
+          f"p95 {percentile(latencies, 0.95) * 1000:.1f} мс, p99 {percentile(latencies, 0.99) * 1000:.1f} мс")
+    print(f"Остаток: {remaining['total']}, минимум по товару: {remaining['minimum']}, "
+          f"продано единиц: {sold_quantity}, висящих резервов: {reservations}")
+    
+    consistent = (remaining['minimum'] >= 0 and reservations == 0
+                  and remaining['total'] + sold_quantity == args.products * args.stock)
+    print("Проверка целостности:", "OK" if consistent else "ОШИБКА")
+    return 0 if consistent else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
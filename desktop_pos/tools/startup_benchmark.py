@@ -0,0 +1,236 @@
+"""
+Замер запуска VetPOS на базах разного размера с записью результатов в JSON.
+
+Каждый прогон выполняется в отдельном процессе: импорт, инициализация
+DatabaseManager, создание интерфейса и модулей, первый поиск товара.
+Без дисплея запускается Xvfb (если установлен), иначе замеряются только
+этапы без интерфейса.
+
+Запуск из каталога desktop_pos:
+    python tools/startup_benchmark.py --scenarios 1k 50k --output bench.json
+    python tools/startup_benchmark.py --scenarios 1k --compare bench.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(TOOLS_DIR)
+
+# Сценарии: число товаров и продаж
+SCENARIOS = {
+    '1k': (1000, 10000),
+    '50k': (50000, 100000),
+    '500k': (500000, 1000000),
+}
+
+# Поисковый запрос первого поиска (совпадает с названиями генератора)
+SEARCH_TERM = 'Корм Royal'
+
+# Регрессия: рост больше допуска и больше порога шума
+NOISE_MS = 5.0
+
+
+def run_child(db_path, gui):
+    """Замер одного запуска (выполняется в дочернем процессе)"""
+    started = time.perf_counter()
+    metrics = {}
+    sys.path.insert(0, APP_DIR)
+    
+    if gui:
+        import main
+        metrics['import_ms'] = (time.perf_counter() - started) * 1000
+        
+        app = main.VetPOSApp(main.StartupProfiler(started=started), db_path=db_path)
+        app.root.update()
+        metrics['window_ready_ms'] = app.profiler.elapsed() * 1000
+        for name, value in app.profiler.as_dict().items():
+            metrics[f'phase:{name}'] = value
+            
+        sales = app.modules['sales']
+        search_started = time.perf_counter()
+        sales.search_products_live(SEARCH_TERM)
+        app.root.update()
+        metrics['first_search_ms'] = (time.perf_counter() - search_started) * 1000
+        
+        # Первое открытие ленивых вкладок
+        for index in range(1, app.notebook.index('end')):
+            title = app.notebook.tab(index, 'text')
+            tab_started = time.perf_counter()
+            app.notebook.select(index)
+            app.root.update()
+            metrics[f'tab:{title}_ms'] = (time.perf_counter() - tab_started) * 1000
+            
+        app.root.destroy()
+    else:
+        import database
+        metrics['import_ms'] = (time.perf_counter() - started) * 1000
+        
+        init_started = time.perf_counter()
+        db = database.DatabaseManager(db_path)
+        metrics['phase:DatabaseManager'] = (time.perf_counter() - init_started) * 1000
+        
+        search_started = time.perf_counter()
+        db.search_products(SEARCH_TERM)
+        metrics['first_search_ms'] = (time.perf_counter() - search_started) * 1000
+        db.close()
+        
+    metrics['child_total_ms'] = (time.perf_counter() - started) * 1000
+    print(json.dumps(metrics))
+
+
+def ensure_database(data_dir, name):
+    """База сценария (генерируется один раз и переиспользуется)"""
+    products, sales = SCENARIOS[name]
+    path = os.path.join(data_dir, f'bench_{name}.db')
+    if not os.path.exists(path):
+        sys.path.insert(0, TOOLS_DIR)
+        import datagen
+        
+        print(f"Генерация базы {name}: {products} товаров, {sales} продаж...")
+        generated = time.perf_counter()
+        partial = path + '.tmp'
+        if os.path.exists(partial):
+            os.remove(partial)
+        datagen.generate(partial, products, sales)
+        os.replace(partial, path)
+        print(f"  готово за {time.perf_counter() - generated:.1f} с")
+    return path
+
+
+def start_display():
+    """Виртуальный дисплей Xvfb, если своего дисплея нет; возвращает (env, процесс)"""
+    env = dict(os.environ)
+    if sys.platform == 'win32' or env.get('DISPLAY'):
+        return env, None, True
+        
+    xvfb = shutil.which('Xvfb')
+    if not xvfb:
+        return env, None, False
+        
+    display = ':97'
+    process = subprocess.Popen([xvfb, display, '-screen', '0', '1400x900x24'],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    time.sleep(1)
+    env['DISPLAY'] = display
+    return env, process, True
+
+
+def run_scenario(path, runs, gui, env):
+    """Серия запусков; медианы метрик"""
+    samples = {}
+    for _ in range(runs):
+        command = [sys.executable, os.path.abspath(__file__), '--child', path]
+        if gui:
+            command.append('--gui')
+            
+        started = time.perf_counter()
+        output = subprocess.run(command, cwd=APP_DIR, env=env, capture_output=True,
+                                text=True, check=True).stdout
+        process_ms = (time.perf_counter() - started) * 1000
+        
+        metrics = json.loads(output.strip().splitlines()[-1])
+        metrics['process_ms'] = process_ms
+        for name, value in metrics.items():
+            samples.setdefault(name, []).append(value)
+            
+    return {name: round(statistics.median(values), 2) for name, values in samples.items()}
+
+
+def compare(results, baseline_path, tolerance):
+    """Сравнение с сохранёнными результатами; возвращает число регрессий"""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+        
+    regressions = 0
+    for name, scenario in results['scenarios'].items():
+        old_scenario = baseline.get('scenarios', {}).get(name)
+        if not old_scenario:
+            continue
+        print(f"\nСценарий {name}:")
+        for metric, value in scenario['metrics'].items():
+            old = old_scenario['metrics'].get(metric)
+            if old is None:
+                continue
+            delta = value - old
+            regression = delta > NOISE_MS and old > 0 and delta / old > tolerance
+            regressions += regression
+            mark = '  РЕГРЕССИЯ' if regression else ''
+            print(f"  {metric:40} {old:10.1f} -> {value:10.1f} мс ({delta:+.1f}){mark}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Замер запуска VetPOS')
+    parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=['1k', '50k'])
+    parser.add_argument('--runs', type=int, default=3, help='запусков на сценарий (берётся медиана)')
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'vetpos_bench'),
+                        help='каталог сгенерированных баз')
+    parser.add_argument('--output', help='файл JSON с результатами')
+    parser.add_argument('--compare', help='файл JSON с прошлыми результатами')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='допустимый рост (доля)')
+    parser.add_argument('--no-gui', action='store_true', help='не создавать окно приложения')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--gui', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    if args.child:
+        run_child(args.child, args.gui)
+        return 0
+        
+    os.makedirs(args.data_dir, exist_ok=True)
+    env, display, gui = start_display()
+    gui = gui and not args.no_gui
+    if not gui:
+        print("Дисплей недоступен: замеряются этапы без интерфейса")
+        
+    results = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'gui': gui,
+            'runs': args.runs,
+        },
+        'scenarios': {}
+    }
+    
+    try:
+        for name in args.scenarios:
+            path = ensure_database(args.data_dir, name)
+            products, sales = SCENARIOS[name]
+            metrics = run_scenario(path, args.runs, gui, env)
+            results['scenarios'][name] = {'products': products, 'sales': sales, 'metrics': metrics}
+            
+            print(f"\nСценарий {name} ({products} товаров, {sales} продаж):")
+            for metric, value in metrics.items():
+                print(f"  {metric:40} {value:10.1f} мс")
+    finally:
+        if display:
+            display.terminate()
+            
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\nРезультаты записаны: {args.output}")
+        
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance)
+        print(f"\nРегрессий: {regressions}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())